@@ -2,21 +2,55 @@
 Application Flask pour générer des factures au format Factur-X.
 """
 
+import hashlib
 import math
 import os
+import shutil
 import sys
-from datetime import datetime, timedelta
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, send_file
 from pathlib import Path
 import re
 
 from utils.facturx_generator import generate_facturx_xml
-from utils.pdf_generator import generate_invoice_pdf
+from utils.pdf_generator import spooled_pdf, write_invoice_pdf
+from utils.pdf_compact import write_compact_pdf
 from utils.invoice_calc import calculate_line_totals, calculate_invoice_totals
-from utils.db import get_db_connection, db_cursor, db_connection
-from utils.super_pdp import get_pdp_token
-from facturx import generate_from_binary
+from utils.invoice_input import API_BATCH_MAX, invoice_data_from_form, invoice_data_from_payload
+from utils.invoice_lines import (
+    columns_to_lines, line_columns_from_csv, line_columns_from_form, line_columns_from_payload,
+    validate_line_columns, validate_step2,
+)
+from utils.db import (
+    get_db_connection, db_cursor, db_connection, ensure_invoice_partitions, replica_status,
+    backend_location, configure_backend, get_backend, lock_sent_invoices,
+)
+from utils.pdp_token import get_token_manager
+from utils.emitters import (
+    DEFAULT_EMITTER, EmitterConfigError, EmitterNotFound, EmitterRegistry, validate_emitter_config,
+)
+from utils.download import send_archived_pdf, remember_file_hash, compute_file_hash, is_within
+from utils.drafts import DraftStore, new_draft_id
+from utils.billing import BILLING_KEY_TTL, item_request_key
+from utils.idempotency import (
+    CONTENT_TTL, KEY_TTL, IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, invoice_content_hash,
+    is_valid_key,
+)
+from utils.export import (
+    EXPORT_TABLES, ACCOUNTING_FORMATS, iter_invoices_for_export, stream_invoices_zip,
+    stream_accounting_export,
+)
+from utils.facturx_parser import FacturXParseError, parse_facturx_xml
+from utils.invoice_store import EXTRACTED_COLUMNS, extracted_fields, store_vat_breakdown, vat_rows_from_totals
+from utils.pdp_sync import SYNC_NAME, get_invoice_events, lifecycle_label
+from utils.search import (
+    SEARCH_CONFIG, SEARCH_VECTOR_SQL, build_fts_query, build_tsquery, index_search_document, search_document,
+    search_invoices,
+)
+from facturx import generate_from_file
 
 
 def load_config(config_path: str = 'resources/config/ma-conf.txt') -> dict:
@@ -46,80 +80,6 @@ def load_config(config_path: str = 'resources/config/ma-conf.txt') -> dict:
     return config
 
 
-
-
-def validate_emitter_config(config: dict) -> list[str]:
-    """Valide les champs obligatoires de l'émetteur."""
-    errors = []
-
-    # Validation SIRET (14 chiffres)
-    siret = config.get('siret', '')
-    if not siret:
-        errors.append("SIRET de l'émetteur non renseigné dans la configuration")
-    elif not re.match(r'^\d{14}$', siret):
-        errors.append(f"SIRET de l'émetteur invalide: '{siret}' (doit contenir 14 chiffres)")
-
-    # Validation SIREN (9 chiffres)
-    siren = config.get('siren', '')
-    if not siren:
-        errors.append("SIREN de l'émetteur non renseigné dans la configuration")
-    elif not re.match(r'^\d{9}$', siren):
-        errors.append(f"SIREN de l'émetteur invalide: '{siren}' (doit contenir 9 chiffres)")
-
-    # Validation cohérence SIREN/SIRET
-    if siret and siren and not siret.startswith(siren):
-        errors.append(f"Incohérence SIREN/SIRET: le SIRET '{siret}' devrait commencer par le SIREN '{siren}'")
-
-    # Validation BIC (8 ou 11 caractères alphanumériques)
-    bic = config.get('bic', '')
-    if bic and not re.match(r'^[A-Z]{4}[A-Z]{2}[A-Z0-9]{2}([A-Z0-9]{3})?$', bic.upper()):
-        errors.append(f"BIC invalide: '{bic}' (format attendu: 8 ou 11 caractères)")
-
-    # Validation numéro TVA intracommunautaire (format FR + 11 caractères)
-    num_tva = config.get('num_tva', '')
-    if num_tva and not re.match(r'^[A-Z]{2}[A-Z0-9]{2,13}$', num_tva.upper()):
-        errors.append(f"Numéro TVA invalide: '{num_tva}' (format attendu: code pays + identifiant)")
-
-    # Validation nom obligatoire
-    if not config.get('name', '').strip():
-        errors.append("Nom de l'émetteur non renseigné dans la configuration")
-
-    # Validation forme juridique obligatoire
-    if not config.get('cie_legal_form', '').strip():
-        errors.append("Forme juridique (cie_legal_form) non renseignée dans la configuration")
-
-    # Validation IBAN obligatoire
-    if not config.get('cie_IBAN', '').strip():
-        errors.append("IBAN de l'émetteur (cie_IBAN) non renseigné dans la configuration")
-
-    # Validation texte PMT obligatoire (BR-FR-05)
-    if not config.get('pmt_text', '').strip():
-        errors.append("Texte frais de recouvrement (pmt_text) non renseigné dans la configuration")
-
-    # Validation texte PMD obligatoire (BR-FR-05)
-    if not config.get('pmd_text', '').strip():
-        errors.append("Texte pénalités de retard (pmd_text) non renseigné dans la configuration")
-
-    return errors
-
-
-def get_logo_path(config: dict) -> str:
-    """Retourne le chemin du logo, avec fallback sur underwork.jpeg."""
-    logo = config.get('logo', '').strip()
-
-    if not logo:
-        # Logo par défaut
-        return './resources/logos/underwork.jpeg'
-
-    # Vérifier que le fichier existe
-    logo_path = Path(logo)
-    if not logo_path.exists():
-        print(f"[WARNING] Logo introuvable: {logo}, utilisation du logo par défaut")
-        return './resources/logos/underwork.jpeg'
-
-    return logo
-
-
 def load_env_file() -> dict:
     """Charge les variables d'environnement depuis .env ou .env.local."""
     env_vars = {}
@@ -179,43 +139,101 @@ def check_database_connection() -> bool:
         return False
 
 
+def check_sqlite_database() -> bool:
+    """Ouvre la base SQLite embarquée (création du fichier et du schéma au premier lancement)."""
+    try:
+        with db_cursor() as (_conn, cursor):
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        print(f"[OK] Base SQLite ouverte ({backend_location()[1]}, journal {journal_mode})")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Impossible d'ouvrir la base SQLite: {e}")
+        return False
+
+
+def is_db_enabled() -> bool:
+    """Une base est-elle activée (PostgreSQL ou SQLite embarqué) ?"""
+    return CONFIG.get('is_db_pg') is True or CONFIG.get('is_db_sqlite') is True
+
+
 def is_auto_numbering() -> bool:
     """Indique si la numérotation automatique est active."""
-    return CONFIG.get('is_db_pg') is True and CONFIG.get('is_num_facturx_auto') is True
+    return is_db_enabled() and CONFIG.get('is_num_facturx_auto') is True
 
 
-def get_next_invoice_number(conn) -> str:
-    """Calcule le prochain numéro de facture depuis la base."""
+def get_next_invoice_number(conn, emitter=None) -> str:
+    """Calcule le prochain numéro de facture de l'émetteur (défaut : ma-conf.txt) depuis la base."""
+    emitter = emitter or EMITTERS.default
     now = datetime.now()
 
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT invoice_num FROM sent_invoices ORDER BY created_at DESC LIMIT 1"
+        "SELECT invoice_num FROM sent_invoices WHERE emitter_code = %s ORDER BY created_at DESC LIMIT 1",
+        (emitter.code,),
     )
     row = cursor.fetchone()
     cursor.close()
 
+    prefix = emitter.invoice_prefix
     if row is None:
-        return f"FAC-{now.year}-{now.month:02d}-0001"
+        return f"{prefix}-{now.year}-{now.month:02d}-0001"
 
     last_number = row[0]
     last_part = last_number.rsplit('-', 1)[-1]
     next_int = int(last_part) + 1
 
-    return f"FAC-{now.year}-{now.month:02d}-{next_int:04d}"
+    return f"{prefix}-{now.year}-{now.month:02d}-{next_int:04d}"
 
 
 def insert_sent_invoice(conn, invoice_num: str, company_name: str, company_siret: str,
                         xml_content: str, pdf_path: str, invoice_date: str,
-                        total_ttc=None) -> None:
-    """Insère la facture dans sent_invoices (dans la transaction en cours)."""
+                        total_ttc=None, vat_breakdown: dict = None, emitter_code: str = DEFAULT_EMITTER) -> None:
+    """
+    Insère la facture (ses champs métier extraits du XML et sa ventilation TVA)
+    dans sent_invoices (dans la transaction en cours).
+
+    Le numéro est d'abord inscrit dans le registre invoice_numbers : une
+    sent_invoices partitionnée n'assure l'unicité que par (numéro, date), le
+    registre la garantit sur le numéro seul (IntegrityError si déjà attribué).
+    """
+    try:
+        parsed = parse_facturx_xml(xml_content)
+        fields, document = extracted_fields(parsed), search_document(parsed)
+    except FacturXParseError as e:
+        print(f"[WARNING] Champs de {invoice_num} non extraits: {e}")
+        fields, document = {}, None
     cursor = conn.cursor()
+    # Registre non partitionné : un numéro déjà attribué (quelle que soit sa date) fait échouer l'émission
     cursor.execute(
-        """INSERT INTO sent_invoices
-           (invoice_num, company_name, company_siret, xml_facture, pdf_path, invoice_date, total_ttc)
-           VALUES (%s, %s, %s, %s::xml, %s, %s, %s)""",
-        (invoice_num, company_name, company_siret, xml_content, pdf_path, invoice_date, total_ttc),
+        "INSERT INTO invoice_numbers (invoice_num, invoice_date) VALUES (%s, %s)",
+        (invoice_num, invoice_date),
     )
+    if get_backend() == 'sqlite':
+        # Pas de type XML ni de tsvector : textes de recherche indexés en FTS5
+        cursor.execute(
+            f"""INSERT INTO sent_invoices
+               (invoice_num, company_name, company_siret, xml_facture, pdf_path, invoice_date, total_ttc,
+                emitter_code, {', '.join(EXTRACTED_COLUMNS)}, fields_extracted_at)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, {', '.join(['%s'] * len(EXTRACTED_COLUMNS))},
+                       {'now()' if fields else 'NULL'})""",
+            (invoice_num, company_name, company_siret, xml_content, pdf_path, invoice_date, total_ttc,
+             emitter_code, *(fields.get(col) for col in EXTRACTED_COLUMNS)),
+        )
+        if document:
+            index_search_document(cursor, 'sent', invoice_num, document)
+    else:
+        cursor.execute(
+            f"""INSERT INTO sent_invoices
+               (invoice_num, company_name, company_siret, xml_facture, pdf_path, invoice_date, total_ttc,
+                emitter_code, {', '.join(EXTRACTED_COLUMNS)}, fields_extracted_at, search_vector)
+               VALUES (%s, %s, %s, %s::xml, %s, %s, %s, %s, {', '.join(['%s'] * len(EXTRACTED_COLUMNS))},
+                       {'now()' if fields else 'NULL'}, {SEARCH_VECTOR_SQL if document else 'NULL'})""",
+            (invoice_num, company_name, company_siret, xml_content, pdf_path, invoice_date, total_ttc,
+             emitter_code, *(fields.get(col) for col in EXTRACTED_COLUMNS), *(document or ())),
+        )
+    if vat_breakdown:
+        store_vat_breakdown(cursor, 'sent', invoice_num, vat_rows_from_totals(vat_breakdown), company_siret)
     cursor.close()
 
 
@@ -243,8 +261,13 @@ def validate_startup_config() -> None:
     emitter_errors = validate_emitter_config(CONFIG)
     errors.extend(emitter_errors)
 
-    # 2. Vérifier le fichier .env si PostgreSQL activé
-    if CONFIG.get('is_db_pg') is True:
+    # 2. Vérifier le fichier .env si PostgreSQL activé (ou ouvrir la base SQLite)
+    if CONFIG.get('is_db_pg') is True and CONFIG.get('is_db_sqlite') is True:
+        errors.append("is_db_pg=True et is_db_sqlite=True sont exclusifs : choisir un seul backend")
+    elif CONFIG.get('is_db_sqlite') is True:
+        if not check_sqlite_database():
+            errors.append("Impossible d'ouvrir la base SQLite")
+    elif CONFIG.get('is_db_pg') is True:
         env_file_exists = Path('.env').exists() or Path('.env.local').exists()
         if not env_file_exists:
             errors.append("is_db_pg=True mais aucun fichier .env ou .env.local trouvé")
@@ -255,6 +278,14 @@ def validate_startup_config() -> None:
             # 3. Vérifier la connexion à la base (ouvre puis ferme)
             if not check_database_connection():
                 errors.append("Impossible d'établir la connexion à PostgreSQL")
+            else:
+                # Partitions de l'année suivante (base partitionnée uniquement)
+                try:
+                    created = ensure_invoice_partitions()
+                    if created:
+                        print(f"[OK] {created} partition(s) de factures créée(s)")
+                except Exception as e:
+                    print(f"[WARNING] Partitions non vérifiées: {e}")
 
     # 4. Créer les répertoires de stockage
     ensure_storage_directories(CONFIG)
@@ -272,6 +303,8 @@ def validate_startup_config() -> None:
         print(f"  - SIRET: {CONFIG.get('siret')}")
         print(f"  - Logo: {LOGO_PATH}")
         print(f"  - PostgreSQL: {'Activé' if CONFIG.get('is_db_pg') else 'Désactivé'}")
+        if CONFIG.get('is_db_sqlite') is True:
+            print(f"  - SQLite: Activé ({backend_location()[1]})")
         print(f"  - Super PDP (PA): {'Activé' if CONFIG.get('super_pdp_as_pa') else 'Désactivé'}")
         if is_auto_numbering():
             try:
@@ -281,7 +314,7 @@ def validate_startup_config() -> None:
             except Exception as e:
                 print(f"  - Numérotation auto: [ERREUR] {e}")
         elif CONFIG.get('is_num_facturx_auto') is True:
-            print("  - Numérotation auto: Désactivée (requiert is_db_pg=True)")
+            print("  - Numérotation auto: Désactivée (requiert is_db_pg=True ou is_db_sqlite=True)")
         print(f"  - Stockage XML: {CONFIG.get('xml_storage', './data/factures-xml')}")
     print("=" * 60 + "\n")
 
@@ -289,31 +322,26 @@ def validate_startup_config() -> None:
 # Charger la configuration
 CONFIG = load_config()
 
-# Définir le chemin du logo (avec fallback)
-LOGO_PATH = get_logo_path(CONFIG)
-
-# Configuration de l'émetteur depuis le fichier de config
-EMITTER = {
-    'name': CONFIG.get('name', ''),
-    'address': CONFIG.get('address', ''),
-    'postal_code': CONFIG.get('postal_code', ''),
-    'city': CONFIG.get('city', ''),
-    'country_code': CONFIG.get('country_code', 'FR'),
-    'siren': CONFIG.get('siren', ''),
-    'siret': CONFIG.get('siret', ''),
-    'vat_number': CONFIG.get('num_tva', ''),
-    'bic': CONFIG.get('bic', ''),
-    # HTML/PDF uniquement
-    'legal_form': CONFIG.get('cie_legal_form', ''),
-    'iban': CONFIG.get('cie_IBAN', ''),
-    # XML Factur-X (notes BR-FR-05)
-    'pmt_text': CONFIG.get('pmt_text', ''),
-    'pmd_text': CONFIG.get('pmd_text', ''),
-}
+# Backend de base : SQLite embarqué si is_db_sqlite=True, sinon PostgreSQL
+if CONFIG.get('is_db_sqlite') is True:
+    configure_backend('sqlite', CONFIG.get('db_sqlite_path'))
+
+# Émetteurs : défaut depuis le fichier de config, autres profils chargés à la demande depuis la base
+EMITTERS = EmitterRegistry(CONFIG, use_db=lambda: is_db_enabled())
+
+# Chemin du logo (avec fallback) et émetteur par défaut (assistant web)
+LOGO_PATH = EMITTERS.default.logo_path
+EMITTER = EMITTERS.default.emitter
 
 app = Flask(__name__, template_folder='resources/templates', static_folder='resources', static_url_path='/static')
 app.secret_key = 'facturx-secret-key-change-in-production'
 
+# Brouillons de l'assistant (étapes 1 à 3) : seul leur identifiant est dans le cookie de session
+DRAFTS = DraftStore(CONFIG.get('draft_storage', './data/drafts'))
+
+# Résultats d'émission par clé de requête (rejeu sans nouveau rendu ni nouveau numéro)
+ISSUED_INVOICES = IdempotencyStore(use_db=lambda: is_db_enabled())
+
 TYPE_LABELS = {
     '380': 'Facture',
     '381': 'Avoir',
@@ -322,6 +350,21 @@ TYPE_LABELS = {
 }
 
 
+def current_draft() -> dict:
+    """Brouillon de la session courante ({} si aucun ou s'il a été supprimé)."""
+    draft_id = session.get('draft_id')
+    return (DRAFTS.load(draft_id) if draft_id else None) or {}
+
+
+def save_draft(**fields) -> dict:
+    """Met à jour le brouillon de la session (créé au premier enregistrement)."""
+    draft_id = session.get('draft_id')
+    if not draft_id or DRAFTS.load(draft_id) is None:
+        draft_id = new_draft_id()
+        session['draft_id'] = draft_id
+    return DRAFTS.update(draft_id, **fields)
+
+
 def validate_step1(data: dict, auto_numbering: bool = False) -> list[dict]:
     """Valide les données du formulaire step1."""
     errors = []
@@ -332,6 +375,13 @@ def validate_step1(data: dict, auto_numbering: bool = False) -> list[dict]:
     if not data.get('issue_date'):
         errors.append({'field': 'issue_date', 'message': 'La date d\'émission est obligatoire'})
 
+    for field, label in (('issue_date', "d'émission"), ('due_date', "d'échéance")):
+        if data.get(field):
+            try:
+                datetime.strptime(data[field], '%Y-%m-%d')
+            except ValueError:
+                errors.append({'field': field, 'message': f'La date {label} doit être au format AAAA-MM-JJ'})
+
     if not data.get('recipient_name', '').strip():
         errors.append({'field': 'recipient_name', 'message': 'La raison sociale du client est obligatoire'})
 
@@ -347,99 +397,6 @@ def validate_step1(data: dict, auto_numbering: bool = False) -> list[dict]:
     return errors
 
 
-def validate_step2(lines: list[dict]) -> list[dict]:
-    """Valide les lignes de facture."""
-    errors = []
-
-    if not lines:
-        errors.append({'field': 'lines', 'message': 'La facture doit contenir au moins une ligne'})
-        return errors
-
-    for i, line in enumerate(lines):
-        if not line.get('description', '').strip():
-            errors.append({
-                'field': f'lines[{i}][description]',
-                'message': f'Ligne {i+1} : la description est obligatoire'
-            })
-
-        try:
-            qty = Decimal(str(line.get('quantity', 0)))
-            if qty <= 0:
-                errors.append({
-                    'field': f'lines[{i}][quantity]',
-                    'message': f'Ligne {i+1} : la quantité doit être supérieure à 0'
-                })
-        except (ValueError, TypeError):
-            errors.append({
-                'field': f'lines[{i}][quantity]',
-                'message': f'Ligne {i+1} : quantité invalide'
-            })
-
-        try:
-            price = Decimal(str(line.get('unit_price_ht', 0)))
-            if price <= 0:
-                errors.append({
-                    'field': f'lines[{i}][unit_price_ht]',
-                    'message': f'Ligne {i+1} : le prix unitaire doit être supérieur à 0'
-                })
-        except (ValueError, TypeError):
-            errors.append({
-                'field': f'lines[{i}][unit_price_ht]',
-                'message': f'Ligne {i+1} : prix unitaire invalide'
-            })
-
-        # Validation catégorie TVA pour taux 0%
-        try:
-            vat_rate = Decimal(str(line.get('vat_rate', 20)))
-        except (ValueError, TypeError):
-            vat_rate = Decimal('20')
-
-        if vat_rate == 0:
-            vat_cat = line.get('vat_category', '').strip()
-            if not vat_cat:
-                errors.append({
-                    'field': f'lines[{i}][vat_category]',
-                    'message': f'Ligne {i+1} : la catégorie TVA est obligatoire quand le taux est à 0%'
-                })
-            elif vat_cat in ('E', 'AE', 'G', 'K', 'O'):
-                exemption_code = line.get('vat_exemption_code', '').strip()
-                exemption_reason = line.get('vat_exemption_reason', '').strip()
-                if not exemption_code and not exemption_reason:
-                    errors.append({
-                        'field': f'lines[{i}][vat_exemption_code]',
-                        'message': f'Ligne {i+1} : un code VATEX ou un motif d\'exonération est requis pour la catégorie {vat_cat}'
-                    })
-
-    return errors
-
-
-def parse_lines_from_form(form_data) -> list[dict]:
-    """Parse les lignes de facture depuis les données du formulaire."""
-    lines = []
-    line_indices = set()
-
-    for key in form_data.keys():
-        if key.startswith('lines[') and '][' in key:
-            idx = int(key.split('[')[1].split(']')[0])
-            line_indices.add(idx)
-
-    for idx in sorted(line_indices):
-        line = {
-            'description': form_data.get(f'lines[{idx}][description]', ''),
-            'quantity': form_data.get(f'lines[{idx}][quantity]', ''),
-            'unit_price_ht': form_data.get(f'lines[{idx}][unit_price_ht]', ''),
-            'vat_rate': form_data.get(f'lines[{idx}][vat_rate]', '20'),
-            'discount_value': form_data.get(f'lines[{idx}][discount_value]', ''),
-            'discount_type': form_data.get(f'lines[{idx}][discount_type]', 'percent'),
-            'vat_category': form_data.get(f'lines[{idx}][vat_category]', ''),
-            'vat_exemption_code': form_data.get(f'lines[{idx}][vat_exemption_code]', ''),
-            'vat_exemption_reason': form_data.get(f'lines[{idx}][vat_exemption_reason]', ''),
-        }
-        lines.append(line)
-
-    return lines
-
-
 def format_date_display(date_str: str) -> str:
     """Formate une date pour l'affichage."""
     if not date_str:
@@ -464,35 +421,34 @@ def get_logo_url() -> str:
 
 @app.route('/')
 def index():
-    """Redirige vers le dashboard si PostgreSQL activé, sinon vers step1."""
-    if CONFIG.get('is_db_pg') is True:
+    """Redirige vers le dashboard si une base est activée, sinon vers step1."""
+    if is_db_enabled():
         return redirect(url_for('dashboard'))
     return redirect(url_for('show_step1'))
 
 
 @app.route('/dashboard')
 def dashboard():
-    """Affiche le tableau de bord facturation (requiert is_db_pg=True)."""
-    if CONFIG.get('is_db_pg') is not True:
+    """Affiche le tableau de bord facturation (requiert is_db_pg=True ou is_db_sqlite=True)."""
+    if not is_db_enabled():
         return redirect(url_for('show_step1'))
 
-    db_host = os.environ.get('DB_URL', 'localhost')
-    db_name = os.environ.get('DB_NAME', 'k_factur_x')
+    db_host, db_name = backend_location()
 
-    # Token OAuth2 SuperPDP
+    # Token OAuth2 SuperPDP : lecture de l'état du gestionnaire, sans appel réseau
     session['OAUTH_TOKEN'] = None
     pdp_token_error = None
     pdp_token_validity = None
 
     if CONFIG.get('super_pdp_as_pa') is True:
-        try:
-            token_response = get_pdp_token()
-            session['OAUTH_TOKEN'] = token_response['access_token']
-            expires_in = token_response.get('expires_in', 0)
-            expiry_time = datetime.now() + timedelta(seconds=int(expires_in))
-            pdp_token_validity = expiry_time.strftime("%H:%M:%S")
-        except (EnvironmentError, RuntimeError) as e:
-            pdp_token_error = str(e)
+        token_manager = get_token_manager()
+        token_manager.start()
+        token_state = token_manager.state()
+        if token_state['access_token']:
+            session['OAUTH_TOKEN'] = token_state['access_token']
+            pdp_token_validity = datetime.fromtimestamp(token_state['expires_at']).strftime("%H:%M:%S")
+        else:
+            pdp_token_error = token_state['error']
 
     return render_template(
         'html/dashboard.html',
@@ -513,7 +469,7 @@ def show_step1():
     client_count = 0
 
     auto_numbering = CONFIG.get('is_num_facturx_auto') is True
-    is_db_pg = CONFIG.get('is_db_pg') is True
+    is_db_pg = is_db_enabled()
 
     if auto_numbering:
         try:
@@ -539,30 +495,14 @@ def show_step1():
         auto_numbering=auto_numbering,
         is_db_pg=is_db_pg,
         client_count=client_count,
+        drafts=DRAFTS.list_pending(limit=5),
     )
 
 
 @app.route('/invoice/step1', methods=['POST'])
 def submit_step1():
-    """Traite le formulaire step1 et stocke les données en session."""
-    data = {
-        'invoice_number': request.form.get('invoice_number', ''),
-        'type_code': request.form.get('type_code', '380'),
-        'currency_code': request.form.get('currency_code', 'EUR'),
-        'issue_date': request.form.get('issue_date', ''),
-        'due_date': request.form.get('due_date', ''),
-        'buyer_reference': request.form.get('buyer_reference', ''),
-        'purchase_order_reference': request.form.get('purchase_order_reference', ''),
-        'payment_terms': request.form.get('payment_terms', ''),
-        'recipient_name': request.form.get('recipient_name', ''),
-        'recipient_legal_form': request.form.get('recipient_legal_form', ''),
-        'recipient_siret': request.form.get('recipient_siret', ''),
-        'recipient_vat_number': request.form.get('recipient_vat_number', ''),
-        'recipient_address': request.form.get('recipient_address', ''),
-        'recipient_postal_code': request.form.get('recipient_postal_code', ''),
-        'recipient_city': request.form.get('recipient_city', ''),
-        'recipient_country_code': request.form.get('recipient_country_code', 'FR'),
-    }
+    """Traite le formulaire step1 et stocke les données dans le brouillon de la session."""
+    data = invoice_data_from_form(request.form)
 
     auto_num = is_auto_numbering()
 
@@ -587,7 +527,7 @@ def submit_step1():
 
     # Insertion du nouveau client en base si demandé
     client_exists = False
-    if CONFIG.get('is_db_pg') is True and request.form.get('save_new_client') == '1':
+    if is_db_enabled() and request.form.get('save_new_client') == '1':
         try:
             with db_cursor(commit=True) as (_conn, cursor):
                 cursor.execute(
@@ -615,8 +555,11 @@ def submit_step1():
             else:
                 print(f"[WARNING] Échec de l'enregistrement du client: {e}")
 
-    # Stocker en session
-    session['invoice_data'] = data
+    # Stocker dans le brouillon (étape 2 à reprendre) ; après une facture
+    # générée, la saisie suivante ouvre un nouveau brouillon
+    if current_draft().get('invoice_summary'):
+        session.pop('draft_id')
+    save_draft(invoice_data=data, step=2)
 
     response = {'success': True}
     if client_exists:
@@ -626,8 +569,8 @@ def submit_step1():
 
 @app.route('/api/clients/search')
 def search_clients():
-    """Recherche de clients par nom ou SIRET (requiert is_db_pg=True)."""
-    if CONFIG.get('is_db_pg') is not True:
+    """Recherche de clients par nom ou SIRET (requiert is_db_pg=True ou is_db_sqlite=True)."""
+    if not is_db_enabled():
         return jsonify({'error': 'Base de données non activée'}), 404
 
     q = request.args.get('q', '').strip()
@@ -636,17 +579,33 @@ def search_clients():
 
     try:
         with db_cursor() as (_conn, cursor):
-            like_pattern = f'%{q}%'
-            cursor.execute(
-                """SELECT id, recipient_name, cie_legal_form, recipient_siret,
-                          recipient_vat_number, recipient_address, recipient_postal_code,
-                          recipient_city, recipient_country_code
-                   FROM client_metadata
-                   WHERE recipient_name ILIKE %s OR recipient_siret ILIKE %s
-                   ORDER BY recipient_name
-                   LIMIT 10""",
-                (like_pattern, like_pattern),
-            )
+            columns_sql = """c.id, c.recipient_name, c.cie_legal_form, c.recipient_siret,
+                             c.recipient_vat_number, c.recipient_address, c.recipient_postal_code,
+                             c.recipient_city, c.recipient_country_code"""
+            if get_backend() == 'sqlite':
+                # Index FTS5 : mots du nom ou SIRET par préfixe, sans accents
+                fts_query = build_fts_query(q)
+                if fts_query is None:
+                    return jsonify({'results': []})
+                cursor.execute(
+                    f"""SELECT {columns_sql}
+                        FROM client_metadata_fts f
+                        JOIN client_metadata c ON c.id = f.rowid
+                        WHERE client_metadata_fts MATCH %s
+                        ORDER BY c.recipient_name
+                        LIMIT 10""",
+                    (fts_query,),
+                )
+            else:
+                like_pattern = f'%{q}%'
+                cursor.execute(
+                    f"""SELECT {columns_sql}
+                        FROM client_metadata c
+                        WHERE c.recipient_name ILIKE %s OR c.recipient_siret ILIKE %s
+                        ORDER BY c.recipient_name
+                        LIMIT 10""",
+                    (like_pattern, like_pattern),
+                )
             columns = [desc[0] for desc in cursor.description]
             results = [dict(zip(columns, row)) for row in cursor.fetchall()]
             return jsonify({'results': results})
@@ -657,23 +616,25 @@ def search_clients():
 
 @app.route('/api/db/test-connection')
 def test_db_connection():
-    """Teste la connexion à la base de données PostgreSQL."""
+    """Teste la connexion à la base de données (PostgreSQL ou SQLite)."""
     timestamp = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    db_host, db_name = backend_location()
     try:
         conn = get_db_connection()
         conn.close()
         return jsonify({
             'connected': True,
-            'host': os.environ.get('DB_URL', 'localhost'),
-            'database': os.environ.get('DB_NAME', 'k_factur_x'),
+            'host': db_host,
+            'database': db_name,
             'timestamp': timestamp,
+            'replica': replica_status(),
         })
     except Exception as e:
         print(f"[ERROR] Test connexion BDD: {e}")
         return jsonify({
             'connected': False,
-            'host': os.environ.get('DB_URL', 'localhost'),
-            'database': os.environ.get('DB_NAME', 'k_factur_x'),
+            'host': db_host,
+            'database': db_name,
             'timestamp': timestamp,
         })
 
@@ -681,12 +642,12 @@ def test_db_connection():
 @app.route('/api/dashboard/stats')
 def dashboard_stats():
     """Retourne les KPI du dashboard (compteurs factures)."""
-    if CONFIG.get('is_db_pg') is not True:
+    if not is_db_enabled():
         return jsonify({'error': 'Base de données non activée'}), 404
 
     stats = {'generated': 0, 'transferred': 0, 'received': 0, 'error': 0}
     try:
-        with db_cursor() as (_conn, cursor):
+        with db_cursor(readonly=True) as (_conn, cursor):
             cursor.execute("SELECT COUNT(*) FROM sent_invoices")
             stats['generated'] = cursor.fetchone()[0]
 
@@ -699,19 +660,29 @@ def dashboard_stats():
         print(f"[ERROR] Stats sent_invoices: {e}")
 
     try:
-        with db_cursor() as (_conn, cursor):
+        with db_cursor(readonly=True) as (_conn, cursor):
             cursor.execute("SELECT COUNT(*) FROM incoming_invoices")
             stats['received'] = cursor.fetchone()[0]
     except Exception as e:
         print(f"[WARNING] Stats incoming_invoices: {e}")
 
+    stats['last_sync'] = None
+    try:
+        with db_cursor(readonly=True) as (_conn, cursor):
+            cursor.execute("SELECT synced_at FROM pdp_sync_state WHERE name = %s", (SYNC_NAME,))
+            row = cursor.fetchone()
+            if row and row[0]:
+                stats['last_sync'] = row[0].isoformat()
+    except Exception as e:
+        print(f"[WARNING] Stats pdp_sync_state: {e}")
+
     return jsonify(stats)
 
 
 @app.route('/api/dashboard/invoices')
 def dashboard_invoices():
     """Retourne la liste des factures pour le dashboard."""
-    if CONFIG.get('is_db_pg') is not True:
+    if not is_db_enabled():
         return jsonify({'error': 'Base de données non activée'}), 404
 
     tab = request.args.get('tab', 'sent')
@@ -721,64 +692,62 @@ def dashboard_invoices():
     per_page = max(1, min(100, int(request.args.get('per_page', 5))))
     offset = (page - 1) * per_page
 
-    has_dates = bool(date_from and date_to)
+    # Filtres sur les colonnes extraites du XML à l'insertion (indexées)
+    conditions, params = [], []
+    if date_from and date_to:
+        conditions.append("invoice_date >= %s AND invoice_date <= %s")
+        params += [date_from, date_to]
+    if request.args.get('due_from'):
+        conditions.append("due_date >= %s")
+        params.append(request.args['due_from'])
+    if request.args.get('due_to'):
+        conditions.append("due_date <= %s")
+        params.append(request.args['due_to'])
+    if request.args.get('vat_number'):
+        # N° TVA du partenaire : le vendeur d'une facture reçue, l'acheteur d'une facture émise
+        conditions.append("seller_vat_number = %s" if tab == 'received' else "buyer_vat_number = %s")
+        params.append(request.args['vat_number'].replace(' ', '').upper())
+    if request.args.get('reference'):
+        conditions.append("(buyer_reference = %s OR purchase_order_reference = %s)")
+        params += [request.args['reference']] * 2
+    if get_backend() == 'sqlite':
+        fts_query = build_fts_query(request.args.get('q', ''))
+        if fts_query:
+            conditions.append("invoice_num IN (SELECT invoice_num FROM invoice_search_fts "
+                              "WHERE invoice_search_fts MATCH %s AND direction = %s)")
+            params += [fts_query, 'received' if tab == 'received' else 'sent']
+    else:
+        tsquery = build_tsquery(request.args.get('q', ''))
+        if tsquery:
+            conditions.append(f"search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)")
+            params.append(tsquery)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
 
     try:
-        with db_cursor() as (_conn, cursor):
+        with db_cursor(readonly=True) as (_conn, cursor):
             if tab == 'received':
-                if has_dates:
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM incoming_invoices WHERE invoice_date >= %s AND invoice_date <= %s",
-                        (date_from, date_to),
-                    )
-                else:
-                    cursor.execute("SELECT COUNT(*) FROM incoming_invoices")
+                cursor.execute(f"SELECT COUNT(*) FROM incoming_invoices {where}", params)
                 total = cursor.fetchone()[0]
-
-                if has_dates:
-                    cursor.execute(
-                        """SELECT invoice_num, company_name, invoice_date, total_ttc
-                           FROM incoming_invoices
-                           WHERE invoice_date >= %s AND invoice_date <= %s
-                           ORDER BY received_at DESC
-                           LIMIT %s OFFSET %s""",
-                        (date_from, date_to, per_page, offset),
-                    )
-                else:
-                    cursor.execute(
-                        """SELECT invoice_num, company_name, invoice_date, total_ttc
-                           FROM incoming_invoices
-                           ORDER BY received_at DESC
-                           LIMIT %s OFFSET %s""",
-                        (per_page, offset),
-                    )
+                cursor.execute(
+                    f"""SELECT invoice_num, company_name, company_siret, invoice_date, due_date, total_ht, total_ttc
+                        FROM incoming_invoices
+                        {where}
+                        ORDER BY received_at DESC
+                        LIMIT %s OFFSET %s""",
+                    params + [per_page, offset],
+                )
             else:
-                if has_dates:
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM sent_invoices WHERE invoice_date >= %s AND invoice_date <= %s",
-                        (date_from, date_to),
-                    )
-                else:
-                    cursor.execute("SELECT COUNT(*) FROM sent_invoices")
+                cursor.execute(f"SELECT COUNT(*) FROM sent_invoices {where}", params)
                 total = cursor.fetchone()[0]
-
-                if has_dates:
-                    cursor.execute(
-                        """SELECT invoice_num, company_name, invoice_date, total_ttc, status
-                           FROM sent_invoices
-                           WHERE invoice_date >= %s AND invoice_date <= %s
-                           ORDER BY created_at DESC
-                           LIMIT %s OFFSET %s""",
-                        (date_from, date_to, per_page, offset),
-                    )
-                else:
-                    cursor.execute(
-                        """SELECT invoice_num, company_name, invoice_date, total_ttc, status
-                           FROM sent_invoices
-                           ORDER BY created_at DESC
-                           LIMIT %s OFFSET %s""",
-                        (per_page, offset),
-                    )
+                cursor.execute(
+                    f"""SELECT invoice_num, company_name, invoice_date, due_date, total_ht, total_ttc, status,
+                               lifecycle_status, lifecycle_at
+                        FROM sent_invoices
+                        {where}
+                        ORDER BY created_at DESC
+                        LIMIT %s OFFSET %s""",
+                    params + [per_page, offset],
+                )
 
             columns = [desc[0] for desc in cursor.description]
             rows = cursor.fetchall()
@@ -787,12 +756,18 @@ def dashboard_invoices():
             for row in rows:
                 inv = dict(zip(columns, row))
                 # Sérialiser les types non-JSON
-                if inv.get('invoice_date'):
-                    inv['invoice_date'] = str(inv['invoice_date'])
-                if inv.get('total_ttc') is not None:
-                    inv['total_ttc'] = float(inv['total_ttc'])
+                for key in ('invoice_date', 'due_date'):
+                    if inv.get(key):
+                        inv[key] = str(inv[key])
+                for key in ('total_ht', 'total_ttc'):
+                    if inv.get(key) is not None:
+                        inv[key] = float(inv[key])
                 if inv.get('status') is not None:
                     inv['status'] = str(inv['status'])
+                if 'lifecycle_status' in inv:
+                    inv['lifecycle_label'] = lifecycle_label(inv['lifecycle_status'])
+                if inv.get('lifecycle_at') is not None:
+                    inv['lifecycle_at'] = inv['lifecycle_at'].isoformat()
                 invoices.append(inv)
 
             total_pages = math.ceil(total / per_page) if total > 0 else 1
@@ -808,10 +783,123 @@ def dashboard_invoices():
         return jsonify({'invoices': [], 'error': str(e)}), 500
 
 
+@app.route('/api/search')
+def api_search():
+    """Recherche plein texte dans les factures émises et reçues (pertinence, pagination par curseur)."""
+    if CONFIG.get('is_db_pg') is not True:
+        return jsonify({'error': 'Base de données non activée'}), 404
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Paramètre q obligatoire'}), 400
+    try:
+        limit = max(1, min(100, int(request.args.get('limit', 20))))
+        result = search_invoices(query, request.args.get('tab', 'all'), limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"[ERROR] Recherche: {e}")
+        return jsonify({'results': [], 'error': str(e)}), 500
+    return jsonify(result)
+
+
+@app.route('/api/invoice/<path:invoice_num>/events')
+def invoice_events(invoice_num):
+    """Retourne l'historique du cycle de vie d'une facture émise (synchronisé depuis la PDP)."""
+    if CONFIG.get('is_db_pg') is not True:
+        return jsonify({'error': 'Base de données non activée'}), 404
+
+    try:
+        return jsonify({'invoice_num': invoice_num, 'events': get_invoice_events(invoice_num)})
+    except Exception as e:
+        print(f"[ERROR] Événements facture {invoice_num}: {e}")
+        return jsonify({'events': [], 'error': str(e)}), 500
+
+
+def _parse_export_args():
+    """Lit et valide les paramètres communs des exports (onglet, période, SIRET)."""
+    tab = request.args.get('tab', 'sent')
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    siret = request.args.get('siret', '').strip() or None
+
+    errors = []
+    if tab not in EXPORT_TABLES:
+        errors.append({'field': 'tab', 'message': f'Type de factures inconnu : {tab}'})
+    for field, value in (('date_from', date_from), ('date_to', date_to)):
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            errors.append({'field': field, 'message': 'Date attendue au format AAAA-MM-JJ'})
+    if siret and not re.match(r'^\d{14}$', siret):
+        errors.append({'field': 'siret', 'message': 'Le SIRET doit contenir exactement 14 chiffres'})
+
+    return tab, date_from, date_to, siret, errors
+
+
+@app.route('/api/export/zip')
+def export_zip():
+    """Exporte en flux une archive ZIP des PDF et XML d'une période."""
+    if CONFIG.get('is_db_pg') is not True:
+        return jsonify({'error': 'Base de données non activée'}), 404
+
+    tab, date_from, date_to, siret, errors = _parse_export_args()
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    invoices = iter_invoices_for_export(tab, date_from, date_to, siret)
+    filename = f"factures-{tab}-{date_from}_{date_to}.zip"
+    return Response(
+        stream_invoices_zip(invoices),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route('/api/export/accounting')
+def export_accounting():
+    """Exporte en flux les écritures comptables (FEC ou CSV) d'une période."""
+    if CONFIG.get('is_db_pg') is not True:
+        return jsonify({'error': 'Base de données non activée'}), 404
+
+    tab = request.args.get('tab', 'all')
+    fmt = request.args.get('format', 'fec')
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+
+    errors = []
+    if tab != 'all' and tab not in EXPORT_TABLES:
+        errors.append({'field': 'tab', 'message': f'Type de factures inconnu : {tab}'})
+    if fmt not in ACCOUNTING_FORMATS:
+        errors.append({'field': 'format', 'message': f"Format d'export inconnu : {fmt}"})
+    for field, value in (('date_from', date_from), ('date_to', date_to)):
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            errors.append({'field': field, 'message': 'Date attendue au format AAAA-MM-JJ'})
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    directions = list(EXPORT_TABLES) if tab == 'all' else [tab]
+    if fmt == 'fec':
+        # Nom réglementaire : <SIREN>FEC<AAAAMMJJ de clôture>.txt
+        filename = f"{CONFIG.get('siren', '')}FEC{date_to.replace('-', '')}.txt"
+        mimetype = 'text/plain; charset=iso-8859-15'
+    else:
+        filename = f"ecritures-{tab}-{date_from}_{date_to}.csv"
+        mimetype = 'text/csv; charset=utf-8'
+
+    return Response(
+        stream_accounting_export(directions, date_from, date_to, fmt),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
 @app.route('/api/clients/count')
 def count_clients():
-    """Retourne le nombre de clients en base (requiert is_db_pg=True)."""
-    if CONFIG.get('is_db_pg') is not True:
+    """Retourne le nombre de clients en base (requiert is_db_pg=True ou is_db_sqlite=True)."""
+    if not is_db_enabled():
         return jsonify({'error': 'Base de données non activée'}), 404
 
     try:
@@ -826,8 +914,9 @@ def count_clients():
 
 @app.route('/invoice/step2')
 def show_step2():
-    """Affiche le formulaire step2 avec les données de step1."""
-    invoice_data = session.get('invoice_data')
+    """Affiche le formulaire step2 avec les données de step1 (et les lignes d'un brouillon repris)."""
+    draft = current_draft()
+    invoice_data = draft.get('invoice_data')
 
     if not invoice_data:
         return redirect(url_for('show_step1'))
@@ -844,39 +933,400 @@ def show_step2():
         logo_path=get_logo_url(),
         emitter=EMITTER,
         invoice=invoice,
+        draft_lines=draft.get('lines') or [],
     )
 
 
+@app.route('/api/invoice/lines/import', methods=['POST'])
+def import_invoice_lines():
+    """Lit des lignes CSV (fichier ou cellules collées depuis un tableur) et les renvoie en colonnes pour step2."""
+    try:
+        columns = line_columns_from_csv(request.get_data())
+    except ValueError as e:
+        return jsonify({'success': False, 'errors': [{'field': 'lines', 'message': str(e)}]}), 400
+    return jsonify({'success': True, 'lines': columns, 'count': len(columns['description'])})
+
+
 def _sanitize_invoice_number(invoice_number: str) -> str:
     """Nettoie le numéro de facture pour l'utiliser dans un nom de fichier."""
     return re.sub(r'[^\w\-]', '_', invoice_number)
 
 
-def save_to_storage(content, invoice_number: str, storage_type: str) -> str:
-    """Sauvegarde un fichier (xml ou pdf) dans le répertoire de stockage."""
-    config_key = f'{storage_type}_storage'
-    defaults = {'xml': './data/factures-xml', 'pdf': './data/factures-pdf'}
-    storage_dir = CONFIG.get(config_key, defaults[storage_type])
+def storage_path(invoice_number: str, storage_type: str, emitter=None) -> Path:
+    """Chemin d'archivage d'un fichier (xml ou pdf) d'une facture de l'émetteur (défaut : ma-conf.txt)."""
+    storage_dir = (emitter or EMITTERS.default).storage_dir(storage_type)
+    return storage_dir / f"{_sanitize_invoice_number(invoice_number)}.{storage_type}"
 
-    safe_number = _sanitize_invoice_number(invoice_number)
-    filename = f"{safe_number}.{storage_type}"
-    filepath = Path(storage_dir) / filename
 
-    if storage_type == 'xml':
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
-    else:
-        with open(filepath, 'wb') as f:
-            f.write(content)
+@contextmanager
+def storage_target(invoice_number: str, storage_type: str, emitter=None):
+    """
+    Chemin temporaire (`.<fichier>.part`, à côté du fichier final) où écrire
+    un fichier archivé ; renommé à la sortie du bloc, supprimé en cas d'erreur.
 
+    Un fichier archivé est donc toujours complet, même si la génération
+    échoue en cours d'écriture.
+    """
+    filepath = storage_path(invoice_number, storage_type, emitter)
+    partial = filepath.with_name(f".{filepath.name}.part")
+    try:
+        yield partial
+        os.replace(partial, filepath)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
     print(f"[OK] {storage_type.upper()} sauvegardé: {filepath}")
+
+
+def save_to_storage(content, invoice_number: str, storage_type: str, emitter=None) -> str:
+    """Sauvegarde un fichier (xml ou pdf, texte ou bytes) dans le répertoire de stockage de l'émetteur."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    with storage_target(invoice_number, storage_type, emitter) as partial:
+        with open(partial, 'wb') as f:
+            f.write(content)
+    filepath = storage_path(invoice_number, storage_type, emitter)
+    if storage_type == 'pdf':
+        # Empreinte connue dès l'écriture : ETag disponible sans relire le fichier
+        remember_file_hash(str(filepath), content)
     return str(filepath)
 
 
+class InvoiceGenerationError(Exception):
+    """Échec de la génération Factur-X (numérotation, PDF, XML ou archivage)."""
+
+
+def write_facturx_pdf(invoice_data: dict, lines: list[dict], target, compact: bool = None, emitter=None) -> str:
+    """
+    Génère le XML Factur-X et écrit le PDF Factur-X qui l'embarque dans `target`.
+
+    Chaque étape écrit dans un fichier : rendu ReportLab et OutputIntent dans
+    un fichier temporaire (en mémoire jusqu'à PDF_SPOOL_MAX_SIZE, puis sur
+    disque), PDF Factur-X directement dans `target` par la librairie
+    factur-x. En mode compact, le PDF Factur-X passe par un fichier
+    temporaire relu par write_compact_pdf.
+
+    Args:
+        target: Chemin du PDF à écrire.
+        compact: Mode compact (logo réduit, profil ICC compressé, flux
+            d'objets) ; par défaut selon pdf_compact de l'émetteur.
+        emitter: Émetteur (utils/emitters.py), défaut : ma-conf.txt. Son
+            bloc XML vendeur et son gabarit de page sont construits une fois.
+
+    Returns:
+        Le XML Factur-X.
+    """
+    emitter = emitter or EMITTERS.default
+    if compact is None:
+        compact = emitter.compact_pdf
+    full_data = {
+        'emitter': emitter.emitter,
+        'seller_xml': emitter.seller_xml,
+        'invoice': invoice_data,
+        'lines': lines,
+    }
+    xml_content = generate_facturx_xml(full_data)
+    facturx_path = str(target)
+    if compact:
+        fd, facturx_path = tempfile.mkstemp(prefix='facturx-', suffix='.pdf')
+        os.close(fd)
+    try:
+        with spooled_pdf() as pdf:
+            write_invoice_pdf(full_data, pdf, compact=compact, layout=emitter.page_layout(compact))
+            pdf.seek(0)
+            generate_from_file(
+                pdf,
+                xml_content.encode('utf-8'),
+                flavor='factur-x',
+                level='en16931',
+                check_xsd=True,
+                pdf_metadata={
+                    'author': emitter.emitter['name'],
+                    'title': f"Facture {invoice_data['invoice_number']}",
+                    'subject': 'Facture électronique Factur-X',
+                },
+                output_pdf_file=facturx_path,
+            )
+        if compact:
+            with open(facturx_path, 'rb') as source, open(target, 'wb') as out:
+                if not write_compact_pdf(source, out):
+                    source.seek(0)
+                    shutil.copyfileobj(source, out)
+    finally:
+        if compact:
+            os.unlink(facturx_path)
+    return xml_content
+
+
+def _generate_and_store(invoice_data: dict, lines: list[dict], emitter) -> tuple[str, str, str]:
+    """
+    Génère le PDF Factur-X (PDF + XML embarqué) et archive les deux fichiers.
+
+    Le PDF est écrit directement dans le stockage PDF de l'émetteur (fichier
+    `.part` renommé une fois complet), sans copie complète en mémoire.
+
+    Returns:
+        (xml_content, xml_filepath, pdf_filepath)
+    """
+    number = invoice_data['invoice_number']
+    with storage_target(number, 'pdf', emitter) as partial:
+        xml_content = write_facturx_pdf(invoice_data, lines, partial, emitter=emitter)
+    xml_filepath = save_to_storage(xml_content, number, 'xml', emitter)
+    return xml_content, xml_filepath, str(storage_path(number, 'pdf', emitter))
+
+
+def _issued_result(invoice_num: str, xml_content: str, xml_filepath: str, pdf_filepath: str,
+                   db_status: str) -> dict:
+    """Champs rejouables (_REPLAY_FIELDS) du résultat d'une émission."""
+    return {
+        'invoice_number': invoice_num,
+        'xml_path': xml_filepath,
+        'pdf_path': pdf_filepath,
+        'xml_sha256': hashlib.sha256(xml_content.encode('utf-8')).hexdigest(),
+        'pdf_sha256': compute_file_hash(pdf_filepath),
+        'db_status': db_status,
+    }
+
+
+def issue_invoice(invoice_data: dict, lines: list[dict], emitter=None, request_key: str | None = None) -> dict:
+    """
+    Émet une facture dont l'en-tête et les lignes sont déjà validés.
+
+    Chemin commun à l'assistant (POST /invoice) et à l'API REST
+    (/api/v1/invoices) : numérotation automatique sous verrou si active
+    (`invoice_data['invoice_number']` est alors renseigné), génération
+    Factur-X, archivage XML/PDF et insertion dans sent_invoices. Numéro,
+    verrou et stockage sont ceux de l'émetteur (défaut : ma-conf.txt).
+    Avec `request_key` (clé réservée par issue_invoice_once), le résultat
+    est enregistré dans la transaction qui insère la facture.
+
+    Returns:
+        {invoice_number, totals, xml_path, pdf_path, xml_sha256, pdf_sha256, db_status}
+
+    Raises:
+        InvoiceGenerationError: Échec de la numérotation, de la génération ou de l'archivage.
+    """
+    emitter = emitter or EMITTERS.default
+    auto_num = is_auto_numbering()
+
+    # Calculer les totaux avant la génération pour disposer de total_ttc
+    invoice_totals = calculate_invoice_totals(lines)
+    total_ttc_value = float(invoice_totals['total_ttc'])
+
+    try:
+        # Si numérotation auto : ouvrir connexion, lock table, calcul du numéro
+        if auto_num:
+            with db_connection() as conn:
+                lock_sent_invoices(conn, scope=emitter.code)
+                invoice_data['invoice_number'] = get_next_invoice_number(conn, emitter)
+
+                # Génération dans la transaction (le lock empêche les doublons)
+                xml_content, xml_filepath, pdf_filepath = _generate_and_store(invoice_data, lines, emitter)
+                issued = _issued_result(invoice_data['invoice_number'], xml_content, xml_filepath,
+                                        pdf_filepath, 'ok')
+
+                insert_sent_invoice(
+                    conn,
+                    invoice_num=invoice_data['invoice_number'],
+                    company_name=invoice_data['recipient_name'],
+                    company_siret=invoice_data['recipient_siret'],
+                    xml_content=xml_content,
+                    pdf_path=pdf_filepath,
+                    invoice_date=invoice_data['issue_date'],
+                    total_ttc=total_ttc_value,
+                    vat_breakdown=invoice_totals['vat_breakdown'],
+                    emitter_code=emitter.code,
+                )
+                if request_key:
+                    ISSUED_INVOICES.record(conn, request_key, issued)
+                conn.commit()
+                print(f"[OK] Facture {invoice_data['invoice_number']} insérée en base")
+        else:
+            # Pas de numérotation auto : génération simple
+            xml_content, xml_filepath, pdf_filepath = _generate_and_store(invoice_data, lines, emitter)
+            issued = _issued_result(invoice_data['invoice_number'], xml_content, xml_filepath,
+                                    pdf_filepath, 'non_applicable')
+
+    except Exception as e:
+        print(f"[ERROR] Échec de la génération Factur-X: {e}")
+        raise InvoiceGenerationError(str(e)) from e
+
+    # Insérer en base si une base est activée (sans auto_num, l'insertion auto_num est déjà faite)
+    if not auto_num and is_db_enabled():
+        try:
+            with db_cursor(commit=True) as (db_conn, _cursor):
+                insert_sent_invoice(
+                    db_conn,
+                    invoice_num=invoice_data['invoice_number'],
+                    company_name=invoice_data['recipient_name'],
+                    company_siret=invoice_data['recipient_siret'],
+                    xml_content=xml_content,
+                    pdf_path=pdf_filepath,
+                    invoice_date=invoice_data['issue_date'],
+                    total_ttc=total_ttc_value,
+                    vat_breakdown=invoice_totals['vat_breakdown'],
+                    emitter_code=emitter.code,
+                )
+                if request_key:
+                    ISSUED_INVOICES.record(db_conn, request_key, {**issued, 'db_status': 'ok'})
+            print(f"[OK] Facture {invoice_data['invoice_number']} insérée en base")
+            issued['db_status'] = 'ok'
+        except Exception as e:
+            print(f"[WARNING] Échec de l'insertion en base: {e}")
+            issued['db_status'] = 'erreur'
+
+    return {**issued, 'totals': invoice_totals}
+
+
+# Champs du résultat d'émission conservés pour un rejeu (les totaux sont recalculés)
+_REPLAY_FIELDS = ('invoice_number', 'xml_path', 'pdf_path', 'xml_sha256', 'pdf_sha256', 'db_status')
+
+
+def issue_invoice_once(invoice_data: dict, lines: list[dict], request_key: str | None = None,
+                       scope: str = '', ttl: float | None = None, emitter=None) -> tuple[dict, bool]:
+    """
+    Émet une facture au plus une fois par clé de requête (voir utils/idempotency.py).
+
+    Sans clé, l'empreinte du contenu normalisé sert de clé pendant
+    CONTENT_TTL, préfixée par `scope` (ex. brouillon de l'assistant) ; une
+    clé fournie par le client reste valable `ttl` (défaut KEY_TTL). Une requête rejouée
+    reçoit le résultat enregistré : ni nouveau rendu, ni nouveau numéro.
+    Le résultat est écrit dans la transaction d'insertion de la facture : une
+    réservation reprise après un arrêt du processus (PENDING_TIMEOUT) rejoue
+    la facture déjà en base au lieu d'en émettre une seconde.
+    Les clés d'un émetteur autre que le défaut sont préfixées par son code :
+    deux émetteurs peuvent employer la même clé.
+
+    Returns:
+        (résultat d'issue_invoice, True si c'est un rejeu)
+
+    Raises:
+        IdempotencyConflict: Clé déjà utilisée pour une autre facture.
+        IdempotencyInProgress: Émission en cours pour cette clé.
+        InvoiceGenerationError: Échec de la génération (la clé est libérée).
+    """
+    emitter = emitter or EMITTERS.default
+    content_hash = invoice_content_hash(invoice_data, lines, auto_numbering=is_auto_numbering())
+    tenant = '' if emitter.is_default else f'{emitter.code}:'
+    if request_key:
+        key, ttl = f'key:{tenant}{request_key}', ttl or KEY_TTL
+    else:
+        key, ttl = f'content:{tenant}{scope}{content_hash}', CONTENT_TTL
+
+    stored = ISSUED_INVOICES.claim(key, content_hash, ttl=ttl)
+    if stored is not None:
+        invoice_data['invoice_number'] = stored['invoice_number']
+        return {**stored, 'totals': calculate_invoice_totals(lines)}, True
+
+    try:
+        issued = issue_invoice(invoice_data, lines, emitter, request_key=key)
+    except BaseException:
+        ISSUED_INVOICES.release(key)
+        raise
+    ISSUED_INVOICES.complete(key, content_hash, {field: issued[field] for field in _REPLAY_FIELDS}, ttl=ttl)
+    return issued, False
+
+
+def issue_billing_item(run_id: str, template_id: int, payload: dict) -> dict | None:
+    """
+    Émet la facture d'un élément de run de facturation (exécuté dans un worker, voir utils/billing.py).
+
+    La clé d'idempotence de l'élément garantit qu'un élément repris après
+    une interruption rejoue la facture déjà émise au lieu d'en émettre une autre.
+    La facture est émise pour l'émetteur du modèle (`payload['emitter']`, défaut sinon).
+
+    Returns:
+        {status: 'ISSUED', invoice_num} ou {status: 'FAILED', error}, ou None si
+        l'élément est en cours d'émission dans un autre worker.
+    """
+    invoice_data, lines = payload['invoice'], payload['lines']
+    errors = validate_step1(invoice_data, auto_numbering=is_auto_numbering()) + validate_step2(lines)
+    if errors:
+        return {'status': 'FAILED', 'error': '; '.join(error['message'] for error in errors)}
+    try:
+        emitter = EMITTERS.get(payload.get('emitter'))
+    except (EmitterNotFound, EmitterConfigError) as e:
+        return {'status': 'FAILED', 'error': str(e)}
+    try:
+        issued, _replayed = issue_invoice_once(
+            invoice_data, lines, request_key=item_request_key(run_id, template_id), ttl=BILLING_KEY_TTL,
+            emitter=emitter,
+        )
+    except IdempotencyInProgress:
+        return None
+    except IdempotencyConflict:
+        return {'status': 'FAILED', 'error': "Clé d'idempotence déjà utilisée pour une autre facture"}
+    except InvoiceGenerationError as e:
+        return {'status': 'FAILED', 'error': f'Erreur lors de la génération: {e}'}
+    if issued['db_status'] != 'ok':
+        return {'status': 'FAILED', 'error': f"Facture {issued['invoice_number']} non enregistrée en base"}
+    return {'status': 'ISSUED', 'invoice_num': issued['invoice_number']}
+
+
+def _fmt_amount(value) -> str:
+    return str(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def build_invoice_summary(invoice_data: dict, lines: list[dict], issued: dict) -> dict:
+    """Récapitulatif affiché par step3 (brouillon finalisé)."""
+    invoice_totals = issued['totals']
+    safe_number = _sanitize_invoice_number(invoice_data['invoice_number'])
+    pdf_filename = f"{safe_number}.pdf"
+    xml_filename = f"{safe_number}.xml"
+
+    summary_lines = []
+    for line in lines:
+        lt = calculate_line_totals(line)
+        vat_display = str(lt['vat_rate'])
+        if lt['vat_category'] != 'S':
+            vat_display += f" ({lt['vat_category']})"
+        summary_lines.append({
+            'description': line['description'],
+            'quantity': str(lt['quantity']),
+            'unit_price': _fmt_amount(lt['unit_price']),
+            'vat_rate': vat_display,
+            'net_ht': _fmt_amount(lt['net_ht']),
+            'discount_amount': _fmt_amount(lt['discount_amount']),
+        })
+
+    vat_breakdown = []
+    for rate_key in sorted(invoice_totals['vat_breakdown'].keys(), key=lambda k: invoice_totals['vat_breakdown'][k]['rate'], reverse=True):
+        info = invoice_totals['vat_breakdown'][rate_key]
+        rate_display = str(info['rate'])
+        if info.get('vat_category', 'S') != 'S':
+            rate_display += f" ({info['vat_category']})"
+        vat_breakdown.append({
+            'rate': rate_display,
+            'base_ht': _fmt_amount(info['base_ht']),
+            'vat_amount': _fmt_amount(info['vat_amount']),
+        })
+
+    return {
+        'invoice_number': invoice_data['invoice_number'],
+        'type_code': invoice_data['type_code'],
+        'type_label': TYPE_LABELS.get(invoice_data['type_code'], 'Facture'),
+        'currency_code': invoice_data.get('currency_code', 'EUR'),
+        'issue_date': format_date_display(invoice_data['issue_date']),
+        'due_date': format_date_display(invoice_data.get('due_date', '')),
+        'recipient_name': invoice_data['recipient_name'],
+        'recipient_siret': invoice_data['recipient_siret'],
+        'emitter_name': EMITTER['name'],
+        'emitter_siret': EMITTER['siret'],
+        'lines': summary_lines,
+        'total_ht': _fmt_amount(invoice_totals['total_ht']),
+        'total_vat': _fmt_amount(invoice_totals['total_vat']),
+        'total_ttc': _fmt_amount(invoice_totals['total_ttc']),
+        'vat_breakdown': vat_breakdown,
+        'pdf_filename': pdf_filename,
+        'xml_filename': xml_filename,
+        'db_status': issued['db_status'],
+    }
+
+
 @app.route('/invoice', methods=['POST'])
 def generate_invoice():
     """Génère le fichier PDF Factur-X complet (PDF + XML embarqué)."""
-    invoice_data = session.get('invoice_data')
+    invoice_data = current_draft().get('invoice_data')
 
     if not invoice_data:
         return jsonify({
@@ -884,173 +1334,40 @@ def generate_invoice():
             'errors': [{'field': '_form', 'message': 'Session expirée, veuillez recommencer'}]
         }), 400
 
-    lines = parse_lines_from_form(request.form)
-    errors = validate_step2(lines)
+    # Lignes en JSON (colonnes, envoyé par step2) ou en formulaire lines[<i>][<champ>]
+    if request.is_json:
+        try:
+            columns = line_columns_from_payload(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'success': False, 'errors': [{'field': 'lines', 'message': str(e)}]}), 400
+    else:
+        columns = line_columns_from_form(request.form)
+    errors = validate_line_columns(columns)
 
     if errors:
         return jsonify({'success': False, 'errors': errors}), 400
+    lines = columns_to_lines(columns)
 
-    try:
-        auto_num = is_auto_numbering()
-
-        # Calculer les totaux avant la génération pour disposer de total_ttc
-        invoice_totals = calculate_invoice_totals(lines)
-        total_ttc_value = float(invoice_totals['total_ttc'])
+    # Lignes valides conservées : une génération en échec peut être reprise
+    draft = save_draft(lines=lines)
 
+    try:
         try:
-            # Si numérotation auto : ouvrir connexion, lock table, calcul du numéro
-            if auto_num:
-                with db_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("LOCK TABLE sent_invoices IN EXCLUSIVE MODE")
-                    cursor.close()
-                    invoice_data['invoice_number'] = get_next_invoice_number(conn)
-                    session['invoice_data'] = invoice_data
-
-                    # Génération dans la transaction (le lock empêche les doublons)
-                    full_data = {
-                        'emitter': EMITTER,
-                        'invoice': invoice_data,
-                        'lines': lines,
-                    }
-                    pdf_bytes = generate_invoice_pdf(full_data, logo_path=LOGO_PATH)
-                    xml_content = generate_facturx_xml(full_data)
-                    facturx_pdf_bytes = generate_from_binary(
-                        pdf_file=pdf_bytes,
-                        xml=xml_content.encode('utf-8'),
-                        flavor='factur-x',
-                        level='en16931',
-                        check_xsd=True,
-                        pdf_metadata={
-                            'author': EMITTER['name'],
-                            'title': f"Facture {invoice_data['invoice_number']}",
-                            'subject': 'Facture électronique Factur-X',
-                        }
-                    )
-                    xml_filepath = save_to_storage(xml_content, invoice_data['invoice_number'], 'xml')
-                    pdf_filepath = save_to_storage(facturx_pdf_bytes, invoice_data['invoice_number'], 'pdf')
-
-                    insert_sent_invoice(
-                        conn,
-                        invoice_num=invoice_data['invoice_number'],
-                        company_name=invoice_data['recipient_name'],
-                        company_siret=invoice_data['recipient_siret'],
-                        xml_content=xml_content,
-                        pdf_path=pdf_filepath,
-                        invoice_date=invoice_data['issue_date'],
-                        total_ttc=total_ttc_value,
-                    )
-                    conn.commit()
-                    print(f"[OK] Facture {invoice_data['invoice_number']} insérée en base")
-            else:
-                # Pas de numérotation auto : génération simple
-                full_data = {
-                    'emitter': EMITTER,
-                    'invoice': invoice_data,
-                    'lines': lines,
-                }
-                pdf_bytes = generate_invoice_pdf(full_data, logo_path=LOGO_PATH)
-                xml_content = generate_facturx_xml(full_data)
-                facturx_pdf_bytes = generate_from_binary(
-                    pdf_file=pdf_bytes,
-                    xml=xml_content.encode('utf-8'),
-                    flavor='factur-x',
-                    level='en16931',
-                    check_xsd=True,
-                    pdf_metadata={
-                        'author': EMITTER['name'],
-                        'title': f"Facture {invoice_data['invoice_number']}",
-                        'subject': 'Facture électronique Factur-X',
-                    }
-                )
-                xml_filepath = save_to_storage(xml_content, invoice_data['invoice_number'], 'xml')
-                pdf_filepath = save_to_storage(facturx_pdf_bytes, invoice_data['invoice_number'], 'pdf')
-
-        except Exception as e:
-            print(f"[ERROR] Échec de la génération Factur-X: {e}")
+            # Double clic ou nouvel essai : le résultat du même brouillon est réutilisé
+            issued, _replayed = issue_invoice_once(invoice_data, lines, scope=f"draft:{draft['id']}:")
+        except IdempotencyInProgress:
+            return jsonify({
+                'success': False,
+                'errors': [{'field': '_form', 'message': 'Génération déjà en cours pour cette facture'}]
+            }), 409
+        except InvoiceGenerationError as e:
             return jsonify({
                 'success': False,
                 'errors': [{'field': '_form', 'message': f'Erreur lors de la génération: {str(e)}'}]
             }), 500
 
-        # Insérer en base si is_db_pg activé (sans auto_num, l'insertion auto_num est déjà faite)
-        db_status = 'non_applicable'
-        if auto_num:
-            db_status = 'ok'
-        elif CONFIG.get('is_db_pg') is True:
-            try:
-                with db_cursor(commit=True) as (db_conn, _cursor):
-                    insert_sent_invoice(
-                        db_conn,
-                        invoice_num=invoice_data['invoice_number'],
-                        company_name=invoice_data['recipient_name'],
-                        company_siret=invoice_data['recipient_siret'],
-                        xml_content=xml_content,
-                        pdf_path=pdf_filepath,
-                        invoice_date=invoice_data['issue_date'],
-                        total_ttc=total_ttc_value,
-                    )
-                print(f"[OK] Facture {invoice_data['invoice_number']} insérée en base")
-                db_status = 'ok'
-            except Exception as e:
-                print(f"[WARNING] Échec de l'insertion en base: {e}")
-                db_status = 'erreur'
-
-        # Construire le récapitulatif en session
-        def _fmt(value):
-            return str(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-
-        safe_number = _sanitize_invoice_number(invoice_data['invoice_number'])
-        pdf_filename = f"{safe_number}.pdf"
-        xml_filename = f"{safe_number}.xml"
-
-        summary_lines = []
-        for line in lines:
-            lt = calculate_line_totals(line)
-            vat_display = str(lt['vat_rate'])
-            if lt['vat_category'] != 'S':
-                vat_display += f" ({lt['vat_category']})"
-            summary_lines.append({
-                'description': line['description'],
-                'quantity': str(lt['quantity']),
-                'unit_price': _fmt(lt['unit_price']),
-                'vat_rate': vat_display,
-                'net_ht': _fmt(lt['net_ht']),
-                'discount_amount': _fmt(lt['discount_amount']),
-            })
-
-        vat_breakdown = []
-        for rate_key in sorted(invoice_totals['vat_breakdown'].keys(), key=lambda k: invoice_totals['vat_breakdown'][k]['rate'], reverse=True):
-            info = invoice_totals['vat_breakdown'][rate_key]
-            rate_display = str(info['rate'])
-            if info.get('vat_category', 'S') != 'S':
-                rate_display += f" ({info['vat_category']})"
-            vat_breakdown.append({
-                'rate': rate_display,
-                'base_ht': _fmt(info['base_ht']),
-                'vat_amount': _fmt(info['vat_amount']),
-            })
-
-        session['invoice_summary'] = {
-            'invoice_number': invoice_data['invoice_number'],
-            'type_code': invoice_data['type_code'],
-            'type_label': TYPE_LABELS.get(invoice_data['type_code'], 'Facture'),
-            'currency_code': invoice_data.get('currency_code', 'EUR'),
-            'issue_date': format_date_display(invoice_data['issue_date']),
-            'due_date': format_date_display(invoice_data.get('due_date', '')),
-            'recipient_name': invoice_data['recipient_name'],
-            'recipient_siret': invoice_data['recipient_siret'],
-            'emitter_name': EMITTER['name'],
-            'emitter_siret': EMITTER['siret'],
-            'lines': summary_lines,
-            'total_ht': _fmt(invoice_totals['total_ht']),
-            'total_vat': _fmt(invoice_totals['total_vat']),
-            'total_ttc': _fmt(invoice_totals['total_ttc']),
-            'vat_breakdown': vat_breakdown,
-            'pdf_filename': pdf_filename,
-            'xml_filename': xml_filename,
-            'db_status': db_status,
-        }
+        invoice_summary = build_invoice_summary(invoice_data, lines, issued)
+        save_draft(invoice_data=invoice_data, invoice_summary=invoice_summary, step=3)
 
         return jsonify({'success': True, 'redirect': '/invoice/step3'})
     except Exception as e:
@@ -1064,7 +1381,7 @@ def generate_invoice():
 @app.route('/invoice/step3')
 def show_step3():
     """Affiche la page récapitulative après génération."""
-    summary = session.get('invoice_summary')
+    summary = current_draft().get('invoice_summary')
     if not summary:
         return redirect(url_for('index'))
 
@@ -1076,26 +1393,324 @@ def show_step3():
     )
 
 
+def find_invoice_pdf(invoice_num: str, tab: str = 'sent', emitter=None, siret: str = None) -> str | None:
+    """
+    Retourne le chemin du PDF archivé d'une facture, ou None.
+
+    Si une base est activée, le chemin est lu dans sent_invoices (ou
+    incoming_invoices pour tab='received' : un numéro n'y est unique que par
+    fournisseur, siret le désigne ; à défaut, la dernière reçue). Sinon, ou si la facture n'est pas
+    en base, le nom de fichier est déduit du numéro dans le stockage PDF de
+    l'émetteur (défaut : ma-conf.txt). Le chemin retourné est toujours situé
+    sous un répertoire de stockage.
+    """
+    pdf_storage = str((emitter or EMITTERS.default).storage_dir('pdf'))
+    incoming_storage = CONFIG.get('incoming_storage', './data/incoming-invoices')
+    roots = [incoming_storage] if tab == 'received' else [pdf_storage]
+
+    candidates = []
+    if is_db_enabled():
+        table = 'incoming_invoices' if tab == 'received' else 'sent_invoices'
+        try:
+            with db_cursor() as (_conn, cursor):
+                if tab == 'received':
+                    cursor.execute(
+                        f"SELECT pdf_path FROM {table} WHERE invoice_num = %s"
+                        f"{' AND company_siret = %s' if siret else ''} ORDER BY received_at DESC LIMIT 1",
+                        (invoice_num, siret) if siret else (invoice_num,),
+                    )
+                else:
+                    cursor.execute(
+                        f"SELECT pdf_path FROM {table} WHERE invoice_num = %s",
+                        (invoice_num,),
+                    )
+                row = cursor.fetchone()
+            if row and row[0]:
+                candidates.append(row[0])
+        except Exception as e:
+            print(f"[WARNING] Recherche du PDF {invoice_num} en base: {e}")
+
+    if tab != 'received':
+        safe_number = _sanitize_invoice_number(invoice_num)
+        candidates.append(str(Path(pdf_storage) / f"{safe_number}.pdf"))
+
+    for candidate in candidates:
+        if Path(candidate).is_file() and is_within(candidate, roots):
+            return candidate
+    return None
+
+
+def _accel_locations(tab: str = 'sent', emitter=None) -> list[tuple[str, str]]:
+    """
+    Locations internes nginx (X-Accel-Redirect) : (répertoire de stockage, préfixe).
+
+    Les PDF émis sont servis sous pdf_accel_prefix, relatifs au stockage PDF
+    de ma-conf.txt (sous-répertoires des émetteurs en base compris) ; un
+    émetteur dont le profil a son propre pdf_storage déclare sa location par
+    pdf_accel_prefix. Les PDF reçus sont servis sous incoming_accel_prefix.
+    """
+    if tab == 'received':
+        return [(CONFIG.get('incoming_storage', './data/incoming-invoices'),
+                 CONFIG.get('incoming_accel_prefix', '/protected-incoming/'))]
+    locations = [(str(EMITTERS.default.storage_dir('pdf')), CONFIG.get('pdf_accel_prefix', '/protected/'))]
+    if emitter is not None and not emitter.is_default and emitter.config.get('pdf_accel_prefix'):
+        locations.insert(0, (str(emitter.storage_dir('pdf')), emitter.config['pdf_accel_prefix']))
+    return locations
+
+
+def _send_invoice_pdf(filepath: str, tab: str = 'sent', emitter=None):
+    """Sert un PDF archivé selon le mode de délégation configuré."""
+    return send_archived_pdf(
+        filepath,
+        download_name=Path(filepath).name,
+        offload=CONFIG.get('pdf_offload', 'none'),
+        accel_locations=_accel_locations(tab, emitter),
+    )
+
+
 @app.route('/invoice/download-pdf')
 def download_pdf():
-    """Sert le PDF Factur-X depuis le répertoire de stockage."""
-    summary = session.get('invoice_summary')
+    """Sert le PDF Factur-X de la facture du récapitulatif du brouillon de la session."""
+    summary = current_draft().get('invoice_summary')
     if not summary:
         return redirect(url_for('index'))
 
     pdf_storage = CONFIG.get('pdf_storage', './data/factures-pdf')
-    filename = summary['pdf_filename']
+    filepath = Path(pdf_storage) / summary['pdf_filename']
+    if not filepath.is_file():
+        return jsonify({'error': 'PDF introuvable'}), 404
+
+    return _send_invoice_pdf(str(filepath))
+
+
+def _request_emitter():
+    """
+    Émetteur de la requête : en-tête X-Emitter (API) ou paramètre ?emitter= (liens de téléchargement).
+
+    Returns:
+        (émetteur, None) ou (None, (réponse d'erreur JSON, code HTTP)).
+    """
+    code = request.headers.get('X-Emitter') or request.args.get('emitter')
+    try:
+        return EMITTERS.get(code), None
+    except EmitterNotFound as e:
+        return None, (jsonify({'success': False, 'errors': [{'field': 'emitter', 'message': str(e)}]}), 404)
+    except EmitterConfigError as e:
+        print(f"[ERROR] Profil émetteur {code} invalide: {e}")
+        return None, (jsonify({'success': False, 'errors': [
+            {'field': 'emitter', 'message': f"Profil émetteur '{code}' invalide"}
+        ]}), 500)
+
+
+@app.route('/invoice/<path:invoice_num>/pdf')
+def download_invoice_pdf(invoice_num):
+    """Sert le PDF archivé d'une facture émise ou reçue (?tab=received&siret=) par son numéro."""
+    emitter, error = _request_emitter()
+    if error:
+        return error
+    tab = request.args.get('tab', 'sent')
+    filepath = find_invoice_pdf(invoice_num, tab, emitter, request.args.get('siret'))
+    if filepath is None:
+        return jsonify({'error': f'PDF introuvable pour la facture {invoice_num}'}), 404
 
-    return send_from_directory(os.path.abspath(pdf_storage), filename, as_attachment=True)
+    return _send_invoice_pdf(filepath, tab, emitter)
+
+
+@app.route('/invoice/<path:invoice_num>/xml')
+def download_invoice_xml(invoice_num):
+    """Sert le XML Factur-X archivé d'une facture émise, par son numéro."""
+    emitter, error = _request_emitter()
+    if error:
+        return error
+    filepath = storage_path(invoice_num, 'xml', emitter)
+    if not filepath.is_file():
+        return jsonify({'error': f'XML introuvable pour la facture {invoice_num}'}), 404
+
+    return send_file(filepath, mimetype='application/xml', as_attachment=True, download_name=filepath.name)
 
 
 @app.route('/invoice/new')
 def new_invoice():
-    """Vide la session et redirige vers step1."""
+    """Vide la session et redirige vers step1 (un brouillon finalisé est supprimé, les autres restent à reprendre)."""
+    draft = current_draft()
+    if draft.get('invoice_summary'):
+        DRAFTS.delete(draft['id'])
     session.clear()
     return redirect(url_for('show_step1'))
 
 
+@app.route('/api/drafts')
+def list_drafts():
+    """Liste les brouillons non finalisés (les plus récents d'abord), après purge des plus anciens."""
+    DRAFTS.purge()
+    return jsonify({'drafts': DRAFTS.list_pending(), 'current': session.get('draft_id')})
+
+
+@app.route('/invoice/draft/<draft_id>')
+def resume_draft(draft_id):
+    """Reprend un brouillon : il devient celui de la session, retour à l'étape enregistrée."""
+    draft = DRAFTS.load(draft_id)
+    if draft is None:
+        return redirect(url_for('show_step1'))
+    session['draft_id'] = draft_id
+    if draft.get('invoice_summary'):
+        return redirect(url_for('show_step3'))
+    if draft.get('invoice_data'):
+        return redirect(url_for('show_step2'))
+    return redirect(url_for('show_step1'))
+
+
+@app.route('/api/drafts/<draft_id>', methods=['DELETE'])
+def delete_draft(draft_id):
+    """Supprime un brouillon (et le détache de la session s'il était courant)."""
+    if not DRAFTS.delete(draft_id):
+        return jsonify({'error': 'Brouillon introuvable'}), 404
+    if session.get('draft_id') == draft_id:
+        session.pop('draft_id')
+    return jsonify({'success': True})
+
+
+def _issued_invoice_json(invoice_data: dict, issued: dict, emitter=None) -> dict:
+    """Résultat d'émission renvoyé par l'API : numéro, totaux, empreintes et URLs de téléchargement."""
+    totals = issued['totals']
+    # Émetteur autre que le défaut : rappelé dans les URLs de téléchargement
+    scope = {} if emitter is None or emitter.is_default else {'emitter': emitter.code}
+    return {
+        'invoice_number': issued['invoice_number'],
+        'currency_code': invoice_data['currency_code'],
+        'total_ht': _fmt_amount(totals['total_ht']),
+        'total_vat': _fmt_amount(totals['total_vat']),
+        'total_ttc': _fmt_amount(totals['total_ttc']),
+        'pdf_sha256': issued['pdf_sha256'],
+        'xml_sha256': issued['xml_sha256'],
+        'pdf_url': url_for('download_invoice_pdf', invoice_num=issued['invoice_number'], **scope),
+        'xml_url': url_for('download_invoice_xml', invoice_num=issued['invoice_number'], **scope),
+        'db_status': issued['db_status'],
+    }
+
+
+def _issue_from_payload(payload, request_key: str | None = None, emitter=None) -> tuple[dict, int]:
+    """
+    Valide et émet une facture décrite en JSON (en-tête, client et lignes)
+    pour l'émetteur donné (défaut : ma-conf.txt).
+
+    Une requête rejouée (même clé, ou même contenu sans clé) reçoit le
+    résultat de la première émission, marqué `replayed`.
+
+    Returns:
+        (corps de réponse, code HTTP) : 201 si émise, 200 si rejouée, 400 si
+        invalide, 409 si émission en cours, 422 si la clé a servi à une autre
+        facture, 500 si la génération échoue.
+    """
+    if not isinstance(payload, dict):
+        return {'success': False, 'errors': [{'field': '_form', 'message': 'Objet JSON attendu'}]}, 400
+    try:
+        invoice_data = invoice_data_from_payload(payload)
+    except ValueError as e:
+        return {'success': False, 'errors': [{'field': 'invoice', 'message': str(e)}]}, 400
+    try:
+        columns = line_columns_from_payload(payload)
+    except ValueError as e:
+        return {'success': False, 'errors': [{'field': 'lines', 'message': str(e)}]}, 400
+
+    errors = validate_step1(invoice_data, auto_numbering=is_auto_numbering()) + validate_line_columns(columns)
+    if errors:
+        return {'success': False, 'errors': errors}, 400
+
+    try:
+        issued, replayed = issue_invoice_once(
+            invoice_data, columns_to_lines(columns), request_key=request_key, emitter=emitter,
+        )
+    except IdempotencyConflict:
+        return {'success': False, 'errors': [
+            {'field': 'idempotency_key', 'message': "Clé d'idempotence déjà utilisée pour une autre facture"}
+        ]}, 422
+    except IdempotencyInProgress:
+        return {'success': False, 'errors': [
+            {'field': 'idempotency_key', 'message': 'Émission déjà en cours pour cette requête'}
+        ]}, 409
+    except InvoiceGenerationError as e:
+        return {'success': False, 'errors': [
+            {'field': '_form', 'message': f'Erreur lors de la génération: {str(e)}'}
+        ]}, 500
+    except Exception as e:
+        print(f"[ERROR] Erreur inattendue lors de l'émission: {e}")
+        return {'success': False, 'errors': [{'field': '_form', 'message': f'Erreur inattendue: {str(e)}'}]}, 500
+    invoice = _issued_invoice_json(invoice_data, issued, emitter)
+    if replayed:
+        return {'success': True, 'replayed': True, 'invoice': invoice}, 200
+    return {'success': True, 'invoice': invoice}, 201
+
+
+def _invalid_key_response():
+    return jsonify({'success': False, 'errors': [
+        {'field': 'idempotency_key', 'message': "Clé d'idempotence invalide (200 caractères imprimables au plus)"}
+    ]}), 400
+
+
+@app.route('/api/v1/invoices', methods=['POST'])
+def api_issue_invoice():
+    """
+    Émet une facture complète en un appel, sans session (même chemin que l'assistant),
+    pour l'émetteur de l'en-tête X-Emitter (défaut : ma-conf.txt).
+    """
+    request_key = request.headers.get('Idempotency-Key')
+    if request_key is not None and not is_valid_key(request_key):
+        return _invalid_key_response()
+    emitter, error = _request_emitter()
+    if error:
+        return error
+
+    body, status = _issue_from_payload(request.get_json(silent=True), request_key=request_key, emitter=emitter)
+    response = jsonify(body)
+    if body.get('replayed'):
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, status
+
+
+@app.route('/api/v1/invoices/batch', methods=['POST'])
+def api_issue_invoices_batch():
+    """Émet un lot de factures ({"invoices": [...]}) d'un même émetteur (X-Emitter) ; un résultat par facture."""
+    payload = request.get_json(silent=True)
+    items = payload.get('invoices') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'errors': [
+            {'field': 'invoices', 'message': "Corps JSON invalide : liste 'invoices' non vide attendue"}
+        ]}), 400
+    if len(items) > API_BATCH_MAX:
+        return jsonify({'success': False, 'errors': [
+            {'field': 'invoices', 'message': f'Trop de factures ({len(items)}, maximum {API_BATCH_MAX})'}
+        ]}), 400
+
+    # Clé par facture : champ idempotency_key, sinon <Idempotency-Key du lot>:<index>
+    batch_key = request.headers.get('Idempotency-Key')
+    if batch_key is not None and not is_valid_key(batch_key):
+        return _invalid_key_response()
+    emitter, error = _request_emitter()
+    if error:
+        return error
+
+    results = []
+    for index, item in enumerate(items):
+        request_key = item.get('idempotency_key') if isinstance(item, dict) else None
+        if request_key is None and batch_key is not None:
+            request_key = f'{batch_key}:{index}'
+        if request_key is not None and not is_valid_key(request_key):
+            body, status = {'success': False, 'errors': [
+                {'field': 'idempotency_key', 'message': "Clé d'idempotence invalide"}
+            ]}, 400
+        else:
+            body, status = _issue_from_payload(item, request_key=request_key, emitter=emitter)
+        results.append({'index': index, 'status': status, **body})
+    issued = sum(1 for result in results if result['success'])
+    return jsonify({
+        'success': issued == len(results),
+        'issued': issued,
+        'failed': len(results) - issued,
+        'results': results,
+    })
+
+
 if __name__ == '__main__':
     # Valider la configuration au démarrage
     validate_startup_config()
@@ -0,0 +1,534 @@
+"""
+Commandes en ligne pour les traitements de masse (exports, envoi vers la PDP, ...).
+
+Usage: uv run python cli.py <commande> [options]
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import date
+
+from app import CONFIG, load_env_file
+
+
+def _require_db() -> None:
+    """Charge .env et vérifie que PostgreSQL est activé."""
+    if CONFIG.get('is_db_pg') is not True:
+        print("[ERROR] Cette commande requiert is_db_pg=True dans la configuration")
+        sys.exit(1)
+    load_env_file()
+
+
+def _require_billing() -> None:
+    """Vérifie qu'une base (PostgreSQL ou SQLite) et la numérotation automatique sont activées."""
+    from app import ensure_storage_directories, is_auto_numbering
+
+    if not is_auto_numbering():
+        print("[ERROR] La facturation récurrente requiert is_db_pg=True ou is_db_sqlite=True, "
+              "et is_num_facturx_auto=True")
+        sys.exit(1)
+    if CONFIG.get('is_db_pg') is True:
+        load_env_file()
+    ensure_storage_directories(CONFIG)
+
+
+def cmd_export_zip(args) -> None:
+    """Écrit l'archive ZIP des factures d'une période."""
+    from utils.export import iter_invoices_for_export, stream_invoices_zip
+
+    _require_db()
+    invoices = iter_invoices_for_export(args.tab, args.date_from, args.date_to, args.siret)
+
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    written = 0
+    try:
+        for chunk in stream_invoices_zip(invoices):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"[OK] Archive écrite: {args.output} ({written} octets)", file=sys.stderr)
+
+
+def cmd_export_accounting(args) -> None:
+    """Écrit l'export comptable (FEC ou CSV) d'une période."""
+    from utils.export import stream_accounting_export
+
+    _require_db()
+    directions = ['sent', 'received'] if args.tab == 'all' else [args.tab]
+
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    written = 0
+    try:
+        for chunk in stream_accounting_export(directions, args.date_from, args.date_to, args.format):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"[OK] Export comptable écrit: {args.output} ({written} octets)", file=sys.stderr)
+
+
+def cmd_send_pending(args) -> None:
+    """Envoie vers SuperPDP toutes les factures en attente."""
+    from utils.pdp_sender import BulkSender
+
+    _require_db()
+    if CONFIG.get('super_pdp_as_pa') is not True:
+        print("[ERROR] Cette commande requiert super_pdp_as_pa=True dans la configuration")
+        sys.exit(1)
+
+    def progress(stats):
+        print(f"  ... {stats['sent']} envoyée(s), {stats['failed']} en erreur, "
+              f"{stats['retries']} reprise(s)", file=sys.stderr)
+
+    sender = BulkSender(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        max_attempts=args.max_attempts,
+        progress=progress,
+    )
+    started = time.monotonic()
+    stats = sender.run(limit=args.limit)
+    elapsed = time.monotonic() - started
+    print(f"[OK] {stats['sent']} facture(s) envoyée(s), {stats['failed']} en erreur, "
+          f"{stats['retries']} reprise(s) en {elapsed:.1f}s", file=sys.stderr)
+
+
+def cmd_sync_status(args) -> None:
+    """Synchronise le cycle de vie des factures émises depuis SuperPDP."""
+    from utils.pdp_sync import sync_invoice_events
+
+    _require_db()
+    if CONFIG.get('super_pdp_as_pa') is not True:
+        print("[ERROR] Cette commande requiert super_pdp_as_pa=True dans la configuration")
+        sys.exit(1)
+
+    def progress(stats):
+        print(f"  ... page {stats['pages']} : {stats['events']} événement(s), "
+              f"watermark {stats['watermark']}", file=sys.stderr)
+
+    stats = sync_invoice_events(page_size=args.page_size, max_pages=args.max_pages, progress=progress)
+    print(f"[OK] {stats['inserted']} nouvel(s) événement(s) sur {stats['events']} lu(s), "
+          f"watermark {stats['watermark']}", file=sys.stderr)
+
+
+def cmd_sync_incoming(args) -> None:
+    """Importe les factures reçues depuis SuperPDP."""
+    from utils.pdp_inbound import sync_incoming_invoices
+
+    _require_db()
+    if CONFIG.get('super_pdp_as_pa') is not True:
+        print("[ERROR] Cette commande requiert super_pdp_as_pa=True dans la configuration")
+        sys.exit(1)
+
+    def progress(stats):
+        print(f"  ... page {stats['pages']} : {stats['inserted']} importée(s), "
+              f"watermark {stats['watermark']}", file=sys.stderr)
+
+    stats = sync_incoming_invoices(
+        storage_dir=CONFIG.get('incoming_storage', './data/incoming-invoices'),
+        page_size=args.page_size,
+        concurrency=args.concurrency,
+        max_pages=args.max_pages,
+        progress=progress,
+    )
+    print(f"[OK] {stats['inserted']} facture(s) reçue(s) importée(s), {stats['invalid']} illisible(s), "
+          f"watermark {stats['watermark']}", file=sys.stderr)
+    if stats['pending']:
+        print(f"[WARNING] {stats['pending']} facture(s) à reprendre à la prochaine exécution", file=sys.stderr)
+
+
+def cmd_ingest(args) -> None:
+    """Ingère les PDF Factur-X déposés dans le répertoire des factures reçues."""
+    from utils.ingest import ingest_directory, watch_directory
+
+    _require_db()
+    directory = args.directory or CONFIG.get('incoming_storage', './data/incoming-invoices')
+
+    def progress(stats):
+        print(f"  ... {stats['inserted']} insérée(s), {stats['skipped']} déjà connue(s), "
+              f"{stats['invalid']} illisible(s)", file=sys.stderr)
+
+    if args.watch:
+        print(f"[OK] Surveillance de {directory} (Ctrl+C pour arrêter)", file=sys.stderr)
+        try:
+            watch_directory(directory, interval=args.interval, workers=args.workers,
+                            batch_size=args.batch_size, progress=progress)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    started = time.monotonic()
+    stats = ingest_directory(directory, workers=args.workers, batch_size=args.batch_size, progress=progress)
+    elapsed = time.monotonic() - started
+    print(f"[OK] {stats['inserted']} facture(s) ingérée(s) sur {stats['scanned']} PDF, "
+          f"{stats['skipped']} déjà connue(s), {stats['invalid']} illisible(s) en {elapsed:.1f}s",
+          file=sys.stderr)
+
+
+def cmd_backfill_fields(args) -> None:
+    """Extrait les champs métier du XML des factures existantes."""
+    from utils.invoice_store import backfill_extracted_fields
+
+    _require_db()
+    directions = ['sent', 'received'] if args.tab == 'all' else [args.tab]
+
+    def progress(stats):
+        print(f"  ... {stats['updated']} facture(s) complétée(s), {stats['invalid']} illisible(s)",
+              file=sys.stderr)
+
+    for direction in directions:
+        stats = backfill_extracted_fields(direction, batch_size=args.batch_size, progress=progress)
+        print(f"[OK] {direction}: {stats['updated']} facture(s) complétée(s), {stats['invalid']} illisible(s), "
+              f"ventilation TVA ajoutée pour {stats['vat_filled']}", file=sys.stderr)
+
+
+def cmd_backfill_search(args) -> None:
+    """Calcule le texte de recherche des factures existantes."""
+    from utils.search import backfill_search_vectors
+
+    _require_db()
+    directions = ['sent', 'received'] if args.tab == 'all' else [args.tab]
+
+    def progress(stats):
+        print(f"  ... {stats['updated']} facture(s) indexée(s), {stats['invalid']} illisible(s)", file=sys.stderr)
+
+    for direction in directions:
+        stats = backfill_search_vectors(direction, batch_size=args.batch_size, progress=progress)
+        print(f"[OK] {direction}: {stats['updated']} facture(s) indexée(s), {stats['invalid']} illisible(s)",
+              file=sys.stderr)
+
+
+def cmd_ensure_partitions(args) -> None:
+    """Crée les partitions annuelles des factures à venir (à planifier en cron)."""
+    from utils.db import ensure_invoice_partitions
+
+    _require_db()
+    created = ensure_invoice_partitions(years_ahead=args.years_ahead)
+    print(f"[OK] {created} partition(s) créée(s)", file=sys.stderr)
+
+
+def cmd_billing_template(args) -> None:
+    """Enregistre le modèle de facture récurrente d'un client, ou liste les modèles."""
+    from utils.billing import BillingError, list_billing_templates, save_billing_template
+
+    _require_billing()
+    if args.list:
+        for template in list_billing_templates():
+            state = '' if template['active'] else ' (inactif)'
+            print(f"{template['id']:>6}  {template['client_siret']}  {template['client_name']} - "
+                  f"{template['label']}{state}")
+        return
+
+    if not args.siret or not args.file:
+        print("[ERROR] --siret et --file sont requis pour enregistrer un modèle")
+        sys.exit(1)
+    try:
+        with open(args.file, encoding='utf-8') as f:
+            template = json.load(f)
+        template_id = save_billing_template(args.siret, args.label, template, active=not args.inactive)
+    except (OSError, ValueError, BillingError) as e:
+        print(f"[ERROR] Modèle non enregistré: {e}")
+        sys.exit(1)
+    print(f"[OK] Modèle {template_id} enregistré pour {args.siret} ({args.label})", file=sys.stderr)
+
+
+def cmd_emitter(args) -> None:
+    """Enregistre le profil d'un émetteur servi par la même instance, ou liste les profils."""
+    from app import EMITTERS, is_db_enabled
+    from utils.emitters import EmitterConfigError, list_emitter_profiles, save_emitter_profile
+
+    if not is_db_enabled():
+        print("[ERROR] Les profils émetteurs requièrent is_db_pg=True ou is_db_sqlite=True")
+        sys.exit(1)
+    if CONFIG.get('is_db_pg') is True:
+        load_env_file()
+    if args.list:
+        for profile in list_emitter_profiles():
+            state = '' if profile['active'] else ' (inactif)'
+            print(f"{profile['code']:<20}  {profile['siret']}  {profile['name']}  "
+                  f"[{profile['invoice_prefix']}]{state}")
+        return
+
+    if not args.code or not args.file:
+        print("[ERROR] --code et --file sont requis pour enregistrer un profil")
+        sys.exit(1)
+    try:
+        with open(args.file, encoding='utf-8') as f:
+            profile = json.load(f)
+        save_emitter_profile(args.code, profile, active=not args.inactive,
+                             reserved_prefixes=[EMITTERS.default.invoice_prefix])
+    except (OSError, ValueError) as e:
+        errors = e.errors if isinstance(e, EmitterConfigError) else [str(e)]
+        print("[ERROR] Profil non enregistré:")
+        for error in errors:
+            print(f"  - {error}")
+        sys.exit(1)
+    context = EMITTERS.get(args.code) if not args.inactive else None
+    location = f", PDF dans {context.storage_dir('pdf')}" if context else ''
+    print(f"[OK] Profil {args.code} enregistré{location}", file=sys.stderr)
+
+
+def cmd_billing_run(args) -> None:
+    """Crée (ou reprend) le run de facturation d'une période et l'exécute."""
+    from app import issue_billing_item
+    from utils.billing import create_billing_run, execute_billing_run
+
+    _require_billing()
+    run_id = args.run_id or args.period
+    issue_date = args.issue_date or date.today().isoformat()
+    try:
+        date.fromisoformat(issue_date)
+    except ValueError:
+        print("[ERROR] --issue-date doit être au format AAAA-MM-JJ")
+        sys.exit(1)
+    if create_billing_run(run_id, args.period, issue_date):
+        print(f"[OK] Run {run_id} créé (émission du {issue_date})", file=sys.stderr)
+    else:
+        print(f"[OK] Reprise du run {run_id}", file=sys.stderr)
+
+    def progress(stats):
+        print(f"  ... {stats['issued']}/{stats['total']} émise(s), {stats['failed']} en erreur, "
+              f"{stats['pending'] + stats['claimed']} restante(s)", file=sys.stderr)
+
+    started = time.monotonic()
+    stats = execute_billing_run(run_id, issue_billing_item, workers=args.workers, batch_size=args.batch_size,
+                                retry_failed=args.retry_failed, progress=progress)
+    elapsed = time.monotonic() - started
+    print(f"[OK] Run {run_id} {stats['status']} : {stats['issued']}/{stats['total']} facture(s) émise(s), "
+          f"{stats['failed']} en erreur en {elapsed:.1f}s", file=sys.stderr)
+    if stats['failed']:
+        print(f"[WARNING] Détail : billing-status {run_id} ; relancer avec --retry-failed après correction",
+              file=sys.stderr)
+
+
+def cmd_billing_status(args) -> None:
+    """Affiche l'avancement d'un run de facturation et ses éléments en erreur."""
+    from utils.billing import BillingError, run_failures, run_progress
+
+    _require_billing()
+    try:
+        stats = run_progress(args.run_id)
+    except BillingError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    print(f"Run {stats['run_id']} ({stats['period']}, émission du {stats['issue_date']}) : {stats['status']}")
+    print(f"  {stats['issued']} émise(s), {stats['failed']} en erreur, {stats['pending']} en attente, "
+          f"{stats['claimed']} en cours sur {stats['total']}")
+    for failure in run_failures(args.run_id):
+        print(f"  [ERREUR] modèle {failure['template_id']} ({failure['client_siret']}, "
+              f"{failure['attempts']} tentative(s)) : {failure['error']}")
+
+
+def cmd_audit(args) -> None:
+    """Revalide les factures archivées (XSD, Schematron EN16931, structure PDF/A-3) et écrit le rapport."""
+    from app import EMITTERS, is_db_enabled
+    from utils.audit import audit_archives, audit_failures, schematron_available
+    from utils.emitters import EmitterConfigError, EmitterNotFound
+
+    if not is_db_enabled():
+        print("[ERROR] L'audit requiert is_db_pg=True ou is_db_sqlite=True (rapport invoice_audit)")
+        sys.exit(1)
+    if CONFIG.get('is_db_pg') is True:
+        load_env_file()
+    schematron = not args.no_schematron
+    if schematron and not schematron_available():
+        print("[WARNING] saxonche non installé : Schematron EN16931 non exécuté (uv add saxonche)", file=sys.stderr)
+
+    def progress(stats):
+        print(f"  ... {stats['scanned']} facture(s) parcourue(s), {stats['unchanged']} inchangée(s), "
+              f"{stats['error']} non conforme(s), {stats['missing']} manquante(s)", file=sys.stderr)
+
+    try:
+        emitter = EMITTERS.get(args.emitter)
+    except (EmitterNotFound, EmitterConfigError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    started = time.monotonic()
+    stats = audit_archives(
+        args.pdf_dir or emitter.storage_dir('pdf'),
+        args.xml_dir or emitter.storage_dir('xml'),
+        workers=args.workers, chunk_size=args.chunk_size, schematron=schematron, force=args.force,
+        progress=progress,
+    )
+    elapsed = time.monotonic() - started
+    print(f"[OK] {stats['audited']} facture(s) auditée(s) sur {stats['scanned']} ({stats['unchanged']} inchangée(s)) : "
+          f"{stats['ok']} conforme(s), {stats['error']} non conforme(s), {stats['missing']} manquante(s) "
+          f"en {elapsed:.1f}s", file=sys.stderr)
+    for failure in audit_failures(limit=args.show):
+        first = failure['errors'][0] if failure['errors'] else {'check': '', 'message': ''}
+        more = f" (+{len(failure['errors']) - 1})" if len(failure['errors']) > 1 else ''
+        print(f"  [{failure['status']}] {failure['doc_key']} : [{first['check']}] {first['message']}{more}")
+
+
+def _bench_invoice(index: int, line_count: int) -> tuple[dict, list[dict]]:
+    """Facture fictive pour la mesure des tailles de PDF (jamais archivée)."""
+    invoice = {
+        'invoice_number': f'BENCH-{index:06d}', 'type_code': '380', 'currency_code': 'EUR',
+        'issue_date': '2026-01-15', 'due_date': '2026-02-14', 'payment_terms': 'Paiement à 30 jours',
+        'recipient_name': f'Client {index}', 'recipient_siret': '12345678901234',
+        'recipient_vat_number': 'FR12345678901', 'recipient_address': '1 rue du Test',
+        'recipient_postal_code': '75001', 'recipient_city': 'Paris', 'recipient_country_code': 'FR',
+    }
+    lines = [
+        {'description': f'Prestation {n + 1} - facture {index}', 'quantity': str(n % 5 + 1),
+         'unit_price_ht': f'{10 + n * 2.5:.2f}', 'vat_rate': '20' if n % 3 else '5.5',
+         'discount_value': '0', 'discount_type': 'percent'}
+        for n in range(line_count)
+    ]
+    return invoice, lines
+
+
+def cmd_pdf_size(args) -> None:
+    """
+    Mesure, en mode standard et compact : octets par facture, temps de rendu
+    et pic de mémoire Python (tracemalloc, sur une facture de plus) du
+    chemin d'émission (write_facturx_pdf), dans un répertoire temporaire.
+    """
+    import os
+    import tempfile
+    import tracemalloc
+    from app import write_facturx_pdf
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, 'facture.pdf')
+        for compact in (False, True):
+            total, started = 0, time.monotonic()
+            for index in range(args.count):
+                write_facturx_pdf(*_bench_invoice(index, args.lines), target, compact=compact)
+                total += os.path.getsize(target)
+            elapsed_ms = (time.monotonic() - started) * 1000 / args.count
+
+            invoice, lines = _bench_invoice(args.count, args.lines)
+            tracemalloc.start()
+            write_facturx_pdf(invoice, lines, target, compact=compact)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[compact] = (total / args.count, elapsed_ms, peak)
+
+    for compact, (size, ms, peak) in results.items():
+        print(f"{'compact' if compact else 'standard':<9} {size:>10,.0f} octets/facture  {ms:>7.1f} ms/facture  "
+              f"pic mémoire {peak / 1e6:>6.1f} Mo")
+    standard, compact = results[False][0], results[True][0]
+    print(f"[OK] {args.count} facture(s) de {args.lines} ligne(s) : mode compact -{1 - compact / standard:.0%} "
+          f"({(standard - compact) * 1_000_000 / 1e9:.1f} Go économisés par million de factures)", file=sys.stderr)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Traitements de masse Factur-X")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export-zip', help="Archive ZIP des PDF/XML d'une période")
+    p.add_argument('--tab', choices=['sent', 'received'], default='sent')
+    p.add_argument('--from', dest='date_from', required=True, help='Date de début (AAAA-MM-JJ)')
+    p.add_argument('--to', dest='date_to', required=True, help='Date de fin incluse (AAAA-MM-JJ)')
+    p.add_argument('--siret', help='SIRET du client / fournisseur')
+    p.add_argument('-o', '--output', default='-', help='Fichier de sortie (- pour stdout)')
+    p.set_defaults(func=cmd_export_zip)
+
+    p = sub.add_parser('export-accounting', help="Écritures comptables FEC / CSV d'une période")
+    p.add_argument('--tab', choices=['all', 'sent', 'received'], default='all')
+    p.add_argument('--from', dest='date_from', required=True, help='Date de début (AAAA-MM-JJ)')
+    p.add_argument('--to', dest='date_to', required=True, help='Date de fin incluse (AAAA-MM-JJ)')
+    p.add_argument('--format', choices=['fec', 'csv'], default='fec')
+    p.add_argument('-o', '--output', default='-', help='Fichier de sortie (- pour stdout)')
+    p.set_defaults(func=cmd_export_accounting)
+
+    p = sub.add_parser('send-pending', help="Envoie les factures PENDING vers SuperPDP")
+    p.add_argument('--concurrency', type=int, default=8, help='Envois simultanés')
+    p.add_argument('--rate', type=float, default=20.0, help='Requêtes par seconde (plafond)')
+    p.add_argument('--batch-size', type=int, default=200, help='Taille des lots réservés')
+    p.add_argument('--max-attempts', type=int, default=5, help='Tentatives par facture')
+    p.add_argument('--limit', type=int, help='Nombre maximal de factures à traiter')
+    p.set_defaults(func=cmd_send_pending)
+
+    p = sub.add_parser('sync-status', help="Synchronise le cycle de vie des factures depuis SuperPDP")
+    p.add_argument('--page-size', type=int, default=100, help='Événements par page')
+    p.add_argument('--max-pages', type=int, help='Nombre maximal de pages')
+    p.set_defaults(func=cmd_sync_status)
+
+    p = sub.add_parser('sync-incoming', help="Importe les factures reçues depuis SuperPDP")
+    p.add_argument('--page-size', type=int, default=100, help='Factures par page')
+    p.add_argument('--concurrency', type=int, default=8, help='Téléchargements simultanés')
+    p.add_argument('--max-pages', type=int, help='Nombre maximal de pages')
+    p.set_defaults(func=cmd_sync_incoming)
+
+    p = sub.add_parser('ingest', help="Ingère les PDF Factur-X déposés dans le répertoire des factures reçues")
+    p.add_argument('--dir', dest='directory', help='Répertoire (défaut : incoming_storage)')
+    p.add_argument('--workers', type=int, help='Processus de parsing (défaut : nombre de CPU)')
+    p.add_argument('--batch-size', type=int, default=200, help='Factures par insertion')
+    p.add_argument('--watch', action='store_true', help='Surveille le répertoire en continu')
+    p.add_argument('--interval', type=float, default=10.0, help='Délai entre deux passages (s)')
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('backfill-fields', help="Extrait les champs métier du XML des factures existantes")
+    p.add_argument('--tab', choices=['all', 'sent', 'received'], default='all')
+    p.add_argument('--batch-size', type=int, default=500, help='Factures par mise à jour')
+    p.set_defaults(func=cmd_backfill_fields)
+
+    p = sub.add_parser('backfill-search', help="Indexe les factures existantes pour la recherche plein texte")
+    p.add_argument('--tab', choices=['all', 'sent', 'received'], default='all')
+    p.add_argument('--batch-size', type=int, default=500, help='Factures par mise à jour')
+    p.set_defaults(func=cmd_backfill_search)
+
+    p = sub.add_parser('ensure-partitions', help="Crée les partitions annuelles des factures à venir")
+    p.add_argument('--years-ahead', type=int, default=1, help="Nombre d'années à anticiper")
+    p.set_defaults(func=cmd_ensure_partitions)
+
+    p = sub.add_parser('billing-template', help="Enregistre le modèle de facture récurrente d'un client")
+    p.add_argument('--siret', help='SIRET du client (client_metadata)')
+    p.add_argument('--file', help='Modèle JSON (invoice, lines, due_days)')
+    p.add_argument('--label', default='Abonnement', help='Libellé du modèle (un client peut en avoir plusieurs)')
+    p.add_argument('--inactive', action='store_true', help="Modèle exclu des prochains runs")
+    p.add_argument('--list', action='store_true', help='Liste les modèles enregistrés')
+    p.set_defaults(func=cmd_billing_template)
+
+    p = sub.add_parser('emitter', help="Enregistre le profil d'un émetteur (multi-émetteur)")
+    p.add_argument('--code', help="Code du profil (en-tête X-Emitter de l'API, champ emitter des modèles)")
+    p.add_argument('--file', help='Profil JSON (clés émetteur de ma-conf.txt : name, siret, siren, logo, ...)')
+    p.add_argument('--inactive', action='store_true', help='Profil désactivé (plus aucune émission)')
+    p.add_argument('--list', action='store_true', help='Liste les profils enregistrés')
+    p.set_defaults(func=cmd_emitter)
+
+    p = sub.add_parser('billing-run', help="Émet (ou reprend) les factures récurrentes d'une période")
+    p.add_argument('--period', required=True, help='Période facturée (ex. 2026-10), remplace {period} des lignes')
+    p.add_argument('--run-id', help='Identifiant du run (défaut : la période)')
+    p.add_argument('--issue-date', help="Date d'émission (AAAA-MM-JJ, défaut : aujourd'hui ; fixée à la création)")
+    p.add_argument('--workers', type=int, help="Processus d'émission (défaut : nombre de CPU, 4 au plus)")
+    p.add_argument('--batch-size', type=int, default=10, help='Éléments réservés à la fois par un processus')
+    p.add_argument('--retry-failed', action='store_true', help='Rejoue les éléments en erreur')
+    p.set_defaults(func=cmd_billing_run)
+
+    p = sub.add_parser('billing-status', help="Avancement d'un run de facturation")
+    p.add_argument('run_id', help='Identifiant du run')
+    p.set_defaults(func=cmd_billing_status)
+
+    p = sub.add_parser('audit', help="Revalide les PDF/XML archivés et écrit le rapport de conformité")
+    p.add_argument('--pdf-dir', help="Répertoire des PDF (défaut : pdf_storage de l'émetteur)")
+    p.add_argument('--xml-dir', help="Répertoire des XML (défaut : xml_storage de l'émetteur)")
+    p.add_argument('--emitter', help='Code du profil émetteur audité (défaut : émetteur de ma-conf.txt)')
+    p.add_argument('--workers', type=int, help='Processus de validation (défaut : nombre de CPU)')
+    p.add_argument('--chunk-size', type=int, default=500, help='Factures par paquet (lecture du cache, écriture)')
+    p.add_argument('--force', action='store_true', help='Revalide aussi les factures inchangées')
+    p.add_argument('--no-schematron', action='store_true', help='XSD et PDF/A seulement (plus rapide)')
+    p.add_argument('--show', type=int, default=20, help='Factures non conformes affichées')
+    p.set_defaults(func=cmd_audit)
+
+    p = sub.add_parser('pdf-size', help="Mesure octets, temps et mémoire par facture (PDF standard et compacts)")
+    p.add_argument('--count', type=int, default=20, help='Factures rendues par mode')
+    p.add_argument('--lines', type=int, default=10, help='Lignes par facture')
+    p.set_defaults(func=cmd_pdf_size)
+
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = build_parser().parse_args()
+    arguments.func(arguments)
@@ -0,0 +1,10 @@
+-- Base k_factur_x dans PG 16
+-- Ingestion des PDF déposés dans data/incoming-invoices (utils/ingest.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_incoming_invoices_ingest.sql
+
+-- Empreinte SHA-256 du PDF reçu : un fichier déjà ingéré est écarté sans être relu
+ALTER TABLE incoming_invoices ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64) DEFAULT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_content_sha256
+    ON incoming_invoices (content_sha256)
+    WHERE content_sha256 IS NOT NULL;
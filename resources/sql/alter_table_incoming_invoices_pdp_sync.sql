@@ -0,0 +1,11 @@
+-- Base k_factur_x dans PG 16
+-- Import incrémental des factures reçues depuis la PDP (utils/pdp_inbound.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_incoming_invoices_pdp_sync.sql
+-- Prérequis : create_table_invoice_events.sql (table pdp_sync_state)
+
+-- Identifiant de la facture côté PDP : une facture déjà importée n'est jamais réinsérée
+ALTER TABLE incoming_invoices ADD COLUMN IF NOT EXISTS pdp_invoice_id BIGINT DEFAULT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_pdp_invoice_id
+    ON incoming_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
@@ -0,0 +1,33 @@
+-- Base k_factur_x dans PG 16
+-- Factures reçues identifiées par fournisseur et numéro (deux fournisseurs peuvent émettre "F-0001")
+-- A lancer une fois sur une base existante, partitionnée ou non :
+--   psql -f resources/sql/alter_table_incoming_invoices_supplier_key.sql
+-- La ventilation TVA porte le SIRET de sa facture source (rattachement sans ambiguïté).
+
+BEGIN;
+
+ALTER TABLE invoice_vat_breakdown ADD COLUMN IF NOT EXISTS company_siret VARCHAR(14) NOT NULL DEFAULT '';
+
+UPDATE invoice_vat_breakdown b SET company_siret = i.company_siret
+FROM incoming_invoices i
+WHERE b.direction = 'received' AND b.company_siret = '' AND i.invoice_num = b.invoice_num;
+
+UPDATE invoice_vat_breakdown b SET company_siret = s.company_siret
+FROM sent_invoices s
+WHERE b.direction = 'sent' AND b.company_siret = '' AND s.invoice_num = b.invoice_num;
+
+ALTER TABLE invoice_vat_breakdown DROP CONSTRAINT IF EXISTS invoice_vat_breakdown_pkey;
+ALTER TABLE invoice_vat_breakdown ADD PRIMARY KEY (direction, company_siret, invoice_num, vat_category, vat_rate);
+
+-- Clé de incoming_invoices ; une table partitionnée garde la clé de partitionnement (invoice_date)
+DO $$
+BEGIN
+    ALTER TABLE incoming_invoices DROP CONSTRAINT IF EXISTS incoming_invoices_pkey;
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('incoming_invoices')) THEN
+        ALTER TABLE incoming_invoices ADD PRIMARY KEY (company_siret, invoice_num, invoice_date);
+    ELSE
+        ALTER TABLE incoming_invoices ADD PRIMARY KEY (company_siret, invoice_num);
+    END IF;
+END $$;
+
+COMMIT;
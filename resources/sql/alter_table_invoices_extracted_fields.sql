@@ -0,0 +1,59 @@
+-- Base k_factur_x dans PG 16
+-- Champs métier extraits du XML Factur-X à l'insertion (utils/invoice_store.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_invoices_extracted_fields.sql
+-- puis renseigner les factures existantes : uv run python cli.py backfill-fields
+-- fields_extracted_at reste NULL tant que les champs n'ont pas été extraits (insertion ou backfill)
+-- type_code (380 facture, 381 avoir...) ajouté après coup : les factures déjà traitées sans type
+-- sont remises en attente pour que backfill-fields le renseigne (sens des écritures FEC)
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['sent_invoices', 'incoming_invoices'] LOOP
+        EXECUTE format('ALTER TABLE %I
+            ADD COLUMN IF NOT EXISTS due_date                 DATE          DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS currency_code            CHAR(3)       DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS seller_vat_number        VARCHAR(20)   DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS buyer_siret              VARCHAR(14)   DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS buyer_vat_number         VARCHAR(20)   DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS buyer_reference          VARCHAR(100)  DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS purchase_order_reference VARCHAR(100)  DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS total_ht                 NUMERIC(12,2) DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS total_vat                NUMERIC(12,2) DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS type_code                CHAR(3)       DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS fields_extracted_at      TIMESTAMP WITH TIME ZONE DEFAULT NULL', t);
+        EXECUTE format('UPDATE %I SET fields_extracted_at = NULL
+                        WHERE type_code IS NULL AND fields_extracted_at IS NOT NULL', t);
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_due_date
+    ON sent_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_vat_number
+    ON sent_invoices (buyer_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_reference
+    ON sent_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_fields_pending
+    ON sent_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_due_date
+    ON incoming_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_seller_vat_number
+    ON incoming_invoices (seller_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_buyer_reference
+    ON incoming_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_fields_pending
+    ON incoming_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+-- Rapports de TVA par taux sans relire les XML
+CREATE INDEX IF NOT EXISTS idx_invoice_vat_breakdown_rate
+    ON invoice_vat_breakdown (direction, vat_rate);
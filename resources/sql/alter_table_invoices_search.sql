@@ -0,0 +1,23 @@
+-- Base k_factur_x dans PG 16
+-- Recherche plein texte dans les factures (utils/search.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_invoices_search.sql
+-- puis indexer les factures existantes : uv run python cli.py backfill-search
+
+-- tsvector pondéré (A : numéro et références, B : parties, C : désignations), calculé à l'insertion
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS search_vector TSVECTOR DEFAULT NULL;
+ALTER TABLE incoming_invoices ADD COLUMN IF NOT EXISTS search_vector TSVECTOR DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search
+    ON sent_invoices USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search
+    ON incoming_invoices USING GIN (search_vector);
+
+-- Factures restant à indexer (backfill-search)
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search_pending
+    ON sent_invoices (invoice_num)
+    WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search_pending
+    ON incoming_invoices (invoice_num)
+    WHERE search_vector IS NULL;
@@ -0,0 +1,11 @@
+-- Base k_factur_x dans PG 16
+-- Numérotation par émetteur (utils/emitters.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_sent_invoices_emitters.sql
+-- (valable aussi après migrate_invoices_partitioned.sql : colonne et index sans contrainte d'unicité)
+
+-- Les factures existantes sont rattachées à l'émetteur par défaut (ma-conf.txt)
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS emitter_code VARCHAR(40) NOT NULL DEFAULT 'default';
+
+-- Numérotation : dernière facture émise de l'émetteur
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_emitter
+    ON sent_invoices (emitter_code, created_at);
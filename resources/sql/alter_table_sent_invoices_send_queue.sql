@@ -0,0 +1,12 @@
+-- Base k_factur_x dans PG 16
+-- File d'envoi des factures PENDING vers la PDP (utils/pdp_sender.py)
+-- A lancer une fois sur une base existante : psql -f resources/sql/alter_table_sent_invoices_send_queue.sql
+
+-- Bail de réservation : une facture réservée n'est pas reprise avant expiration
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS claimed_at    TIMESTAMP WITH TIME ZONE DEFAULT NULL;
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS send_attempts INTEGER                  NOT NULL DEFAULT 0;
+
+-- Index partiel : seules les factures en attente sont parcourues par l'expéditeur
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_pending
+    ON sent_invoices (created_at)
+    WHERE status = 'PENDING';
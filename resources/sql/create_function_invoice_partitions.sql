@@ -0,0 +1,109 @@
+-- Base k_factur_x dans PG 16
+-- Partitions annuelles (invoice_date) de sent_invoices et incoming_invoices
+-- Prérequis de migrate_invoices_partitioned.sql ; rejouable sans effet de bord
+--
+-- ensure_invoice_partitions('sent_invoices', '2026-01-01', '2027-12-31')
+--   crée les partitions <table>_<année> manquantes entre les deux dates et
+--   retourne leur nombre. Les lignes déjà rangées dans la partition par
+--   défaut (<table>_default) pour l'année créée y sont déplacées.
+--   Sans effet (0) si la table n'est pas partitionnée.
+--   Appelée au démarrage de l'application et par `cli.py ensure-partitions` (cron).
+
+CREATE OR REPLACE FUNCTION ensure_invoice_partitions(parent TEXT, date_from DATE, date_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    y           INTEGER;
+    part        TEXT;
+    lower_bound DATE;
+    upper_bound DATE;
+    default_part TEXT := parent || '_default';
+    created     INTEGER := 0;
+    has_rows    BOOLEAN;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(parent)) THEN
+        RETURN 0;
+    END IF;
+
+    FOR y IN EXTRACT(YEAR FROM date_from)::int .. EXTRACT(YEAR FROM date_to)::int LOOP
+        part := parent || '_' || y;
+        CONTINUE WHEN to_regclass(part) IS NOT NULL;
+        lower_bound := make_date(y, 1, 1);
+        upper_bound := make_date(y + 1, 1, 1);
+
+        has_rows := FALSE;
+        IF to_regclass(default_part) IS NOT NULL THEN
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE invoice_date >= %L AND invoice_date < %L)',
+                           default_part, lower_bound, upper_bound) INTO has_rows;
+        END IF;
+
+        IF has_rows THEN
+            -- Des lignes de cette année sont dans la partition par défaut :
+            -- les déplacer dans la nouvelle table avant de l'attacher
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, parent);
+            EXECUTE format('WITH moved AS (DELETE FROM %I WHERE invoice_date >= %L AND invoice_date < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved',
+                           default_part, lower_bound, upper_bound, part);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           parent, part, lower_bound, upper_bound);
+        ELSE
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           part, parent, lower_bound, upper_bound);
+        END IF;
+        created := created + 1;
+    END LOOP;
+
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Conversion d'une table existante en table partitionnée par année (utilisée
+-- par migrate_invoices_partitioned.sql). L'ancienne table est conservée sous
+-- le nom <table>_legacy (ses index sont renommés <index>_legacy) ; les index
+-- et triggers de la nouvelle table sont créés par le script de migration.
+CREATE OR REPLACE FUNCTION partition_invoice_table(parent TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+    legacy      TEXT := parent || '_legacy';
+    idx         RECORD;
+    first_date  DATE;
+    moved       BIGINT;
+    pk_columns  TEXT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(parent)) THEN
+        RAISE NOTICE '% est déjà partitionnée', parent;
+        RETURN 0;
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, legacy);
+    FOR idx IN SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE i.indrelid = to_regclass(legacy) LOOP
+        IF EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = to_regclass(idx.relname)) THEN
+            EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I',
+                           legacy, idx.relname, left(idx.relname, 56) || '_legacy');
+        ELSE
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname, left(idx.relname, 56) || '_legacy');
+        END IF;
+    END LOOP;
+
+    -- Même structure ; la clé primaire (celle de l'ancienne table) inclut la clé de partitionnement
+    SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY k.ord) INTO pk_columns
+    FROM pg_index i
+    CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+    WHERE i.indrelid = to_regclass(legacy) AND i.indisprimary AND a.attname <> 'invoice_date';
+
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) '
+                   'PARTITION BY RANGE (invoice_date)', parent, legacy);
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s, invoice_date)', parent, COALESCE(pk_columns, 'invoice_num'));
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+
+    EXECUTE format('SELECT min(invoice_date) FROM %I', legacy) INTO first_date;
+    PERFORM ensure_invoice_partitions(parent, COALESCE(first_date, CURRENT_DATE),
+                                      (CURRENT_DATE + INTERVAL '1 year')::date);
+
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', parent, legacy);
+    GET DIAGNOSTICS moved = ROW_COUNT;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,49 @@
+-- Base k_factur_x dans PG 16
+-- Facturation récurrente (utils/billing.py)
+--   billing_templates : modèle de facture par client (JSON : en-tête, lignes, due_days)
+--   billing_runs      : un run par période (ex. 2026-10), statut OPEN -> RUNNING -> DONE / PARTIAL
+--   billing_run_items : journal du run, une ligne par modèle, figée à la création du run ;
+--                       point de reprise PENDING -> CLAIMED -> ISSUED / FAILED
+--   claimed_at        : horodatage epoch (secondes) de la réservation par un worker (bail)
+
+CREATE TABLE IF NOT EXISTS billing_templates (
+    id              SERIAL                   PRIMARY KEY,
+    client_siret    VARCHAR(14)              NOT NULL
+                                             REFERENCES client_metadata (recipient_siret) ON DELETE CASCADE,
+    label           VARCHAR(100)             NOT NULL,
+    template        TEXT                     NOT NULL,
+    active          BOOLEAN                  NOT NULL DEFAULT TRUE,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (client_siret, label)
+);
+
+CREATE TABLE IF NOT EXISTS billing_runs (
+    run_id          VARCHAR(50)              PRIMARY KEY,
+    period          VARCHAR(50)              NOT NULL,
+    issue_date      DATE                     NOT NULL,
+    status          VARCHAR(10)              NOT NULL DEFAULT 'OPEN'
+                                             CHECK (status IN ('OPEN', 'RUNNING', 'DONE', 'PARTIAL')),
+    item_count      INTEGER                  NOT NULL DEFAULT 0,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at      TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    finished_at     TIMESTAMP WITH TIME ZONE DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS billing_run_items (
+    run_id          VARCHAR(50)              NOT NULL REFERENCES billing_runs (run_id) ON DELETE CASCADE,
+    template_id     INTEGER                  NOT NULL,
+    client_siret    VARCHAR(14)              NOT NULL,
+    payload         TEXT                     NOT NULL,
+    status          VARCHAR(10)              NOT NULL DEFAULT 'PENDING'
+                                             CHECK (status IN ('PENDING', 'CLAIMED', 'ISSUED', 'FAILED')),
+    attempts        INTEGER                  NOT NULL DEFAULT 0,
+    claimed_at      DOUBLE PRECISION         DEFAULT NULL,
+    invoice_num     VARCHAR(50)              DEFAULT NULL,
+    error           TEXT                     DEFAULT NULL,
+    done_at         TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    PRIMARY KEY (run_id, template_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_billing_run_items_status
+    ON billing_run_items (run_id, status);
@@ -0,0 +1,15 @@
+-- Base k_factur_x dans PG 16
+-- Profils émetteurs (utils/emitters.py) : un processus sert plusieurs sociétés émettrices
+--   emitter_code : code du profil (en-tête X-Emitter de l'API, champ "emitter" des modèles de facturation)
+--   config       : JSON, clés de ma-conf.txt propres à l'émetteur (name, siret, siren, logo, cie_IBAN,
+--                  pmt_text, pmd_text, invoice_prefix, xml_storage, pdf_storage, pdf_compact...)
+--   updated_at   : version du profil ; un profil modifié est rechargé par les processus en cours
+-- L'émetteur par défaut (ma-conf.txt) n'a pas de ligne dans cette table.
+
+CREATE TABLE IF NOT EXISTS emitters (
+    emitter_code    VARCHAR(40)              PRIMARY KEY,
+    config          TEXT                     NOT NULL,
+    active          BOOLEAN                  NOT NULL DEFAULT TRUE,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
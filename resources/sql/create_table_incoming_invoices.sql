@@ -1,15 +1,31 @@
 -- Base k_factur_x dans PG 16
 -- Factures reçues depuis la plateforme agréée
+-- Un numéro n'est unique que chez son fournisseur : clé (company_siret, invoice_num)
 
 CREATE TABLE IF NOT EXISTS incoming_invoices (
-    invoice_num     VARCHAR(50)              PRIMARY KEY,
+    invoice_num     VARCHAR(50)              NOT NULL,
     company_name    VARCHAR(255)             NOT NULL,
     company_siret   VARCHAR(14)              NOT NULL,
     xml_facture     XML                      NOT NULL,
     pdf_path        VARCHAR(500)             NOT NULL,
     invoice_date    DATE                     NOT NULL,
     total_ttc       NUMERIC(12,2)           NOT NULL,
-    received_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    received_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    pdp_invoice_id  BIGINT                   DEFAULT NULL,
+    content_sha256  CHAR(64)                 DEFAULT NULL,
+    due_date        DATE                     DEFAULT NULL,
+    currency_code   CHAR(3)                  DEFAULT NULL,
+    seller_vat_number VARCHAR(20)            DEFAULT NULL,
+    buyer_siret     VARCHAR(14)              DEFAULT NULL,
+    buyer_vat_number VARCHAR(20)             DEFAULT NULL,
+    buyer_reference VARCHAR(100)             DEFAULT NULL,
+    purchase_order_reference VARCHAR(100)    DEFAULT NULL,
+    total_ht        NUMERIC(12,2)            DEFAULT NULL,
+    total_vat       NUMERIC(12,2)            DEFAULT NULL,
+    type_code       CHAR(3)                  DEFAULT NULL,
+    fields_extracted_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    search_vector   TSVECTOR                 DEFAULT NULL,
+    PRIMARY KEY (company_siret, invoice_num)
 );
 
 CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_name
@@ -21,3 +37,33 @@ CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_siret
 
 CREATE INDEX IF NOT EXISTS idx_incoming_invoices_total_ttc
     ON incoming_invoices (total_ttc);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_pdp_invoice_id
+    ON incoming_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_content_sha256
+    ON incoming_invoices (content_sha256)
+    WHERE content_sha256 IS NOT NULL;
+
+-- Champs extraits du XML (filtres du dashboard, rapports)
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_due_date
+    ON incoming_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_seller_vat_number
+    ON incoming_invoices (seller_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_buyer_reference
+    ON incoming_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_fields_pending
+    ON incoming_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+-- Recherche plein texte (utils/search.py)
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search
+    ON incoming_invoices USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search_pending
+    ON incoming_invoices (invoice_num)
+    WHERE search_vector IS NULL;
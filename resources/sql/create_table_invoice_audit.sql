@@ -0,0 +1,29 @@
+-- Base k_factur_x dans PG 16
+-- Rapport d'audit de conformité des factures archivées (utils/audit.py, cli.py audit)
+--   doc_key        : nom du fichier sans extension (pdf_storage / xml_storage)
+--   pdf_sha256, xml_sha256 : empreintes des fichiers audités (facture inchangée = non revalidée)
+--   rules_version  : version des contrôles (librairie factur-x, Schematron exécuté ou non)
+--   xsd_valid, schematron_valid, pdfa_valid : NULL si le contrôle n'a pas pu être exécuté
+--   errors         : JSON [{check, message}] (check : file, pdfa, consistency, xsd, schematron)
+
+CREATE TABLE IF NOT EXISTS invoice_audit (
+    doc_key         VARCHAR(255)             PRIMARY KEY,
+    invoice_num     VARCHAR(50)              DEFAULT NULL,
+    pdf_path        VARCHAR(500)             DEFAULT NULL,
+    xml_path        VARCHAR(500)             DEFAULT NULL,
+    pdf_sha256      CHAR(64)                 DEFAULT NULL,
+    xml_sha256      CHAR(64)                 DEFAULT NULL,
+    rules_version   VARCHAR(50)              NOT NULL,
+    status          VARCHAR(10)              NOT NULL CHECK (status IN ('OK', 'ERROR', 'MISSING')),
+    xsd_valid       BOOLEAN                  DEFAULT NULL,
+    schematron_valid BOOLEAN                 DEFAULT NULL,
+    pdfa_valid      BOOLEAN                  DEFAULT NULL,
+    errors          TEXT                     DEFAULT NULL,
+    audited_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_audit_status
+    ON invoice_audit (status);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_audit_invoice_num
+    ON invoice_audit (invoice_num);
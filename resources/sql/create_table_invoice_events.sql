@@ -0,0 +1,37 @@
+-- Base k_factur_x dans PG 16
+-- Cycle de vie des factures émises, synchronisé depuis la PDP (utils/pdp_sync.py)
+-- Prérequis : create_table_sent_invoices.sql
+
+-- Identifiant PDP de la facture (réponse du téléversement) et dernier statut connu
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS pdp_invoice_id   BIGINT                   DEFAULT NULL;
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS lifecycle_status VARCHAR(20)              DEFAULT NULL;
+ALTER TABLE sent_invoices ADD COLUMN IF NOT EXISTS lifecycle_at     TIMESTAMP WITH TIME ZONE DEFAULT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sent_invoices_pdp_invoice_id
+    ON sent_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+-- Événements de cycle de vie (un par changement de statut côté PDP)
+--   status_code : code PDP (ex. fr:205 Approuvée, fr:212 Encaissée)
+--   invoice_num : NULL si la facture PDP n'est pas (encore) rattachée
+CREATE TABLE IF NOT EXISTS invoice_events (
+    pdp_event_id    BIGINT                   PRIMARY KEY,
+    pdp_invoice_id  BIGINT                   NOT NULL,
+    invoice_num     VARCHAR(50)              DEFAULT NULL,
+    status_code     VARCHAR(20)              NOT NULL,
+    event_at        TIMESTAMP WITH TIME ZONE NOT NULL,
+    details         TEXT                     DEFAULT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_events_invoice
+    ON invoice_events (invoice_num, event_at);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_events_pdp_invoice
+    ON invoice_events (pdp_invoice_id, event_at);
+
+-- Curseurs de synchronisation (dernier identifiant d'événement traité)
+CREATE TABLE IF NOT EXISTS pdp_sync_state (
+    name            VARCHAR(50)              PRIMARY KEY,
+    watermark       BIGINT                   NOT NULL DEFAULT 0,
+    synced_at       TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,17 @@
+-- Base k_factur_x dans PG 16
+-- Registre des numéros de factures émises : un numéro n'est attribué qu'une fois.
+-- sent_invoices partitionnée (migrate_invoices_partitioned.sql) ne peut garantir
+-- l'unicité que par (invoice_num, invoice_date) ; ce registre non partitionné la
+-- garantit sur le numéro seul. Alimenté dans la transaction d'émission
+-- (app.insert_sent_invoice) : un numéro déjà attribué fait échouer l'émission.
+-- Rejouable : reprend les numéros déjà présents dans sent_invoices.
+
+CREATE TABLE IF NOT EXISTS invoice_numbers (
+    invoice_num     VARCHAR(50)              PRIMARY KEY,
+    invoice_date    DATE                     NOT NULL,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO invoice_numbers (invoice_num, invoice_date)
+SELECT invoice_num, min(invoice_date) FROM sent_invoices GROUP BY invoice_num
+ON CONFLICT (invoice_num) DO NOTHING;
@@ -0,0 +1,19 @@
+-- Base k_factur_x dans PG 16
+-- Émission idempotente des factures (utils/idempotency.py)
+--   request_key  : clé Idempotency-Key de l'API, ou empreinte du contenu de la facture
+--   content_hash : SHA-256 du contenu normalisé (une clé réutilisée pour un autre contenu est refusée)
+--   result       : résultat JSON de l'émission, NULL tant qu'elle est en cours
+--   claimed_at, expires_at : horodatages epoch (secondes) de la réservation et de l'expiration
+
+CREATE TABLE IF NOT EXISTS invoice_requests (
+    request_key     VARCHAR(255)             PRIMARY KEY,
+    content_hash    CHAR(64)                 NOT NULL,
+    invoice_num     VARCHAR(50)              DEFAULT NULL,
+    result          TEXT                     DEFAULT NULL,
+    claimed_at      DOUBLE PRECISION         NOT NULL,
+    expires_at      DOUBLE PRECISION         NOT NULL,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_requests_expires
+    ON invoice_requests (expires_at);
@@ -0,0 +1,20 @@
+-- Base k_factur_x dans PG 16
+-- Ventilation TVA par taux/catégorie des factures émises et reçues
+-- Alimentée à l'insertion, ou depuis le XML par `cli.py backfill-fields` (factures antérieures)
+-- company_siret : celui de la facture source (client d'une facture émise, fournisseur d'une
+-- facture reçue), deux fournisseurs pouvant utiliser le même numéro
+
+CREATE TABLE IF NOT EXISTS invoice_vat_breakdown (
+    direction       VARCHAR(8)               NOT NULL CHECK (direction IN ('sent', 'received')),
+    company_siret   VARCHAR(14)              NOT NULL DEFAULT '',
+    invoice_num     VARCHAR(50)              NOT NULL,
+    vat_category    VARCHAR(2)               NOT NULL,
+    vat_rate        NUMERIC(5,2)             NOT NULL,
+    base_ht         NUMERIC(12,2)            NOT NULL,
+    vat_amount      NUMERIC(12,2)            NOT NULL,
+    PRIMARY KEY (direction, company_siret, invoice_num, vat_category, vat_rate)
+);
+
+-- Rapports de TVA par taux sans relire les XML
+CREATE INDEX IF NOT EXISTS idx_invoice_vat_breakdown_rate
+    ON invoice_vat_breakdown (direction, vat_rate);
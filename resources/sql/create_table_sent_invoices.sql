@@ -24,7 +24,25 @@ CREATE TABLE IF NOT EXISTS sent_invoices (
     status          invoice_status           DEFAULT 'PENDING',
     exception       TEXT                     DEFAULT NULL,
     total_ttc       NUMERIC(12,2)            DEFAULT NULL,
-    sent_at         TIMESTAMP WITH TIME ZONE DEFAULT NULL
+    sent_at         TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    claimed_at      TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    send_attempts   INTEGER                  NOT NULL DEFAULT 0,
+    pdp_invoice_id  BIGINT                   DEFAULT NULL,
+    lifecycle_status VARCHAR(20)             DEFAULT NULL,
+    lifecycle_at    TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    due_date        DATE                     DEFAULT NULL,
+    currency_code   CHAR(3)                  DEFAULT NULL,
+    seller_vat_number VARCHAR(20)            DEFAULT NULL,
+    buyer_siret     VARCHAR(14)              DEFAULT NULL,
+    buyer_vat_number VARCHAR(20)             DEFAULT NULL,
+    buyer_reference VARCHAR(100)             DEFAULT NULL,
+    purchase_order_reference VARCHAR(100)    DEFAULT NULL,
+    total_ht        NUMERIC(12,2)            DEFAULT NULL,
+    total_vat       NUMERIC(12,2)            DEFAULT NULL,
+    type_code       CHAR(3)                  DEFAULT NULL,
+    fields_extracted_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    search_vector   TSVECTOR                 DEFAULT NULL,
+    emitter_code    VARCHAR(40)              NOT NULL DEFAULT 'default'
 );
 
 -- Index
@@ -40,6 +58,40 @@ CREATE INDEX IF NOT EXISTS idx_sent_invoices_invoice_date
 CREATE INDEX IF NOT EXISTS idx_sent_invoices_status
     ON sent_invoices (status);
 
+-- Numérotation par émetteur (dernière facture émise)
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_emitter
+    ON sent_invoices (emitter_code, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_pending
+    ON sent_invoices (created_at)
+    WHERE status = 'PENDING';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sent_invoices_pdp_invoice_id
+    ON sent_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+-- Champs extraits du XML (filtres du dashboard, rapports)
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_due_date
+    ON sent_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_vat_number
+    ON sent_invoices (buyer_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_reference
+    ON sent_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_fields_pending
+    ON sent_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+-- Recherche plein texte (utils/search.py)
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search
+    ON sent_invoices USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search_pending
+    ON sent_invoices (invoice_num)
+    WHERE search_vector IS NULL;
+
 -- Trigger : logique status/exception
 --   PENDING    → pas de contrainte sur exception
 --   SENT-OK    → pas de contrainte sur exception
@@ -0,0 +1,147 @@
+-- Base k_factur_x dans PG 16
+-- Partitionnement annuel de sent_invoices et incoming_invoices sur invoice_date
+-- A lancer une fois, sur une base existante ou neuve (après les scripts create_table_* et alter_table_*) :
+--   psql -d factur_x -f resources/sql/create_function_invoice_partitions.sql
+--   psql -d factur_x -f resources/sql/create_table_invoice_numbers.sql
+--   psql -d factur_x -f resources/sql/migrate_invoices_partitioned.sql
+--
+-- Les filtres de dates du dashboard n'accèdent plus qu'aux partitions des années
+-- demandées (élagage des partitions). Une partition <table>_default reçoit les
+-- factures d'années pas encore créées ; `cli.py ensure-partitions` (cron annuel,
+-- également exécuté au démarrage de l'application) crée les suivantes.
+--
+-- Contraintes d'unicité : une contrainte d'une table partitionnée doit inclure
+-- la clé de partitionnement. Les clés, l'identifiant PDP et l'empreinte d'une
+-- facture ne sont donc uniques que par date de facture. Pour les factures émises,
+-- le numéro reste unique tous exercices confondus grâce au registre non
+-- partitionné invoice_numbers (alimenté dans la transaction d'émission). Pour
+-- les factures reçues, une même facture (même XML) ayant toujours la même date,
+-- les réimports restent ignorés (ON CONFLICT DO NOTHING).
+--
+-- Les scripts create_table_* / alter_table_* antérieurs ne sont plus à rejouer après
+-- la migration (leurs index uniques sans invoice_date sont refusés sur une table partitionnée).
+--
+-- Les anciennes tables sont conservées (sent_invoices_legacy, incoming_invoices_legacy) :
+-- après vérification des volumes, les supprimer avec DROP TABLE ..._legacy;
+
+BEGIN;
+
+-- Pas d'écriture concurrente pendant la copie
+LOCK TABLE sent_invoices, incoming_invoices IN ACCESS EXCLUSIVE MODE;
+
+-- Le registre des numéros doit exister : sans lui, l'unicité des numéros émis serait perdue
+DO $$
+BEGIN
+    IF to_regclass('invoice_numbers') IS NULL THEN
+        RAISE EXCEPTION 'Lancer d''abord create_table_invoice_numbers.sql';
+    END IF;
+END $$;
+INSERT INTO invoice_numbers (invoice_num, invoice_date)
+SELECT invoice_num, invoice_date FROM sent_invoices
+ON CONFLICT (invoice_num) DO NOTHING;
+
+SELECT partition_invoice_table('sent_invoices') AS sent_invoices_rows;
+SELECT partition_invoice_table('incoming_invoices') AS incoming_invoices_rows;
+
+-- Index de sent_invoices (créés sur chaque partition)
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_company_name
+    ON sent_invoices (company_name);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_company_siret
+    ON sent_invoices (company_siret);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_invoice_date
+    ON sent_invoices (invoice_date);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_created_at
+    ON sent_invoices (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_status
+    ON sent_invoices (status);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_emitter
+    ON sent_invoices (emitter_code, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_pending
+    ON sent_invoices (created_at)
+    WHERE status = 'PENDING';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sent_invoices_pdp_invoice_id
+    ON sent_invoices (pdp_invoice_id, invoice_date)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_due_date
+    ON sent_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_vat_number
+    ON sent_invoices (buyer_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_reference
+    ON sent_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_fields_pending
+    ON sent_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search
+    ON sent_invoices USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_search_pending
+    ON sent_invoices (invoice_num)
+    WHERE search_vector IS NULL;
+
+-- Trigger status/exception (cloné sur chaque partition)
+DROP TRIGGER IF EXISTS trg_check_exception_on_status ON sent_invoices;
+CREATE TRIGGER trg_check_exception_on_status
+    BEFORE INSERT OR UPDATE ON sent_invoices
+    FOR EACH ROW
+    EXECUTE FUNCTION check_exception_on_status();
+
+-- Index de incoming_invoices
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_name
+    ON incoming_invoices (company_name);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_siret
+    ON incoming_invoices (company_siret);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_invoice_date
+    ON incoming_invoices (invoice_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_received_at
+    ON incoming_invoices (received_at);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_total_ttc
+    ON incoming_invoices (total_ttc);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_pdp_invoice_id
+    ON incoming_invoices (pdp_invoice_id, invoice_date)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_content_sha256
+    ON incoming_invoices (content_sha256, invoice_date)
+    WHERE content_sha256 IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_due_date
+    ON incoming_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_seller_vat_number
+    ON incoming_invoices (seller_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_buyer_reference
+    ON incoming_invoices (buyer_reference);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_fields_pending
+    ON incoming_invoices (invoice_num)
+    WHERE fields_extracted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search
+    ON incoming_invoices USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_search_pending
+    ON incoming_invoices (invoice_num)
+    WHERE search_vector IS NULL;
+
+COMMIT;
+
+ANALYZE sent_invoices;
+ANALYZE incoming_invoices;
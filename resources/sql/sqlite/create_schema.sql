@@ -0,0 +1,322 @@
+-- Base k_factur_x embarquée (SQLite 3.35+, FTS5)
+-- Equivalent des scripts PostgreSQL create_table_* pour is_db_sqlite=True
+-- Appliqué automatiquement à la première connexion (utils/db_sqlite.py) ; rejouable sans effet de bord
+--
+-- Types déclarés DATE, TIMESTAMP et NUMERIC : relus en date, datetime (UTC) et
+-- Decimal comme avec psycopg2. Horodatages au format 'AAAA-MM-JJ HH:MM:SS.mmm' (UTC).
+
+CREATE TABLE IF NOT EXISTS sent_invoices (
+    invoice_num     VARCHAR(50)     PRIMARY KEY,
+    company_name    VARCHAR(255)    NOT NULL,
+    company_siret   VARCHAR(14)     NOT NULL,
+    xml_facture     TEXT            NOT NULL,
+    pdf_path        VARCHAR(500)    NOT NULL,
+    invoice_date    DATE            NOT NULL,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    validated_at    TIMESTAMP,
+    status          VARCHAR(10)     DEFAULT 'PENDING'
+                                    CHECK (status IN ('PENDING', 'SENT-OK', 'SENT-ERROR')),
+    exception       TEXT            DEFAULT NULL,
+    total_ttc       NUMERIC(12,2)   DEFAULT NULL,
+    sent_at         TIMESTAMP       DEFAULT NULL,
+    claimed_at      TIMESTAMP       DEFAULT NULL,
+    send_attempts   INTEGER         NOT NULL DEFAULT 0,
+    pdp_invoice_id  BIGINT          DEFAULT NULL,
+    lifecycle_status VARCHAR(20)    DEFAULT NULL,
+    lifecycle_at    TIMESTAMP       DEFAULT NULL,
+    due_date        DATE            DEFAULT NULL,
+    currency_code   CHAR(3)         DEFAULT NULL,
+    seller_vat_number VARCHAR(20)   DEFAULT NULL,
+    buyer_siret     VARCHAR(14)     DEFAULT NULL,
+    buyer_vat_number VARCHAR(20)    DEFAULT NULL,
+    buyer_reference VARCHAR(100)    DEFAULT NULL,
+    purchase_order_reference VARCHAR(100) DEFAULT NULL,
+    total_ht        NUMERIC(12,2)   DEFAULT NULL,
+    total_vat       NUMERIC(12,2)   DEFAULT NULL,
+    type_code       CHAR(3)         DEFAULT NULL,
+    fields_extracted_at TIMESTAMP   DEFAULT NULL,
+    emitter_code    VARCHAR(40)     NOT NULL DEFAULT 'default',
+    -- SENT-ERROR : exception obligatoire (trigger check_exception_on_status côté PostgreSQL)
+    CHECK (status <> 'SENT-ERROR' OR TRIM(COALESCE(exception, '')) <> '')
+);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_company_name
+    ON sent_invoices (company_name);
+
+-- Registre des numéros émis (voir create_table_invoice_numbers.sql)
+CREATE TABLE IF NOT EXISTS invoice_numbers (
+    invoice_num     VARCHAR(50)     PRIMARY KEY,
+    invoice_date    DATE            NOT NULL,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_company_siret
+    ON sent_invoices (company_siret);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_invoice_date
+    ON sent_invoices (invoice_date);
+
+-- Numérotation (dernière facture émise) et tri du dashboard
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_created_at
+    ON sent_invoices (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_emitter
+    ON sent_invoices (emitter_code, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_status
+    ON sent_invoices (status);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sent_invoices_pdp_invoice_id
+    ON sent_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_due_date
+    ON sent_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_vat_number
+    ON sent_invoices (buyer_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_sent_invoices_buyer_reference
+    ON sent_invoices (buyer_reference);
+
+
+CREATE TABLE IF NOT EXISTS incoming_invoices (
+    invoice_num     VARCHAR(50)     NOT NULL,
+    company_name    VARCHAR(255)    NOT NULL,
+    company_siret   VARCHAR(14)     NOT NULL,
+    xml_facture     TEXT            NOT NULL,
+    pdf_path        VARCHAR(500)    NOT NULL,
+    invoice_date    DATE            NOT NULL,
+    total_ttc       NUMERIC(12,2)   NOT NULL,
+    received_at     TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    pdp_invoice_id  BIGINT          DEFAULT NULL,
+    content_sha256  CHAR(64)        DEFAULT NULL,
+    due_date        DATE            DEFAULT NULL,
+    currency_code   CHAR(3)         DEFAULT NULL,
+    seller_vat_number VARCHAR(20)   DEFAULT NULL,
+    buyer_siret     VARCHAR(14)     DEFAULT NULL,
+    buyer_vat_number VARCHAR(20)    DEFAULT NULL,
+    buyer_reference VARCHAR(100)    DEFAULT NULL,
+    purchase_order_reference VARCHAR(100) DEFAULT NULL,
+    total_ht        NUMERIC(12,2)   DEFAULT NULL,
+    total_vat       NUMERIC(12,2)   DEFAULT NULL,
+    type_code       CHAR(3)         DEFAULT NULL,
+    fields_extracted_at TIMESTAMP   DEFAULT NULL,
+    PRIMARY KEY (company_siret, invoice_num)
+);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_name
+    ON incoming_invoices (company_name);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_company_siret
+    ON incoming_invoices (company_siret);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_invoice_date
+    ON incoming_invoices (invoice_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_received_at
+    ON incoming_invoices (received_at);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_pdp_invoice_id
+    ON incoming_invoices (pdp_invoice_id)
+    WHERE pdp_invoice_id IS NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_incoming_invoices_content_sha256
+    ON incoming_invoices (content_sha256)
+    WHERE content_sha256 IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_due_date
+    ON incoming_invoices (due_date);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_seller_vat_number
+    ON incoming_invoices (seller_vat_number);
+
+CREATE INDEX IF NOT EXISTS idx_incoming_invoices_buyer_reference
+    ON incoming_invoices (buyer_reference);
+
+
+CREATE TABLE IF NOT EXISTS invoice_vat_breakdown (
+    direction       VARCHAR(8)      NOT NULL CHECK (direction IN ('sent', 'received')),
+    company_siret   VARCHAR(14)     NOT NULL DEFAULT '',
+    invoice_num     VARCHAR(50)     NOT NULL,
+    vat_category    VARCHAR(2)      NOT NULL,
+    vat_rate        NUMERIC(5,2)    NOT NULL,
+    base_ht         NUMERIC(12,2)   NOT NULL,
+    vat_amount      NUMERIC(12,2)   NOT NULL,
+    PRIMARY KEY (direction, company_siret, invoice_num, vat_category, vat_rate)
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_vat_breakdown_rate
+    ON invoice_vat_breakdown (direction, vat_rate);
+
+
+CREATE TABLE IF NOT EXISTS client_metadata (
+    id                  INTEGER         PRIMARY KEY AUTOINCREMENT,
+    recipient_name      VARCHAR(255)    NOT NULL,
+    cie_legal_form      VARCHAR(20),
+    recipient_siret     VARCHAR(14)     NOT NULL UNIQUE,
+    recipient_vat_number VARCHAR(20),
+    recipient_address   VARCHAR(500),
+    recipient_postal_code VARCHAR(10),
+    recipient_city      VARCHAR(100),
+    recipient_country_code VARCHAR(2)   NOT NULL DEFAULT 'FR',
+    created_at          TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    updated_at          TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_client_metadata_name
+    ON client_metadata (recipient_name);
+
+
+CREATE TABLE IF NOT EXISTS invoice_events (
+    pdp_event_id    BIGINT          PRIMARY KEY,
+    pdp_invoice_id  BIGINT          NOT NULL,
+    invoice_num     VARCHAR(50)     DEFAULT NULL,
+    status_code     VARCHAR(20)     NOT NULL,
+    event_at        TIMESTAMP       NOT NULL,
+    details         TEXT            DEFAULT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_events_invoice
+    ON invoice_events (invoice_num, event_at);
+
+CREATE TABLE IF NOT EXISTS pdp_sync_state (
+    name            VARCHAR(50)     PRIMARY KEY,
+    watermark       BIGINT          NOT NULL DEFAULT 0,
+    synced_at       TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS invoice_requests (
+    request_key     VARCHAR(255)    PRIMARY KEY,
+    content_hash    CHAR(64)        NOT NULL,
+    invoice_num     VARCHAR(50)     DEFAULT NULL,
+    result          TEXT            DEFAULT NULL,
+    claimed_at      REAL            NOT NULL,
+    expires_at      REAL            NOT NULL,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_requests_expires
+    ON invoice_requests (expires_at);
+
+
+CREATE TABLE IF NOT EXISTS billing_templates (
+    id              INTEGER         PRIMARY KEY AUTOINCREMENT,
+    client_siret    VARCHAR(14)     NOT NULL
+                                    REFERENCES client_metadata (recipient_siret) ON DELETE CASCADE,
+    label           VARCHAR(100)    NOT NULL,
+    template        TEXT            NOT NULL,
+    active          BOOLEAN         NOT NULL DEFAULT TRUE,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    updated_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    UNIQUE (client_siret, label)
+);
+
+CREATE TABLE IF NOT EXISTS billing_runs (
+    run_id          VARCHAR(50)     PRIMARY KEY,
+    period          VARCHAR(50)     NOT NULL,
+    issue_date      DATE            NOT NULL,
+    status          VARCHAR(10)     NOT NULL DEFAULT 'OPEN'
+                                    CHECK (status IN ('OPEN', 'RUNNING', 'DONE', 'PARTIAL')),
+    item_count      INTEGER         NOT NULL DEFAULT 0,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    started_at      TIMESTAMP       DEFAULT NULL,
+    finished_at     TIMESTAMP       DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS billing_run_items (
+    run_id          VARCHAR(50)     NOT NULL REFERENCES billing_runs (run_id) ON DELETE CASCADE,
+    template_id     INTEGER         NOT NULL,
+    client_siret    VARCHAR(14)     NOT NULL,
+    payload         TEXT            NOT NULL,
+    status          VARCHAR(10)     NOT NULL DEFAULT 'PENDING'
+                                    CHECK (status IN ('PENDING', 'CLAIMED', 'ISSUED', 'FAILED')),
+    attempts        INTEGER         NOT NULL DEFAULT 0,
+    claimed_at      REAL            DEFAULT NULL,
+    invoice_num     VARCHAR(50)     DEFAULT NULL,
+    error           TEXT            DEFAULT NULL,
+    done_at         TIMESTAMP       DEFAULT NULL,
+    PRIMARY KEY (run_id, template_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_billing_run_items_status
+    ON billing_run_items (run_id, status);
+
+
+CREATE TABLE IF NOT EXISTS emitters (
+    emitter_code    VARCHAR(40)     PRIMARY KEY,
+    config          TEXT            NOT NULL,
+    active          BOOLEAN         NOT NULL DEFAULT TRUE,
+    created_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    updated_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+
+CREATE TABLE IF NOT EXISTS invoice_audit (
+    doc_key         VARCHAR(255)    PRIMARY KEY,
+    invoice_num     VARCHAR(50)     DEFAULT NULL,
+    pdf_path        VARCHAR(500)    DEFAULT NULL,
+    xml_path        VARCHAR(500)    DEFAULT NULL,
+    pdf_sha256      CHAR(64)        DEFAULT NULL,
+    xml_sha256      CHAR(64)        DEFAULT NULL,
+    rules_version   VARCHAR(50)     NOT NULL,
+    status          VARCHAR(10)     NOT NULL CHECK (status IN ('OK', 'ERROR', 'MISSING')),
+    xsd_valid       BOOLEAN         DEFAULT NULL,
+    schematron_valid BOOLEAN        DEFAULT NULL,
+    pdfa_valid      BOOLEAN         DEFAULT NULL,
+    errors          TEXT            DEFAULT NULL,
+    audited_at      TIMESTAMP       DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_audit_status
+    ON invoice_audit (status);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_audit_invoice_num
+    ON invoice_audit (invoice_num);
+
+
+-- Recherche de clients (nom, SIRET) par préfixe, sans accents : index FTS5
+-- adossé à client_metadata (contenu externe), tenu à jour par triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS client_metadata_fts USING fts5(
+    recipient_name, recipient_siret,
+    content='client_metadata', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_client_metadata_fts_insert
+    AFTER INSERT ON client_metadata BEGIN
+    INSERT INTO client_metadata_fts (rowid, recipient_name, recipient_siret)
+    VALUES (NEW.id, NEW.recipient_name, NEW.recipient_siret);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_client_metadata_fts_delete
+    AFTER DELETE ON client_metadata BEGIN
+    INSERT INTO client_metadata_fts (client_metadata_fts, rowid, recipient_name, recipient_siret)
+    VALUES ('delete', OLD.id, OLD.recipient_name, OLD.recipient_siret);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_client_metadata_fts_update
+    AFTER UPDATE OF recipient_name, recipient_siret ON client_metadata BEGIN
+    INSERT INTO client_metadata_fts (client_metadata_fts, rowid, recipient_name, recipient_siret)
+    VALUES ('delete', OLD.id, OLD.recipient_name, OLD.recipient_siret);
+    INSERT INTO client_metadata_fts (rowid, recipient_name, recipient_siret)
+    VALUES (NEW.id, NEW.recipient_name, NEW.recipient_siret);
+END;
+
+
+-- Recherche plein texte des factures (équivalent des colonnes search_vector) :
+-- textes A (numéro, références), B (parties), C (désignations) de utils/search.py
+CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search_fts USING fts5(
+    direction UNINDEXED, invoice_num UNINDEXED, refs, parties, lines,
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_sent_invoices_fts_delete
+    AFTER DELETE ON sent_invoices BEGIN
+    DELETE FROM invoice_search_fts WHERE direction = 'sent' AND invoice_num = OLD.invoice_num;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_incoming_invoices_fts_delete
+    AFTER DELETE ON incoming_invoices BEGIN
+    DELETE FROM invoice_search_fts WHERE direction = 'received' AND invoice_num = OLD.invoice_num;
+END;
@@ -0,0 +1,82 @@
+"""
+Fabrique de PDF Factur-X de test (générateurs du projet + librairie factur-x).
+"""
+
+import copy
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from facturx import generate_from_binary
+
+from utils.facturx_generator import generate_facturx_xml
+from utils.pdf_generator import generate_invoice_pdf
+
+SAMPLE_DATA = {
+    'emitter': {
+        'name': 'Fournisseur Test SAS',
+        'address': '12 rue des Lilas',
+        'postal_code': '69001',
+        'city': 'Lyon',
+        'country_code': 'FR',
+        'siren': '987654321',
+        'siret': '98765432100011',
+        'vat_number': 'FR45987654321',
+        'bic': 'BNPAFRPPXXX',
+    },
+    'invoice': {
+        'invoice_number': 'FRNS-TEST-001',
+        'type_code': '380',
+        'currency_code': 'EUR',
+        'issue_date': '2026-02-10',
+        'due_date': '2026-03-10',
+        'buyer_reference': 'REF-001',
+        'purchase_order_reference': 'PO-001',
+        'payment_terms': 'Paiement sous 30 jours',
+        'recipient_name': 'ACME Corporation',
+        'recipient_siret': '12345678901234',
+        'recipient_vat_number': 'FR12345678901',
+        'recipient_address': '123 rue de la Paix',
+        'recipient_postal_code': '75001',
+        'recipient_city': 'Paris',
+        'recipient_country_code': 'FR',
+    },
+    'lines': [
+        {
+            'description': 'Ramettes papier A4',
+            'quantity': '10',
+            'unit_price_ht': '4.5',
+            'vat_rate': '20',
+            'discount_value': '0',
+            'discount_type': 'percent',
+        },
+        {
+            'description': 'Livres techniques',
+            'quantity': '2',
+            'unit_price_ht': '30',
+            'vat_rate': '5.5',
+            'discount_value': '0',
+            'discount_type': 'percent',
+        },
+    ],
+}
+
+_PDF_CACHE = {}
+
+
+def make_facturx_pdf(invoice_number: str = 'FRNS-TEST-001', seller_siret: str = None) -> bytes:
+    """Retourne un PDF Factur-X (EN16931) du fournisseur de test (ou de ce SIRET) pour ce numéro."""
+    key = (invoice_number, seller_siret)
+    if key not in _PDF_CACHE:
+        data = copy.deepcopy(SAMPLE_DATA)
+        data['invoice']['invoice_number'] = invoice_number
+        if seller_siret:
+            data['emitter']['siret'] = seller_siret
+            data['emitter']['siren'] = seller_siret[:9]
+        xml = generate_facturx_xml(data)
+        pdf = generate_invoice_pdf(data)
+        _PDF_CACHE[key] = generate_from_binary(
+            pdf_file=pdf, xml=xml.encode('utf-8'), flavor='factur-x', level='en16931', check_xsd=False,
+        )
+    return _PDF_CACHE[key]
@@ -0,0 +1,214 @@
+"""
+Bouchon local de l'API SuperPDP pour les tests (serveur HTTP/1.1 keep-alive).
+
+Usage:
+    with PdpStub() as stub:
+        os.environ['PDP_API_URL'] = stub.url
+        ...
+"""
+
+import fnmatch
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VALID_TOKEN = 'stub-access-token'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload, headers: dict = None) -> None:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        headers = dict(headers or {})
+        self.send_response(status)
+        self.send_header('Content-Type', headers.pop('Content-Type', 'application/json'))
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _authorized(self) -> bool:
+        return self.headers.get('Authorization') == f'Bearer {VALID_TOKEN}'
+
+    def _dispatch(self, method: str) -> None:
+        stub = self.server.stub
+        body = self._read_body()
+        with stub.lock:
+            stub.requests.append((method, self.path, body))
+            stub.client_ports.add(self.client_address[1])
+            forced = stub.forced.pop(self.path, None) or stub.forced.pop('*', None)
+            dropped = self.path in stub.dropped
+            stub.dropped.discard(self.path)
+        if dropped:
+            # Requête reçue mais connexion fermée sans réponse (keep-alive expiré côté serveur)
+            self.close_connection = True
+            return
+        if forced is not None:
+            self._send(*forced)
+            return
+
+        path = self.path.split('?')[0]
+        handler = stub.routes.get((method, path))
+        if handler is None:
+            # Routes paramétrées (ex. /v1.beta/invoices/*/download)
+            for (route_method, pattern), candidate in stub.routes.items():
+                if route_method == method and '*' in pattern and fnmatch.fnmatchcase(path, pattern):
+                    handler = candidate
+                    break
+        if handler is None:
+            self._send(404, {'error': 'not_found', 'message': self.path})
+            return
+        status, payload, *extra = handler(self, body)
+        self._send(status, payload, *extra)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+def _token(handler, body):
+    form = dict(pair.split('=', 1) for pair in body.decode().split('&') if '=' in pair)
+    if form.get('client_secret') != 'secret':
+        return 401, {'error': 'invalid_client', 'error_description': 'Bad credentials'}
+    return 200, {'access_token': VALID_TOKEN, 'expires_in': 1800, 'token_type': 'Bearer'}
+
+
+def _upload(handler, body):
+    if not handler._authorized():
+        return 401, {'error': 'unauthorized'}
+    if not body.startswith(b'%PDF'):
+        return 400, {'message': 'Not a PDF'}
+    stub = handler.server.stub
+    with stub.lock:
+        stub.invoice_seq += 1
+        invoice_id = stub.invoice_seq
+        stub.uploads.append(body)
+    return 201, {'id': invoice_id, 'created_at': '2026-03-01T10:00:00Z'}
+
+
+def _company(handler, body):
+    if not handler._authorized():
+        return 401, {'error': 'unauthorized'}
+    return 200, {'formal_name': 'Stub SAS', 'env': 'sandbox'}
+
+
+def _invoice_events(handler, body):
+    if not handler._authorized():
+        return 401, {'error': 'unauthorized'}
+    query = parse_qs(urlsplit(handler.path).query)
+    after = int(query.get('starting_after_id', ['0'])[0])
+    limit = int(query.get('limit', ['100'])[0])
+    stub = handler.server.stub
+    with stub.lock:
+        newer = [e for e in stub.events if e['id'] > after]
+    return 200, {'data': newer[:limit], 'has_after': len(newer) > limit}
+
+
+def _list_invoices(handler, body):
+    if not handler._authorized():
+        return 401, {'error': 'unauthorized'}
+    query = parse_qs(urlsplit(handler.path).query)
+    after = int(query.get('starting_after_id', ['0'])[0])
+    limit = int(query.get('limit', ['100'])[0])
+    stub = handler.server.stub
+    with stub.lock:
+        newer = [{'id': i, 'direction': 'in', 'created_at': '2026-03-02T08:00:00Z'}
+                 for i in sorted(stub.inbox) if i > after]
+    return 200, {'data': newer[:limit], 'has_after': len(newer) > limit}
+
+
+def _download(handler, body):
+    if not handler._authorized():
+        return 401, {'error': 'unauthorized'}
+    invoice_id = int(handler.path.split('/')[3])
+    stub = handler.server.stub
+    with stub.lock:
+        pdf = stub.inbox.get(invoice_id)
+        stub.downloads.append(invoice_id)
+    if pdf is None:
+        return 404, {'message': 'invoice not found'}
+    return 200, pdf, {'Content-Type': 'application/pdf'}
+
+
+class PdpStub:
+    """Serveur bouchon : routes SuperPDP, historique des requêtes et réponses forcées."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.uploads = []
+        self.client_ports = set()
+        self.forced = {}
+        self.dropped = set()
+        self.invoice_seq = 0
+        self.events = []
+        self.inbox = {}
+        self.downloads = []
+        self.routes = {
+            ('POST', '/oauth2/token'): _token,
+            ('POST', '/v1.beta/invoices'): _upload,
+            ('GET', '/v1.beta/companies/me'): _company,
+            ('GET', '/v1.beta/invoice_events'): _invoice_events,
+            ('GET', '/v1.beta/invoices'): _list_invoices,
+            ('GET', '/v1.beta/invoices/*/download'): _download,
+        }
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.stub = self
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def force(self, path: str, status: int, payload, headers: dict = None) -> None:
+        """Force la prochaine réponse sur `path` ('*' : n'importe quel chemin)."""
+        with self.lock:
+            self.forced[path] = (status, payload, headers)
+
+    def drop(self, path: str) -> None:
+        """Ferme la connexion sans répondre à la prochaine requête sur `path`."""
+        with self.lock:
+            self.dropped.add(path)
+
+    def add_event(self, invoice_id: int, status_code: str, created_at: str = '2026-03-02T09:00:00Z',
+                  status_text: str = None) -> dict:
+        """Ajoute un événement de cycle de vie au flux /v1.beta/invoice_events."""
+        with self.lock:
+            event = {
+                'id': len(self.events) + 1,
+                'invoice_id': invoice_id,
+                'status_code': status_code,
+                'status_text': status_text,
+                'created_at': created_at,
+            }
+            self.events.append(event)
+            return event
+
+    def add_incoming(self, pdf: bytes) -> int:
+        """Dépose une facture reçue (PDF Factur-X) dans la boîte de réception du bouchon."""
+        with self.lock:
+            invoice_id = 1000 + len(self.inbox) + 1
+            self.inbox[invoice_id] = pdf
+            return invoice_id
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,131 @@
+"""
+Tests de l'API REST d'émission de factures (/api/v1/invoices), sur base SQLite temporaire.
+
+Usage: uv run python tests/test_api_invoices.py
+"""
+
+import hashlib
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as app_module
+import utils.db as db
+from utils.invoice_input import invoice_data_from_payload
+
+INVOICE = {
+    'invoice': {'type_code': '380', 'currency_code': 'EUR', 'issue_date': '2026-02-18', 'due_date': '2026-03-18'},
+    'client': {'name': 'Client API SAS', 'siret': '12345678901234', 'country_code': 'FR',
+               'address': '1 rue de la Paix', 'postal_code': '75002', 'city': 'Paris'},
+    'lines': [
+        {'description': 'Abonnement mensuel', 'quantity': 1, 'unit_price_ht': '99.90', 'vat_rate': 20},
+        {'description': 'Livres', 'quantity': 3, 'unit_price_ht': 12, 'vat_rate': '5.5'},
+    ],
+}
+
+
+class _ApiEnvironment:
+    """Base SQLite, numérotation automatique et stockage dans un répertoire temporaire."""
+
+    KEYS = ('is_db_pg', 'is_db_sqlite', 'is_num_facturx_auto', 'xml_storage', 'pdf_storage')
+
+    def __enter__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        for name in ('xml', 'pdf'):
+            (root / name).mkdir()
+        self.saved = {key: app_module.CONFIG.get(key) for key in self.KEYS}
+        db.configure_backend('sqlite', str(root / 'factur_x.sqlite3'))
+        app_module.CONFIG.update(is_db_pg=False, is_db_sqlite=True, is_num_facturx_auto=True,
+                                 xml_storage=str(root / 'xml'), pdf_storage=str(root / 'pdf'))
+        app_module.ISSUED_INVOICES.cache.clear()
+        app_module.app.config['TESTING'] = True
+        return app_module.app.test_client()
+
+    def __exit__(self, *exc):
+        app_module.CONFIG.update(self.saved)
+        db.configure_backend('postgresql')
+        self.tmp.cleanup()
+
+
+def test_payload_header():
+    """En-tête : champs client sans préfixe, valeurs par défaut, objets invalides refusés."""
+    data = invoice_data_from_payload(INVOICE)
+    assert data['recipient_name'] == 'Client API SAS' and data['recipient_city'] == 'Paris'
+    assert data['invoice_number'] == '' and data['buyer_reference'] == ''
+    try:
+        invoice_data_from_payload({'invoice': ['x']})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("en-tête invalide accepté")
+    print("[OK] test_payload_header")
+
+
+def test_issue_single_invoice():
+    """Une facture émise en un appel, sans cookie : numéro, totaux, empreintes, URLs servies."""
+    with _ApiEnvironment() as client:
+        resp = client.post('/api/v1/invoices', json=INVOICE)
+        assert resp.status_code == 201, resp.get_json()
+        invoice = resp.get_json()['invoice']
+        assert invoice['invoice_number'].startswith('FAC-') and invoice['invoice_number'].endswith('-0001')
+        assert (invoice['total_ht'], invoice['total_vat'], invoice['total_ttc']) == ('135.90', '21.96', '157.86')
+        assert invoice['db_status'] == 'ok' and 'Set-Cookie' not in resp.headers
+
+        pdf = client.get(invoice['pdf_url'])
+        xml = client.get(invoice['xml_url'])
+        assert pdf.status_code == 200 and hashlib.sha256(pdf.data).hexdigest() == invoice['pdf_sha256']
+        assert xml.status_code == 200 and hashlib.sha256(xml.data).hexdigest() == invoice['xml_sha256']
+
+        resp = client.post('/api/v1/invoices', json={**INVOICE, 'client': {'name': 'Sans SIRET'}, 'lines': []})
+        fields = [e['field'] for e in resp.get_json()['errors']]
+        assert resp.status_code == 400 and fields == ['recipient_siret', 'lines']
+        assert client.post('/api/v1/invoices', data='x').status_code == 400
+    print("[OK] test_issue_single_invoice")
+
+
+def test_issue_batch():
+    """Lot : un résultat par facture dans l'ordre, une facture invalide n'arrête pas les autres."""
+    with _ApiEnvironment() as client:
+        bad = {**INVOICE, 'invoice': {**INVOICE['invoice'], 'issue_date': '18/02/2026'}}
+        other = {**INVOICE, 'client': {**INVOICE['client'], 'name': 'Autre client SARL'}}
+        resp = client.post('/api/v1/invoices/batch', json={'invoices': [INVOICE, bad, other]})
+        data = resp.get_json()
+        assert resp.status_code == 200 and (data['issued'], data['failed']) == (2, 1) and not data['success']
+        assert [r['status'] for r in data['results']] == [201, 400, 201]
+        assert data['results'][1]['errors'][0]['field'] == 'issue_date'
+        numbers = [r['invoice']['invoice_number'] for r in data['results'] if r['success']]
+        assert [n[-4:] for n in numbers] == ['0001', '0002']
+
+        assert client.post('/api/v1/invoices/batch', json={'invoices': []}).status_code == 400
+        too_many = {'invoices': [INVOICE] * (app_module.API_BATCH_MAX + 1)}
+        assert client.post('/api/v1/invoices/batch', json=too_many).status_code == 400
+    print("[OK] test_issue_batch")
+
+
+def test_invalid_line_numbers_rejected():
+    """Taux de TVA ou rabais illisible : 400 avec le champ de la ligne, jamais 500 (unitaire et lot)."""
+    bad_rate = {**INVOICE, 'lines': [INVOICE['lines'][0], {**INVOICE['lines'][1], 'vat_rate': 'abc'}]}
+    bad_discount = {**INVOICE, 'lines': [{**INVOICE['lines'][0], 'discount_value': 'NaN'}]}
+    with _ApiEnvironment() as client:
+        resp = client.post('/api/v1/invoices', json=bad_rate)
+        assert resp.status_code == 400, resp.get_json()
+        assert [e['field'] for e in resp.get_json()['errors']] == ['lines[1][vat_rate]']
+
+        resp = client.post('/api/v1/invoices/batch', json={'invoices': [bad_rate, INVOICE, bad_discount]})
+        data = resp.get_json()
+        assert resp.status_code == 200 and [r['status'] for r in data['results']] == [400, 201, 400], data
+        assert data['results'][0]['errors'][0]['field'] == 'lines[1][vat_rate]'
+        assert data['results'][2]['errors'][0]['field'] == 'lines[0][discount_value]'
+        assert data['results'][1]['invoice']['invoice_number'].endswith('-0001')
+    print("[OK] test_invalid_line_numbers_rejected")
+
+
+if __name__ == '__main__':
+    test_payload_header()
+    test_issue_single_invoice()
+    test_issue_batch()
+    test_invalid_line_numbers_rejected()
+    print("\nTous les tests de l'API REST sont passés.")
@@ -0,0 +1,121 @@
+"""
+Tests de l'audit de conformité des archives (XSD, Schematron, structure PDF/A, cache par empreinte).
+
+Usage: uv run python tests/test_audit.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import utils.db as db
+from facturx_fixtures import SAMPLE_DATA, make_facturx_pdf
+from utils.audit import (
+    audit_archives, audit_failures, check_facturx_xml, check_pdfa_structure, schematron_available,
+)
+from utils.db import db_cursor
+from utils.facturx_parser import extract_facturx_xml
+from utils.pdf_generator import generate_invoice_pdf
+
+
+def test_pdf_structure():
+    """PDF Factur-X généré : structure PDF/A-3 conforme ; PDF simple sans XMP ni pièce jointe : refusé."""
+    errors, xml = check_pdfa_structure(make_facturx_pdf('AUD-001'))
+    assert errors == [] and b'AUD-001' in xml
+
+    errors, xml = check_pdfa_structure(generate_invoice_pdf(SAMPLE_DATA))
+    assert xml is None
+    assert any('XMP' in e for e in errors) and any('Pièce jointe' in e for e in errors)
+    assert check_pdfa_structure(b'pas un pdf')[0] == ["En-tête %PDF- absent ou non suivi d'un commentaire binaire"]
+    print("[OK] test_pdf_structure")
+
+
+def _row(doc_key: str) -> dict:
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            """SELECT status, invoice_num, xsd_valid, schematron_valid, pdfa_valid, errors
+               FROM invoice_audit WHERE doc_key = %s""",
+            (doc_key,),
+        )
+        status, invoice_num, *flags, errors = cursor.fetchone()
+    # SQLite restitue les booléens en entiers
+    xsd, schematron, pdfa = (None if flag is None else bool(flag) for flag in flags)
+    return {'status': status, 'invoice_num': invoice_num, 'xsd': xsd, 'schematron': schematron,
+            'pdfa': pdfa, 'errors': errors or ''}
+
+
+def test_audit_archives_and_cache():
+    """Archives parcourues en pool, rapport par facture ; fichiers inchangés non revalidés au passage suivant."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        pdf_dir, xml_dir = root / 'pdf', root / 'xml'
+        pdf_dir.mkdir()
+        xml_dir.mkdir()
+        good = make_facturx_pdf('AUD-001')
+        (pdf_dir / 'AUD-001.pdf').write_bytes(good)
+        (xml_dir / 'AUD-001.xml').write_bytes(extract_facturx_xml(good))
+        (pdf_dir / 'AUD-002.pdf').write_bytes(make_facturx_pdf('AUD-002'))
+        (xml_dir / 'AUD-002.xml').write_bytes(extract_facturx_xml(good))
+        (pdf_dir / 'AUD-003.pdf').write_bytes(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\ntronque')
+        (xml_dir / 'AUD-004.xml').write_bytes(extract_facturx_xml(make_facturx_pdf('AUD-004')))
+
+        try:
+            db.configure_backend('sqlite', str(root / 'factur_x.sqlite3'))
+            with db_cursor(commit=True) as (_conn, cursor):
+                cursor.execute(
+                    """INSERT INTO sent_invoices (invoice_num, company_name, company_siret, xml_facture, pdf_path,
+                                                  invoice_date)
+                       VALUES ('AUD-005', 'ACME', '12345678901234', '<x/>', %s, '2026-02-10')""",
+                    (str(root / 'ailleurs' / 'AUD-005.pdf'),),
+                )
+
+            stats = audit_archives(pdf_dir, xml_dir, workers=2, chunk_size=2)
+            assert (stats['scanned'], stats['audited'], stats['unchanged']) == (5, 5, 0), stats
+            assert (stats['ok'], stats['error'], stats['missing']) == (2, 2, 1), stats
+
+            row = _row('AUD-001')
+            assert row['status'] == 'OK' and row['invoice_num'] == 'AUD-001' and row['xsd'] and row['pdfa']
+            assert row['schematron'] == (True if schematron_available() else None)
+            assert 'consistency' in _row('AUD-002')['errors'] and _row('AUD-003')['pdfa'] is False
+            assert _row('AUD-004')['status'] == 'OK' and _row('AUD-004')['pdfa'] is None
+            assert _row('AUD-005')['status'] == 'MISSING'
+            assert [f['doc_key'] for f in audit_failures()] == ['AUD-002', 'AUD-003', 'AUD-005']
+
+            stats = audit_archives(pdf_dir, xml_dir, workers=2, chunk_size=2)
+            assert (stats['audited'], stats['unchanged']) == (0, 5), stats
+
+            (xml_dir / 'AUD-002.xml').write_bytes(extract_facturx_xml(make_facturx_pdf('AUD-002')))
+            stats = audit_archives(pdf_dir, xml_dir, workers=1)
+            assert (stats['audited'], stats['ok']) == (1, 1) and _row('AUD-002')['status'] == 'OK'
+            assert audit_archives(pdf_dir, xml_dir, workers=1, force=True)['audited'] == 5
+        finally:
+            db.configure_backend('postgresql')
+    print("[OK] test_audit_archives_and_cache")
+
+
+def test_xml_rules():
+    """XSD du profil détecté ; règles EN16931 (Schematron) si saxonche est installé."""
+    xml = extract_facturx_xml(make_facturx_pdf('AUD-001'))
+    result = check_facturx_xml(xml)
+    assert result['xsd_valid'] and result['level'] == 'en16931' and result['errors'] == []
+
+    wrong_total = xml.replace(b'<ram:GrandTotalAmount>', b'<ram:GrandTotalAmount>1', 1)
+    result = check_facturx_xml(wrong_total)
+    assert result['xsd_valid']
+    if schematron_available():
+        assert result['schematron_valid'] is False
+        assert any(e['message'].startswith('BR-CO-15') for e in result['errors'])
+
+    result = check_facturx_xml(xml.replace(b'<rsm:ExchangedDocument>', b'<rsm:ExchangedDocument><ram:Inconnu/>', 1))
+    assert result['xsd_valid'] is False and result['errors'][0]['check'] == 'xsd'
+    print("[OK] test_xml_rules")
+
+
+if __name__ == '__main__':
+    test_pdf_structure()
+    test_audit_archives_and_cache()
+    test_xml_rules()
+    print("\nTous les tests d'audit sont passés.")
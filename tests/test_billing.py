@@ -0,0 +1,124 @@
+"""
+Tests de la facturation récurrente (modèles par client, runs journalisés et reprise), sur base SQLite temporaire.
+
+Usage: uv run python tests/test_billing.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import app as app_module
+from test_api_invoices import _ApiEnvironment
+from utils.billing import (
+    BillingError, build_run_invoice, checkpoint_item, claim_run_items, create_billing_run, execute_billing_run,
+    parse_billing_template, run_failures, run_progress, save_billing_template,
+)
+from utils.db import db_cursor
+
+TEMPLATE = {
+    'invoice': {'type_code': '380', 'currency_code': 'EUR', 'payment_terms': 'Prélèvement à 30 jours'},
+    'lines': [
+        {'description': 'Abonnement {period}', 'quantity': 1, 'unit_price_ht': '49.00', 'vat_rate': 20},
+        {'description': 'Support', 'quantity': 2, 'unit_price_ht': '15', 'vat_rate': 20},
+    ],
+    'due_days': 30,
+}
+
+
+def _add_client(siret: str, name: str) -> None:
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            """INSERT INTO client_metadata (recipient_name, recipient_siret, recipient_address,
+                                            recipient_postal_code, recipient_city)
+               VALUES (%s, %s, '1 rue du Test', '75001', 'Paris')""",
+            (name, siret),
+        )
+
+
+def _sent_invoice_numbers() -> list[str]:
+    with db_cursor() as (_conn, cursor):
+        cursor.execute("SELECT invoice_num FROM sent_invoices ORDER BY invoice_num")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_template_and_run_invoice():
+    """Modèle vérifié à l'enregistrement ; période et échéance résolues à la création du run."""
+    template = parse_billing_template(TEMPLATE)
+    assert template['lines']['description'] == ['Abonnement {period}', 'Support']
+
+    for bad in ([], {'lines': []}, {**TEMPLATE, 'due_days': -1}, {**TEMPLATE, 'invoice': 'x'},
+                {'lines': [{'description': '', 'quantity': 1, 'unit_price_ht': 1}]}):
+        try:
+            parse_billing_template(bad)
+        except BillingError:
+            continue
+        raise AssertionError(f"modèle accepté : {bad}")
+
+    client = {'recipient_name': 'ACME', 'recipient_siret': '12345678901234', 'recipient_country_code': 'FR'}
+    payload = build_run_invoice(template, client, '2026-10-01', '2026-10')
+    assert payload['invoice']['due_date'] == '2026-10-31' and payload['invoice']['recipient_name'] == 'ACME'
+    assert payload['invoice']['payment_terms'] == 'Prélèvement à 30 jours'
+    assert payload['lines'][0]['description'] == 'Abonnement 2026-10' and payload['lines'][1]['quantity'] == '2'
+    print("[OK] test_template_and_run_invoice")
+
+
+def test_run_resumes_after_interruption():
+    """Run interrompu : reprise aux éléments non terminés, sans doublon ni numéro perdu, sur 2 processus."""
+    with _ApiEnvironment():
+        for index in range(5):
+            siret = f'1000000000000{index}'
+            _add_client(siret, f'Client {index}')
+            save_billing_template(siret, 'Abonnement', TEMPLATE)
+        _add_client('2000000000000', 'Client inactif')
+        save_billing_template('2000000000000', 'Abonnement', TEMPLATE, active=False)
+        _add_client('123', 'SIRET invalide')
+        save_billing_template('123', 'Abonnement', TEMPLATE)
+        try:
+            save_billing_template('99999999999999', 'Abonnement', TEMPLATE)
+        except BillingError:
+            pass
+        else:
+            raise AssertionError("modèle d'un client inconnu accepté")
+
+        assert create_billing_run('2026-10', '2026-10', '2026-10-01') is True
+        assert create_billing_run('2026-10', '2026-10', '2026-11-01') is False
+        assert run_progress('2026-10')['total'] == 6
+
+        # Interruption : un élément terminé, un émis mais pas encore marqué, un réservé
+        (first, first_payload), (second, second_payload), _third = claim_run_items('2026-10', 3)
+        checkpoint_item('2026-10', first, **app_module.issue_billing_item('2026-10', first, first_payload))
+        issued_before_crash = app_module.issue_billing_item('2026-10', second, second_payload)['invoice_num']
+        with db_cursor(commit=True) as (_conn, cursor):
+            cursor.execute("UPDATE billing_run_items SET claimed_at = claimed_at - 1000 WHERE status = 'CLAIMED'")
+        assert len(_sent_invoice_numbers()) == 2
+
+        reports = []
+        stats = execute_billing_run('2026-10', app_module.issue_billing_item, workers=2, batch_size=2,
+                                    progress=reports.append, poll_interval=0.05)
+        assert (stats['issued'], stats['failed'], stats['pending'], stats['claimed']) == (5, 1, 0, 0)
+        assert stats['status'] == 'PARTIAL' and reports
+        numbers = _sent_invoice_numbers()
+        assert len(numbers) == 5 and [n[-4:] for n in numbers] == ['0001', '0002', '0003', '0004', '0005']
+
+        with db_cursor() as (_conn, cursor):
+            cursor.execute("SELECT invoice_num FROM billing_run_items WHERE run_id = %s AND template_id = %s",
+                           ('2026-10', second))
+            assert cursor.fetchone()[0] == issued_before_crash
+        failures = run_failures('2026-10')
+        assert failures[0]['client_siret'] == '123' and 'SIRET' in failures[0]['error']
+
+        # Relance : rien à émettre ; --retry-failed rejoue l'élément en erreur
+        assert execute_billing_run('2026-10', app_module.issue_billing_item, workers=1)['issued'] == 5
+        stats = execute_billing_run('2026-10', app_module.issue_billing_item, workers=1, retry_failed=True)
+        assert stats['failed'] == 1 and run_failures('2026-10')[0]['attempts'] == 2
+        assert len(_sent_invoice_numbers()) == 5
+    print("[OK] test_run_resumes_after_interruption")
+
+
+if __name__ == '__main__':
+    test_template_and_run_invoice()
+    test_run_resumes_after_interruption()
+    print("\nTous les tests de facturation récurrente sont passés.")
@@ -0,0 +1,181 @@
+"""
+Tests du routage des lectures vers le réplica (pool et connexions simulés, sans base).
+
+Usage: uv run python tests/test_db_replica.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import psycopg2
+
+import utils.db as db
+
+
+class FakeConnection:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+        self.readonly = None
+        self.rollbacks = 0
+
+    def set_session(self, readonly=None, autocommit=None):
+        self.readonly = readonly
+
+    def cursor(self, name=None):
+        return FakeCursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def commit(self):
+        raise AssertionError("commit sur une connexion de lecture")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    closed = False
+    itersize = None
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.out = 0
+        self.returned = []
+
+    def getconn(self):
+        if self.fail:
+            raise psycopg2.OperationalError("connexion refusée")
+        self.out += 1
+        return FakeConnection('replica')
+
+    def putconn(self, conn, close=False):
+        self.out -= 1
+        self.returned.append((conn, close))
+
+
+def _setup(pool, lag=0.0, configured=True):
+    """Remplace pool, primaire et mesure du retard ; retourne les connexions primaires ouvertes."""
+    primaries = []
+
+    def primary():
+        conn = FakeConnection('primary')
+        primaries.append(conn)
+        return conn
+
+    checks = []
+
+    def fake_lag(conn):
+        checks.append(conn)
+        return lag
+
+    db._get_replica_pool = lambda: pool
+    db.get_db_connection = primary
+    db.replica_lag = fake_lag
+    db._REPLICA_STATE.update(checked_at=None, usable=False, lag=None, error=None)
+    if configured:
+        os.environ['DB_REPLICA_URL'] = 'replica.local'
+    else:
+        os.environ.pop('DB_REPLICA_URL', None)
+    return primaries, checks
+
+
+_ORIGINALS = (db._get_replica_pool, db.get_db_connection, db.replica_lag)
+
+
+def _restore():
+    db._get_replica_pool, db.get_db_connection, db.replica_lag = _ORIGINALS
+    os.environ.pop('DB_REPLICA_URL', None)
+
+
+def test_readonly_uses_replica():
+    """Réplica à jour : connexion du pool, lecture seule, rendue au pool ; l'état est mis en cache."""
+    pool = FakePool()
+    try:
+        primaries, checks = _setup(pool, lag=0.5)
+        for _ in range(3):
+            with db.db_cursor(readonly=True) as (conn, _cursor):
+                assert conn.name == 'replica' and conn.readonly is True
+        assert pool.out == 0 and not primaries
+        assert len(checks) == 1  # retard mesuré une fois par intervalle
+        with db.db_server_cursor('t', replica=True) as (conn, cursor):
+            assert conn.name == 'replica' and cursor.itersize == 2000
+        assert pool.out == 0
+    finally:
+        _restore()
+    print("[OK] test_readonly_uses_replica")
+
+
+def test_stale_or_down_replica_falls_back():
+    """Réplica en retard ou injoignable : lecture sur le primaire, sans réessayer à chaque requête."""
+    pool = FakePool()
+    try:
+        primaries, checks = _setup(pool, lag=60)
+        for _ in range(2):
+            with db.db_cursor(readonly=True) as (conn, _cursor):
+                assert conn.name == 'primary' and conn.readonly is True
+        assert len(checks) == 1 and pool.out == 0
+        assert all(c.closed for c in primaries)
+        assert db.replica_status()['usable'] is False
+
+        down = FakePool(fail=True)
+        primaries, checks = _setup(down)
+        with db.db_cursor(readonly=True) as (conn, _cursor):
+            assert conn.name == 'primary'
+        assert db._REPLICA_STATE['error'] and not checks
+    finally:
+        _restore()
+    print("[OK] test_stale_or_down_replica_falls_back")
+
+
+def test_without_replica_and_writes():
+    """Sans DB_REPLICA_URL, ou en écriture, tout passe par le primaire."""
+    pool = FakePool()
+    try:
+        primaries, _checks = _setup(pool, configured=False)
+        with db.db_cursor(readonly=True) as (conn, _cursor):
+            assert conn.name == 'primary'
+        assert db.replica_status()['configured'] is False
+
+        _setup(pool)
+        with db.db_cursor() as (conn, _cursor):
+            assert conn.name == 'primary' and conn.readonly is None
+        assert pool.out == 0 and not pool.returned
+    finally:
+        _restore()
+    print("[OK] test_without_replica_and_writes")
+
+
+def test_error_in_body_returns_connection():
+    """Une erreur pendant la lecture rend la connexion au pool et se propage."""
+    pool = FakePool()
+    try:
+        _setup(pool)
+        try:
+            with db.db_cursor(readonly=True):
+                raise RuntimeError("requête en échec")
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("erreur masquée")
+        assert pool.out == 0 and pool.returned[-1][0].rollbacks == 1
+    finally:
+        _restore()
+    print("[OK] test_error_in_body_returns_connection")
+
+
+if __name__ == '__main__':
+    test_readonly_uses_replica()
+    test_stale_or_down_replica_falls_back()
+    test_without_replica_and_writes()
+    test_error_in_body_returns_connection()
+    print("\nTous les tests du réplica sont passés.")
@@ -0,0 +1,207 @@
+"""
+Tests du backend SQLite embarqué (fichier temporaire, sans serveur de base).
+
+Usage: uv run python tests/test_db_sqlite.py
+"""
+
+import copy
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import app as app_module
+import utils.db as db
+import utils.db_sqlite as db_sqlite
+from facturx_fixtures import SAMPLE_DATA
+from utils.facturx_generator import generate_facturx_xml
+from utils.invoice_calc import calculate_invoice_totals
+
+
+def _use_sqlite(tmp):
+    db.configure_backend('sqlite', str(Path(tmp) / 'factur_x.sqlite3'))
+
+
+def _restore():
+    db.configure_backend('postgresql')
+
+
+def _insert_invoice(invoice_num, recipient_name='ACME Corporation', description='Ramettes papier A4'):
+    data = copy.deepcopy(SAMPLE_DATA)
+    data['invoice']['invoice_number'] = invoice_num
+    data['invoice']['recipient_name'] = recipient_name
+    data['lines'][0]['description'] = description
+    totals = calculate_invoice_totals(data['lines'])
+    with db.db_connection() as conn:
+        db.lock_sent_invoices(conn)
+        app_module.insert_sent_invoice(
+            conn, invoice_num=invoice_num, company_name=recipient_name,
+            company_siret=data['invoice']['recipient_siret'], xml_content=generate_facturx_xml(data),
+            pdf_path=f'./data/factures-pdf/{invoice_num}.pdf', invoice_date=data['invoice']['issue_date'],
+            total_ttc=float(totals['total_ttc']), vat_breakdown=totals['vat_breakdown'],
+        )
+        conn.commit()
+
+
+def test_translate_sql():
+    """Paramètres psycopg2 (%s, %%) traduits au style SQLite."""
+    sql = db_sqlite.translate_sql("SELECT * FROM t WHERE a = %s AND b LIKE 'FAC-%%' AND c IN (%s, %s)")
+    assert sql == "SELECT * FROM t WHERE a = ? AND b LIKE 'FAC-%' AND c IN (?, ?)"
+    print("[OK] test_translate_sql")
+
+
+def test_schema_wal_and_types():
+    """Schéma appliqué à la première connexion, WAL, mêmes types Python que psycopg2."""
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            _use_sqlite(tmp)
+            with db.db_cursor() as (_conn, cursor):
+                cursor.execute("PRAGMA journal_mode")
+                assert cursor.fetchone()[0] == 'wal'
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                tables = {row[0] for row in cursor.fetchall()}
+            assert {'sent_invoices', 'incoming_invoices', 'client_metadata', 'invoice_vat_breakdown',
+                    'invoice_events', 'pdp_sync_state', 'client_metadata_fts', 'invoice_search_fts'} <= tables
+
+            _insert_invoice('FAC-2026-02-0001')
+            with db.db_cursor(readonly=True) as (_conn, cursor):
+                cursor.execute(
+                    "SELECT invoice_date, due_date, total_ttc, total_ht, created_at, fields_extracted_at, status "
+                    "FROM sent_invoices WHERE invoice_num = %s", ('FAC-2026-02-0001',),
+                )
+                invoice_date, due_date, total_ttc, total_ht, created_at, extracted_at, status = cursor.fetchone()
+                cursor.execute("SELECT vat_rate, base_ht FROM invoice_vat_breakdown ORDER BY vat_rate")
+                vat_rows = cursor.fetchall()
+            assert invoice_date == date(2026, 2, 10) and due_date == date(2026, 3, 10)
+            assert total_ttc == Decimal('117.3') and total_ht == Decimal('105')
+            assert isinstance(created_at, datetime) and created_at.tzinfo is not None
+            assert extracted_at is not None and status == 'PENDING'
+            assert vat_rows == [(Decimal('5.5'), Decimal('60')), (Decimal('20'), Decimal('45'))]
+
+            # Lecture seule : écriture refusée
+            try:
+                with db.db_cursor(readonly=True) as (_conn, cursor):
+                    cursor.execute("DELETE FROM sent_invoices")
+            except sqlite3.OperationalError:
+                pass
+            else:
+                raise AssertionError("écriture acceptée en lecture seule")
+        finally:
+            _restore()
+    print("[OK] test_schema_wal_and_types")
+
+
+def test_numbering_lock():
+    """Le verrou de numérotation bloque un second émetteur, pas les lectures (WAL)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        timeout = db_sqlite.BUSY_TIMEOUT
+        try:
+            _use_sqlite(tmp)
+            _insert_invoice('FAC-2026-02-0001')
+            db_sqlite.BUSY_TIMEOUT = 0.1
+            with db.db_connection() as conn:
+                db.lock_sent_invoices(conn)
+                assert app_module.get_next_invoice_number(conn).endswith('-0002')
+
+                with db.db_cursor(readonly=True) as (_other, cursor):
+                    cursor.execute("SELECT COUNT(*) FROM sent_invoices")
+                    assert cursor.fetchone()[0] == 1
+                try:
+                    with db.db_connection() as other:
+                        db.lock_sent_invoices(other)
+                except sqlite3.OperationalError as e:
+                    assert 'locked' in str(e)
+                else:
+                    raise AssertionError("second verrou accordé")
+                conn.rollback()
+        finally:
+            db_sqlite.BUSY_TIMEOUT = timeout
+            _restore()
+    print("[OK] test_numbering_lock")
+
+
+def test_client_directory_and_dashboard():
+    """Clients enregistrés depuis step1, recherche FTS5, KPI et filtre q du dashboard."""
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = {key: app_module.CONFIG.get(key) for key in ('is_db_pg', 'is_db_sqlite')}
+        try:
+            _use_sqlite(tmp)
+            app_module.CONFIG.update(is_db_pg=False, is_db_sqlite=True)
+            app_module.app.config['TESTING'] = True
+            client = app_module.app.test_client()
+
+            form = {
+                'invoice_number': 'TEST-001', 'type_code': '380', 'currency_code': 'EUR',
+                'issue_date': '2026-02-18', 'recipient_name': 'Société Générale des Eaux',
+                'recipient_siret': '12345678901234', 'recipient_country_code': 'FR',
+                'save_new_client': '1',
+            }
+            with client.session_transaction() as sess:
+                sess['next_invoice_number'] = 'FAC-2026-02-0001'
+            assert client.post('/invoice/step1', data=form).get_json() == {'success': True}
+            resp = client.post('/invoice/step1', data=form).get_json()
+            assert resp.get('client_exists') is True
+
+            for q, expected in (('societe gen', 1), ('EAUX', 1), ('123456', 1), ('ramette', 0)):
+                results = client.get(f'/api/clients/search?q={q}').get_json()['results']
+                assert len(results) == expected, (q, results)
+            assert results == [] and client.get('/api/clients/count').get_json() == {'count': 1}
+
+            _insert_invoice('FAC-2026-02-0001')
+            _insert_invoice('FAC-2026-02-0002', recipient_name='Durand SARL', description='Cartouches encre')
+            stats = client.get('/api/dashboard/stats').get_json()
+            assert stats['generated'] == 2 and stats['received'] == 0
+
+            page = client.get('/api/dashboard/invoices?tab=sent&q=cartouche').get_json()
+            assert page['total'] == 1 and page['invoices'][0]['invoice_num'] == 'FAC-2026-02-0002'
+            assert page['invoices'][0]['total_ttc'] == 117.3
+            page = client.get('/api/dashboard/invoices?tab=sent&vat_number=FR12345678901').get_json()
+            assert page['total'] == 2 and page['invoices'][0]['invoice_date'] == '2026-02-10'
+        finally:
+            app_module.CONFIG.update(saved)
+            _restore()
+    print("[OK] test_client_directory_and_dashboard")
+
+
+def test_invoice_number_registry():
+    """Un numéro déjà attribué (même à une autre date, autre partition) fait échouer l'émission."""
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            _use_sqlite(tmp)
+            _insert_invoice('FAC-2026-02-0001')
+            # Numéro émis l'an passé, dont la ligne vit dans une autre partition de sent_invoices
+            with db.db_cursor(commit=True) as (_conn, cursor):
+                cursor.execute(
+                    "INSERT INTO invoice_numbers (invoice_num, invoice_date) VALUES (%s, %s)",
+                    ('FAC-2025-02-0001', '2025-02-10'),
+                )
+            for number in ('FAC-2026-02-0001', 'FAC-2025-02-0001'):
+                try:
+                    _insert_invoice(number)
+                except sqlite3.IntegrityError:
+                    pass
+                else:
+                    raise AssertionError(f"numéro {number} attribué deux fois")
+            with db.db_cursor(readonly=True) as (_conn, cursor):
+                cursor.execute("SELECT invoice_num FROM sent_invoices ORDER BY invoice_num")
+                assert [row[0] for row in cursor.fetchall()] == ['FAC-2026-02-0001']
+                cursor.execute("SELECT invoice_num, invoice_date FROM invoice_numbers ORDER BY invoice_num")
+                assert cursor.fetchall() == [('FAC-2025-02-0001', date(2025, 2, 10)),
+                                             ('FAC-2026-02-0001', date(2026, 2, 10))]
+        finally:
+            _restore()
+    print("[OK] test_invoice_number_registry")
+
+
+if __name__ == '__main__':
+    test_translate_sql()
+    test_schema_wal_and_types()
+    test_numbering_lock()
+    test_client_directory_and_dashboard()
+    test_invoice_number_registry()
+    print("\nTous les tests du backend SQLite sont passés.")
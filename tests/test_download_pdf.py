@@ -0,0 +1,122 @@
+"""
+Tests du service des PDF archivés : ETag fort, 304, Range et délégation proxy.
+
+Usage: uv run python tests/test_download_pdf.py
+"""
+
+import hashlib
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flask import Flask
+
+from utils.download import accel_redirect_path, send_archived_pdf, compute_file_hash
+
+PDF_CONTENT = b'%PDF-1.7\n' + b'0123456789' * 100 + b'\n%%EOF\n'
+
+
+def make_app(pdf_path: str, offload: str = 'none') -> Flask:
+    """Crée une application minimale servant un seul PDF."""
+    test_app = Flask(__name__)
+    test_app.config['TESTING'] = True
+    locations = [(str(Path(pdf_path).parent), '/protected/')]
+
+    @test_app.route('/pdf')
+    def pdf():
+        return send_archived_pdf(pdf_path, 'facture.pdf', offload=offload, accel_locations=locations)
+
+    return test_app
+
+
+def write_pdf(directory: str) -> str:
+    path = Path(directory) / 'facture.pdf'
+    path.write_bytes(PDF_CONTENT)
+    return str(path)
+
+
+def test_strong_etag_is_content_hash():
+    """L'ETag est le SHA-256 du fichier, identique après réécriture du même contenu."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_pdf(tmp)
+        client = make_app(pdf_path).test_client()
+
+        resp = client.get('/pdf')
+        assert resp.status_code == 200
+        assert resp.data == PDF_CONTENT
+        expected = hashlib.sha256(PDF_CONTENT).hexdigest()
+        assert resp.headers['ETag'] == f'"{expected}"'
+
+        # Régénération à l'identique : même ETag
+        Path(pdf_path).write_bytes(PDF_CONTENT)
+        assert compute_file_hash(pdf_path) == expected
+    print("[OK] test_strong_etag_is_content_hash")
+
+
+def test_if_none_match_returns_304():
+    """Un If-None-Match correspondant retourne 304 sans corps."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_pdf(tmp)
+        for offload in ('none', 'x-accel-redirect'):
+            client = make_app(pdf_path, offload).test_client()
+            etag = client.get('/pdf').headers['ETag']
+            resp = client.get('/pdf', headers={'If-None-Match': etag})
+            assert resp.status_code == 304, f"{offload}: attendu 304, recu {resp.status_code}"
+            assert resp.data == b''
+    print("[OK] test_if_none_match_returns_304")
+
+
+def test_range_request():
+    """Une requête Range retourne 206 et la portion demandée."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_pdf(tmp)
+        client = make_app(pdf_path).test_client()
+
+        resp = client.get('/pdf', headers={'Range': 'bytes=0-8'})
+        assert resp.status_code == 206, f"Attendu 206, recu {resp.status_code}"
+        assert resp.data == PDF_CONTENT[:9]
+        assert resp.headers['Content-Range'] == f'bytes 0-8/{len(PDF_CONTENT)}'
+    print("[OK] test_range_request")
+
+
+def test_offload_headers():
+    """En mode délégation, le corps est vide et l'en-tête proxy est posé."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_pdf(tmp)
+
+        resp = make_app(pdf_path, 'x-accel-redirect').test_client().get('/pdf')
+        assert resp.status_code == 200
+        assert resp.data == b''
+        assert resp.headers['X-Accel-Redirect'] == '/protected/facture.pdf'
+
+        resp = make_app(pdf_path, 'x-sendfile').test_client().get('/pdf')
+        assert resp.headers['X-Sendfile'] == str(Path(pdf_path).resolve())
+    print("[OK] test_offload_headers")
+
+
+def test_accel_redirect_path():
+    """Chemin relatif au stockage qui contient le fichier, même hors du répertoire courant."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / 'pdf' / 'dupont').mkdir(parents=True)
+        locations = [(str(root / 'dupont-pdf'), '/protected-dupont'), (str(root / 'pdf'), '/protected/')]
+        assert accel_redirect_path(str(root / 'pdf' / 'dupont' / 'F 1.pdf'), locations) == '/protected/dupont/F 1.pdf'
+        assert accel_redirect_path(str(root / 'dupont-pdf' / 'F1.pdf'), locations) == '/protected-dupont/F1.pdf'
+        try:
+            accel_redirect_path(str(root / 'ailleurs' / 'F1.pdf'), locations)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("ValueError attendue hors des stockages")
+    print("[OK] test_accel_redirect_path")
+
+
+if __name__ == '__main__':
+    test_strong_etag_is_content_hash()
+    test_if_none_match_returns_304()
+    test_range_request()
+    test_offload_headers()
+    test_accel_redirect_path()
+    print("\n=== Tous les tests téléchargement PDF OK ===")
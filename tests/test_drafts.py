@@ -0,0 +1,145 @@
+"""
+Tests des brouillons de facture côté serveur (stockage disque, assistant step1 -> step3).
+
+Usage: uv run python tests/test_drafts.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as app_module
+from utils.drafts import DraftStore, is_valid_draft_id, new_draft_id
+
+STEP1_DATA = {
+    'invoice_number': 'BROUILLON-001',
+    'type_code': '380',
+    'currency_code': 'EUR',
+    'issue_date': '2026-02-18',
+    'recipient_name': 'Client Brouillon SARL',
+    'recipient_siret': '12345678901234',
+    'recipient_country_code': 'FR',
+}
+
+
+def _lines_form(count: int) -> dict:
+    form = {}
+    for i in range(count):
+        form.update({
+            f'lines[{i}][description]': f'Prestation de conseil numéro {i + 1}',
+            f'lines[{i}][quantity]': '2',
+            f'lines[{i}][unit_price_ht]': '15.5',
+            f'lines[{i}][vat_rate]': '20',
+            f'lines[{i}][discount_type]': 'percent',
+        })
+    return form
+
+
+def test_store_roundtrip_and_ids():
+    """Création, mise à jour partielle, liste des brouillons non finalisés, identifiants sûrs."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = DraftStore(tmp)
+        first, second = new_draft_id(), new_draft_id()
+        assert is_valid_draft_id(first) and first != second
+        assert not is_valid_draft_id('../../etc/passwd') and store.load('../x') is None
+
+        store.update(first, invoice_data={'invoice_number': 'A-1', 'recipient_name': 'ACME'}, step=2)
+        store.update(first, lines=[{'description': 'x'}] * 3)
+        draft = store.load(first)
+        assert draft['invoice_data']['invoice_number'] == 'A-1' and len(draft['lines']) == 3
+        assert draft['created_at'] <= draft['updated_at']
+
+        store.update(second, invoice_data={'invoice_number': 'A-2'}, invoice_summary={'x': 1}, step=3)
+        pending = store.list_pending()
+        assert [d['id'] for d in pending] == [first] and pending[0]['line_count'] == 3
+
+        old = time.time() - 40 * 86400
+        os.utime(Path(tmp) / f'{first}.json', (old, old))
+        assert store.purge() == 1 and store.load(first) is None
+        assert store.delete(second) and not store.delete(second)
+        assert not list(Path(tmp).glob('.draft-*'))
+    print("[OK] test_store_roundtrip_and_ids")
+
+
+def test_wizard_keeps_cookie_small():
+    """100 lignes : récapitulatif stocké côté serveur, cookie limité à l'identifiant du brouillon."""
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_config = {key: app_module.CONFIG.get(key)
+                        for key in ('is_db_pg', 'is_num_facturx_auto', 'xml_storage', 'pdf_storage')}
+        saved_drafts = app_module.DRAFTS
+        try:
+            for name in ('xml', 'pdf'):
+                (Path(tmp) / name).mkdir()
+            app_module.CONFIG.update(is_db_pg=False, is_num_facturx_auto=False,
+                                     xml_storage=str(Path(tmp) / 'xml'), pdf_storage=str(Path(tmp) / 'pdf'))
+            app_module.DRAFTS = DraftStore(str(Path(tmp) / 'drafts'))
+            app_module.app.config['TESTING'] = True
+            client = app_module.app.test_client()
+
+            assert client.post('/invoice/step1', data=STEP1_DATA).get_json()['success'] is True
+            resp = client.post('/invoice', data=_lines_form(100))
+            assert resp.get_json() == {'success': True, 'redirect': '/invoice/step3'}, resp.get_json()
+
+            with client.session_transaction() as sess:
+                assert set(sess.keys()) == {'draft_id'}
+                draft_id = sess['draft_id']
+            cookie = client.get_cookie('session')
+            assert len(cookie.value) < 200, len(cookie.value)
+
+            draft = app_module.DRAFTS.load(draft_id)
+            assert len(draft['lines']) == 100 and len(draft['invoice_summary']['lines']) == 100
+            step3 = client.get('/invoice/step3')
+            assert step3.status_code == 200 and b'BROUILLON-001' in step3.data
+            assert client.get('/invoice/download-pdf').status_code == 200
+
+            # Facture suivante : nouveau brouillon, le précédent (finalisé) est supprimé
+            client.get('/invoice/new')
+            assert app_module.DRAFTS.load(draft_id) is None
+        finally:
+            app_module.CONFIG.update(saved_config)
+            app_module.DRAFTS = saved_drafts
+    print("[OK] test_wizard_keeps_cookie_small")
+
+
+def test_resume_draft():
+    """Un brouillon interrompu à l'étape 2 est repris depuis une autre session, lignes comprises."""
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_config = {key: app_module.CONFIG.get(key) for key in ('is_db_pg', 'is_num_facturx_auto')}
+        saved_drafts = app_module.DRAFTS
+        try:
+            app_module.CONFIG.update(is_db_pg=False, is_num_facturx_auto=False)
+            app_module.DRAFTS = DraftStore(tmp)
+            app_module.app.config['TESTING'] = True
+            draft_id = new_draft_id()
+            app_module.DRAFTS.update(draft_id, invoice_data={**STEP1_DATA, 'due_date': ''}, step=2,
+                                     lines=[{'description': 'Ligne enregistrée', 'quantity': '1',
+                                             'unit_price_ht': '10', 'vat_rate': '20'}])
+
+            client = app_module.app.test_client()
+            drafts = client.get('/api/drafts').get_json()['drafts']
+            assert [d['id'] for d in drafts] == [draft_id]
+            assert b'Client Brouillon SARL' in client.get('/invoice/step1').data
+
+            resp = client.get(f'/invoice/draft/{draft_id}')
+            assert resp.status_code == 302 and resp.headers['Location'].endswith('/invoice/step2')
+            step2 = client.get('/invoice/step2')
+            assert step2.status_code == 200 and b'Ligne enregistr' in step2.data
+
+            assert client.delete(f'/api/drafts/{draft_id}').get_json() == {'success': True}
+            assert client.get('/invoice/step2').status_code == 302
+            assert client.get('/invoice/draft/inconnu').status_code == 302
+        finally:
+            app_module.CONFIG.update(saved_config)
+            app_module.DRAFTS = saved_drafts
+    print("[OK] test_resume_draft")
+
+
+if __name__ == '__main__':
+    test_store_roundtrip_and_ids()
+    test_wizard_keeps_cookie_small()
+    test_resume_draft()
+    print("\nTous les tests des brouillons sont passés.")
@@ -0,0 +1,143 @@
+"""
+Tests du multi-émetteur (profils en base, cache LRU, numérotation et stockage par émetteur).
+
+Usage: uv run python tests/test_emitters.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import app as app_module
+import utils.db as db
+from facturx_fixtures import SAMPLE_DATA
+from test_api_invoices import INVOICE, _ApiEnvironment
+from utils.emitters import (
+    EmitterConfigError, EmitterNotFound, EmitterRegistry, save_emitter_profile,
+)
+from utils.facturx_generator import generate_facturx_xml, seller_party_xml
+
+PROFILE = {
+    'name': 'Cabinet Dupont', 'address': '3 place du Marché', 'postal_code': '69001', 'city': 'Lyon',
+    'siren': '123456789', 'siret': '12345678900017', 'num_tva': 'FR40123456789', 'bic': 'AGRIFRPP882',
+    'cie_legal_form': 'SAS', 'cie_IBAN': 'FR7612345678901234567890123',
+    'pmt_text': 'Indemnité forfaitaire de 40 € pour frais de recouvrement.',
+    'pmd_text': "Pénalités de retard : 3 fois le taux d'intérêt légal.",
+}
+
+
+def _expect(exception, call, *args, **kwargs):
+    try:
+        call(*args, **kwargs)
+    except exception as e:
+        return e
+    raise AssertionError(f"{exception.__name__} attendue")
+
+
+def test_seller_block():
+    """Bloc vendeur pré-sérialisé : XML identique à celui construit facture par facture."""
+    emitter = dict(SAMPLE_DATA['emitter'], name='Dupont & Fils <"Lyon">')
+    data = dict(SAMPLE_DATA, emitter=emitter)
+    xml = generate_facturx_xml(data)
+    assert generate_facturx_xml(dict(data, seller_xml=seller_party_xml(emitter))) == xml
+    assert xml.count('<ram:SellerTradeParty>') == 1 and 'Dupont &amp; Fils &lt;"Lyon"&gt;' in xml
+    print("[OK] test_seller_block")
+
+
+def test_registry_cache():
+    """Profils chargés à la demande, évincés au-delà de la taille du cache, rechargés s'ils changent."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        config = {'xml_storage': str(root / 'xml'), 'pdf_storage': str(root / 'pdf'), **PROFILE}
+        try:
+            db.configure_backend('sqlite', str(root / 'factur_x.sqlite3'))
+            for index, code in enumerate(('alpha', 'beta', 'gamma')):
+                save_emitter_profile(code, dict(PROFILE, name=f'Société {index}'), reserved_prefixes=['FAC'])
+            registry = EmitterRegistry(config, use_db=lambda: True, max_entries=2)
+
+            alpha = registry.get('alpha')
+            assert alpha.emitter['name'] == 'Société 0' and alpha.invoice_prefix == 'FAC-ALPHA'
+            assert alpha.storage_dir('pdf') == root / 'pdf' / 'alpha' and (root / 'xml' / 'alpha').is_dir()
+            assert registry.get('alpha') is alpha and alpha.seller_xml is alpha.seller_xml
+            assert alpha.page_layout(False) is alpha.page_layout(False) and alpha.page_layout(False)['logo']
+            registry.get('beta')
+            registry.get('gamma')
+            assert registry.cached_codes() == ['beta', 'gamma']
+            assert registry.get('alpha') is not alpha
+            assert registry.get(None) is registry.default and registry.default.emitter['siret'] == PROFILE['siret']
+
+            # Profil modifié : rechargé après le délai de rafraîchissement, inchangé : conservé
+            registry.refresh = 0
+            gamma = registry.get('gamma')
+            assert registry.get('gamma') is gamma
+            save_emitter_profile('gamma', dict(PROFILE, name='Gamma SA', invoice_prefix='GAM'))
+            gamma = registry.get('gamma')
+            assert gamma.emitter['name'] == 'Gamma SA' and gamma.invoice_prefix == 'GAM'
+
+            save_emitter_profile('beta', PROFILE, active=False)
+            _expect(EmitterNotFound, registry.get, 'beta')
+            _expect(EmitterNotFound, registry.get, 'inconnu')
+            assert 'beta' not in registry.cached_codes()
+
+            invalid = dict(PROFILE, siret='123', db_url='x')
+            errors = _expect(EmitterConfigError, save_emitter_profile, 'delta', invalid).errors
+            assert any('db_url' in error for error in errors) and any('SIRET' in error for error in errors)
+            _expect(EmitterConfigError, save_emitter_profile, 'delta', dict(PROFILE, invoice_prefix='gam'))
+            _expect(EmitterConfigError, save_emitter_profile, 'delta', dict(PROFILE, invoice_prefix='FAC'),
+                    reserved_prefixes=['FAC'])
+            _expect(EmitterConfigError, save_emitter_profile, 'Delta!', PROFILE)
+        finally:
+            db.configure_backend('postgresql')
+    print("[OK] test_registry_cache")
+
+
+def test_issue_per_emitter():
+    """Numérotation, stockage, clés d'idempotence et téléchargements propres à chaque émetteur."""
+    with _ApiEnvironment() as client:
+        app_module.EMITTERS.clear()
+        pdf_dir = Path(app_module.CONFIG['pdf_storage'])
+        save_emitter_profile('dupont', PROFILE, reserved_prefixes=[app_module.EMITTERS.default.invoice_prefix])
+        headers = {'X-Emitter': 'dupont', 'Idempotency-Key': 'commande-42'}
+
+        resp = client.post('/api/v1/invoices', json=INVOICE, headers=headers)
+        assert resp.status_code == 201, resp.get_json()
+        tenant = resp.get_json()['invoice']
+        assert tenant['invoice_number'].startswith('FAC-DUPONT-') and tenant['invoice_number'].endswith('-0001')
+        pdf = (pdf_dir / 'dupont' / f"{tenant['invoice_number']}.pdf").read_bytes()
+        assert tenant['pdf_url'].endswith('?emitter=dupont') and client.get(tenant['pdf_url']).data == pdf
+        xml = client.get(tenant['xml_url']).data
+        saved = app_module.CONFIG.get('pdf_offload')
+        app_module.CONFIG.update(pdf_offload='x-accel-redirect', pdf_accel_prefix='/protected/')
+        try:
+            accel = client.get(tenant['pdf_url']).headers['X-Accel-Redirect']
+        finally:
+            app_module.CONFIG['pdf_offload'] = saved
+        assert accel == f"/protected/dupont/{tenant['invoice_number']}.pdf"
+        assert PROFILE['siret'].encode() in xml and app_module.EMITTER['siret'].encode() not in xml
+
+        # Même clé, autre émetteur : facture distincte, numérotée dans la séquence par défaut
+        resp = client.post('/api/v1/invoices', json=INVOICE, headers={'Idempotency-Key': 'commande-42'})
+        assert resp.status_code == 201, resp.get_json()
+        default = resp.get_json()['invoice']
+        assert default['invoice_number'].startswith('FAC-2') and default['invoice_number'].endswith('-0001')
+        assert (pdf_dir / f"{default['invoice_number']}.pdf").is_file()
+
+        resp = client.post('/api/v1/invoices', json=INVOICE, headers=headers)
+        assert resp.status_code == 200 and resp.get_json()['invoice']['invoice_number'] == tenant['invoice_number']
+        resp = client.post('/api/v1/invoices', json=INVOICE, headers={'X-Emitter': 'dupont'})
+        assert resp.get_json()['invoice']['invoice_number'].endswith('-0002')
+
+        assert client.post('/api/v1/invoices', json=INVOICE, headers={'X-Emitter': 'absent'}).status_code == 404
+        assert client.get(f"/invoice/{tenant['invoice_number']}/xml").status_code == 404
+        app_module.EMITTERS.clear()
+    print("[OK] test_issue_per_emitter")
+
+
+if __name__ == '__main__':
+    test_seller_block()
+    test_registry_cache()
+    test_issue_per_emitter()
+    print("\nTous les tests multi-émetteur sont passés.")
@@ -0,0 +1,179 @@
+"""
+Tests des exports en flux (archive ZIP des factures, écritures FEC / CSV).
+
+Usage: uv run python tests/test_export.py
+"""
+
+import io
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import utils.export as export
+from utils.export import stream_invoices_zip, fec_entries, FEC_COLUMNS
+from utils.facturx_parser import parse_facturx_xml
+from utils.invoice_store import vat_rows_from_parsed
+
+ACCOUNTING_ROWS = [
+    ('FAC-2026-01-0001', date(2026, 1, 5), 'Client A', '12345678900011', 'S', Decimal('20.00'), Decimal('100.00'), Decimal('20.00'), '380'),
+    ('FAC-2026-01-0001', date(2026, 1, 5), 'Client A', '12345678900011', 'S', Decimal('5.50'), Decimal('10.00'), Decimal('0.55'), '380'),
+    ('FAC-2026-01-0002', date(2026, 1, 6), 'Client B', '98765432100022', 'E', Decimal('0.00'), Decimal('50.00'), Decimal('0.00'), None),
+]
+# Factures reçues de deux fournisseurs, même numéro et même date (ordre de iter_accounting_rows)
+HOMONYM_ROWS = [
+    ('F-0001', date(2026, 1, 8), 'Alpha', '11111111100011', 'S', Decimal('20.00'), Decimal('100.00'), Decimal('20.00'), '380'),
+    ('F-0001', date(2026, 1, 8), 'Beta', '22222222200022', 'S', Decimal('20.00'), Decimal('50.00'), Decimal('10.00'), '380'),
+]
+CREDIT_NOTE_ROWS = [
+    ('AV-2026-01-0003', date(2026, 1, 7), 'Client A', '12345678900011', 'S', Decimal('20.00'), Decimal('100.00'), Decimal('20.00'), '381'),
+]
+
+
+def _balances(entries) -> dict:
+    """(débit, crédit) par compte."""
+    totals = {}
+    for e in entries:
+        debit, credit = totals.get(e[4], (Decimal('0'), Decimal('0')))
+        totals[e[4]] = (debit + Decimal(e[11].replace(',', '.')), credit + Decimal(e[12].replace(',', '.')))
+    return totals
+
+
+def test_zip_stream_contents():
+    """L'archive produite en flux contient les PDF, les XML et la liste des manquants."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_a = Path(tmp) / 'FAC-2026-01-0001.pdf'
+        pdf_a.write_bytes(b'%PDF-1.7 ' + os.urandom(300_000))
+        pdf_b = Path(tmp) / 'FAC-2026-01-0002.pdf'
+        pdf_b.write_bytes(b'%PDF-1.7 B')
+
+        invoices = [
+            ('FAC-2026-01-0001', str(pdf_a), '<xml>A</xml>'),
+            ('FAC-2026-01-0002', str(pdf_b), '<xml>B</xml>'),
+            ('FAC/2026/0003', str(Path(tmp) / 'absent.pdf'), '<xml>C</xml>'),
+        ]
+
+        chunks = list(stream_invoices_zip(iter(invoices), chunk_size=64 * 1024))
+        assert len(chunks) > 1, "L'archive doit être émise en plusieurs blocs"
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+            names = zf.namelist()
+            assert 'FAC-2026-01-0001.pdf' in names
+            assert 'FAC-2026-01-0002.xml' in names
+            assert 'FAC_2026_0003.xml' in names
+            assert 'FAC_2026_0003.pdf' not in names
+            assert zf.read('FAC-2026-01-0001.pdf') == pdf_a.read_bytes()
+            assert zf.read('FAC-2026-01-0002.xml') == b'<xml>B</xml>'
+            assert 'FAC/2026/0003' in zf.read('MANQUANTS.txt').decode('utf-8')
+            assert zf.testzip() is None
+
+        # Factures reçues : même numéro chez deux fournisseurs, deux entrées distinctes
+        received = [
+            ('F-0001', str(pdf_b), '<xml>Alpha</xml>', '11111111100011'),
+            ('F-0001', str(pdf_b), '<xml>Beta</xml>', '22222222200022'),
+        ]
+        with zipfile.ZipFile(io.BytesIO(b''.join(stream_invoices_zip(iter(received))))) as zf:
+            names = zf.namelist()
+            assert len(names) == len(set(names)) == 4, names
+            assert zf.read('22222222200022_F-0001.xml') == b'<xml>Beta</xml>'
+    print("[OK] test_zip_stream_contents")
+
+
+def test_fec_entries_balanced():
+    """Chaque écriture FEC est équilibrée (débit = crédit) et le 411 porte le TTC."""
+    entries = list(fec_entries('sent', iter(ACCOUNTING_ROWS)))
+    assert all(len(e) == len(FEC_COLUMNS) for e in entries)
+
+    by_num = {}
+    for e in entries:
+        debit = Decimal(e[11].replace(',', '.'))
+        credit = Decimal(e[12].replace(',', '.'))
+        by_num.setdefault(e[2], [Decimal('0'), Decimal('0')])
+        by_num[e[2]][0] += debit
+        by_num[e[2]][1] += credit
+    assert len(by_num) == 2
+    for num, (debit, credit) in by_num.items():
+        assert debit == credit, f"Ecriture {num} desequilibree: {debit} != {credit}"
+
+    first = entries[0]
+    assert first[4] == '411000' and first[11] == '130,55' and first[6] == '12345678900011'
+    # Pas de ligne 44571 pour une TVA nulle
+    assert sum(1 for e in entries if e[4] == '445710') == 2
+
+    purchases = list(fec_entries('received', iter(ACCOUNTING_ROWS[:2])))
+    assert purchases[-1][4] == '401000' and purchases[-1][12] == '130,55'
+    print("[OK] test_fec_entries_balanced")
+
+
+def test_fec_credit_note_reversed():
+    """Un avoir (381) passe les comptes en sens inverse d'une facture, toujours équilibré."""
+    sale = _balances(fec_entries('sent', iter(CREDIT_NOTE_ROWS)))
+    assert sale['411000'] == (Decimal('0'), Decimal('120.00'))
+    assert sale['706000'] == (Decimal('100.00'), Decimal('0')) and sale['445710'] == (Decimal('20.00'), Decimal('0'))
+
+    purchase = list(fec_entries('received', iter(CREDIT_NOTE_ROWS)))
+    assert purchase[-1][4] == '401000' and purchase[-1][11] == '120,00' and purchase[-1][10].startswith('Avoir ')
+    assert _balances(purchase)['607000'] == (Decimal('0'), Decimal('100.00'))
+
+    # Facture et avoir de même montant : comptes soldés
+    both = _balances(fec_entries('sent', iter(ACCOUNTING_ROWS[:1] + CREDIT_NOTE_ROWS)))
+    assert all(debit == credit for debit, credit in both.values())
+    print("[OK] test_fec_credit_note_reversed")
+
+
+def test_fec_homonym_suppliers():
+    """Deux fournisseurs, même numéro et même date : deux écritures, chacune sur son fournisseur."""
+    entries = list(fec_entries('received', iter(HOMONYM_ROWS)))
+    thirds = [e for e in entries if e[4] == '401000']
+    assert [(e[2], e[6], e[12]) for e in thirds] == [
+        ('HA00000001', '11111111100011', '120,00'),
+        ('HA00000002', '22222222200022', '60,00'),
+    ]
+    for num in ('HA00000001', 'HA00000002'):
+        balances = _balances(e for e in entries if e[2] == num)
+        assert sum(d for d, _c in balances.values()) == sum(c for _d, c in balances.values())
+    print("[OK] test_fec_homonym_suppliers")
+
+
+def test_accounting_stream_csv():
+    """L'export CSV est émis par blocs avec HT/TVA/TTC par taux."""
+    original = export.iter_accounting_rows
+    export.iter_accounting_rows = lambda direction, date_from, date_to: iter(ACCOUNTING_ROWS)
+    try:
+        chunks = list(export.stream_accounting_export(['sent'], '2026-01-01', '2026-01-31', 'csv', flush_rows=1))
+        fec = b''.join(export.stream_accounting_export(['sent'], '2026-01-01', '2026-01-31', 'fec'))
+    finally:
+        export.iter_accounting_rows = original
+
+    assert len(chunks) == 3
+    lines = b''.join(chunks).decode('utf-8').splitlines()
+    assert lines[0].startswith('direction;invoice_num;type_code')
+    assert lines[1].startswith('sent;FAC-2026-01-0001;380;')
+    assert lines[1].endswith(';100.00;20.00;120.00')
+    assert fec.decode('iso-8859-15').splitlines()[0].split('\t') == FEC_COLUMNS
+    print("[OK] test_accounting_stream_csv")
+
+
+def test_vat_rows_from_incoming_xml():
+    """La ventilation TVA est extraite des XML Factur-X reçus."""
+    xml = (Path(__file__).resolve().parent.parent / 'data' / 'incoming-invoices' / 'facturx-IT-2026-0042.xml').read_bytes()
+    parsed = parse_facturx_xml(xml)
+    assert parsed['invoice_number'] == 'IT-2026-0042'
+    assert parsed['seller']['siret'] == '55443322100033'
+    assert vat_rows_from_parsed(parsed) == [('S', Decimal('20.00'), Decimal('1200.00'), Decimal('240.00'))]
+    print("[OK] test_vat_rows_from_incoming_xml")
+
+
+if __name__ == '__main__':
+    test_zip_stream_contents()
+    test_fec_entries_balanced()
+    test_fec_credit_note_reversed()
+    test_fec_homonym_suppliers()
+    test_accounting_stream_csv()
+    test_vat_rows_from_incoming_xml()
+    print("\n=== Tous les tests export OK ===")
@@ -0,0 +1,198 @@
+"""
+Tests de l'émission idempotente (empreinte du contenu, clés de requête, rejeu sans rendu).
+
+Usage: uv run python tests/test_idempotency.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import app as app_module
+import utils.db as db
+import utils.idempotency as idempotency
+from test_api_invoices import INVOICE, _ApiEnvironment
+from utils.drafts import DraftStore
+from utils.invoice_input import invoice_data_from_payload
+from utils.invoice_lines import columns_to_lines, line_columns_from_payload
+from utils.idempotency import (
+    IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, invoice_content_hash,
+)
+
+HEADER = {'invoice_number': 'F-1', 'issue_date': '2026-02-18', 'recipient_name': 'ACME'}
+LINE = {'description': 'Conseil', 'quantity': '2', 'unit_price_ht': '10', 'vat_rate': '20'}
+
+
+class _CountingIssue:
+    """Compte les appels à issue_invoice (rendu effectif) pendant le bloc."""
+
+    def __enter__(self):
+        self.calls = 0
+        self.original = app_module.issue_invoice
+
+        def counting(*args, **kwargs):
+            self.calls += 1
+            return self.original(*args, **kwargs)
+
+        app_module.issue_invoice = counting
+        return self
+
+    def __exit__(self, *exc):
+        app_module.issue_invoice = self.original
+
+
+def test_content_hash():
+    """Empreinte stable aux espaces et écritures des nombres ; numéro ignoré en numérotation auto."""
+    reference = invoice_content_hash(HEADER, [LINE])
+    same = invoice_content_hash({**HEADER, 'recipient_name': ' ACME '},
+                                [{**LINE, 'quantity': '2.00', 'unit_price_ht': '10.0'}])
+    assert same == reference
+    assert invoice_content_hash(HEADER, [{**LINE, 'quantity': '3'}]) != reference
+    assert invoice_content_hash({**HEADER, 'invoice_number': 'F-2'}, [LINE]) != reference
+    assert (invoice_content_hash({**HEADER, 'invoice_number': 'F-2'}, [LINE], auto_numbering=True)
+            == invoice_content_hash(HEADER, [LINE], auto_numbering=True))
+    print("[OK] test_content_hash")
+
+
+def _exercise_store(store: IdempotencyStore):
+    assert store.claim('k', 'h1') is None
+    for content_hash, error in (('h1', IdempotencyInProgress), ('h2', IdempotencyConflict)):
+        try:
+            store.claim('k', content_hash)
+        except error:
+            pass
+        else:
+            raise AssertionError(f"{error.__name__} attendu")
+    store.complete('k', 'h1', {'invoice_number': 'F-1'})
+    if store.use_db():
+        store.cache.clear()  # relu dans invoice_requests
+    assert store.claim('k', 'h1') == {'invoice_number': 'F-1'}
+
+    assert store.claim('failed', 'h1') is None
+    store.release('failed')
+    assert store.claim('failed', 'h1') is None
+
+
+def test_store_memory_and_sqlite():
+    """Réservation, rejeu, conflit, libération ; reprise d'une réservation abandonnée (base)."""
+    _exercise_store(IdempotencyStore(use_db=lambda: False))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        timeout = idempotency.PENDING_TIMEOUT
+        try:
+            db.configure_backend('sqlite', str(Path(tmp) / 'factur_x.sqlite3'))
+            store = IdempotencyStore(use_db=lambda: True)
+            _exercise_store(store)
+
+            # Autre processus (cache distinct) : résultat relu dans invoice_requests
+            assert IdempotencyStore(use_db=lambda: True).claim('k', 'h1') == {'invoice_number': 'F-1'}
+
+            assert store.claim('stale', 'h1') is None
+            idempotency.PENDING_TIMEOUT = -1
+            assert IdempotencyStore(use_db=lambda: True).claim('stale', 'h1') is None
+
+            idempotency.PENDING_TIMEOUT = timeout
+            assert store.claim('expired', 'h1', ttl=-1) is None
+            assert store.purge() == 1
+        finally:
+            idempotency.PENDING_TIMEOUT = timeout
+            db.configure_backend('postgresql')
+    print("[OK] test_store_memory_and_sqlite")
+
+
+def test_api_replay_with_key():
+    """Même Idempotency-Key : résultat rejoué sans rendu ; autre contenu refusé (422)."""
+    with _ApiEnvironment() as client, _CountingIssue() as counter:
+        headers = {'Idempotency-Key': 'erp-commande-4242'}
+        first = client.post('/api/v1/invoices', json=INVOICE, headers=headers)
+        again = client.post('/api/v1/invoices', json=INVOICE, headers=headers)
+        assert first.status_code == 201 and again.status_code == 200, again.get_json()
+        assert again.headers['Idempotent-Replayed'] == 'true' and again.get_json()['replayed'] is True
+        assert again.get_json()['invoice'] == first.get_json()['invoice'] and counter.calls == 1
+
+        changed = {**INVOICE, 'lines': INVOICE['lines'][:1]}
+        resp = client.post('/api/v1/invoices', json=changed, headers=headers)
+        assert resp.status_code == 422 and resp.get_json()['errors'][0]['field'] == 'idempotency_key'
+
+        # Sans clé : le même contenu est rejoué, un autre contenu est émis
+        assert client.post('/api/v1/invoices', json=changed).status_code == 201
+        assert client.post('/api/v1/invoices', json=changed).status_code == 200
+        batch = client.post('/api/v1/invoices/batch', json={'invoices': [INVOICE, changed]},
+                            headers={'Idempotency-Key': 'lot-7'}).get_json()
+        assert [r['status'] for r in batch['results']] == [201, 201] and counter.calls == 4
+        numbers = [r['invoice']['invoice_number'][-4:] for r in batch['results']]
+        assert numbers == ['0003', '0004']
+        assert client.post('/api/v1/invoices', json=INVOICE, headers={'Idempotency-Key': ''}).status_code == 400
+    print("[OK] test_api_replay_with_key")
+
+
+def test_wizard_double_submit():
+    """Assistant : un second envoi du même brouillon ne régénère pas et ne consomme pas de numéro."""
+    with _ApiEnvironment() as client, _CountingIssue() as counter, tempfile.TemporaryDirectory() as tmp:
+        saved_drafts = app_module.DRAFTS
+        try:
+            app_module.DRAFTS = DraftStore(tmp)
+            step1 = {'type_code': '380', 'currency_code': 'EUR', 'issue_date': '2026-02-18',
+                     'recipient_name': 'Client Assistant', 'recipient_siret': '12345678901234',
+                     'recipient_country_code': 'FR'}
+            assert client.post('/invoice/step1', data=step1).get_json()['success'] is True
+            lines = {'lines': {'description': ['Conseil'], 'quantity': ['2'], 'unit_price_ht': ['300']}}
+            for _ in range(2):
+                resp = client.post('/invoice', json=lines)
+                assert resp.get_json() == {'success': True, 'redirect': '/invoice/step3'}
+            assert counter.calls == 1
+            with client.session_transaction() as sess:
+                draft = app_module.DRAFTS.load(sess['draft_id'])
+            assert draft['invoice_summary']['invoice_number'].endswith('-0001')
+            assert draft['invoice_summary']['total_ttc'] == '720.00'
+        finally:
+            app_module.DRAFTS = saved_drafts
+    print("[OK] test_wizard_double_submit")
+
+
+def test_reclaim_after_crash():
+    """Processus arrêté entre l'insertion et complete : la reprise rejoue la facture déjà en base."""
+    def crash(*args, **kwargs):
+        raise SystemExit("processus arrêté")
+
+    def payload():
+        return invoice_data_from_payload(INVOICE), columns_to_lines(line_columns_from_payload(INVOICE))
+
+    timeout = idempotency.PENDING_TIMEOUT
+    with _ApiEnvironment(), _CountingIssue() as counter:
+        store = app_module.ISSUED_INVOICES
+        try:
+            store.complete = crash
+            try:
+                app_module.issue_invoice_once(*payload(), request_key='billing:run-1:7')
+            except SystemExit:
+                pass
+            else:
+                raise AssertionError("arrêt simulé non propagé")
+            del store.complete
+
+            # Autre processus, après expiration de la réservation
+            store.cache.clear()
+            idempotency.PENDING_TIMEOUT = -1
+            issued, replayed = app_module.issue_invoice_once(*payload(), request_key='billing:run-1:7')
+            assert replayed and counter.calls == 1
+            assert issued['invoice_number'].endswith('-0001') and issued['db_status'] == 'ok'
+            with db.db_cursor(readonly=True) as (_conn, cursor):
+                cursor.execute("SELECT COUNT(*) FROM sent_invoices")
+                assert cursor.fetchone()[0] == 1
+        finally:
+            idempotency.PENDING_TIMEOUT = timeout
+            store.__dict__.pop('complete', None)
+    print("[OK] test_reclaim_after_crash")
+
+
+if __name__ == '__main__':
+    test_content_hash()
+    test_store_memory_and_sqlite()
+    test_api_replay_with_key()
+    test_wizard_double_submit()
+    test_reclaim_after_crash()
+    print("\nTous les tests d'idempotence sont passés.")
@@ -0,0 +1,167 @@
+"""
+Tests de l'ingestion d'un répertoire de PDF Factur-X reçus (pool de processus, sans base).
+
+Usage: uv run python tests/test_ingest.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturx_fixtures import make_facturx_pdf
+from utils.facturx_parser import FacturXParseError, extract_facturx_xml, parse_facturx_xml
+import utils.ingest as ingest_module
+from utils.ingest import file_sha256, ingest_directory, scan_pdf_files
+from utils.invoice_store import EXTRACTED_COLUMNS, INCOMING_COLUMNS, extracted_fields
+
+
+class MemoryInsert:
+    """Équivalent en mémoire de insert_invoice_batch (ON CONFLICT DO NOTHING sur (SIRET, numéro) et empreinte)."""
+
+    def __init__(self):
+        self.rows = {}
+        self.batches = 0
+
+    def __call__(self, invoices):
+        self.batches += 1
+        hashes = {r['content_sha256'] for r in self.rows.values()}
+        inserted = 0
+        for inv in invoices:
+            key = (inv['company_siret'], inv['invoice_num'])
+            if key not in self.rows and inv['content_sha256'] not in hashes:
+                self.rows[key] = inv
+                hashes.add(inv['content_sha256'])
+                inserted += 1
+        return inserted
+
+
+def test_extract_embedded_xml():
+    """Le XML est lu dans l'arbre EmbeddedFiles ; un PDF sans pièce jointe est refusé."""
+    xml = extract_facturx_xml(make_facturx_pdf('FRNS-X01'))
+    assert b'FRNS-X01' in xml
+    try:
+        extract_facturx_xml(b'%PDF-1.4 pas un vrai pdf')
+    except FacturXParseError:
+        pass
+    else:
+        raise AssertionError("PDF illisible accepté")
+    print("[OK] test_extract_embedded_xml")
+
+
+def test_extracted_fields():
+    """Les champs métier sont extraits une fois du XML, typés pour leurs colonnes."""
+    fields = extracted_fields(parse_facturx_xml(extract_facturx_xml(make_facturx_pdf('FRNS-X02'))))
+    assert set(fields) == set(EXTRACTED_COLUMNS) and set(EXTRACTED_COLUMNS) <= set(INCOMING_COLUMNS)
+    assert fields['due_date'] == '2026-03-10' and fields['currency_code'] == 'EUR'
+    assert fields['seller_vat_number'] == 'FR45987654321'
+    assert fields['buyer_vat_number'] == 'FR12345678901' and fields['buyer_siret'] == '12345678901234'
+    assert fields['buyer_reference'] == 'REF-001' and fields['purchase_order_reference'] == 'PO-001'
+    assert str(fields['total_ht']) == '105.00' and str(fields['total_vat']) == '12.30'
+    print("[OK] test_extracted_fields")
+
+
+def test_ingest_directory():
+    """Les PDF sont parsés en parallèle, insérés par lots, puis écartés par empreinte."""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        for i in range(5):
+            (directory / f"facture-ING-{i:03d}.pdf").write_bytes(make_facturx_pdf(f'ING-{i:03d}'))
+        (directory / 'facture-KO.pdf').write_bytes(b'%PDF-1.4 illisible')
+        (directory / 'notes.txt').write_text('ignoré')
+
+        insert = MemoryInsert()
+        known = set()
+        stats = ingest_directory(directory, workers=2, batch_size=2, known=known, insert=insert)
+        assert stats == {'scanned': 6, 'skipped': 0, 'parsed': 5, 'inserted': 5, 'invalid': 1}, stats
+        assert insert.batches == 3
+        row = insert.rows[('98765432100011', 'ING-003')]
+        assert row['company_siret'] == '98765432100011'
+        assert str(row['total_ttc']) == '117.30'
+        assert row['content_sha256'] == file_sha256(row['pdf_path'])
+        assert row['due_date'] == '2026-03-10' and row['buyer_reference'] == 'REF-001'
+
+        # Second passage : tout est déjà connu, rien n'est relu
+        stats = ingest_directory(directory, workers=2, known=known, insert=insert)
+        assert stats['skipped'] == 6 and stats['parsed'] == 0 and insert.batches == 3, stats
+    print("[OK] test_ingest_directory")
+
+
+def test_sidecar_and_recent_files():
+    """Un PDF sans XML embarqué utilise facturx-<numéro>.xml ; un fichier en cours de copie attend."""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        pdf = make_facturx_pdf('SIDE-001')
+        (directory / 'facture-SIDE-001.pdf').write_bytes(b'%PDF-1.4 sans piece jointe')
+        (directory / 'facturx-SIDE-001.xml').write_bytes(extract_facturx_xml(pdf))
+        old = time.time() - 60
+        os.utime(directory / 'facture-SIDE-001.pdf', (old, old))
+        (directory / 'facture-NEW-001.pdf').write_bytes(make_facturx_pdf('NEW-001'))
+
+        assert [p.name for p in scan_pdf_files(directory, min_age=5)] == ['facture-SIDE-001.pdf']
+        insert = MemoryInsert()
+        stats = ingest_directory(directory, workers=1, known=set(), insert=insert, min_age=5)
+        assert stats['inserted'] == 1 and ('98765432100011', 'SIDE-001') in insert.rows, stats
+    print("[OK] test_sidecar_and_recent_files")
+
+
+def test_same_number_two_suppliers():
+    """Deux fournisseurs peuvent émettre le même numéro : les deux factures sont conservées."""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        (directory / 'a.pdf').write_bytes(make_facturx_pdf('F-0001'))
+        (directory / 'b.pdf').write_bytes(make_facturx_pdf('F-0001', seller_siret='11122233300044'))
+        insert = MemoryInsert()
+        stats = ingest_directory(directory, workers=1, known=set(), insert=insert)
+        assert stats['inserted'] == 2, stats
+        assert set(insert.rows) == {('98765432100011', 'F-0001'), ('11122233300044', 'F-0001')}
+    print("[OK] test_same_number_two_suppliers")
+
+
+def test_unchanged_files_not_rehashed():
+    """Un fichier inchangé (mtime_ns, taille) n'est pas relu ; un fichier modifié l'est."""
+    hashed = []
+
+    def counting_sha256(path):
+        hashed.append(Path(path).name)
+        return file_sha256(path)
+
+    original = ingest_module.file_sha256
+    ingest_module.file_sha256 = counting_sha256
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            for i in range(3):
+                (directory / f"facture-STAT-{i:03d}.pdf").write_bytes(make_facturx_pdf(f'STAT-{i:03d}'))
+            insert, known, seen = MemoryInsert(), set(), {}
+            ingest_directory(directory, workers=1, known=known, insert=insert, seen=seen)
+            assert len(hashed) == 3 and len(seen) == 3
+
+            hashed.clear()
+            stats = ingest_directory(directory, workers=1, known=known, insert=insert, seen=seen)
+            assert hashed == [] and stats['skipped'] == 3, (hashed, stats)
+
+            changed = directory / 'facture-STAT-001.pdf'
+            later = changed.stat().st_mtime + 5
+            os.utime(changed, (later, later))
+            (directory / 'facture-STAT-002.pdf').unlink()
+            stats = ingest_directory(directory, workers=1, known=known, insert=insert, seen=seen)
+            assert hashed == ['facture-STAT-001.pdf'] and stats['skipped'] == 2, (hashed, stats)
+            assert len(seen) == 2
+    finally:
+        ingest_module.file_sha256 = original
+    print("[OK] test_unchanged_files_not_rehashed")
+
+
+if __name__ == '__main__':
+    test_extract_embedded_xml()
+    test_extracted_fields()
+    test_ingest_directory()
+    test_sidecar_and_recent_files()
+    test_same_number_two_suppliers()
+    test_unchanged_files_not_rehashed()
+    print("\nTous les tests d'ingestion sont passés.")
@@ -0,0 +1,216 @@
+"""
+Tests de la lecture et de la validation des lignes de l'étape 2 (formulaire, JSON colonnes ou lignes, CSV).
+
+Usage: uv run python tests/test_invoice_lines.py
+"""
+
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from werkzeug.datastructures import MultiDict
+
+import app as app_module
+from utils.invoice_lines import (
+    LINE_FIELDS, MAX_LINES, columns_to_lines, line_columns_from_csv, line_columns_from_payload,
+    parse_lines_from_form, validate_line_columns, validate_step2,
+)
+from utils.invoice_calc import calculate_invoice_totals
+
+VALID_LINE = {
+    'description': 'Ramettes papier A4', 'quantity': '10', 'unit_price_ht': '4.5', 'vat_rate': '20',
+    'discount_value': '', 'discount_type': 'percent', 'vat_category': 'Z',
+    'vat_exemption_code': '', 'vat_exemption_reason': '',
+}
+
+
+def test_form_parsing():
+    """Formulaire : lignes ordonnées par indice (même non contigu), champs absents par défaut."""
+    form = MultiDict({
+        'lines[10][description]': 'Deuxième', 'lines[10][quantity]': '1',
+        'lines[2][description]': 'Première', 'lines[2][unit_price_ht]': '3',
+        'lines[2][inconnu]': 'ignoré', 'csrf': 'x',
+    })
+    lines = parse_lines_from_form(form)
+    assert [line['description'] for line in lines] == ['Première', 'Deuxième']
+    assert lines[0]['unit_price_ht'] == '3' and lines[0]['vat_rate'] == '20' and lines[0]['quantity'] == ''
+    assert set(lines[0]) == set(LINE_FIELDS)
+    print("[OK] test_form_parsing")
+
+
+def test_json_payloads():
+    """JSON en colonnes et en liste de lignes : mêmes lignes, nombres convertis en texte."""
+    rows = line_columns_from_payload({'lines': [
+        {'description': 'A', 'quantity': 2, 'unit_price_ht': 4.5},
+        {'description': 'B', 'quantity': '1', 'unit_price_ht': '10', 'vat_rate': 0, 'vat_category': 'E',
+         'vat_exemption_reason': 'Franchise'},
+    ]})
+    columns = line_columns_from_payload({'lines': {
+        'description': ['A', 'B'], 'quantity': [2, '1'], 'unit_price_ht': [4.5, '10'],
+        'vat_rate': [None, 0], 'vat_category': ['', 'E'], 'vat_exemption_reason': ['', 'Franchise'],
+    }})
+    assert rows == columns
+    lines = columns_to_lines(columns)
+    assert lines[0]['quantity'] == '2' and lines[0]['unit_price_ht'] == '4.5' and lines[0]['vat_rate'] == '20'
+    assert lines[1]['vat_rate'] == '0' and lines[1]['discount_type'] == 'percent'
+    assert validate_line_columns(columns) == []
+
+    for payload in (None, [], {'lines': 'x'}, {'lines': [1]}, {'lines': {}},
+                    {'lines': {'description': ['A'], 'quantity': ['1', '2']}},
+                    {'lines': {'description': ['A'], 'quantity': '1'}},
+                    {'lines': [{}] * (MAX_LINES + 1)}):
+        try:
+            line_columns_from_payload(payload)
+        except ValueError:
+            continue
+        raise AssertionError(f"corps accepté : {str(payload)[:60]}")
+    print("[OK] test_json_payloads")
+
+
+def test_validation_messages():
+    """Mêmes règles que l'étape 2, erreurs triées par ligne ; valeurs non numériques signalées."""
+    lines = [
+        VALID_LINE,
+        {**VALID_LINE, 'description': ' ', 'quantity': 'abc', 'unit_price_ht': '0'},
+        {**VALID_LINE, 'quantity': 'NaN', 'vat_rate': '0', 'vat_category': ''},
+        {**VALID_LINE, 'vat_rate': '0.00', 'vat_category': 'AE'},
+        {**VALID_LINE, 'vat_rate': '0', 'vat_category': 'K', 'vat_exemption_code': 'VATEX-EU-IC'},
+    ]
+    errors = validate_step2(lines)
+    assert [e['field'] for e in errors] == [
+        'lines[1][description]', 'lines[1][quantity]', 'lines[1][unit_price_ht]',
+        'lines[2][quantity]', 'lines[2][vat_category]', 'lines[3][vat_exemption_code]',
+    ]
+    assert errors[1]['message'] == 'Ligne 2 : quantité invalide'
+    assert errors[2]['message'] == 'Ligne 2 : le prix unitaire doit être supérieur à 0'
+    assert 'catégorie AE' in errors[5]['message']
+    assert validate_step2([]) == [{'field': 'lines', 'message': 'La facture doit contenir au moins une ligne'}]
+    print("[OK] test_validation_messages")
+
+
+def test_vat_rate_and_discount_validation():
+    """Taux et rabais non numériques, non finis ou négatifs refusés ; rabais en % au plus 100."""
+    lines = [
+        {**VALID_LINE, 'vat_rate': '', 'discount_value': ''},
+        {**VALID_LINE, 'vat_rate': 'abc'},
+        {**VALID_LINE, 'vat_rate': 'NaN', 'discount_value': 'Infinity'},
+        {**VALID_LINE, 'vat_rate': '-5.5', 'discount_value': '-1'},
+        {**VALID_LINE, 'discount_value': '100.01', 'discount_type': 'percent'},
+        {**VALID_LINE, 'discount_value': '150', 'discount_type': 'amount'},
+        {**VALID_LINE, 'discount_value': '100', 'discount_type': 'percent'},
+    ]
+    errors = validate_step2(lines)
+    assert [e['field'] for e in errors] == [
+        'lines[1][vat_rate]', 'lines[2][vat_rate]', 'lines[2][discount_value]',
+        'lines[3][vat_rate]', 'lines[3][discount_value]', 'lines[4][discount_value]',
+    ], errors
+    assert errors[0]['message'] == 'Ligne 2 : taux de TVA invalide'
+    assert errors[2]['message'] == 'Ligne 3 : rabais invalide'
+    assert errors[3]['message'] == 'Ligne 4 : le taux de TVA ne peut pas être négatif'
+    assert errors[4]['message'] == 'Ligne 4 : le rabais ne peut pas être négatif'
+    assert '100 %' in errors[5]['message']
+    print("[OK] test_vat_rate_and_discount_validation")
+
+
+def test_large_payload_is_fast():
+    """5 000 lignes en colonnes : lecture et validation en quelques millisecondes."""
+    count = 5000
+    payload = {'lines': {
+        'description': [f'Article {i}' for i in range(count)],
+        'quantity': ['2'] * count,
+        'unit_price_ht': ['19.90'] * count,
+        'vat_rate': ['20'] * count,
+    }}
+    started = time.perf_counter()
+    columns = line_columns_from_payload(payload)
+    errors = validate_line_columns(columns)
+    lines = columns_to_lines(columns)
+    elapsed = time.perf_counter() - started
+    assert errors == [] and len(lines) == count
+    assert elapsed < 0.5, f"{elapsed:.3f}s"
+    print(f"[OK] test_large_payload_is_fast ({elapsed * 1000:.1f} ms)")
+
+
+def test_csv_import():
+    """CSV français avec en-têtes, collage tableur sans en-tête : mêmes colonnes que le JSON."""
+    text = (
+        'Désignation;Quantité;Prix unitaire HT;TVA %;Remise;Type de rabais\n'
+        'Papier A4;1 000;0,045;20,00 %;;\n'
+        '"Stylos; lot de 10";2;1.234,50;5,5;10;EUR\n'
+        '\n'
+    )
+    columns = line_columns_from_csv(text.encode('cp1252'))
+    assert columns['description'] == ['Papier A4', 'Stylos; lot de 10']
+    assert columns['quantity'] == ['1000', '2'] and columns['unit_price_ht'] == ['0.045', '1234.50']
+    assert columns['vat_rate'] == ['20', '5.5'] and columns['discount_type'] == ['percent', 'amount']
+    assert validate_line_columns(columns) == []
+    totals = calculate_invoice_totals(columns_to_lines(columns))
+    assert totals['total_ht'] == Decimal('2504') and set(totals['vat_breakdown']) == {'20_S', '5.5_S'}
+
+    pasted = line_columns_from_csv('Conseil\t2\t450\t0\t\t\te\tVATEX-EU-O\r\nRemise client\t1\t5\n')
+    assert pasted['description'] == ['Conseil', 'Remise client'] and pasted['vat_category'] == ['E', '']
+    assert pasted['vat_rate'] == ['0', '20'] and pasted['vat_exemption_code'] == ['VATEX-EU-O', '']
+
+    for bad in ('', ' \n\n', 'x\n' * (MAX_LINES + 1)):
+        try:
+            line_columns_from_csv(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"CSV accepté : {bad[:20]!r}")
+    print("[OK] test_csv_import")
+
+
+def test_step2_grid_and_import_route():
+    """Step2 rendu sans lignes dans le HTML (grille virtualisée), import CSV renvoyé en colonnes."""
+    app_module.app.config['TESTING'] = True
+    client = app_module.app.test_client()
+    saved = app_module.current_draft
+    try:
+        app_module.current_draft = lambda: {'invoice_data': {
+            'invoice_number': 'X', 'type_code': '380', 'currency_code': 'EUR',
+            'issue_date': '2026-02-18', 'due_date': ''}, 'lines': [VALID_LINE] * 3}
+        html = client.get('/invoice/step2').data
+        assert b'id="lines-viewport"' in html and b'lines[0][description]' not in html
+        assert html.count(b'Ramettes papier A4') == 3
+
+        resp = client.post('/api/invoice/lines/import', data='A;1;2\nB;3;4,5\n', content_type='text/csv')
+        data = resp.get_json()
+        assert data['success'] is True and data['count'] == 2 and data['lines']['unit_price_ht'] == ['2', '4.5']
+        resp = client.post('/api/invoice/lines/import', data='', content_type='text/csv')
+        assert resp.status_code == 400 and resp.get_json()['errors'][0]['field'] == 'lines'
+    finally:
+        app_module.current_draft = saved
+    print("[OK] test_step2_grid_and_import_route")
+
+
+def test_route_rejects_invalid_json_lines():
+    """POST /invoice en JSON : erreurs de lignes renvoyées en 400, sans génération."""
+    app_module.app.config['TESTING'] = True
+    client = app_module.app.test_client()
+    saved = app_module.current_draft
+    try:
+        app_module.current_draft = lambda: {'invoice_data': {'invoice_number': 'X'}}
+        resp = client.post('/invoice', json={'lines': {'description': [''], 'quantity': ['1'],
+                                                        'unit_price_ht': ['1']}})
+        assert resp.status_code == 400
+        assert resp.get_json()['errors'][0]['field'] == 'lines[0][description]'
+        resp = client.post('/invoice', json={'lines': 'x'})
+        assert resp.status_code == 400 and resp.get_json()['errors'][0]['field'] == 'lines'
+    finally:
+        app_module.current_draft = saved
+    print("[OK] test_route_rejects_invalid_json_lines")
+
+
+if __name__ == '__main__':
+    test_form_parsing()
+    test_json_payloads()
+    test_validation_messages()
+    test_vat_rate_and_discount_validation()
+    test_large_payload_is_fast()
+    test_csv_import()
+    test_step2_grid_and_import_route()
+    test_route_rejects_invalid_json_lines()
+    print("\nTous les tests des lignes sont passés.")
@@ -0,0 +1,86 @@
+"""
+Tests du mode PDF compact (flux d'objets, profil ICC compressé, logo réduit).
+
+Usage: uv run python tests/test_pdf_compact.py
+"""
+
+import copy
+import sys
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturx import generate_from_binary, get_xml_from_pdf
+from PIL import Image as PILImage
+from pypdf import PdfReader
+
+from facturx_fixtures import SAMPLE_DATA, make_facturx_pdf
+from utils.audit import check_pdfa_structure
+from utils.facturx_generator import generate_facturx_xml
+from utils.pdf_compact import compact_pdf
+from utils.pdf_generator import generate_invoice_pdf
+
+
+def _images(pdf: bytes) -> list[dict]:
+    reader = PdfReader(BytesIO(pdf))
+    xobjects = reader.pages[0]['/Resources'].get('/XObject', {})
+    return [xobjects[name].get_object() for name in xobjects]
+
+
+def test_compact_rewrite():
+    """Réécriture : flux d'objets, pas de copie morte, XML et structure PDF/A-3 conservés."""
+    standard = make_facturx_pdf('CMP-001')
+    compact = compact_pdf(standard)
+
+    assert compact.startswith(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n') and compact.count(b'%%EOF') == 1
+    assert b'/ObjStm' in compact and b'/XRef' in compact
+    assert len(compact) < len(standard) * 0.6, (len(compact), len(standard))
+
+    errors, embedded = check_pdfa_structure(compact)
+    assert errors == [], errors
+    assert embedded == get_xml_from_pdf(standard, check_xsd=False)[1]
+    assert get_xml_from_pdf(compact, check_xsd=True)[0] == 'factur-x.xml'
+
+    reader = PdfReader(BytesIO(compact))
+    assert 'Ramettes papier A4' in reader.pages[0].extract_text()
+    assert reader.trailer['/ID'] == PdfReader(BytesIO(standard)).trailer['/ID']
+    assert reader.metadata.title == PdfReader(BytesIO(standard)).metadata.title
+
+    # Idempotent : un PDF déjà compact n'est pas dégradé
+    assert len(compact_pdf(compact)) <= len(compact)
+    print("[OK] test_compact_rewrite")
+
+
+def test_compact_logo_and_icc():
+    """Mode compact : logo réduit à sa taille imprimée, profil ICC compressé."""
+    data = copy.deepcopy(SAMPLE_DATA)
+    with tempfile.TemporaryDirectory() as tmp:
+        logo = Path(tmp) / 'logo.jpg'
+        PILImage.effect_noise((1800, 1200), 50).convert('RGB').save(logo, quality=95)
+
+        standard = generate_invoice_pdf(data, logo_path=str(logo))
+        compact = generate_invoice_pdf(data, logo_path=str(logo), compact=True)
+        assert [image['/Width'] for image in _images(standard)] == [1800]
+        assert [image['/Width'] for image in _images(compact)] == [177]
+        assert len(compact) * 10 < len(standard)
+
+    intent = PdfReader(BytesIO(compact)).trailer['/Root']['/OutputIntents'][0].get_object()
+    assert intent['/DestOutputProfile'].get_object()['/Filter'] == '/FlateDecode'
+
+    # Petit logo : repris tel quel
+    small = generate_invoice_pdf(data, logo_path='./resources/logos/sntpk-logo.jpeg', compact=True)
+    assert [image['/Width'] for image in _images(small)] == [80]
+
+    facturx = generate_from_binary(pdf_file=compact, xml=generate_facturx_xml(data).encode('utf-8'),
+                                   flavor='factur-x', level='en16931', check_xsd=False)
+    assert check_pdfa_structure(compact_pdf(facturx))[0] == []
+    print("[OK] test_compact_logo_and_icc")
+
+
+if __name__ == '__main__':
+    test_compact_rewrite()
+    test_compact_logo_and_icc()
+    print("\nTous les tests du mode PDF compact sont passés.")
@@ -0,0 +1,93 @@
+"""
+Tests du chemin de génération Factur-X en flux (fichiers temporaires, écriture directe dans le stockage).
+
+Usage: uv run python tests/test_pdf_pipeline.py
+"""
+
+import hashlib
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturx import get_xml_from_pdf
+
+import app as app_module
+import utils.pdf_generator as pdf_generator
+from cli import _bench_invoice
+from test_api_invoices import INVOICE, _ApiEnvironment
+from utils.audit import check_pdfa_structure
+
+
+def _check_archived(invoice: dict, pdf_dir: Path) -> None:
+    pdf = (pdf_dir / f"{invoice['invoice_number']}.pdf").read_bytes()
+    assert pdf.count(b'%%EOF') == 1 and check_pdfa_structure(pdf)[0] == []
+    assert hashlib.sha256(pdf).hexdigest() == invoice['pdf_sha256']
+    assert invoice['invoice_number'].encode() in get_xml_from_pdf(pdf, check_xsd=False)[1]
+
+
+def test_issue_writes_into_storage():
+    """PDF écrit directement dans pdf_storage (standard et compact), sans fichier .part résiduel."""
+    with _ApiEnvironment() as client:
+        pdf_dir = Path(app_module.CONFIG['pdf_storage'])
+        saved = app_module.CONFIG.get('pdf_compact')
+        try:
+            for compact in (False, True):
+                app_module.CONFIG['pdf_compact'] = compact
+                resp = client.post('/api/v1/invoices', json={**INVOICE, 'lines': INVOICE['lines'] * (2 + compact)})
+                assert resp.status_code == 201, resp.get_json()
+                _check_archived(resp.get_json()['invoice'], pdf_dir)
+        finally:
+            app_module.CONFIG['pdf_compact'] = saved
+        assert sorted(p.suffix for p in pdf_dir.iterdir()) == ['.pdf', '.pdf']
+    print("[OK] test_issue_writes_into_storage")
+
+
+def test_failed_generation_leaves_no_file():
+    """Échec pendant l'écriture du PDF : ni fichier partiel ni PDF tronqué dans le stockage."""
+    with _ApiEnvironment() as client:
+        original = app_module.generate_from_file
+
+        def failing(pdf_file, xml, **kwargs):
+            Path(kwargs['output_pdf_file']).write_bytes(b'%PDF-1.6\n')
+            raise RuntimeError("disque plein")
+
+        try:
+            app_module.generate_from_file = failing
+            resp = client.post('/api/v1/invoices', json=INVOICE)
+        finally:
+            app_module.generate_from_file = original
+        assert resp.status_code == 500
+        assert list(Path(app_module.CONFIG['pdf_storage']).iterdir()) == []
+    print("[OK] test_failed_generation_leaves_no_file")
+
+
+def test_spill_to_disk_and_peak_memory():
+    """PDF intermédiaires déversés sur disque au-delà du seuil ; pic mémoire borné pour 1 000 lignes."""
+    invoice, lines = _bench_invoice(1, 1000)
+    threshold = pdf_generator.PDF_SPOOL_MAX_SIZE
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / 'facture.pdf'
+        try:
+            pdf_generator.PDF_SPOOL_MAX_SIZE = 64 * 1024
+            tracemalloc.start()
+            app_module.write_facturx_pdf(invoice, lines, target, compact=False)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            pdf_generator.PDF_SPOOL_MAX_SIZE = threshold
+        pdf = target.read_bytes()
+    assert len(pdf) > 64 * 1024 and check_pdfa_structure(pdf)[0] == []
+    # Arbre XML et rendu ReportLab compris ; l'ancien chemin (minidom, copies en mémoire) dépassait 20 Mo
+    assert peak < 12 * 1024 * 1024, f"pic mémoire {peak / 1e6:.1f} Mo"
+    print(f"[OK] test_spill_to_disk_and_peak_memory ({peak / 1e6:.1f} Mo)")
+
+
+if __name__ == '__main__':
+    test_issue_writes_into_storage()
+    test_failed_generation_leaves_no_file()
+    test_spill_to_disk_and_peak_memory()
+    print("\nTous les tests du chemin de génération en flux sont passés.")
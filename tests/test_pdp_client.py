@@ -0,0 +1,119 @@
+"""
+Tests du client HTTP SuperPDP contre un bouchon local (keep-alive, flux, erreurs).
+
+Usage: uv run python tests/test_pdp_client.py
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from pdp_stub import PdpStub, VALID_TOKEN
+from utils.pdp_client import PdpClient, PdpAuthError, PdpClientError, PdpTransientError
+from utils import super_pdp
+
+
+def test_keep_alive_and_streaming_upload():
+    """Plusieurs appels réutilisent la même connexion ; le PDF arrive intact."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / 'facture.pdf'
+        content = b'%PDF-1.7\n' + os.urandom(200_000)
+        pdf_path.write_bytes(content)
+
+        client = PdpClient(stub.url, timeout=5)
+        token = client.fetch_token('id', 'secret')['access_token']
+        for _ in range(5):
+            response = client.upload_invoice(token, str(pdf_path))
+            assert 'id' in response
+        client.get_company(token)
+
+        assert client.connections_opened == 1, f"Attendu 1 connexion, {client.connections_opened} ouvertes"
+        assert len(stub.client_ports) == 1
+        assert stub.uploads[0] == content
+        client.close()
+    print("[OK] test_keep_alive_and_streaming_upload")
+
+
+def test_error_mapping():
+    """Les statuts HTTP sont convertis en exceptions structurées."""
+    with PdpStub() as stub:
+        client = PdpClient(stub.url, timeout=5)
+
+        try:
+            client.fetch_token('id', 'wrong')
+            assert False, "PdpAuthError attendue"
+        except PdpAuthError as e:
+            assert e.status == 401 and 'invalid_client' in str(e)
+
+        stub.force('/v1.beta/companies/me', 503, {'message': 'maintenance'}, {'Retry-After': '7'})
+        try:
+            client.get_company(VALID_TOKEN)
+            assert False, "PdpTransientError attendue"
+        except PdpTransientError as e:
+            assert e.status == 503 and e.retry_after == 7.0
+
+        stub.force('/v1.beta/companies/me', 422, {'message': 'invalide'})
+        try:
+            client.get_company(VALID_TOKEN)
+            assert False, "PdpClientError attendue"
+        except PdpClientError as e:
+            assert e.status == 422 and isinstance(e, RuntimeError)
+        client.close()
+    print("[OK] test_error_mapping")
+
+
+def test_stale_connection_replay():
+    """Connexion fermée sans réponse : GET rejoué sur une connexion neuve, POST jamais rejoué."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / 'facture.pdf'
+        pdf_path.write_bytes(b'%PDF-1.7\n')
+        client = PdpClient(stub.url, timeout=5)
+        client.get_company(VALID_TOKEN)
+
+        stub.drop('/v1.beta/companies/me')
+        assert client.get_company(VALID_TOKEN)['formal_name'] == 'Stub SAS'
+        assert sum(1 for r in stub.requests if r[1] == '/v1.beta/companies/me') == 3
+
+        stub.drop('/v1.beta/invoices')
+        try:
+            client.upload_invoice(VALID_TOKEN, str(pdf_path))
+            assert False, "PdpTransientError attendue"
+        except PdpTransientError:
+            pass
+        # Reçu une seule fois par le serveur : pas de second téléversement automatique
+        assert sum(1 for r in stub.requests if r[1] == '/v1.beta/invoices') == 1
+        client.close()
+    print("[OK] test_stale_connection_replay")
+
+
+def test_super_pdp_functions_use_client():
+    """get_pdp_token / check_pdp_token passent par le client HTTP natif."""
+    with PdpStub() as stub:
+        previous = {k: os.environ.get(k) for k in ('PDP_API_URL', 'PDP_SENDER_ID', 'PDP_SENDER_SECRET')}
+        os.environ.update({'PDP_API_URL': stub.url, 'PDP_SENDER_ID': 'id', 'PDP_SENDER_SECRET': 'secret'})
+        original_load_env = super_pdp._load_env
+        super_pdp._load_env = lambda: None
+        try:
+            token = super_pdp.get_pdp_token()
+            assert token['access_token'] == VALID_TOKEN
+            assert super_pdp.check_pdp_token(token['access_token'])['formal_name'] == 'Stub SAS'
+        finally:
+            super_pdp._load_env = original_load_env
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+    print("[OK] test_super_pdp_functions_use_client")
+
+
+if __name__ == '__main__':
+    test_keep_alive_and_streaming_upload()
+    test_error_mapping()
+    test_stale_connection_replay()
+    test_super_pdp_functions_use_client()
+    print("\n=== Tous les tests client SuperPDP OK ===")
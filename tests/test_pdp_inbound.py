@@ -0,0 +1,106 @@
+"""
+Tests de l'import incrémental des factures reçues (bouchon PDP local, sans base).
+
+Usage: uv run python tests/test_pdp_inbound.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturx_fixtures import make_facturx_pdf
+from pdp_stub import PdpStub, VALID_TOKEN
+from utils.pdp_client import PdpClient
+from utils.pdp_inbound import sync_incoming_invoices
+
+
+class MemoryIncomingStore:
+    """Équivalent en mémoire de PgIncomingStore (ON CONFLICT DO NOTHING sur (SIRET, numéro) et id PDP)."""
+
+    def __init__(self):
+        self.watermark = 0
+        self.rows = {}
+
+    def load_watermark(self):
+        return self.watermark
+
+    def save_page(self, invoices, watermark):
+        inserted = 0
+        known_ids = {r['pdp_invoice_id'] for r in self.rows.values()}
+        for inv in invoices:
+            key = (inv['company_siret'], inv['invoice_num'])
+            if key not in self.rows and inv['pdp_invoice_id'] not in known_ids:
+                self.rows[key] = inv
+                inserted += 1
+        self.watermark = max(self.watermark, watermark)
+        return inserted
+
+
+def _sync(stub, client, store, storage, **kwargs):
+    return sync_incoming_invoices(
+        storage_dir=storage,
+        list_page=lambda after, limit: client.list_invoices(VALID_TOKEN, 'in', after, limit),
+        download=lambda invoice_id, dest: client.download_invoice(VALID_TOKEN, invoice_id, dest),
+        store=store, **kwargs,
+    )
+
+
+def test_inbound_sync_pages():
+    """Les factures sont listées par pages, téléchargées, parsées et insérées une seule fois."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        ids = [stub.add_incoming(make_facturx_pdf(f'FRNS-{i:03d}')) for i in range(7)]
+        client = PdpClient(stub.url, timeout=5)
+        store = MemoryIncomingStore()
+
+        stats = _sync(stub, client, store, tmp, page_size=3, concurrency=4)
+        assert stats['pages'] == 3 and stats['inserted'] == 7, stats
+        assert stats['watermark'] == ids[-1]
+        row = store.rows[('98765432100011', 'FRNS-004')]
+        assert row['company_siret'] == '98765432100011'
+        assert row['company_name'] == 'Fournisseur Test SAS'
+        assert str(row['total_ttc']) == '117.30' and row['invoice_date'] == '2026-02-10'
+        assert sorted(r[1] for r in row['vat_rows']) == [5.5, 20]
+        assert Path(row['pdf_path']).read_bytes() == stub.inbox[row['pdp_invoice_id']]
+        assert not list(Path(tmp).glob('*.part'))
+
+        # Seconde exécution : rien à relire ni à télécharger
+        downloads = len(stub.downloads)
+        stats = _sync(stub, client, store, tmp, page_size=3)
+        assert stats['invoices'] == 0 and len(stub.downloads) == downloads
+        client.close()
+    print("[OK] test_inbound_sync_pages")
+
+
+def test_inbound_resume_and_invalid():
+    """Un téléchargement en échec bloque le watermark ; un PDF sans XML est ignoré."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        first = stub.add_incoming(make_facturx_pdf('FRNS-100'))
+        broken = stub.add_incoming(make_facturx_pdf('FRNS-101'))
+        stub.add_incoming(b'%PDF-1.4 sans XML embarque')
+        stub.add_incoming(make_facturx_pdf('FRNS-103'))
+        client = PdpClient(stub.url, timeout=5)
+        store = MemoryIncomingStore()
+
+        stub.force(f'/v1.beta/invoices/{broken}/download', 503, {'message': 'indisponible'})
+        stats = _sync(stub, client, store, tmp, page_size=10, concurrency=2)
+        assert stats['pending'] == 1 and stats['watermark'] == first, stats
+        assert stats['invalid'] == 1
+        assert sorted(num for _siret, num in store.rows) == ['FRNS-100', 'FRNS-103']
+
+        # Reprise : seule la facture en échec est retéléchargée
+        downloads = len(stub.downloads)
+        stats = _sync(stub, client, store, tmp, page_size=10)
+        assert stats['pending'] == 0 and stats['inserted'] == 1
+        assert sorted(num for _siret, num in store.rows) == ['FRNS-100', 'FRNS-101', 'FRNS-103']
+        assert len(stub.downloads) - downloads == 1
+        client.close()
+    print("[OK] test_inbound_resume_and_invalid")
+
+
+if __name__ == '__main__':
+    test_inbound_sync_pages()
+    test_inbound_resume_and_invalid()
+    print("\n=== Tous les tests import des factures reçues OK ===")
@@ -0,0 +1,245 @@
+"""
+Tests du moteur d'envoi en masse vers SuperPDP (bouchon local, sans base).
+
+Usage: uv run python tests/test_pdp_sender.py
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from pdp_stub import PdpStub, VALID_TOKEN
+from utils.pdp_client import PdpClient
+from utils.pdp_sender import BulkSender, PdpResultSink, RateLimiter
+
+
+class FakeQueue:
+    """File PENDING en mémoire : claim() réserve les lignes par lots."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.lock = threading.Lock()
+        self.ok = {}
+        self.errors = {}
+
+    def claim(self, limit):
+        with self.lock:
+            batch, self.rows = self.rows[:limit], self.rows[limit:]
+            return batch
+
+    def on_success(self, invoice_num, response):
+        with self.lock:
+            self.ok[invoice_num] = response
+
+    def on_failure(self, invoice_num, error):
+        with self.lock:
+            self.errors[invoice_num] = error
+
+
+def test_bulk_send_with_retries():
+    """Toutes les factures sont envoyées ; 503 rejoué, fichier absent en erreur définitive."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        rows = []
+        for i in range(40):
+            path = Path(tmp) / f'FAC-{i:04d}.pdf'
+            path.write_bytes(b'%PDF-1.7 ' + str(i).encode())
+            rows.append((f'FAC-{i:04d}', str(path)))
+        rows.append(('FAC-MISSING', str(Path(tmp) / 'absent.pdf')))
+        queue = FakeQueue(rows)
+
+        client = PdpClient(stub.url, timeout=5)
+        stub.force('/v1.beta/invoices', 503, {'message': 'surcharge'})
+
+        sender = BulkSender(
+            concurrency=4, rate=1000, batch_size=8, max_attempts=3, backoff_base=0.001,
+            claim=queue.claim,
+            upload=lambda pdf_path: client.upload_invoice(VALID_TOKEN, pdf_path),
+            on_success=queue.on_success, on_failure=queue.on_failure,
+        )
+        stats = sender.run()
+        client.close()
+
+        assert stats['sent'] == 40, stats
+        assert stats['failed'] == 1 and 'FAC-MISSING' in queue.errors
+        assert stats['retries'] == 1
+        assert len(stub.uploads) == 40
+        assert client.connections_opened <= 4
+    print("[OK] test_bulk_send_with_retries")
+
+
+def test_limit_and_permanent_error():
+    """Un 4xx n'est pas rejoué et `limit` borne le nombre de factures traitées."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'not-a-pdf.pdf'
+        path.write_bytes(b'hello')
+        queue = FakeQueue([(f'FAC-{i}', str(path)) for i in range(10)])
+        client = PdpClient(stub.url, timeout=5)
+
+        sender = BulkSender(
+            concurrency=2, rate=1000, batch_size=4, max_attempts=5,
+            claim=queue.claim,
+            upload=lambda pdf_path: client.upload_invoice(VALID_TOKEN, pdf_path),
+            on_success=queue.on_success, on_failure=queue.on_failure,
+        )
+        stats = sender.run(limit=6)
+        client.close()
+
+        assert stats == {'sent': 0, 'failed': 6, 'retries': 0}, stats
+        assert len(queue.rows) == 4
+        assert 'HTTP 400' in queue.errors['FAC-0']
+    print("[OK] test_limit_and_permanent_error")
+
+
+def test_rate_limiter():
+    """Le seau à jetons espace les acquisitions au-delà de la rafale."""
+    now = [0.0]
+    slept = []
+
+    def sleep(delay):
+        slept.append(delay)
+        now[0] += delay
+
+    limiter = RateLimiter(rate=10, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(12):
+        limiter.acquire()
+    # 2 jetons de rafale puis 10 acquisitions à 10/s : ~1 s simulée
+    assert abs(now[0] - 1.0) < 1e-6, now[0]
+    print("[OK] test_rate_limiter")
+
+
+def test_result_sink_batches():
+    """Les résultats sont écrits par lots (taille, délai), une ligne par facture."""
+    now = [0.0]
+    batches = []
+    sink = PdpResultSink(max_batch=3, max_delay=5.0, flush=batches.append, clock=lambda: now[0])
+
+    sink.on_success('A', {'created_at': '2026-03-01T10:00:00Z'})
+    sink.on_failure('B', 'HTTP 400')
+    sink.on_success('B', {})  # nouvelle tentative réussie : remplace l'erreur
+    assert batches == []
+    sink.on_success('C', {'created_at': '2026-03-01T10:00:01Z'})
+    assert len(batches) == 1 and [r[0] for r in batches[0]] == ['A', 'B', 'C']
+    assert batches[0][1][1] == 'SENT-OK'
+
+    sink.on_failure('D', 'Timeout')
+    now[0] += 6  # délai dépassé : écrit au prochain ajout
+    sink.on_failure('E', 'Timeout')
+    assert len(batches) == 2 and [r[0] for r in batches[1]] == ['D', 'E']
+    assert batches[1][0][1:3] == ('SENT-ERROR', 'Timeout')
+
+    # Délai dépassé sans nouvel ajout : écrit par flush_due()
+    sink.on_success('G', {})
+    assert sink.flush_due() == 0
+    now[0] += 5
+    assert sink.flush_due() == 1 and batches[-1][0][0] == 'G'
+
+    # Règle du trigger : SENT-ERROR sans exception rejeté avant l'écriture
+    for bad in (None, '  '):
+        try:
+            sink.add('F', 'SENT-ERROR', bad)
+            raise AssertionError("ValueError attendue")
+        except ValueError:
+            pass
+    assert sink.flush() == 0
+    print("[OK] test_result_sink_batches")
+
+
+def test_result_sink_requeue_on_error():
+    """Un lot non écrit est remis en attente sans écraser un résultat plus récent."""
+    calls = []
+
+    def flaky(batch):
+        calls.append(list(batch))
+        if len(calls) == 1:
+            raise RuntimeError("connexion perdue")
+
+    sink = PdpResultSink(max_batch=100, flush=flaky)
+    sink.add('A', 'SENT-ERROR', 'HTTP 503')
+    sink.add('B', 'SENT-OK')
+    try:
+        sink.flush()
+        raise AssertionError("RuntimeError attendue")
+    except RuntimeError:
+        pass
+    sink.add('A', 'SENT-OK')
+    assert sink.flush() == 2
+    assert sorted((r[0], r[1]) for r in calls[1]) == [('A', 'SENT-OK'), ('B', 'SENT-OK')]
+    print("[OK] test_result_sink_requeue_on_error")
+
+
+def test_bulk_send_through_sink():
+    """BulkSender écrit ses résultats via le tampon, par lots de batch_size."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        rows = []
+        for i in range(25):
+            path = Path(tmp) / f'FAC-{i}.pdf'
+            path.write_bytes(b'%PDF-1.7')
+            rows.append((f'FAC-{i}', str(path)))
+        queue = FakeQueue(rows)
+        client = PdpClient(stub.url, timeout=5)
+        batches = []
+
+        sender = BulkSender(
+            concurrency=4, rate=1000, batch_size=10, claim=queue.claim,
+            upload=lambda pdf_path: client.upload_invoice(VALID_TOKEN, pdf_path),
+            sink=PdpResultSink(max_batch=10, max_delay=60, flush=batches.append),
+        )
+        stats = sender.run()
+        client.close()
+
+        assert stats['sent'] == 25
+        assert [len(b) for b in batches] == [10, 10, 5]
+        assert all(r[1] == 'SENT-OK' and r[3] == '2026-03-01T10:00:00Z' for b in batches for r in b)
+    print("[OK] test_bulk_send_through_sink")
+
+
+def test_sink_flushed_while_upload_blocked():
+    """Un envoi bloqué n'empêche pas l'écriture des résultats déjà obtenus."""
+    release = threading.Event()
+    written = threading.Event()
+    batches = []
+
+    def upload(pdf_path):
+        if pdf_path == 'lent.pdf':
+            release.wait(10)
+        return {'id': 1, 'created_at': '2026-03-01T10:00:00Z'}
+
+    def flush(batch):
+        batches.append(batch)
+        written.set()
+
+    sender = BulkSender(
+        concurrency=2, rate=1000, batch_size=10, claim=FakeQueue([('A', 'lent.pdf'), ('B', 'b.pdf')]).claim,
+        upload=upload, sink=PdpResultSink(max_batch=10, max_delay=0.05, flush=flush),
+    )
+    runner = threading.Thread(target=sender.run)
+    runner.start()
+    try:
+        assert written.wait(5), "Résultat de B retenu tant que A est bloqué"
+        assert [r[0] for r in batches[0]] == ['B']
+    finally:
+        release.set()
+        runner.join()
+    assert [r[0] for b in batches for r in b] == ['B', 'A']
+
+    try:
+        PdpResultSink(max_delay=600)
+        raise AssertionError("ValueError attendue")
+    except ValueError:
+        pass
+    print("[OK] test_sink_flushed_while_upload_blocked")
+
+
+if __name__ == '__main__':
+    test_bulk_send_with_retries()
+    test_limit_and_permanent_error()
+    test_rate_limiter()
+    test_result_sink_batches()
+    test_result_sink_requeue_on_error()
+    test_bulk_send_through_sink()
+    test_sink_flushed_while_upload_blocked()
+    print("\n=== Tous les tests envoi en masse OK ===")
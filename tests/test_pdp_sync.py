@@ -0,0 +1,156 @@
+"""
+Tests de la synchronisation du cycle de vie depuis la PDP (bouchon local, sans base).
+
+Usage: uv run python tests/test_pdp_sync.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from pdp_stub import PdpStub, VALID_TOKEN
+from utils.pdp_client import PdpClient
+from utils.pdp_sync import lifecycle_label, normalize_event, sync_invoice_events
+
+
+class MemoryEventStore:
+    """Équivalent en mémoire de PgEventStore (mêmes règles d'idempotence et de statut)."""
+
+    def __init__(self):
+        self.watermark = 0
+        self.events = {}
+        self.saves = 0
+        # sent_invoices : pdp_invoice_id -> invoice_num, invoice_num -> (status_code, event_at)
+        self.invoice_ids = {}
+        self.lifecycle = {}
+        # invoice_events.invoice_num
+        self.linked = {}
+
+    def load_watermark(self):
+        return self.watermark
+
+    def _apply_latest(self, events):
+        # Par facture rattachée : événement le plus récent (event_at, puis pdp_event_id)
+        latest = {}
+        for event in sorted(events, key=lambda e: (e[3], e[0])):
+            if event[1] in self.invoice_ids:
+                latest[event[1]] = event
+        for pdp_id, event in latest.items():
+            invoice_num = self.invoice_ids[pdp_id]
+            current = self.lifecycle.get(invoice_num)
+            if current is None or current[1] <= event[3]:
+                self.lifecycle[invoice_num] = (event[2], event[3])
+
+    def save_page(self, events, watermark):
+        self.saves += 1
+        inserted = 0
+        for event in events:
+            if event[0] not in self.events:
+                self.events[event[0]] = event
+                self.linked[event[0]] = self.invoice_ids.get(event[1])
+                inserted += 1
+        self._apply_latest(events)
+        self.watermark = max(self.watermark, watermark)
+        return inserted
+
+    def link_orphans(self):
+        orphans = [self.events[event_id] for event_id, num in self.linked.items()
+                   if num is None and self.events[event_id][1] in self.invoice_ids]
+        for event in orphans:
+            self.linked[event[0]] = self.invoice_ids[event[1]]
+        self._apply_latest(orphans)
+        return len(orphans)
+
+
+def _fetcher(client):
+    return lambda after, limit: client.list_invoice_events(VALID_TOKEN, after, limit)
+
+
+def test_sync_pages_and_watermark():
+    """Le flux est lu par pages depuis le watermark ; une 2e synchro ne relit rien."""
+    with PdpStub() as stub:
+        for invoice_id in range(1, 8):
+            stub.add_event(invoice_id, 'fr:200')
+            stub.add_event(invoice_id, 'fr:205', status_text='OK acheteur')
+        client = PdpClient(stub.url, timeout=5)
+        store = MemoryEventStore()
+
+        stats = sync_invoice_events(fetch_page=_fetcher(client), store=store, page_size=5)
+        assert stats == {'pages': 3, 'events': 14, 'inserted': 14, 'watermark': 14}, stats
+        event_calls = [r for r in stub.requests if r[1].startswith('/v1.beta/invoice_events')]
+        assert len(event_calls) == 3
+
+        stats = sync_invoice_events(fetch_page=_fetcher(client), store=store, page_size=5)
+        assert stats['events'] == 0 and stats['watermark'] == 14
+
+        stub.add_event(3, 'fr:212')
+        stats = sync_invoice_events(fetch_page=_fetcher(client), store=store, page_size=5)
+        assert stats['events'] == 1 and store.events[15][1:3] == (3, 'fr:212')
+        assert 'starting_after_id=14' in stub.requests[-1][1]
+        client.close()
+    print("[OK] test_sync_pages_and_watermark")
+
+
+def test_sync_resume_after_interruption():
+    """Une synchro interrompue (max_pages) reprend à la page suivante, sans doublon."""
+    with PdpStub() as stub:
+        for invoice_id in range(1, 11):
+            stub.add_event(invoice_id, 'fr:200')
+        client = PdpClient(stub.url, timeout=5)
+        store = MemoryEventStore()
+
+        first = sync_invoice_events(fetch_page=_fetcher(client), store=store, page_size=4, max_pages=1)
+        assert first['watermark'] == 4
+        second = sync_invoice_events(fetch_page=_fetcher(client), store=store, page_size=4)
+        assert second['pages'] == 2 and second['inserted'] == 6
+        assert sorted(store.events) == list(range(1, 11))
+        client.close()
+    print("[OK] test_sync_resume_after_interruption")
+
+
+def test_events_before_pdp_id():
+    """Événements reçus avant l'identifiant PDP de leur facture : statut appliqué au rattachement."""
+    with PdpStub() as stub:
+        stub.add_event(42, 'fr:200', created_at='2026-03-02T09:00:00Z')
+        stub.add_event(42, 'fr:205', created_at='2026-03-02T10:00:00Z')
+        stub.add_event(7, 'fr:200', created_at='2026-03-02T09:30:00Z')
+        client = PdpClient(stub.url, timeout=5)
+        store = MemoryEventStore()
+        store.invoice_ids[7] = 'FAC-0007'
+
+        sync_invoice_events(fetch_page=_fetcher(client), store=store)
+        assert store.lifecycle == {'FAC-0007': ('fr:200', '2026-03-02T09:30:00Z')}
+
+        # Identifiant écrit par send-pending après la synchro : rattaché à la suivante, sans nouvel événement
+        store.invoice_ids[42] = 'FAC-0042'
+        stats = sync_invoice_events(fetch_page=_fetcher(client), store=store)
+        assert stats['events'] == 0
+        assert store.lifecycle['FAC-0042'] == ('fr:205', '2026-03-02T10:00:00Z')
+        assert store.linked[1] == store.linked[2] == 'FAC-0042'
+        client.close()
+    print("[OK] test_events_before_pdp_id")
+
+
+def test_event_normalization():
+    """Libellés des statuts et rejet des événements incomplets."""
+    assert lifecycle_label('fr:212') == 'Encaissée'
+    assert lifecycle_label('xx:999') == 'xx:999'
+    row = normalize_event({'id': '7', 'invoice_id': 3, 'status_code': 'fr:210',
+                           'created_at': '2026-03-02T09:00:00Z', 'status_text': 'Montant erroné'})
+    assert row == (7, 3, 'fr:210', '2026-03-02T09:00:00Z', 'Montant erroné')
+    try:
+        normalize_event({'id': 8, 'status_code': 'fr:200'})
+        raise AssertionError("ValueError attendue")
+    except ValueError:
+        pass
+    print("[OK] test_event_normalization")
+
+
+if __name__ == '__main__':
+    test_sync_pages_and_watermark()
+    test_sync_resume_after_interruption()
+    test_events_before_pdp_id()
+    test_event_normalization()
+    print("\n=== Tous les tests synchronisation cycle de vie OK ===")
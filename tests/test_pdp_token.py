@@ -0,0 +1,140 @@
+"""
+Tests du gestionnaire de jeton SuperPDP (bouchon local, sans identifiants réels).
+
+Usage: uv run python tests/test_pdp_token.py
+"""
+
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from pdp_stub import PdpStub, VALID_TOKEN
+from utils.pdp_client import PdpClient
+from utils.pdp_token import TokenManager
+
+
+def test_single_flight_refresh():
+    """Des appels concurrents sans jeton ne déclenchent qu'un seul appel /oauth2/token."""
+    with PdpStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        client = PdpClient(stub.url, timeout=5)
+
+        def fetch():
+            time.sleep(0.1)  # laisse tous les threads arriver pendant l'appel
+            return client.fetch_token('sender', 'secret')
+
+        manager = TokenManager(fetch=fetch, cache_path=Path(tmp) / 'token.json')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.get())) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        client.close()
+
+        token_calls = [r for r in stub.requests if r[1] == '/oauth2/token']
+        assert len(token_calls) == 1, len(token_calls)
+        assert manager.fetch_count == 1
+        assert all(r['access_token'] == VALID_TOKEN for r in results)
+        assert (Path(tmp) / 'token.json').exists()
+    print("[OK] test_single_flight_refresh")
+
+
+def test_expiry_and_state():
+    """state() ne fait aucun appel ; get() renouvelle dans la marge d'expiration."""
+    now = [1000.0]
+    calls = []
+
+    def fetch():
+        calls.append(now[0])
+        return {'access_token': f'tok-{len(calls)}', 'expires_in': 1800, 'token_type': 'Bearer'}
+
+    manager = TokenManager(fetch=fetch, cache_path=None, margin=60, clock=lambda: now[0])
+    assert manager.state() == {'access_token': None, 'expires_at': None, 'error': None}
+    assert calls == []
+
+    assert manager.get()['access_token'] == 'tok-1'
+    now[0] += 1700
+    assert manager.get()['access_token'] == 'tok-1'
+    assert manager.state()['expires_at'] == 2800.0
+
+    now[0] += 50  # moins de 60 s avant expiration
+    assert manager.get()['access_token'] == 'tok-2'
+    assert len(calls) == 2
+    print("[OK] test_expiry_and_state")
+
+
+def test_error_state():
+    """Un échec de renouvellement est exposé par state() sans être rejoué."""
+    def fetch():
+        raise RuntimeError("Erreur API SuperPDP: invalid_client")
+
+    manager = TokenManager(fetch=fetch, cache_path=None)
+    try:
+        manager.get()
+        raise AssertionError("RuntimeError attendue")
+    except RuntimeError:
+        pass
+    state = manager.state()
+    assert state['access_token'] is None and 'invalid_client' in state['error']
+    print("[OK] test_error_state")
+
+
+def _process_fetch():
+    time.sleep(0.2)
+    return {'access_token': 'shared-token', 'expires_in': 1800, 'token_type': 'Bearer'}
+
+
+def _process_get(cache_path, out_queue):
+    manager = TokenManager(fetch=_process_fetch, cache_path=cache_path)
+    manager.get()
+    out_queue.put(manager.fetch_count)
+
+
+def test_cross_process_cache():
+    """Plusieurs processus partagent le cache disque : un seul appel réseau au total."""
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = Path(tmp) / 'token.json'
+        out = ctx.Queue()
+        procs = [ctx.Process(target=_process_get, args=(cache_path, out)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(10)
+        counts = [out.get(timeout=5) for _ in procs]
+        assert sum(counts) == 1, counts
+
+        # Un nouveau processus (ou redémarrage) adopte le cache sans appel réseau
+        manager = TokenManager(fetch=_process_fetch, cache_path=cache_path)
+        assert manager.state()['access_token'] == 'shared-token'
+        assert manager.fetch_count == 0
+    print("[OK] test_cross_process_cache")
+
+
+def test_background_refresh():
+    """Le thread de fond obtient le jeton avant toute demande."""
+    manager = TokenManager(fetch=lambda: {'access_token': 'bg', 'expires_in': 1800}, cache_path=None)
+    manager.start()
+    for _ in range(50):
+        if manager.state()['access_token']:
+            break
+        time.sleep(0.02)
+    manager.stop()
+    assert manager.state()['access_token'] == 'bg'
+    assert manager.fetch_count == 1
+    print("[OK] test_background_refresh")
+
+
+if __name__ == '__main__':
+    test_single_flight_refresh()
+    test_expiry_and_state()
+    test_error_state()
+    test_cross_process_cache()
+    test_background_refresh()
+    print("\n=== Tous les tests jeton SuperPDP OK ===")
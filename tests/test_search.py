@@ -0,0 +1,66 @@
+"""
+Tests de la recherche plein texte (texte indexé, requêtes, curseur ; sans base).
+
+Usage: uv run python tests/test_search.py
+"""
+
+import base64
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturx_fixtures import make_facturx_pdf
+from utils.facturx_parser import extract_facturx_xml, parse_facturx_xml
+from utils.search import build_tsquery, decode_cursor, encode_cursor, normalize_search_text, search_document
+
+
+def test_search_document_weights():
+    """Numéro et références en A, parties en B, désignations en C, sans accents."""
+    parsed = parse_facturx_xml(extract_facturx_xml(make_facturx_pdf('FRNS-S01')))
+    parsed['lines'][1]['description'] = 'Livres techniques édition spéciale'
+    weight_a, weight_b, weight_c = search_document(parsed)
+    assert 'frns-s01' in weight_a and 'ref-001' in weight_a and 'po-001' in weight_a
+    assert 'fournisseur test sas' in weight_b and 'acme corporation' in weight_b
+    assert 'fr45987654321' in weight_b
+    assert 'ramettes papier a4' in weight_c and 'edition speciale' in weight_c
+    print("[OK] test_search_document_weights")
+
+
+def test_build_tsquery():
+    """Tous les termes par préfixe ; ponctuation et opérateurs tsquery neutralisés."""
+    assert build_tsquery('Ramette  ACME') == 'ramette:* & acme:*'
+    assert build_tsquery('Équipe') == 'equipe:*'
+    assert build_tsquery('FAC-2026-02') == 'fac:* & 2026:* & 02:*'
+    assert build_tsquery("a' | !b & (c)") == 'a:* & b:* & c:*'
+    assert build_tsquery('  -- !! ') is None
+    assert build_tsquery(' '.join(f"t{i}" for i in range(20))).count(':*') == 8
+    assert normalize_search_text("L'Été") == 'l ete'
+    print("[OK] test_build_tsquery")
+
+
+def test_cursor_roundtrip():
+    """Le curseur de pagination restitue la clé de tri ; un curseur altéré est refusé."""
+    row = {'rank': 0.1, 'invoice_date': '2026-02-10', 'direction': 'received', 'invoice_num': 'F-0001',
+           'company_siret': '11111111100011'}
+    assert decode_cursor(encode_cursor(row)) == [0.1, '2026-02-10', 'received', 'F-0001', '11111111100011']
+    # Même numéro chez un autre fournisseur : clé distincte, la page suivante ne le saute pas
+    homonym = {**row, 'company_siret': '22222222200022'}
+    assert decode_cursor(encode_cursor(homonym)) > decode_cursor(encode_cursor(row))
+    legacy = base64.urlsafe_b64encode(json.dumps([0.1, '2026-02-10', 'sent', 'F-0001']).encode()).decode()
+    for bad in ('xx', encode_cursor(row)[:-4] + '!!!!', legacy):
+        try:
+            decode_cursor(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"Curseur invalide accepté : {bad}")
+    print("[OK] test_cursor_roundtrip")
+
+
+if __name__ == '__main__':
+    test_search_document_weights()
+    test_build_tsquery()
+    test_cursor_roundtrip()
+    print("\nTous les tests de recherche sont passés.")
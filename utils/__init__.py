@@ -3,4 +3,4 @@
 from utils.facturx_generator import generate_facturx_xml
 from utils.pdf_generator import generate_invoice_pdf
 from utils.invoice_calc import calculate_line_totals, calculate_invoice_totals
-from utils.db import get_db_connection, db_cursor, db_connection
+from utils.db import get_db_connection, db_cursor, db_connection, db_server_cursor
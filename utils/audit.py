@@ -0,0 +1,470 @@
+"""
+Audit de conformité des factures archivées (PDF Factur-X et XML).
+
+Chaque facture archivée (PDF de pdf_storage et XML voisin de xml_storage,
+ou PDF référencé par sent_invoices hors de pdf_storage) est revalidée dans
+un pool de processus :
+  - XSD Factur-X du profil détecté (schémas de la librairie factur-x) ;
+  - Schematron EN16931 (XSLT de la librairie factur-x, exécuté par saxonche
+    si le paquet est installé, sinon contrôle signalé comme non exécuté) ;
+  - structure PDF/A-3 : en-tête, métadonnées XMP (pdfaid, extension
+    Factur-X), OutputIntent, pièce jointe XML (AFRelationship), polices
+    embarquées, absence de chiffrement et de JavaScript. Ce n'est pas une
+    validation VeraPDF complète, mais elle couvre les défauts courants ;
+  - cohérence du XML archivé avec le XML embarqué dans le PDF.
+
+Le résultat de chaque facture est écrit dans invoice_audit avec les
+empreintes SHA-256 des fichiers et la version des règles : lors des audits
+suivants, une facture dont les fichiers n'ont pas changé n'est pas revalidée.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from importlib import metadata, resources
+from io import BytesIO
+from pathlib import Path
+
+from utils.db import db_cursor, db_server_cursor
+from utils.facturx_generator import NAMESPACES
+from utils.facturx_parser import filespec_data, find_facturx_filespec
+
+# Version des contrôles : un résultat enregistré sous une autre version est recalculé
+AUDIT_RULES_VERSION = f"1/factur-x-{metadata.version('factur-x')}"
+AUDIT_STATUSES = ('OK', 'ERROR', 'MISSING')
+# Nombre maximal de messages conservés par contrôle
+MAX_MESSAGES = 20
+
+_SVRL_NS = {'svrl': 'http://purl.oclc.org/dsdl/svrl'}
+_BINARY_COMMENT = re.compile(rb'%PDF-\d\.\d[\r\n]+%([^\r\n]*)')
+_PDFAID_PART = re.compile(rb'pdfaid:part(?:>|\s*=\s*["\'])\s*3\b')
+_PDFAID_CONFORMANCE = re.compile(rb'pdfaid:conformance(?:>|\s*=\s*["\'])\s*[ABU]\b')
+_FONT_FILES = ('/FontFile', '/FontFile2', '/FontFile3')
+
+
+def schematron_available() -> bool:
+    """Le Schematron EN16931 peut-il être exécuté (paquet saxonche installé) ?"""
+    return importlib.util.find_spec('saxonche') is not None
+
+
+def _file_sha256(data: bytes | None) -> str | None:
+    return hashlib.sha256(data).hexdigest() if data is not None else None
+
+
+# --- Contrôles XML ---
+
+def _facturx_resource(path: str) -> str:
+    return str(resources.files('facturx').joinpath('xsd_and_schematron', path))
+
+
+@lru_cache(maxsize=None)
+def _xsd_schema(level: str):
+    """Schéma XSD compilé d'un profil (une fois par processus)."""
+    from facturx.facturx import FACTURX_LEVEL2xsd
+    from lxml import etree
+
+    return etree.XMLSchema(file=_facturx_resource(FACTURX_LEVEL2xsd[level]))
+
+
+@lru_cache(maxsize=None)
+def _schematron_executable(level: str):
+    """XSLT Schematron compilé d'un profil (une fois par processus), ou None sans saxonche."""
+    from facturx.facturx import FACTURX_LEVEL2schematron
+    try:
+        from saxonche import PySaxonProcessor
+    except ImportError:
+        return None
+
+    processor = PySaxonProcessor(license=False)
+    executable = processor.new_xslt30_processor().compile_stylesheet(
+        stylesheet_file=_facturx_resource(FACTURX_LEVEL2schematron[level]),
+    )
+    return processor, executable
+
+
+def run_schematron(xml: bytes, level: str) -> list[str] | None:
+    """
+    Messages des règles Schematron en échec (liste vide si conforme), ou None si non exécuté.
+
+    Les assertions marquées `flag="warning"` ne sont pas des erreurs.
+    """
+    from lxml import etree
+
+    compiled = _schematron_executable(level)
+    if compiled is None:
+        return None
+    processor, executable = compiled
+    node = processor.parse_xml(xml_text=xml.decode('utf-8').lstrip('\ufeff'))
+    report = etree.fromstring(executable.transform_to_string(xdm_node=node).encode('utf-8'))
+    messages = []
+    for failed in report.iterfind('.//svrl:failed-assert', _SVRL_NS):
+        if failed.get('flag') == 'warning':
+            continue
+        text = ' '.join((failed.findtext('svrl:text', '', _SVRL_NS) or '').split())
+        messages.append(f"{failed.get('id') or failed.get('location')}: {text}")
+    return messages
+
+
+def check_facturx_xml(xml: bytes, schematron: bool = True) -> dict:
+    """
+    Valide un XML Factur-X (XSD du profil détecté, puis Schematron EN16931).
+
+    Returns:
+        {invoice_num, level, xsd_valid, schematron_valid (None si non exécuté),
+        errors: [{check, message}]}
+    """
+    from facturx import get_level
+    from lxml import etree
+
+    result = {'invoice_num': None, 'level': None, 'xsd_valid': False, 'schematron_valid': None, 'errors': []}
+    try:
+        tree = etree.fromstring(xml)
+        result['level'] = level = get_level(tree, 'factur-x')
+    except Exception as e:
+        result['errors'].append({'check': 'xsd', 'message': f"XML illisible ou profil inconnu : {e}"})
+        return result
+    result['invoice_num'] = tree.findtext('rsm:ExchangedDocument/ram:ID', namespaces=NAMESPACES)
+
+    schema = _xsd_schema(level)
+    result['xsd_valid'] = schema.validate(tree)
+    for entry in list(schema.error_log)[:MAX_MESSAGES]:
+        result['errors'].append({'check': 'xsd', 'message': f"ligne {entry.line} : {entry.message}"})
+
+    if schematron:
+        messages = run_schematron(xml, level)
+        if messages is not None:
+            result['schematron_valid'] = not messages
+            result['errors'].extend({'check': 'schematron', 'message': m} for m in messages[:MAX_MESSAGES])
+    return result
+
+
+# --- Contrôles PDF/A-3 ---
+
+def _font_errors(reader) -> list[str]:
+    """Polices non embarquées (ressources des pages ; les polices Type 3 sont dessinées)."""
+    missing, seen = [], set()
+    for page in reader.pages:
+        resources_dict = page.get('/Resources')
+        fonts = resources_dict.get_object().get('/Font') if resources_dict is not None else None
+        if fonts is None:
+            continue
+        for font in fonts.get_object().values():
+            font = font.get_object()
+            if font.get('/Subtype') == '/Type3':
+                continue
+            name = str(font.get('/BaseFont', '?'))
+            if name in seen:
+                continue
+            seen.add(name)
+            if font.get('/Subtype') == '/Type0':
+                font = font['/DescendantFonts'][0].get_object()
+            descriptor = font.get('/FontDescriptor')
+            descriptor = descriptor.get_object() if descriptor is not None else {}
+            if not any(key in descriptor for key in _FONT_FILES):
+                missing.append(f"Police non embarquée : {name.lstrip('/')}")
+    return missing
+
+
+def check_pdfa_structure(pdf: bytes) -> tuple[list[str], bytes | None]:
+    """
+    Contrôles structurels PDF/A-3 et Factur-X d'un PDF.
+
+    Returns:
+        (messages d'erreur, XML Factur-X embarqué ou None)
+    """
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    header = _BINARY_COMMENT.match(pdf[:1024])
+    if header is None:
+        return ["En-tête %PDF- absent ou non suivi d'un commentaire binaire"], None
+    errors = []
+    if sum(1 for byte in header.group(1) if byte > 127) < 4:
+        errors.append("Commentaire binaire d'en-tête incomplet (4 octets > 127 requis)")
+
+    try:
+        reader = PdfReader(BytesIO(pdf))
+        if reader.is_encrypted:
+            return errors + ["PDF chiffré"], None
+        trailer = reader.trailer
+        catalog = trailer['/Root'].get_object()
+        if '/ID' not in trailer:
+            errors.append("Identifiant de fichier (/ID) absent du trailer")
+
+        metadata_stream = catalog.get('/Metadata')
+        xmp = metadata_stream.get_object().get_data() if metadata_stream is not None else b''
+        if not xmp:
+            errors.append("Métadonnées XMP absentes")
+        else:
+            if not _PDFAID_PART.search(xmp) or not _PDFAID_CONFORMANCE.search(xmp):
+                errors.append("Identification PDF/A-3 (pdfaid:part=3, pdfaid:conformance) absente du XMP")
+            if b'urn:factur-x:pdfa:CrossIndustryDocument:invoice:1p0#' not in xmp:
+                errors.append("Extension XMP Factur-X (fx:DocumentType, fx:ConformanceLevel) absente")
+
+        intents = catalog.get('/OutputIntents')
+        intents = [intent.get_object() for intent in intents.get_object()] if intents is not None else []
+        if not any(intent.get('/S') == '/GTS_PDFA1' and '/DestOutputProfile' in intent for intent in intents):
+            errors.append("OutputIntent GTS_PDFA1 avec profil ICC absent")
+
+        names = catalog.get('/Names')
+        if names is not None and '/JavaScript' in names.get_object():
+            errors.append("JavaScript embarqué interdit en PDF/A")
+
+        embedded = None
+        spec = find_facturx_filespec(catalog)
+        if spec is None:
+            errors.append("Pièce jointe XML Factur-X absente")
+        else:
+            embedded = filespec_data(spec)
+            if '/AFRelationship' not in spec:
+                errors.append("AFRelationship absent de la pièce jointe XML")
+            if '/AF' not in catalog:
+                errors.append("Tableau /AF absent du catalogue")
+
+        errors.extend(_font_errors(reader))
+    except (PyPdfError, KeyError, AttributeError, TypeError, ValueError, IndexError) as e:
+        return errors + [f"PDF illisible : {e}"], None
+    return errors[:MAX_MESSAGES], embedded
+
+
+# --- Audit d'une facture (exécuté dans un processus du pool) ---
+
+def _read(path: str | None) -> bytes | None:
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def audit_document(task: tuple) -> dict:
+    """
+    Audite une facture archivée.
+
+    Args:
+        task: (doc_key, pdf_path, xml_path, known, schematron) ; `known` est le
+            couple d'empreintes (pdf, xml) du dernier audit sous la même version
+            des règles, ou None.
+
+    Returns:
+        {'doc_key', 'unchanged': True} si les fichiers n'ont pas changé depuis
+        le dernier audit, sinon la ligne du rapport (voir store_audit_results).
+    """
+    doc_key, pdf_path, xml_path, known, schematron = task
+    pdf, xml_file = _read(pdf_path), _read(xml_path)
+    hashes = (_file_sha256(pdf), _file_sha256(xml_file))
+    if known is not None and tuple(known) == hashes:
+        return {'doc_key': doc_key, 'unchanged': True}
+
+    row = {
+        'doc_key': doc_key, 'invoice_num': None, 'pdf_path': pdf_path, 'xml_path': xml_path,
+        'pdf_sha256': hashes[0], 'xml_sha256': hashes[1], 'status': 'OK',
+        'xsd_valid': None, 'schematron_valid': None, 'pdfa_valid': None, 'errors': [],
+    }
+    errors = row['errors']
+    if pdf_path is not None and pdf is None:
+        errors.append({'check': 'file', 'message': f"PDF introuvable ou illisible : {pdf_path}"})
+        row['status'] = 'MISSING'
+
+    embedded = None
+    if pdf is not None:
+        pdf_errors, embedded = check_pdfa_structure(pdf)
+        row['pdfa_valid'] = not pdf_errors
+        errors.extend({'check': 'pdfa', 'message': message} for message in pdf_errors)
+
+    if embedded is not None and xml_file is not None and embedded.strip() != xml_file.strip():
+        errors.append({'check': 'consistency', 'message': "XML archivé différent du XML embarqué dans le PDF"})
+
+    xml = embedded if embedded is not None else xml_file
+    if xml is not None:
+        checked = check_facturx_xml(xml, schematron=schematron)
+        row.update(invoice_num=checked['invoice_num'], xsd_valid=checked['xsd_valid'],
+                   schematron_valid=checked['schematron_valid'])
+        errors.extend(checked['errors'])
+    elif pdf is not None:
+        row['xsd_valid'] = False
+
+    if row['status'] == 'OK' and errors:
+        row['status'] = 'ERROR'
+    return row
+
+
+# --- Parcours des archives et rapport ---
+
+def _scan(directory, suffix: str) -> list[str]:
+    if not directory or not os.path.isdir(directory):
+        return []
+    with os.scandir(directory) as entries:
+        return sorted(e.name for e in entries if e.is_file() and e.name.lower().endswith(suffix))
+
+
+def iter_audit_targets(pdf_dir, xml_dir, use_db: bool = True):
+    """
+    Factures à auditer : (doc_key, pdf_path, xml_path), une par nom de fichier sans extension.
+
+    Ordre : PDF de pdf_dir (avec le XML homonyme de xml_dir), PDF référencés
+    par sent_invoices hors de pdf_dir ou absents du disque, puis XML de
+    xml_dir sans PDF.
+    """
+    pdf_dir = Path(pdf_dir).resolve() if pdf_dir else None
+    xml_dir = Path(xml_dir).resolve() if xml_dir else None
+
+    def _sidecar(stem: str) -> str | None:
+        path = xml_dir / f'{stem}.xml' if xml_dir else None
+        return str(path) if path is not None and path.is_file() else None
+
+    for name in _scan(pdf_dir, '.pdf'):
+        stem = name[:-4]
+        yield stem, str(pdf_dir / name), _sidecar(stem)
+
+    referenced = set()
+    if use_db:
+        with db_server_cursor('audit_targets', itersize=5000) as (_conn, cursor):
+            cursor.execute("SELECT pdf_path FROM sent_invoices ORDER BY invoice_num")
+            for (pdf_path,) in cursor:
+                path = Path(pdf_path).resolve()
+                if path.parent == pdf_dir and path.is_file():
+                    continue
+                referenced.add(path.stem)
+                yield path.stem, str(path), _sidecar(path.stem)
+
+    for name in _scan(xml_dir, '.xml'):
+        stem = name[:-4]
+        if stem in referenced or (pdf_dir is not None and (pdf_dir / f'{stem}.pdf').is_file()):
+            continue
+        yield stem, None, str(xml_dir / name)
+
+
+def rules_version(schematron: bool) -> str:
+    """Version des règles enregistrée avec un résultat (un audit sans Schematron est distinct)."""
+    return f"{AUDIT_RULES_VERSION}{'+schematron' if schematron else ''}"
+
+
+def load_known_hashes(doc_keys: list[str], version: str) -> dict:
+    """
+    Empreintes du dernier audit de ces factures sous la version de règles `version`.
+
+    Returns:
+        {doc_key: (pdf_sha256, xml_sha256)}
+    """
+    if not doc_keys:
+        return {}
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            f"""SELECT doc_key, pdf_sha256, xml_sha256 FROM invoice_audit
+                WHERE rules_version = %s AND doc_key IN ({', '.join(['%s'] * len(doc_keys))})""",
+            (version, *doc_keys),
+        )
+        return {key: (pdf_sha, xml_sha) for key, pdf_sha, xml_sha in cursor.fetchall()}
+
+
+_REPORT_COLUMNS = (
+    'doc_key', 'invoice_num', 'pdf_path', 'xml_path', 'pdf_sha256', 'xml_sha256', 'status',
+    'xsd_valid', 'schematron_valid', 'pdfa_valid',
+)
+
+
+def store_audit_results(rows: list[dict], version: str) -> None:
+    """Écrit (ou remplace) les lignes du rapport invoice_audit en une transaction."""
+    if not rows:
+        return
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.executemany(
+            f"""INSERT INTO invoice_audit ({', '.join(_REPORT_COLUMNS)}, errors, rules_version, audited_at)
+                VALUES ({', '.join(['%s'] * (len(_REPORT_COLUMNS) + 2))}, now())
+                ON CONFLICT (doc_key) DO UPDATE SET
+                {', '.join(f'{col} = EXCLUDED.{col}' for col in _REPORT_COLUMNS[1:])},
+                errors = EXCLUDED.errors, rules_version = EXCLUDED.rules_version, audited_at = now()""",
+            [
+                (*(row[col] for col in _REPORT_COLUMNS),
+                 json.dumps(row['errors'], ensure_ascii=False) if row['errors'] else None, version)
+                for row in rows
+            ],
+        )
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def audit_archives(pdf_dir, xml_dir, use_db: bool = True, workers: int = None, chunk_size: int = 500,
+                   schematron: bool = True, force: bool = False, progress=None) -> dict:
+    """
+    Audite les factures archivées et écrit le rapport invoice_audit.
+
+    Les factures sont traitées par paquets de `chunk_size` : empreintes du
+    dernier audit lues en une requête, contrôles répartis sur le pool de
+    processus (deux paquets en vol pour ne pas laisser le pool inactif),
+    résultats écrits en une transaction.
+
+    Args:
+        pdf_dir, xml_dir: Répertoires d'archivage (pdf_storage, xml_storage).
+        use_db: Inclut les PDF référencés par sent_invoices.
+        workers: Nombre de processus (défaut : nombre de CPU).
+        schematron: Exécute le Schematron EN16931 (si saxonche est installé).
+        force: Revalide aussi les factures inchangées.
+        progress: Fonction (stats) appelée après chaque paquet.
+
+    Returns:
+        Statistiques {scanned, unchanged, audited, ok, error, missing}.
+    """
+    schematron = schematron and schematron_available()
+    version = rules_version(schematron)
+    stats = {'scanned': 0, 'unchanged': 0, 'audited': 0, 'ok': 0, 'error': 0, 'missing': 0}
+    chunksize = max(1, min(16, chunk_size // ((workers or os.cpu_count() or 1) * 4)))
+
+    def _collect(results):
+        rows = []
+        for row in results:
+            if row.get('unchanged'):
+                stats['unchanged'] += 1
+                continue
+            stats['audited'] += 1
+            stats[row['status'].lower()] += 1
+            rows.append(row)
+        store_audit_results(rows, version)
+        if progress:
+            progress(dict(stats))
+
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in _chunks(iter_audit_targets(pdf_dir, xml_dir, use_db), chunk_size):
+            stats['scanned'] += len(chunk)
+            known = {} if force else load_known_hashes([key for key, _pdf, _xml in chunk], version)
+            tasks = [(key, pdf, xml, known.get(key), schematron) for key, pdf, xml in chunk]
+            in_flight.append(pool.map(audit_document, tasks, chunksize=chunksize))
+            if len(in_flight) > 1:
+                _collect(in_flight.popleft())
+        while in_flight:
+            _collect(in_flight.popleft())
+    return stats
+
+
+def audit_failures(limit: int = 50) -> list[dict]:
+    """Factures non conformes du dernier audit (doc_key, numéro, statut, erreurs), par nom."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            """SELECT doc_key, invoice_num, status, errors FROM invoice_audit
+               WHERE status <> 'OK'
+               ORDER BY doc_key
+               LIMIT %s""",
+            (limit,),
+        )
+        return [
+            {'doc_key': row[0], 'invoice_num': row[1], 'status': row[2], 'errors': json.loads(row[3] or '[]')}
+            for row in cursor.fetchall()
+        ]
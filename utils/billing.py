@@ -0,0 +1,359 @@
+"""
+Facturation récurrente : modèles de facture par client et runs journalisés.
+
+Un modèle (billing_templates) décrit la facture type d'un client : en-tête,
+lignes et délai d'échéance. Un run (billing_runs) émet, pour une période,
+une facture par modèle actif. À sa création, le run fige dans son journal
+(billing_run_items) la facture complète de chaque modèle, client compris :
+le reprendre plus tard produit exactement les mêmes factures.
+
+Chaque élément du journal est un point de reprise : réservé par lots par
+les workers (bail `claimed_at`, FOR UPDATE SKIP LOCKED sous PostgreSQL),
+émis, puis marqué ISSUED (avec son numéro) ou FAILED. Un run interrompu
+reprend aux éléments non terminés ; l'émission passe par une clé
+d'idempotence propre à l'élément, si bien qu'une facture émise juste avant
+l'interruption, mais pas encore marquée, n'est pas émise une seconde fois.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from datetime import date, timedelta
+
+from utils.db import backend_location, configure_backend, db_cursor, get_backend
+from utils.emitters import DEFAULT_EMITTER, is_valid_emitter_code
+from utils.invoice_input import invoice_data_from_payload
+from utils.invoice_lines import columns_to_lines, line_columns_from_payload, validate_line_columns
+
+ITEM_STATUSES = ('PENDING', 'CLAIMED', 'ISSUED', 'FAILED')
+# Élément réservé par un worker interrompu : repris après ce délai (s)
+CLAIM_LEASE = 120
+# Validité de la clé d'idempotence d'un élément (reprise d'un run des semaines plus tard)
+BILLING_KEY_TTL = 90 * 24 * 3600
+# Marque remplacée par la période du run dans les désignations des lignes
+PERIOD_PLACEHOLDER = '{period}'
+
+_CLIENT_COLUMNS = (
+    'recipient_name', 'cie_legal_form', 'recipient_siret', 'recipient_vat_number', 'recipient_address',
+    'recipient_postal_code', 'recipient_city', 'recipient_country_code',
+)
+
+
+class BillingError(Exception):
+    """Modèle invalide ou run inconnu."""
+
+
+def item_request_key(run_id: str, template_id: int) -> str:
+    """Clé d'idempotence de l'émission d'un élément de run."""
+    return f'billing:{run_id}:{template_id}'
+
+
+# --- Modèles ---
+
+def parse_billing_template(template: dict) -> dict:
+    """
+    Vérifie un modèle et le ramène à sa forme stockée.
+
+    Format : {"invoice": {type_code, currency_code, payment_terms, ...},
+    "lines": [...] (lignes ou colonnes, comme l'API), "due_days": 30,
+    "emitter": "code"} (émetteur facultatif, défaut : ma-conf.txt).
+    Le client et les dates sont fixés à la création du run.
+
+    Raises:
+        BillingError: Modèle invalide (message lisible).
+    """
+    if not isinstance(template, dict):
+        raise BillingError("Modèle invalide : objet JSON attendu")
+    try:
+        invoice_data_from_payload({'invoice': template.get('invoice', {})})
+        columns = line_columns_from_payload(template)
+    except ValueError as e:
+        raise BillingError(str(e)) from e
+    errors = validate_line_columns(columns)
+    if errors:
+        raise BillingError('; '.join(error['message'] for error in errors))
+
+    due_days = template.get('due_days')
+    if due_days is not None and (not isinstance(due_days, int) or isinstance(due_days, bool) or due_days < 0):
+        raise BillingError("due_days doit être un nombre entier de jours positif")
+    emitter = template.get('emitter') or DEFAULT_EMITTER
+    if not is_valid_emitter_code(emitter):
+        raise BillingError(f"Code émetteur invalide: {emitter!r}")
+    return {'invoice': template.get('invoice', {}), 'lines': columns, 'due_days': due_days, 'emitter': emitter}
+
+
+def save_billing_template(client_siret: str, label: str, template: dict, active: bool = True) -> int:
+    """
+    Enregistre (ou remplace) le modèle `label` d'un client de client_metadata.
+
+    Returns:
+        Identifiant du modèle.
+
+    Raises:
+        BillingError: Modèle invalide, client ou émetteur inconnu.
+    """
+    parsed = parse_billing_template(template)
+    stored = json.dumps(parsed, ensure_ascii=False)
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute("SELECT 1 FROM client_metadata WHERE recipient_siret = %s", (client_siret,))
+        if cursor.fetchone() is None:
+            raise BillingError(f"Client {client_siret} inconnu dans client_metadata")
+        if parsed['emitter'] != DEFAULT_EMITTER:
+            cursor.execute("SELECT 1 FROM emitters WHERE emitter_code = %s", (parsed['emitter'],))
+            if cursor.fetchone() is None:
+                raise BillingError(f"Émetteur {parsed['emitter']} inconnu dans emitters")
+        cursor.execute(
+            """INSERT INTO billing_templates (client_siret, label, template, active)
+               VALUES (%s, %s, %s, %s)
+               ON CONFLICT (client_siret, label)
+               DO UPDATE SET template = EXCLUDED.template, active = EXCLUDED.active, updated_at = now()
+               RETURNING id""",
+            (client_siret, label, stored, active),
+        )
+        return cursor.fetchone()[0]
+
+
+def list_billing_templates() -> list[dict]:
+    """Modèles enregistrés, par client puis libellé."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            """SELECT t.id, t.client_siret, c.recipient_name, t.label, t.active
+               FROM billing_templates t
+               JOIN client_metadata c ON c.recipient_siret = t.client_siret
+               ORDER BY c.recipient_name, t.label"""
+        )
+        return [
+            {'id': row[0], 'client_siret': row[1], 'client_name': row[2], 'label': row[3], 'active': bool(row[4])}
+            for row in cursor.fetchall()
+        ]
+
+
+def build_run_invoice(template: dict, client: dict, issue_date: str, period: str) -> dict:
+    """
+    Facture d'un modèle pour un run : client, dates et période résolus.
+
+    Returns:
+        {'invoice': invoice_data, 'lines': [...], 'emitter': code} (numéro attribué à l'émission).
+    """
+    invoice = {**template['invoice'], 'invoice_number': '', 'issue_date': issue_date}
+    if template.get('due_days') is not None:
+        due = date.fromisoformat(issue_date) + timedelta(days=template['due_days'])
+        invoice['due_date'] = due.isoformat()
+    invoice_data = invoice_data_from_payload({'invoice': invoice, 'client': client})
+
+    lines = columns_to_lines(template['lines'])
+    for line in lines:
+        line['description'] = line['description'].replace(PERIOD_PLACEHOLDER, period)
+    return {'invoice': invoice_data, 'lines': lines, 'emitter': template.get('emitter', DEFAULT_EMITTER)}
+
+
+# --- Runs ---
+
+def create_billing_run(run_id: str, period: str, issue_date: str) -> bool:
+    """
+    Crée le run et fige son journal : un élément par modèle actif.
+
+    Run et journal sont écrits dans la même transaction. Si le run existe
+    déjà, rien n'est modifié (son journal et sa date d'émission sont repris
+    tels quels, même si les modèles ont changé depuis).
+
+    Returns:
+        True si le run a été créé, False s'il existait.
+    """
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            """INSERT INTO billing_runs (run_id, period, issue_date) VALUES (%s, %s, %s)
+               ON CONFLICT (run_id) DO NOTHING""",
+            (run_id, period, issue_date),
+        )
+        if cursor.rowcount != 1:
+            return False
+
+        cursor.execute(
+            f"""SELECT t.id, t.template, {', '.join(f'c.{col}' for col in _CLIENT_COLUMNS)}
+                FROM billing_templates t
+                JOIN client_metadata c ON c.recipient_siret = t.client_siret
+                WHERE t.active
+                ORDER BY t.id"""
+        )
+        items = []
+        for template_id, template, *client_values in cursor.fetchall():
+            client = {col: value or '' for col, value in zip(_CLIENT_COLUMNS, client_values)}
+            client['recipient_legal_form'] = client.pop('cie_legal_form')
+            payload = build_run_invoice(json.loads(template), client, issue_date, period)
+            items.append((run_id, template_id, client['recipient_siret'], json.dumps(payload, ensure_ascii=False)))
+
+        cursor.executemany(
+            "INSERT INTO billing_run_items (run_id, template_id, client_siret, payload) VALUES (%s, %s, %s, %s)",
+            items,
+        )
+        cursor.execute("UPDATE billing_runs SET item_count = %s WHERE run_id = %s", (len(items), run_id))
+    return True
+
+
+def claim_run_items(run_id: str, limit: int, lease_seconds: float = CLAIM_LEASE) -> list[tuple[int, dict]]:
+    """
+    Réserve jusqu'à `limit` éléments à émettre (PENDING, ou CLAIMED dont le bail a expiré).
+
+    Returns:
+        Liste de tuples (template_id, payload), dans l'ordre des modèles.
+    """
+    now = time.time()
+    skip_locked = '' if get_backend() == 'sqlite' else 'FOR UPDATE SKIP LOCKED'
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            f"""UPDATE billing_run_items
+                SET status = 'CLAIMED', claimed_at = %s, attempts = attempts + 1
+                WHERE run_id = %s AND template_id IN (
+                    SELECT template_id FROM billing_run_items
+                    WHERE run_id = %s
+                      AND (status = 'PENDING' OR (status = 'CLAIMED' AND claimed_at < %s))
+                    ORDER BY template_id
+                    LIMIT %s
+                    {skip_locked}
+                )
+                RETURNING template_id, payload""",
+            (now, run_id, run_id, now - lease_seconds, limit),
+        )
+        rows = cursor.fetchall()
+    return [(template_id, json.loads(payload)) for template_id, payload in sorted(rows)]
+
+
+def checkpoint_item(run_id: str, template_id: int, status: str, invoice_num: str = None,
+                    error: str = None) -> None:
+    """Enregistre l'issue d'un élément (ISSUED avec son numéro, ou FAILED avec l'erreur)."""
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            """UPDATE billing_run_items
+               SET status = %s, invoice_num = %s, error = %s, claimed_at = NULL, done_at = now()
+               WHERE run_id = %s AND template_id = %s""",
+            (status, invoice_num, error, run_id, template_id),
+        )
+
+
+def run_progress(run_id: str) -> dict:
+    """
+    Avancement d'un run, lu dans son journal.
+
+    Returns:
+        {run_id, period, issue_date, status, total, pending, claimed, issued, failed}
+
+    Raises:
+        BillingError: Run inconnu.
+    """
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            "SELECT period, issue_date, status, item_count FROM billing_runs WHERE run_id = %s", (run_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise BillingError(f"Run {run_id} inconnu")
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM billing_run_items WHERE run_id = %s GROUP BY status", (run_id,),
+        )
+        counts = dict(cursor.fetchall())
+    progress = {
+        'run_id': run_id, 'period': row[0], 'issue_date': str(row[1]), 'status': row[2], 'total': row[3],
+    }
+    progress.update({status.lower(): counts.get(status, 0) for status in ITEM_STATUSES})
+    return progress
+
+
+def run_failures(run_id: str, limit: int = 50) -> list[dict]:
+    """Éléments en erreur d'un run (modèle, client, message), dans l'ordre des modèles."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            """SELECT template_id, client_siret, attempts, error FROM billing_run_items
+               WHERE run_id = %s AND status = 'FAILED'
+               ORDER BY template_id
+               LIMIT %s""",
+            (run_id, limit),
+        )
+        return [
+            {'template_id': row[0], 'client_siret': row[1], 'attempts': row[2], 'error': row[3]}
+            for row in cursor.fetchall()
+        ]
+
+
+def _set_run_status(run_id: str, status: str, column: str) -> None:
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            f"UPDATE billing_runs SET status = %s, {column} = now() WHERE run_id = %s", (status, run_id),
+        )
+
+
+def _init_worker(backend: str, sqlite_path: str | None) -> None:
+    # Processus démarré par spawn/forkserver : même base que le processus parent
+    configure_backend(backend, sqlite_path)
+
+
+def _run_worker(run_id: str, issue, batch_size: int, lease_seconds: float) -> int:
+    """Boucle d'un worker : réserve, émet et marque les éléments jusqu'à épuisement du journal."""
+    processed = 0
+    while True:
+        items = claim_run_items(run_id, batch_size, lease_seconds)
+        if not items:
+            return processed
+        for template_id, payload in items:
+            try:
+                outcome = issue(run_id, template_id, payload)
+            except Exception as e:
+                outcome = {'status': 'FAILED', 'error': f"Erreur inattendue: {e}"}
+            if outcome is None:
+                # Émission en cours ailleurs : l'élément sera repris à l'expiration du bail
+                continue
+            checkpoint_item(run_id, template_id, **outcome)
+            processed += 1
+
+
+def execute_billing_run(run_id: str, issue, workers: int = None, batch_size: int = 10,
+                        lease_seconds: float = CLAIM_LEASE, retry_failed: bool = False,
+                        progress=None, poll_interval: float = 1.0) -> dict:
+    """
+    Exécute (ou reprend) un run dans un pool de processus.
+
+    Args:
+        run_id: Run créé par create_billing_run.
+        issue: Fonction (run_id, template_id, payload) -> {status, invoice_num | error},
+            ou None pour laisser l'élément à reprendre ; exécutée dans les workers
+            (fonction de module, transmissible à un processus).
+        workers: Nombre de processus (défaut : nombre de CPU, 4 au plus).
+        batch_size: Éléments réservés à la fois par un worker.
+        lease_seconds: Bail d'une réservation.
+        retry_failed: Remet les éléments FAILED en attente avant de démarrer.
+        progress: Fonction (stats de run_progress) appelée toutes les poll_interval s.
+
+    Returns:
+        Avancement final (voir run_progress).
+    """
+    stats = run_progress(run_id)
+    if retry_failed and stats['failed']:
+        with db_cursor(commit=True) as (_conn, cursor):
+            cursor.execute(
+                """UPDATE billing_run_items SET status = 'PENDING', error = NULL, done_at = NULL
+                   WHERE run_id = %s AND status = 'FAILED'""",
+                (run_id,),
+            )
+    _set_run_status(run_id, 'RUNNING', 'started_at')
+
+    workers = workers or min(4, os.cpu_count() or 1)
+    backend = get_backend()
+    sqlite_path = backend_location()[1] if backend == 'sqlite' else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(backend, sqlite_path)) as pool:
+        futures = [pool.submit(_run_worker, run_id, issue, batch_size, lease_seconds) for _ in range(workers)]
+        while True:
+            done, running = wait(futures, timeout=poll_interval, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+            if progress:
+                progress(run_progress(run_id))
+            if not running:
+                break
+
+    stats = run_progress(run_id)
+    if not stats['pending'] and not stats['claimed']:
+        _set_run_status(run_id, 'PARTIAL' if stats['failed'] else 'DONE', 'finished_at')
+        stats['status'] = 'PARTIAL' if stats['failed'] else 'DONE'
+    return stats
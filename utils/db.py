@@ -1,13 +1,66 @@
 """
-Context managers pour les connexions PostgreSQL.
+Context managers pour les connexions à la base (PostgreSQL, ou SQLite embarqué).
+
+Le backend est choisi au démarrage (configure_backend) : PostgreSQL par
+défaut, ou fichier SQLite (utils/db_sqlite.py) pour une installation
+mono-poste. db_cursor, db_connection et db_server_cursor s'utilisent de la
+même façon avec les deux backends (paramètres `%s`).
+
+Les lectures lourdes (dashboard, recherche, exports) peuvent être routées
+vers un réplica en lecture seule (DB_REPLICA_URL), via un pool de
+connexions. Si le réplica n'est pas configuré, injoignable ou en retard de
+plus de DB_REPLICA_MAX_LAG secondes, ces lectures retombent sur le primaire
+(en transaction lecture seule).
 """
 
 import os
+import threading
+import time
 from contextlib import contextmanager
 
+# Retard de réplication maximal toléré (s) avant de lire sur le primaire
+REPLICA_MAX_LAG = 10.0
+# Durée (s) pendant laquelle l'état du réplica (retard, disponibilité) est réutilisé
+REPLICA_CHECK_INTERVAL = 5.0
+REPLICA_POOL_SIZE = 10
+
+BACKENDS = ('postgresql', 'sqlite')
+DEFAULT_SQLITE_PATH = './data/factur_x.sqlite3'
+
+_BACKEND = {'name': 'postgresql', 'sqlite_path': DEFAULT_SQLITE_PATH}
+
+
+def configure_backend(name: str, sqlite_path: str = None) -> None:
+    """
+    Sélectionne le backend des connexions ouvertes ensuite.
+
+    Raises:
+        ValueError: Backend inconnu.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de base inconnu : {name}")
+    _BACKEND['name'] = name
+    _BACKEND['sqlite_path'] = sqlite_path or DEFAULT_SQLITE_PATH
+
+
+def get_backend() -> str:
+    """Backend courant : 'postgresql' ou 'sqlite'."""
+    return _BACKEND['name']
+
+
+def backend_location() -> tuple[str, str]:
+    """(hôte, base) affichés par le dashboard et /api/db/test-connection."""
+    if _BACKEND['name'] == 'sqlite':
+        return 'SQLite', _BACKEND['sqlite_path']
+    return os.environ.get('DB_URL', 'localhost'), os.environ.get('DB_NAME', 'k_factur_x')
+
 
 def get_db_connection():
-    """Ouvre et retourne une nouvelle connexion PostgreSQL."""
+    """Ouvre et retourne une nouvelle connexion (PostgreSQL ou fichier SQLite)."""
+    if _BACKEND['name'] == 'sqlite':
+        from utils.db_sqlite import connect
+        return connect(_BACKEND['sqlite_path'])
+
     import psycopg2
     conn = psycopg2.connect(
         host=os.environ.get('DB_URL', 'localhost'),
@@ -20,9 +73,163 @@ def get_db_connection():
     return conn
 
 
+# --- Réplica en lecture seule ---
+
+_REPLICA_POOL = None
+_REPLICA_LOCK = threading.Lock()
+_REPLICA_STATE = {'checked_at': None, 'usable': False, 'lag': None, 'error': None}
+
+
+def replica_configured() -> bool:
+    """Un réplica de lecture est-il configuré (DB_REPLICA_URL, PostgreSQL uniquement) ?"""
+    return _BACKEND['name'] == 'postgresql' and bool(os.environ.get('DB_REPLICA_URL'))
+
+
+def _replica_params() -> dict:
+    """Paramètres du réplica ; base, utilisateur et mot de passe par défaut ceux du primaire."""
+    return {
+        'host': os.environ['DB_REPLICA_URL'],
+        'port': os.environ.get('DB_REPLICA_PORT') or os.environ.get('DB_PORT', '5432'),
+        'dbname': os.environ.get('DB_REPLICA_NAME') or os.environ.get('DB_NAME', 'k_factur_x'),
+        'user': os.environ.get('DB_REPLICA_USER') or os.environ.get('DB_USER', 'postgres'),
+        'password': os.environ.get('DB_REPLICA_PASS') or os.environ.get('DB_PASS', ''),
+    }
+
+
+def _get_replica_pool():
+    global _REPLICA_POOL
+    with _REPLICA_LOCK:
+        if _REPLICA_POOL is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            size = int(os.environ.get('DB_REPLICA_POOL_SIZE') or REPLICA_POOL_SIZE)
+            _REPLICA_POOL = ThreadedConnectionPool(0, size, **_replica_params())
+        return _REPLICA_POOL
+
+
+def replica_lag(conn) -> float:
+    """
+    Retard de réplication (s) vu depuis le réplica.
+
+    0 si tout le WAL reçu est rejoué (un primaire inactif ne fait pas
+    croître le retard), ou si la connexion n'est pas un réplica.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT CASE
+                   WHEN NOT pg_is_in_recovery() THEN 0
+                   WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                   ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+               END"""
+        )
+        lag = float(cursor.fetchone()[0])
+    conn.rollback()
+    return lag
+
+
+def _record_replica_state(usable: bool, lag: float = None, error: str = None) -> None:
+    _REPLICA_STATE.update(checked_at=time.monotonic(), usable=usable, lag=lag, error=error)
+
+
+def _checkout_replica():
+    """Connexion du pool réplica, ou None s'il faut lire sur le primaire."""
+    import psycopg2
+    from psycopg2.pool import PoolError
+
+    checked_at = _REPLICA_STATE['checked_at']
+    fresh = checked_at is not None and time.monotonic() - checked_at < REPLICA_CHECK_INTERVAL
+    if fresh and not _REPLICA_STATE['usable']:
+        return None
+
+    try:
+        pool = _get_replica_pool()
+        conn = pool.getconn()
+    except PoolError:
+        return None  # pool saturé : le primaire absorbe le surplus
+    except psycopg2.Error as e:
+        print(f"[WARNING] Réplica injoignable, lecture sur le primaire: {e}")
+        _record_replica_state(False, error=str(e))
+        return None
+
+    try:
+        conn.set_session(readonly=True, autocommit=False)
+        if not fresh:
+            lag = replica_lag(conn)
+            max_lag = float(os.environ.get('DB_REPLICA_MAX_LAG') or REPLICA_MAX_LAG)
+            _record_replica_state(lag <= max_lag, lag=lag)
+            if lag > max_lag:
+                print(f"[WARNING] Réplica en retard de {lag:.1f}s, lecture sur le primaire")
+                pool.putconn(conn)
+                return None
+    except psycopg2.Error as e:
+        _record_replica_state(False, error=str(e))
+        pool.putconn(conn, close=True)
+        return None
+    return conn
+
+
+def replica_status() -> dict:
+    """État du réplica de lecture : {configured, usable, lag, error} (dernière vérification)."""
+    if not replica_configured():
+        return {'configured': False, 'usable': False, 'lag': None, 'error': None}
+    conn = _checkout_replica()
+    if conn is not None:
+        _get_replica_pool().putconn(conn)
+    return {
+        'configured': True,
+        'usable': _REPLICA_STATE['usable'],
+        'lag': _REPLICA_STATE['lag'],
+        'error': _REPLICA_STATE['error'],
+    }
+
+
 @contextmanager
-def db_cursor(commit=False):
-    """Context manager qui yield (conn, cursor), gère commit/rollback/close."""
+def read_connection():
+    """
+    Context manager qui yield une connexion de lecture (transaction lecture seule).
+
+    Réplica du pool s'il est configuré, disponible et à jour ; sinon
+    nouvelle connexion au primaire. La transaction est annulée à la sortie.
+    """
+    conn = _checkout_replica() if replica_configured() else None
+    if conn is not None:
+        pool = _get_replica_pool()
+        try:
+            yield conn
+        finally:
+            if conn.closed:
+                pool.putconn(conn, close=True)
+            else:
+                conn.rollback()
+                pool.putconn(conn)
+        return
+
+    conn = get_db_connection()
+    conn.set_session(readonly=True)
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            conn.close()
+
+
+@contextmanager
+def db_cursor(commit=False, readonly=False):
+    """
+    Context manager qui yield (conn, cursor), gère commit/rollback/close.
+
+    Avec readonly=True, la lecture est routée vers le réplica si possible
+    (voir read_connection) : à réserver aux requêtes tolérant un léger retard.
+    """
+    if readonly:
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield conn, cursor
+            finally:
+                cursor.close()
+        return
+
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
@@ -38,9 +245,28 @@ def db_cursor(commit=False):
             conn.close()
 
 
+def lock_sent_invoices(conn, scope: str | None = None) -> None:
+    """
+    Verrou d'écriture sur sent_invoices jusqu'à la fin de la transaction (numérotation).
+
+    PostgreSQL : LOCK TABLE ... IN EXCLUSIVE MODE (les lectures restent possibles) ;
+    avec `scope` (code émetteur), verrou consultatif de transaction propre à
+    ce scope : deux émetteurs numérotent en parallèle.
+    SQLite : BEGIN IMMEDIATE, verrou d'écriture de la base (lectures WAL non bloquées).
+    """
+    cursor = conn.cursor()
+    if _BACKEND['name'] == 'sqlite':
+        cursor.execute("BEGIN IMMEDIATE")
+    elif scope is not None:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f'sent_invoices:{scope}',))
+    else:
+        cursor.execute("LOCK TABLE sent_invoices IN EXCLUSIVE MODE")
+    cursor.close()
+
+
 @contextmanager
 def db_connection():
-    """Context manager qui yield conn brut (pour les cas avec LOCK TABLE)."""
+    """Context manager qui yield conn brut (pour les cas avec verrou, voir lock_sent_invoices)."""
     conn = get_db_connection()
     try:
         yield conn
@@ -51,3 +277,74 @@ def db_connection():
     finally:
         if not conn.closed:
             conn.close()
+
+
+@contextmanager
+def db_server_cursor(name: str, itersize: int = 2000, replica: bool = False):
+    """
+    Context manager qui yield (conn, cursor) avec un curseur nommé (côté serveur).
+
+    Les lignes sont rapatriées par lots de `itersize` pendant l'itération :
+    la mémoire reste constante quel que soit le volume du résultat.
+    La transaction est en lecture seule et annulée à la sortie.
+
+    Args:
+        replica: Lire sur le réplica si possible (voir read_connection).
+    """
+    if replica:
+        with read_connection() as conn:
+            cursor = conn.cursor(name=name)
+            cursor.itersize = itersize
+            try:
+                yield conn, cursor
+            finally:
+                if not cursor.closed:
+                    cursor.close()
+        return
+
+    conn = get_db_connection()
+    conn.set_session(readonly=True)
+    cursor = conn.cursor(name=name)
+    cursor.itersize = itersize
+    try:
+        yield conn, cursor
+    finally:
+        if not cursor.closed:
+            cursor.close()
+        if not conn.closed:
+            conn.rollback()
+            conn.close()
+
+
+# Tables partitionnées par année sur invoice_date (migrate_invoices_partitioned.sql)
+PARTITIONED_TABLES = ('sent_invoices', 'incoming_invoices')
+
+
+def ensure_invoice_partitions(years_ahead: int = 1) -> int:
+    """
+    Crée les partitions annuelles manquantes, de l'année en cours à `years_ahead` ans.
+
+    Sans effet sur une base non partitionnée (la fonction SQL retourne 0)
+    ou SQLite.
+
+    Returns:
+        Nombre de partitions créées.
+
+    Raises:
+        psycopg2.Error: Fonction ensure_invoice_partitions absente
+            (create_function_invoice_partitions.sql non appliqué).
+    """
+    from datetime import date
+
+    if _BACKEND['name'] == 'sqlite':
+        return 0
+    today = date.today()
+    created = 0
+    with db_cursor(commit=True) as (_conn, cursor):
+        for table in PARTITIONED_TABLES:
+            cursor.execute(
+                "SELECT ensure_invoice_partitions(%s, %s, %s)",
+                (table, today, date(today.year + years_ahead, 12, 31)),
+            )
+            created += cursor.fetchone()[0]
+    return created
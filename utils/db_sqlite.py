@@ -0,0 +1,163 @@
+"""
+Backend SQLite embarqué (is_db_sqlite=True), alternative à PostgreSQL pour
+une installation mono-poste : numérotation, répertoire clients et dashboard
+sans serveur de base de données.
+
+Le fichier est ouvert en mode WAL (lectures concurrentes d'une écriture) et
+le schéma (resources/sql/sqlite/create_schema.sql) appliqué à la première
+connexion. Les connexions exposent l'interface utilisée par le code
+psycopg2 de l'application (cursor, commit, rollback, closed, set_session) ;
+les requêtes gardent le style de paramètres `%s`, traduit en `?`.
+"""
+
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / 'resources' / 'sql' / 'sqlite' / 'create_schema.sql'
+
+# Attente maximale (s) du verrou d'écriture détenu par une autre connexion
+BUSY_TIMEOUT = 10.0
+
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+_PLACEHOLDER = re.compile(r'%([s%])')
+
+_SCHEMA_LOCK = threading.Lock()
+_INITIALIZED = set()
+
+
+def _adapt_datetime(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(_TIMESTAMP_FORMAT)[:-3]
+
+
+def _convert_timestamp(value: bytes) -> datetime:
+    parsed = datetime.fromisoformat(value.decode())
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _now() -> str:
+    """Equivalent de now() PostgreSQL (UTC, à la milliseconde)."""
+    return _adapt_datetime(datetime.now(timezone.utc))
+
+
+# Mêmes types Python que psycopg2 : date, datetime UTC, Decimal
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+sqlite3.register_converter('NUMERIC', lambda value: Decimal(value.decode()))
+
+
+def translate_sql(sql: str) -> str:
+    """Convertit les paramètres `%s` (et `%%`) du style psycopg2 au style SQLite."""
+    return _PLACEHOLDER.sub(lambda m: '?' if m.group(1) == 's' else '%', sql)
+
+
+class SqliteCursor:
+    """Curseur sqlite3 acceptant les requêtes au format psycopg2."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+        self.closed = False
+        self.itersize = cursor.arraysize
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, sql: str, params=()):
+        self._cursor.execute(translate_sql(sql), tuple(params or ()))
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        self._cursor.executemany(translate_sql(sql), [tuple(p) for p in seq_of_params])
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: int = None):
+        return self._cursor.fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        while True:
+            rows = self._cursor.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self) -> None:
+        if not self.closed:
+            self._cursor.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteConnection:
+    """Connexion sqlite3 avec l'interface psycopg2 utilisée par utils/db.py."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self.closed = False
+
+    def cursor(self, name: str = None) -> SqliteCursor:
+        # Pas de curseur côté serveur : `name` est ignoré, l'itération lit par lots de itersize
+        return SqliteCursor(self._conn.cursor())
+
+    def set_session(self, readonly: bool = None, autocommit: bool = None) -> None:
+        if readonly is not None:
+            self._conn.execute(f"PRAGMA query_only = {'ON' if readonly else 'OFF'}")
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._conn.close()
+            self.closed = True
+
+
+def init_schema(path: str) -> None:
+    """Crée le fichier, passe la base en WAL et applique le schéma (une fois par processus)."""
+    with _SCHEMA_LOCK:
+        if path in _INITIALIZED:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+        finally:
+            conn.close()
+        _INITIALIZED.add(path)
+
+
+def connect(path: str) -> SqliteConnection:
+    """Ouvre une connexion au fichier SQLite (schéma appliqué au premier appel)."""
+    init_schema(path)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES)
+    # WAL : synchronous=NORMAL reste sûr en cas d'arrêt brutal de l'application
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.create_function('now', 0, _now)
+    return SqliteConnection(conn)
@@ -0,0 +1,170 @@
+"""
+Service des PDF archivés : ETag fort, requêtes conditionnelles, Range
+et délégation du transfert au proxy frontal (X-Sendfile / X-Accel-Redirect).
+"""
+
+import hashlib
+import threading
+from pathlib import Path
+
+from flask import Response, request, send_file
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Cache des empreintes : chemin absolu -> (mtime_ns, taille, sha256)
+_ETAG_CACHE: dict[str, tuple[int, int, str]] = {}
+_ETAG_LOCK = threading.Lock()
+
+OFFLOAD_MODES = ('none', 'x-sendfile', 'x-accel-redirect')
+
+
+def _file_signature(path: Path) -> tuple[int, int]:
+    """Retourne (mtime_ns, taille) du fichier."""
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def remember_file_hash(filepath: str, content: bytes) -> str:
+    """
+    Enregistre l'empreinte SHA-256 d'un fichier qui vient d'être écrit.
+
+    Évite de relire le fichier au premier téléchargement : le contenu est
+    déjà en mémoire au moment de l'archivage.
+
+    Returns:
+        L'empreinte SHA-256 hexadécimale.
+    """
+    path = Path(filepath).resolve()
+    digest = hashlib.sha256(content).hexdigest()
+    with _ETAG_LOCK:
+        _ETAG_CACHE[str(path)] = (*_file_signature(path), digest)
+    return digest
+
+
+def compute_file_hash(filepath: str) -> str:
+    """
+    Retourne l'empreinte SHA-256 d'un fichier archivé.
+
+    Le résultat est mis en cache tant que la date de modification et la
+    taille du fichier ne changent pas. Une facture régénérée à l'identique
+    conserve donc le même ETag.
+    """
+    path = Path(filepath).resolve()
+    signature = _file_signature(path)
+
+    with _ETAG_LOCK:
+        cached = _ETAG_CACHE.get(str(path))
+    if cached and cached[:2] == signature:
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _ETAG_LOCK:
+        _ETAG_CACHE[str(path)] = (*signature, digest)
+    return digest
+
+
+def is_within(filepath: str, roots: list[str]) -> bool:
+    """Indique si le fichier se trouve sous l'un des répertoires autorisés."""
+    path = Path(filepath).resolve()
+    for root in roots:
+        try:
+            path.relative_to(Path(root).resolve())
+            return True
+        except ValueError:
+            continue
+    return False
+
+
+def accel_redirect_path(filepath: str, locations) -> str:
+    """
+    Chemin X-Accel-Redirect d'un fichier archivé.
+
+    Args:
+        filepath: Chemin du fichier sur disque.
+        locations: Couples (répertoire de stockage, préfixe de la location
+            interne nginx qui le sert), le premier répertoire contenant le
+            fichier l'emporte.
+
+    Raises:
+        ValueError: Si le fichier n'est sous aucun des répertoires.
+    """
+    path = Path(filepath).resolve()
+    for root, prefix in locations:
+        try:
+            relative = path.relative_to(Path(root).resolve())
+        except ValueError:
+            continue
+        return prefix.rstrip('/') + '/' + relative.as_posix()
+    raise ValueError(f"Aucune location X-Accel-Redirect ne couvre {filepath}")
+
+
+def send_archived_pdf(filepath: str, download_name: str, offload: str = 'none',
+                      accel_locations=()) -> Response:
+    """
+    Construit la réponse HTTP de téléchargement d'un PDF archivé.
+
+    L'ETag fort est l'empreinte SHA-256 du fichier. `If-None-Match` et
+    `Range` sont honorés. Avec `offload` à `x-sendfile` ou `x-accel-redirect`,
+    le corps est laissé vide et le proxy frontal (Apache mod_xsendfile, nginx)
+    se charge du transfert, y compris des requêtes partielles.
+
+    Args:
+        filepath: Chemin du PDF sur disque.
+        download_name: Nom proposé au navigateur.
+        offload: 'none', 'x-sendfile' ou 'x-accel-redirect'.
+        accel_locations: Couples (répertoire de stockage, préfixe de la
+            location interne nginx) : l'en-tête X-Accel-Redirect est le préfixe
+            suivi du chemin relatif au répertoire qui contient le fichier.
+
+    Raises:
+        FileNotFoundError: Si le fichier n'existe pas.
+        ValueError: Si le mode de délégation est inconnu, ou si aucune
+            location X-Accel-Redirect ne couvre le fichier.
+    """
+    path = Path(filepath)
+    if not path.is_file():
+        raise FileNotFoundError(f"PDF introuvable : {filepath}")
+
+    offload = (offload or 'none').lower()
+    if offload not in OFFLOAD_MODES:
+        raise ValueError(f"Mode de délégation inconnu : {offload}")
+
+    accel_path = accel_redirect_path(str(path), accel_locations) if offload == 'x-accel-redirect' else None
+    etag = compute_file_hash(str(path))
+
+    if offload == 'none':
+        response = send_file(
+            path.resolve(),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=download_name,
+            etag=etag,
+            conditional=True,
+            max_age=0,
+        )
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    # Délégation au proxy : on répond nous-mêmes au 304, le reste est servi par le frontal
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = Response(mimetype='application/pdf')
+    response.set_etag(etag)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.no_cache = True
+
+    if offload == 'x-sendfile':
+        response.headers['X-Sendfile'] = str(path.resolve())
+    else:
+        response.headers['X-Accel-Redirect'] = accel_path
+
+    return response
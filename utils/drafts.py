@@ -0,0 +1,140 @@
+"""
+Brouillons de facture côté serveur (état des étapes 1 à 3 de l'assistant).
+
+Le cookie de session Flask ne contient plus que l'identifiant opaque du
+brouillon (`session['draft_id']`) : les données saisies, les lignes et le
+récapitulatif sont écrits dans un fichier JSON par brouillon
+(`draft_storage`, ./data/drafts par défaut). La taille du cookie ne dépend
+donc plus du nombre de lignes, et un brouillon interrompu peut être repris.
+"""
+
+import json
+import os
+import re
+import secrets
+import tempfile
+import time
+from pathlib import Path
+
+# Brouillons non modifiés depuis plus longtemps supprimés à la purge
+DRAFT_MAX_AGE_DAYS = 30
+
+_DRAFT_ID = re.compile(r'^[A-Za-z0-9_-]{22}$')
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def new_draft_id() -> str:
+    """Identifiant opaque et non devinable d'un brouillon."""
+    return secrets.token_urlsafe(16)
+
+
+def is_valid_draft_id(draft_id) -> bool:
+    """L'identifiant a-t-il le format de new_draft_id (pas de chemin) ?"""
+    return isinstance(draft_id, str) and bool(_DRAFT_ID.match(draft_id))
+
+
+class DraftStore:
+    """Brouillons stockés en fichiers JSON (un par brouillon, écriture atomique)."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def _path(self, draft_id: str) -> Path:
+        if not is_valid_draft_id(draft_id):
+            raise ValueError(f"Identifiant de brouillon invalide : {draft_id!r}")
+        return self.directory / f"{draft_id}.json"
+
+    def load(self, draft_id: str) -> dict | None:
+        """Brouillon, ou None s'il n'existe pas (ou plus)."""
+        if not is_valid_draft_id(draft_id):
+            return None
+        try:
+            with open(self._path(draft_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def update(self, draft_id: str, **fields) -> dict:
+        """
+        Met à jour (ou crée) un brouillon avec les champs donnés.
+
+        Champs utilisés par l'application : invoice_data (étape 1), lines
+        (étape 2), invoice_summary (étape 3), step (étape à reprendre).
+
+        Returns:
+            Brouillon enregistré.
+
+        Raises:
+            ValueError: Identifiant invalide.
+        """
+        path = self._path(draft_id)
+        now = time.time()
+        draft = self.load(draft_id) or {'id': draft_id, 'created_at': now}
+        draft.update(fields, updated_at=now)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.draft-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(draft, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return draft
+
+    def delete(self, draft_id: str) -> bool:
+        """Supprime un brouillon ; False s'il n'existait pas."""
+        if not is_valid_draft_id(draft_id):
+            return False
+        try:
+            self._path(draft_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def purge(self, max_age_days: float = DRAFT_MAX_AGE_DAYS) -> int:
+        """Supprime les brouillons non modifiés depuis `max_age_days` jours ; retourne leur nombre."""
+        if not self.directory.is_dir():
+            return 0
+        limit = time.time() - max_age_days * 86400
+        purged = 0
+        for path in self.directory.glob('*.json'):
+            if _mtime(path) < limit:
+                path.unlink(missing_ok=True)
+                purged += 1
+        return purged
+
+    def list_pending(self, limit: int = 20) -> list[dict]:
+        """
+        Brouillons non finalisés (sans récapitulatif), du plus récent au plus ancien.
+
+        Returns:
+            Résumés {id, step, invoice_number, recipient_name, line_count, updated_at}.
+        """
+        if not self.directory.is_dir():
+            return []
+        paths = sorted(self.directory.glob('*.json'), key=_mtime, reverse=True)
+        drafts = []
+        for path in paths:
+            draft = self.load(path.stem)
+            if draft is None or draft.get('invoice_summary'):
+                continue
+            invoice_data = draft.get('invoice_data') or {}
+            drafts.append({
+                'id': draft['id'],
+                'step': draft.get('step', 1),
+                'invoice_number': invoice_data.get('invoice_number', ''),
+                'recipient_name': invoice_data.get('recipient_name', ''),
+                'line_count': len(draft.get('lines') or []),
+                'updated_at': draft['updated_at'],
+            })
+            if len(drafts) >= limit:
+                break
+        return drafts
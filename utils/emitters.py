@@ -0,0 +1,398 @@
+"""
+Profils émetteurs : un processus sert plusieurs sociétés émettrices.
+
+L'émetteur par défaut est celui de ma-conf.txt. Les autres profils sont
+enregistrés dans la table `emitters` (code et configuration JSON aux clés
+de ma-conf.txt) et choisis par requête (en-tête `X-Emitter` de l'API,
+champ `emitter` d'un modèle de facturation).
+
+Un profil est chargé au premier usage dans un cache LRU borné
+(EmitterRegistry) ; ses ressources sont construites à la demande, une
+seule fois : configuration validée, logo et gabarit de page PDF, bloc XML
+vendeur pré-sérialisé. Un profil modifié en base est rechargé au plus tard
+PROFILE_REFRESH secondes après (comparaison de `updated_at`).
+
+Numérotation (préfixe, verrou, dernière facture) et stockage XML/PDF sont
+propres à chaque émetteur.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import ChainMap, OrderedDict
+from functools import cached_property
+from pathlib import Path
+
+from utils.db import db_cursor
+from utils.facturx_generator import seller_party_xml
+from utils.pdf_generator import emitter_layout
+
+DEFAULT_EMITTER = 'default'
+DEFAULT_INVOICE_PREFIX = 'FAC'
+DEFAULT_LOGO = './resources/logos/underwork.jpeg'
+# Profils gardés en mémoire (le moins récemment utilisé est évincé au-delà)
+EMITTER_CACHE_SIZE = 64
+# Délai (s) après lequel un profil en cache est comparé à sa version en base
+PROFILE_REFRESH = 60.0
+
+_CODE_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,39}$')
+_PREFIX_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,19}$')
+
+# Clés propres à un émetteur : jamais héritées de la configuration du processus
+EMITTER_KEYS = (
+    'name', 'address', 'postal_code', 'city', 'country_code', 'siren', 'siret', 'num_tva', 'bic', 'logo',
+    'cie_legal_form', 'cie_IBAN', 'pmt_text', 'pmd_text', 'invoice_prefix', 'xml_storage', 'pdf_storage',
+    'pdf_accel_prefix',
+)
+# Clés admises dans un profil en base (pdf_compact hérité de ma-conf.txt s'il est absent)
+PROFILE_KEYS = EMITTER_KEYS + ('pdf_compact',)
+
+
+class EmitterNotFound(LookupError):
+    """Profil émetteur inconnu ou désactivé."""
+
+
+class EmitterConfigError(ValueError):
+    """Profil émetteur invalide (liste des erreurs dans `errors`)."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def is_valid_emitter_code(code) -> bool:
+    """Code de profil : minuscules, chiffres, `-` et `_`, 40 caractères au plus."""
+    return isinstance(code, str) and bool(_CODE_PATTERN.match(code))
+
+
+def validate_emitter_config(config: dict) -> list[str]:
+    """Valide les champs obligatoires de l'émetteur."""
+    errors = []
+
+    # Validation SIRET (14 chiffres)
+    siret = config.get('siret', '')
+    if not siret:
+        errors.append("SIRET de l'émetteur non renseigné dans la configuration")
+    elif not re.match(r'^\d{14}$', siret):
+        errors.append(f"SIRET de l'émetteur invalide: '{siret}' (doit contenir 14 chiffres)")
+
+    # Validation SIREN (9 chiffres)
+    siren = config.get('siren', '')
+    if not siren:
+        errors.append("SIREN de l'émetteur non renseigné dans la configuration")
+    elif not re.match(r'^\d{9}$', siren):
+        errors.append(f"SIREN de l'émetteur invalide: '{siren}' (doit contenir 9 chiffres)")
+
+    # Validation cohérence SIREN/SIRET
+    if siret and siren and not siret.startswith(siren):
+        errors.append(f"Incohérence SIREN/SIRET: le SIRET '{siret}' devrait commencer par le SIREN '{siren}'")
+
+    # Validation BIC (8 ou 11 caractères alphanumériques)
+    bic = config.get('bic', '')
+    if bic and not re.match(r'^[A-Z]{4}[A-Z]{2}[A-Z0-9]{2}([A-Z0-9]{3})?$', bic.upper()):
+        errors.append(f"BIC invalide: '{bic}' (format attendu: 8 ou 11 caractères)")
+
+    # Validation numéro TVA intracommunautaire (format FR + 11 caractères)
+    num_tva = config.get('num_tva', '')
+    if num_tva and not re.match(r'^[A-Z]{2}[A-Z0-9]{2,13}$', num_tva.upper()):
+        errors.append(f"Numéro TVA invalide: '{num_tva}' (format attendu: code pays + identifiant)")
+
+    # Validation nom obligatoire
+    if not config.get('name', '').strip():
+        errors.append("Nom de l'émetteur non renseigné dans la configuration")
+
+    # Validation forme juridique obligatoire
+    if not config.get('cie_legal_form', '').strip():
+        errors.append("Forme juridique (cie_legal_form) non renseignée dans la configuration")
+
+    # Validation IBAN obligatoire
+    if not config.get('cie_IBAN', '').strip():
+        errors.append("IBAN de l'émetteur (cie_IBAN) non renseigné dans la configuration")
+
+    # Validation texte PMT obligatoire (BR-FR-05)
+    if not config.get('pmt_text', '').strip():
+        errors.append("Texte frais de recouvrement (pmt_text) non renseigné dans la configuration")
+
+    # Validation texte PMD obligatoire (BR-FR-05)
+    if not config.get('pmd_text', '').strip():
+        errors.append("Texte pénalités de retard (pmd_text) non renseigné dans la configuration")
+
+    # Préfixe de numérotation (facultatif)
+    prefix = config.get('invoice_prefix', '')
+    if prefix and not _PREFIX_PATTERN.match(prefix):
+        errors.append(f"Préfixe de numérotation invalide: '{prefix}' (lettres, chiffres, - et _, 20 au plus)")
+
+    return errors
+
+
+def get_logo_path(config: dict) -> str:
+    """Retourne le chemin du logo, avec fallback sur underwork.jpeg."""
+    logo = config.get('logo', '').strip()
+
+    if not logo:
+        # Logo par défaut
+        return DEFAULT_LOGO
+
+    # Vérifier que le fichier existe
+    logo_path = Path(logo)
+    if not logo_path.exists():
+        print(f"[WARNING] Logo introuvable: {logo}, utilisation du logo par défaut")
+        return DEFAULT_LOGO
+
+    return logo
+
+
+def invoice_prefix(code: str, config) -> str:
+    """Préfixe des numéros de facture : invoice_prefix, sinon FAC (défaut) ou FAC-<CODE>."""
+    if config.get('invoice_prefix'):
+        return config['invoice_prefix']
+    return DEFAULT_INVOICE_PREFIX if code == DEFAULT_EMITTER else f'{DEFAULT_INVOICE_PREFIX}-{code.upper()}'
+
+
+def emitter_fields(config: dict) -> dict:
+    """Émetteur (vendeur) des factures, tel qu'attendu par les générateurs XML et PDF."""
+    return {
+        'name': config.get('name', ''),
+        'address': config.get('address', ''),
+        'postal_code': config.get('postal_code', ''),
+        'city': config.get('city', ''),
+        'country_code': config.get('country_code', 'FR'),
+        'siren': config.get('siren', ''),
+        'siret': config.get('siret', ''),
+        'vat_number': config.get('num_tva', ''),
+        'bic': config.get('bic', ''),
+        # HTML/PDF uniquement
+        'legal_form': config.get('cie_legal_form', ''),
+        'iban': config.get('cie_IBAN', ''),
+        # XML Factur-X (notes BR-FR-05)
+        'pmt_text': config.get('pmt_text', ''),
+        'pmd_text': config.get('pmd_text', ''),
+    }
+
+
+class EmitterContext:
+    """
+    Émetteur prêt à émettre : configuration validée et ressources construites à la demande.
+
+    `config` donne d'abord les clés du profil puis, pour les autres, la
+    configuration du processus (lue à chaque accès).
+    """
+
+    def __init__(self, code: str, config, version: str | None = None):
+        self.code = code
+        self.config = config
+        self.version = version
+        self.emitter = emitter_fields(config)
+        self.logo_path = get_logo_path(config)
+        self._layouts = {}
+
+    @property
+    def is_default(self) -> bool:
+        return self.code == DEFAULT_EMITTER
+
+    @property
+    def invoice_prefix(self) -> str:
+        return invoice_prefix(self.code, self.config)
+
+    @property
+    def compact_pdf(self) -> bool:
+        return self.config.get('pdf_compact') is True
+
+    def storage_dir(self, storage_type: str) -> Path:
+        """
+        Répertoire d'archivage (xml ou pdf) de l'émetteur.
+
+        Sans répertoire dans son profil, un émetteur en base archive dans un
+        sous-répertoire `<code>` du stockage de ma-conf.txt.
+        """
+        config_key = f'{storage_type}_storage'
+        defaults = {'xml': './data/factures-xml', 'pdf': './data/factures-pdf'}
+        if self.is_default or self.config.maps[0].get(config_key):
+            return Path(self.config.get(config_key) or defaults[storage_type])
+        return Path(self.config.maps[1].get(config_key) or defaults[storage_type]) / self.code
+
+    def ensure_storage(self) -> None:
+        for storage_type in ('xml', 'pdf'):
+            self.storage_dir(storage_type).mkdir(parents=True, exist_ok=True)
+
+    @cached_property
+    def seller_xml(self) -> str:
+        """Bloc XML SellerTradeParty, sérialisé une fois."""
+        return seller_party_xml(self.emitter)
+
+    def page_layout(self, compact: bool) -> dict:
+        """Gabarit de page PDF (logo chargé ou réduit, blocs de texte), construit une fois par mode."""
+        layout = self._layouts.get(compact)
+        if layout is None:
+            layout = self._layouts[compact] = emitter_layout(self.emitter, self.logo_path, compact)
+        return layout
+
+
+def default_context(config: dict) -> EmitterContext:
+    """Émetteur par défaut : ma-conf.txt (validée au démarrage de l'application)."""
+    return EmitterContext(DEFAULT_EMITTER, ChainMap(config))
+
+
+def profile_context(code: str, profile: dict, base_config: dict, version: str | None = None) -> EmitterContext:
+    """
+    Émetteur d'un profil en base : clés du profil, puis configuration du
+    processus pour les autres (base, sauf les clés propres à l'émetteur).
+
+    Raises:
+        EmitterConfigError: Profil invalide.
+    """
+    errors = validate_profile(profile)
+    if errors:
+        raise EmitterConfigError(errors)
+    # Clés propres absentes du profil : vides plutôt qu'héritées de l'émetteur par défaut
+    own = {key: '' for key in EMITTER_KEYS}
+    own.update(profile)
+    context = EmitterContext(code, ChainMap(own, base_config), version)
+    context.ensure_storage()
+    return context
+
+
+def validate_profile(profile) -> list[str]:
+    """Erreurs d'un profil en base : clés inconnues puis champs obligatoires de l'émetteur."""
+    if not isinstance(profile, dict):
+        return ["Profil invalide : objet JSON attendu"]
+    unknown = sorted(set(profile) - set(PROFILE_KEYS))
+    errors = [f"Clé non admise dans un profil émetteur: '{key}'" for key in unknown]
+    if 'pdf_compact' in profile and not isinstance(profile['pdf_compact'], bool):
+        errors.append("pdf_compact doit valoir true ou false")
+    strings = {key: value for key, value in profile.items() if key != 'pdf_compact'}
+    errors += [f"Valeur texte attendue pour '{key}'" for key, value in strings.items() if not isinstance(value, str)]
+    return errors + validate_emitter_config({key: value for key, value in strings.items() if isinstance(value, str)})
+
+
+# --- Profils en base ---
+
+def save_emitter_profile(code: str, profile: dict, active: bool = True, reserved_prefixes=()) -> None:
+    """
+    Enregistre (ou remplace) le profil `code`.
+
+    `reserved_prefixes` : préfixes déjà pris hors de la table (émetteur par
+    défaut). Deux émetteurs ne peuvent pas partager un préfixe de
+    numérotation : le numéro de facture est unique dans sent_invoices.
+
+    Raises:
+        EmitterConfigError: Code ou profil invalide, préfixe déjà utilisé.
+    """
+    if not is_valid_emitter_code(code) or code == DEFAULT_EMITTER:
+        raise EmitterConfigError([f"Code émetteur invalide: '{code}' (minuscules, chiffres, - et _)"])
+    errors = validate_profile(profile)
+    if errors:
+        raise EmitterConfigError(errors)
+
+    prefix = invoice_prefix(code, profile)
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute("SELECT emitter_code, config FROM emitters WHERE emitter_code <> %s", (code,))
+        taken = {invoice_prefix(other, json.loads(config)).upper(): other for other, config in cursor.fetchall()}
+        taken.update({reserved.upper(): DEFAULT_EMITTER for reserved in reserved_prefixes})
+        owner = taken.get(prefix.upper())
+        if owner is not None:
+            raise EmitterConfigError([f"Préfixe de numérotation '{prefix}' déjà utilisé par '{owner}'"])
+        cursor.execute(
+            """INSERT INTO emitters (emitter_code, config, active)
+               VALUES (%s, %s, %s)
+               ON CONFLICT (emitter_code)
+               DO UPDATE SET config = EXCLUDED.config, active = EXCLUDED.active, updated_at = now()""",
+            (code, json.dumps(profile, ensure_ascii=False), active),
+        )
+
+
+def load_emitter_profile(code: str) -> tuple[dict, str] | None:
+    """(profil, version) d'un profil actif, ou None."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute(
+            "SELECT config, updated_at FROM emitters WHERE emitter_code = %s AND active",
+            (code,),
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), str(row[1])
+
+
+def list_emitter_profiles() -> list[dict]:
+    """Profils enregistrés, par code."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute("SELECT emitter_code, config, active, updated_at FROM emitters ORDER BY emitter_code")
+        rows = cursor.fetchall()
+    profiles = []
+    for code, config, active, updated_at in rows:
+        profile = json.loads(config)
+        profiles.append({
+            'code': code, 'name': profile.get('name', ''), 'siret': profile.get('siret', ''),
+            'invoice_prefix': invoice_prefix(code, profile),
+            'active': bool(active), 'updated_at': updated_at,
+        })
+    return profiles
+
+
+class EmitterRegistry:
+    """
+    Émetteurs servis par le processus : défaut (ma-conf.txt) et profils en
+    base, chargés à la demande (LRU borné, partagé entre threads).
+
+    `use_db` est appelé à chaque chargement : sans base activée, seul
+    l'émetteur par défaut existe.
+    """
+
+    def __init__(self, config: dict, use_db, max_entries: int = EMITTER_CACHE_SIZE,
+                 refresh: float = PROFILE_REFRESH):
+        self.config = config
+        self.use_db = use_db
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.default = default_context(config)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code: str | None = None) -> EmitterContext:
+        """
+        Émetteur `code` (défaut si vide).
+
+        Raises:
+            EmitterNotFound: Profil inconnu, désactivé, ou aucune base activée.
+            EmitterConfigError: Profil en base invalide.
+        """
+        if not code or code == DEFAULT_EMITTER:
+            return self.default
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and now - entry[0] < self.refresh:
+                self._entries.move_to_end(code)
+                return entry[1]
+
+        loaded = load_emitter_profile(code) if is_valid_emitter_code(code) and self.use_db() else None
+        if loaded is None:
+            self.invalidate(code)
+            raise EmitterNotFound(f"Émetteur inconnu: '{code}'")
+        profile, version = loaded
+        if entry is not None and entry[1].version == version:
+            context = entry[1]
+        else:
+            context = profile_context(code, profile, self.config, version)
+
+        with self._lock:
+            self._entries[code] = (now, context)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return context
+
+    def invalidate(self, code: str) -> None:
+        with self._lock:
+            self._entries.pop(code, None)
+
+    def cached_codes(self) -> list[str]:
+        """Codes des profils en cache, du moins au plus récemment utilisé."""
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
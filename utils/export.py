@@ -0,0 +1,355 @@
+"""
+Exports en flux des factures archivées (archive ZIP des PDF et XML,
+écritures comptables CSV / FEC).
+
+Les factures sont lues via un curseur nommé PostgreSQL et les fichiers par
+blocs : la mémoire consommée ne dépend pas du volume exporté et les premiers
+octets partent dès la première facture lue.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+from pathlib import Path
+
+from utils.db import db_server_cursor
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Tables exportables : onglet du dashboard -> table
+EXPORT_TABLES = {
+    'sent': 'sent_invoices',
+    'received': 'incoming_invoices',
+}
+
+
+def _safe_name(invoice_num: str) -> str:
+    """Nettoie le numéro de facture pour l'utiliser dans un nom d'entrée ZIP."""
+    return re.sub(r'[^\w\-]', '_', invoice_num)
+
+
+def iter_invoices_for_export(tab: str, date_from: str, date_to: str,
+                             company_siret: str = None):
+    """
+    Parcourt les factures d'une période via un curseur côté serveur.
+
+    Args:
+        tab: 'sent' (sent_invoices) ou 'received' (incoming_invoices).
+        date_from: Date de début incluse (YYYY-MM-DD).
+        date_to: Date de fin incluse (YYYY-MM-DD).
+        company_siret: Filtre optionnel sur le SIRET du client / fournisseur.
+
+    Yields:
+        Tuples (invoice_num, pdf_path, xml_facture, supplier_siret) ;
+        supplier_siret est None pour les factures émises (numéro unique).
+
+    Raises:
+        ValueError: Si l'onglet est inconnu.
+    """
+    table = EXPORT_TABLES.get(tab)
+    if table is None:
+        raise ValueError(f"Type de factures inconnu : {tab}")
+
+    # Factures reçues : un numéro n'est unique que par fournisseur
+    supplier = 'company_siret' if tab == 'received' else 'NULL'
+    query = (
+        f"SELECT invoice_num, pdf_path, xml_facture::text, {supplier} FROM {table} "
+        "WHERE invoice_date >= %s AND invoice_date <= %s"
+    )
+    params = [date_from, date_to]
+    if company_siret:
+        query += " AND company_siret = %s"
+        params.append(company_siret)
+    query += " ORDER BY invoice_date, invoice_num, company_siret"
+
+    with db_server_cursor(f'export_{tab}', replica=True) as (_conn, cursor):
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+
+
+class _ChunkSink:
+    """Flux d'écriture non positionnable qui accumule les octets produits par zipfile."""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        """Retourne et vide les octets accumulés."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return data
+
+    @property
+    def pending(self) -> int:
+        return self._size
+
+
+def stream_invoices_zip(invoices, chunk_size: int = _CHUNK_SIZE):
+    """
+    Génère une archive ZIP à la volée à partir de factures.
+
+    Chaque facture produit `<numéro>.pdf` (lu par blocs depuis le disque) et
+    `<numéro>.xml` (contenu XML fourni) ; une facture reçue est préfixée du
+    SIRET de son fournisseur (`<siret>_<numéro>.pdf`), deux fournisseurs
+    pouvant employer le même numéro. Les PDF manquants sont ignorés et
+    listés dans `MANQUANTS.txt` en fin d'archive.
+
+    Args:
+        invoices: Itérable de tuples (invoice_num, pdf_path, xml_content[, supplier_siret]).
+        chunk_size: Taille des blocs émis.
+
+    Yields:
+        Blocs d'octets de l'archive ZIP.
+    """
+    sink = _ChunkSink()
+    missing = []
+
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=1, allowZip64=True) as zf:
+        for invoice_num, pdf_path, xml_content, *supplier in invoices:
+            supplier_siret = supplier[0] if supplier else None
+            name = _safe_name(f"{supplier_siret}_{invoice_num}" if supplier_siret else invoice_num)
+
+            pdf = Path(pdf_path) if pdf_path else None
+            if pdf is not None and pdf.is_file():
+                info = zipfile.ZipInfo.from_file(pdf, arcname=f"{name}.pdf")
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(pdf, 'rb') as src, zf.open(info, mode='w', force_zip64=True) as dst:
+                    for block in iter(lambda: src.read(chunk_size), b''):
+                        dst.write(block)
+                        if sink.pending >= chunk_size:
+                            yield sink.drain()
+            else:
+                missing.append(f"{supplier_siret or ''};{invoice_num};{pdf_path or ''}")
+
+            if xml_content:
+                zf.writestr(f"{name}.xml", xml_content)
+
+            if sink.pending >= chunk_size:
+                yield sink.drain()
+
+        if missing:
+            zf.writestr('MANQUANTS.txt', 'company_siret;invoice_num;pdf_path\n' + '\n'.join(missing) + '\n')
+
+    if sink.pending:
+        yield sink.drain()
+
+
+# --- Export comptable (CSV / FEC) ---
+
+# Comptes du plan comptable général utilisés pour les écritures
+ACCOUNTS = {
+    'sent': {
+        'journal': ('VT', 'Ventes'),
+        'third': ('411000', 'Clients'),
+        'base': ('706000', 'Prestations de services'),
+        'vat': ('445710', 'TVA collectée'),
+    },
+    'received': {
+        'journal': ('HA', 'Achats'),
+        'third': ('401000', 'Fournisseurs'),
+        'base': ('607000', 'Achats de marchandises'),
+        'vat': ('445660', 'TVA déductible sur ABS'),
+    },
+}
+
+# Colonnes réglementaires du FEC (art. A47 A-1 du LPF)
+FEC_COLUMNS = [
+    'JournalCode', 'JournalLib', 'EcritureNum', 'EcritureDate', 'CompteNum',
+    'CompteLib', 'CompAuxNum', 'CompAuxLib', 'PieceRef', 'PieceDate',
+    'EcritureLib', 'Debit', 'Credit', 'EcritureLet', 'DateLet', 'ValidDate',
+    'Montantdevise', 'Idevise',
+]
+
+CSV_COLUMNS = [
+    'direction', 'invoice_num', 'type_code', 'invoice_date', 'company_name', 'company_siret',
+    'vat_category', 'vat_rate', 'base_ht', 'vat_amount', 'total_ttc',
+]
+
+# Types de document (UNTDID 1001) des avoirs : écritures inversées
+CREDIT_NOTE_TYPE_CODES = frozenset({'261', '262', '381', '396', '502', '503'})
+
+ACCOUNTING_FORMATS = ('fec', 'csv')
+
+
+def iter_accounting_rows(direction: str, date_from: str, date_to: str):
+    """
+    Parcourt les montants HT/TVA par taux des factures d'une période.
+
+    La ventilation est lue dans invoice_vat_breakdown via un curseur côté
+    serveur, en lecture seule (réplica si configuré). Elle est enregistrée à
+    l'insertion ; celle des factures antérieures est complétée par
+    `cli.py backfill-fields`.
+
+    Yields:
+        Tuples (invoice_num, invoice_date, company_name, company_siret,
+        vat_category, vat_rate, base_ht, vat_amount, type_code), groupés
+        par facture.
+    """
+    table = EXPORT_TABLES.get(direction)
+    if table is None:
+        raise ValueError(f"Type de factures inconnu : {direction}")
+
+    query = (
+        "SELECT i.invoice_num, i.invoice_date, i.company_name, i.company_siret, "
+        "       b.vat_category, b.vat_rate, b.base_ht, b.vat_amount, i.type_code "
+        f"FROM {table} i "
+        "JOIN invoice_vat_breakdown b ON b.direction = %s AND b.company_siret = i.company_siret "
+        "  AND b.invoice_num = i.invoice_num "
+        "WHERE i.invoice_date >= %s AND i.invoice_date <= %s "
+        "ORDER BY i.invoice_date, i.company_siret, i.invoice_num, b.vat_rate DESC, b.vat_category"
+    )
+    with db_server_cursor(f'accounting_{direction}', replica=True) as (_conn, cursor):
+        cursor.execute(query, (direction, date_from, date_to))
+        for row in cursor:
+            yield row
+
+
+def _fec_amount(value) -> str:
+    """Formate un montant FEC (virgule décimale, sans séparateur de milliers)."""
+    return f"{Decimal(value):.2f}".replace('.', ',')
+
+
+def _fec_date(value) -> str:
+    """Formate une date FEC (AAAAMMJJ)."""
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y%m%d')
+    return str(value).replace('-', '')
+
+
+def fec_entries(direction: str, rows, start_num: int = 1):
+    """
+    Transforme les lignes de ventilation en écritures FEC équilibrées.
+
+    Ventes : débit 411 (TTC), crédit 706 (HT) et 44571 (TVA) par taux.
+    Achats : débit 607 (HT) et 44566 (TVA) par taux, crédit 401 (TTC).
+    Les avoirs (CREDIT_NOTE_TYPE_CODES), dont les montants sont positifs
+    dans le XML, passent les mêmes comptes en sens inverse.
+
+    Args:
+        direction: 'sent' ou 'received'.
+        rows: Lignes de iter_accounting_rows (groupées par facture : numéro et SIRET).
+        start_num: Premier numéro d'écriture.
+
+    Yields:
+        Listes de valeurs dans l'ordre de FEC_COLUMNS.
+    """
+    accounts = ACCOUNTS[direction]
+    journal_code, journal_lib = accounts['journal']
+    is_sale = direction == 'sent'
+    num = start_num
+
+    # Une facture : (numéro, SIRET), deux fournisseurs pouvant employer le même numéro
+    for (invoice_num, _siret), group in groupby(rows, key=lambda r: (r[0], r[3])):
+        group = list(group)
+        _, invoice_date, company_name, company_siret = group[0][:4]
+        is_credit_note = group[0][8] in CREDIT_NOTE_TYPE_CODES
+        third_debit = is_sale != is_credit_note
+        piece_date = _fec_date(invoice_date)
+        ecriture_num = f"{journal_code}{num:08d}"
+        label = f"{'Avoir' if is_credit_note else 'Facture'} {invoice_num} {company_name}"[:100]
+
+        def entry(account, amount, is_debit, aux=('', ''), lib=label):
+            return [
+                journal_code, journal_lib, ecriture_num, piece_date,
+                account[0], account[1], aux[0], aux[1], invoice_num, piece_date,
+                lib, _fec_amount(amount if is_debit else 0),
+                _fec_amount(0 if is_debit else amount), '', '', piece_date, '', '',
+            ]
+
+        total_ttc = sum((r[6] + r[7] for r in group), Decimal('0'))
+        third = entry(accounts['third'], total_ttc, third_debit, (company_siret, company_name))
+
+        detail = []
+        for row in group:
+            vat_category, vat_rate, base_ht, vat_amount = row[4:8]
+            rate_label = f"{label[:80]} TVA {vat_rate}% {vat_category}"
+            detail.append(entry(accounts['base'], base_ht, not third_debit, lib=rate_label))
+            if vat_amount:
+                detail.append(entry(accounts['vat'], vat_amount, not third_debit, lib=rate_label))
+
+        if is_sale:
+            yield third
+            yield from detail
+        else:
+            yield from detail
+            yield third
+        num += 1
+
+
+def stream_accounting_export(directions: list[str], date_from: str, date_to: str,
+                             fmt: str = 'fec', flush_rows: int = 1000):
+    """
+    Génère en flux l'export comptable d'une période.
+
+    Args:
+        directions: Liste parmi 'sent' et 'received'.
+        date_from: Date de début incluse (YYYY-MM-DD).
+        date_to: Date de fin incluse (YYYY-MM-DD).
+        fmt: 'fec' (tabulations, ISO-8859-15) ou 'csv' (point-virgule, UTF-8,
+            une ligne par facture et par taux avec type de document et
+            HT/TVA/TTC tels qu'au XML).
+        flush_rows: Nombre de lignes regroupées par bloc émis.
+
+    Yields:
+        Blocs d'octets.
+    """
+    if fmt not in ACCOUNTING_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt}")
+
+    buffer = io.StringIO()
+    if fmt == 'fec':
+        writer = csv.writer(buffer, delimiter='\t', lineterminator='\r\n', quoting=csv.QUOTE_NONE,
+                            escapechar=None, quotechar=None)
+        writer.writerow(FEC_COLUMNS)
+        encoding = 'iso-8859-15'
+    else:
+        writer = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+        writer.writerow(CSV_COLUMNS)
+        encoding = 'utf-8'
+
+    def _drain() -> bytes:
+        data = buffer.getvalue().encode(encoding, errors='replace')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    pending = 0
+    for direction in directions:
+        rows = iter_accounting_rows(direction, date_from, date_to)
+        if fmt == 'fec':
+            records = fec_entries(direction, rows)
+        else:
+            records = (
+                [direction, r[0], r[8] or '', str(r[1]), r[2], r[3], r[4], f"{r[5]:.2f}",
+                 f"{r[6]:.2f}", f"{r[7]:.2f}", f"{r[6] + r[7]:.2f}"]
+                for r in rows
+            )
+        for record in records:
+            if fmt == 'fec':
+                # Le FEC n'autorise ni tabulation ni saut de ligne dans les champs
+                record = [str(v).replace('\t', ' ').replace('\r', ' ').replace('\n', ' ') for v in record]
+            writer.writerow(record)
+            pending += 1
+            if pending >= flush_rows:
+                yield _drain()
+                pending = 0
+
+    tail = _drain()
+    if tail:
+        yield tail
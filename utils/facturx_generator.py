@@ -6,8 +6,8 @@ Basé sur la norme EN 16931 et le standard Factur-X 1.07 (UN/CEFACT CII D22B).
 
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
 from xml.etree import ElementTree as ET
-from xml.dom import minidom
 
 from utils.invoice_calc import calculate_line_totals, calculate_invoice_totals
 
@@ -27,8 +27,9 @@ def _register_namespaces():
         ET.register_namespace(prefix, uri)
 
 
+@lru_cache(maxsize=None)
 def _qname(ns: str, tag: str) -> str:
-    """Génère un nom qualifié avec namespace."""
+    """Génère un nom qualifié avec namespace (une chaîne partagée par tous les éléments du même nom)."""
     return f'{{{NAMESPACES[ns]}}}{tag}'
 
 
@@ -106,12 +107,54 @@ def _add_note(parent, text: str, subject_code: str = None):
     return note
 
 
+# Élément vide remplacé par le bloc vendeur (un texte de facture ne peut pas produire de balise)
+_SELLER_PLACEHOLDER = '<ram:SellerTradeParty />'
+# Profondeur de SellerTradeParty sous la racine (Transaction > Agreement > SellerTradeParty)
+_SELLER_LEVEL = 3
+
+
+def seller_party_xml(emitter: dict) -> str:
+    """
+    Bloc SellerTradeParty de l'émetteur, sérialisé et indenté à sa place dans le document.
+
+    Ne dépend que de l'émetteur : construit une fois par profil émetteur
+    (voir utils/emitters.py) et passé à generate_facturx_xml dans
+    data['seller_xml'].
+    """
+    _register_namespaces()
+    seller = ET.Element(_qname('ram', 'SellerTradeParty'))
+    seller_name = ET.SubElement(seller, _qname('ram', 'Name'))
+    seller_name.text = emitter['name']
+
+    # Identifiants légaux du vendeur (SIREN — 9 chiffres, BR-FR-10)
+    seller_legal = ET.SubElement(seller, _qname('ram', 'SpecifiedLegalOrganization'))
+    seller_siren = ET.SubElement(seller_legal, _qname('ram', 'ID'))
+    seller_siren.set('schemeID', '0002')
+    seller_siren.text = emitter['siren']
+
+    # Adresse du vendeur (BT-35..BT-40)
+    _add_postal_address(seller, emitter['address'], emitter['city'], None, emitter['country_code'])
+
+    # Adresse électronique du vendeur (BT-34, BR-FR-13)
+    _add_uri_endpoint(seller, emitter['siret'])
+
+    # TVA du vendeur
+    if emitter.get('vat_number'):
+        _add_tax_registration(seller, emitter['vat_number'])
+
+    ET.indent(seller, space='  ', level=_SELLER_LEVEL)
+    xml = ET.tostring(seller, encoding='unicode')
+    # Le namespace est déclaré sur la racine du document
+    return xml.replace(f' xmlns:ram="{NAMESPACES["ram"]}"', '', 1)
+
+
 def generate_facturx_xml(data: dict) -> str:
     """
     Génère le XML Factur-X au profil BASIC.
 
     Args:
         data: Dictionnaire contenant 'emitter', 'invoice', et 'lines'
+            (et 'seller_xml', bloc vendeur déjà sérialisé, facultatif)
 
     Returns:
         Chaîne XML formatée
@@ -238,26 +281,8 @@ def generate_facturx_xml(data: dict) -> str:
         buyer_ref = ET.SubElement(agreement, _qname('ram', 'BuyerReference'))
         buyer_ref.text = invoice['buyer_reference']
 
-    # Vendeur (émetteur)
-    seller = ET.SubElement(agreement, _qname('ram', 'SellerTradeParty'))
-    seller_name = ET.SubElement(seller, _qname('ram', 'Name'))
-    seller_name.text = emitter['name']
-
-    # Identifiants légaux du vendeur (SIREN — 9 chiffres, BR-FR-10)
-    seller_legal = ET.SubElement(seller, _qname('ram', 'SpecifiedLegalOrganization'))
-    seller_siren = ET.SubElement(seller_legal, _qname('ram', 'ID'))
-    seller_siren.set('schemeID', '0002')
-    seller_siren.text = emitter['siren']
-
-    # Adresse du vendeur (BT-35..BT-40)
-    _add_postal_address(seller, emitter['address'], emitter['city'], None, emitter['country_code'])
-
-    # Adresse électronique du vendeur (BT-34, BR-FR-13)
-    _add_uri_endpoint(seller, emitter['siret'])
-
-    # TVA du vendeur
-    if emitter.get('vat_number'):
-        _add_tax_registration(seller, emitter['vat_number'])
+    # Vendeur (émetteur) : bloc pré-sérialisé inséré après la sérialisation
+    ET.SubElement(agreement, _qname('ram', 'SellerTradeParty'))
 
     # Acheteur (client)
     buyer = ET.SubElement(agreement, _qname('ram', 'BuyerTradeParty'))
@@ -368,14 +393,8 @@ def generate_facturx_xml(data: dict) -> str:
     due_payable = ET.SubElement(monetary_sum, _qname('ram', 'DuePayableAmount'))
     due_payable.text = _format_amount(invoice_totals['total_ttc'])
 
-    # Génération du XML formaté
-    xml_string = ET.tostring(root, encoding='unicode')
-    dom = minidom.parseString(xml_string)
-    pretty_xml = dom.toprettyxml(indent='  ', encoding='UTF-8')
-
-    # Retirer la ligne XML générée par minidom et la remplacer
-    lines_list = pretty_xml.decode('utf-8').split('\n')
-    if lines_list[0].startswith('<?xml'):
-        lines_list[0] = '<?xml version="1.0" encoding="UTF-8"?>'
-
-    return '\n'.join(lines_list)
+    # Génération du XML formaté (indentation en place : pas de second arbre DOM en mémoire)
+    ET.indent(root, space='  ')
+    xml = ET.tostring(root, encoding='unicode')
+    seller_xml = data.get('seller_xml') or seller_party_xml(emitter)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml.replace(_SELLER_PLACEHOLDER, seller_xml, 1) + '\n'
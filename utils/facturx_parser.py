@@ -0,0 +1,220 @@
+"""
+Lecture des XML Factur-X (CII) : extraction des champs métier utiles
+à l'archivage, à la comptabilité et à la recherche.
+
+Pendant de facturx_generator : mêmes namespaces, mêmes chemins d'éléments.
+"""
+
+import io
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree as ET
+
+from utils.facturx_generator import NAMESPACES
+
+
+class FacturXParseError(ValueError):
+    """XML Factur-X illisible ou incomplet."""
+
+
+def _text(node, path: str) -> str:
+    """Retourne le texte (nettoyé) du premier élément trouvé, ou ''."""
+    if node is None:
+        return ''
+    found = node.find(path, NAMESPACES)
+    if found is None or found.text is None:
+        return ''
+    return found.text.strip()
+
+
+def _amount(node, path: str) -> Decimal | None:
+    """Retourne un montant Decimal, ou None si absent / invalide."""
+    value = _text(node, path)
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def _date(node, path: str) -> str:
+    """Convertit une date CII (format 102, YYYYMMDD) en date ISO, ou ''."""
+    value = _text(node, path)
+    if not value:
+        return ''
+    try:
+        return datetime.strptime(value, '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return value
+
+
+def _party(node) -> dict:
+    """Extrait l'identité d'une partie (vendeur / acheteur)."""
+    return {
+        'name': _text(node, 'ram:Name'),
+        'legal_id': _text(node, 'ram:SpecifiedLegalOrganization/ram:ID'),
+        'siret': _text(node, 'ram:URIUniversalCommunication/ram:URIID'),
+        'vat_number': _text(node, "ram:SpecifiedTaxRegistration/ram:ID[@schemeID='VA']"),
+        'city': _text(node, 'ram:PostalTradeAddress/ram:CityName'),
+        'country_code': _text(node, 'ram:PostalTradeAddress/ram:CountryID'),
+    }
+
+
+def parse_facturx_xml(xml) -> dict:
+    """
+    Extrait les champs métier d'un XML Factur-X (profil EN16931 / BASIC).
+
+    Args:
+        xml: Contenu XML (str ou bytes).
+
+    Returns:
+        Dictionnaire : invoice_number, type_code, issue_date, due_date,
+        currency_code, buyer_reference, purchase_order_reference, seller,
+        buyer, total_ht, total_vat, total_ttc, vat_breakdown (liste de
+        {vat_category, rate, base_ht, vat_amount, vat_exemption_code,
+        vat_exemption_reason}) et lines (liste de {description, net_ht}).
+
+    Raises:
+        FacturXParseError: Si le XML est invalide ou n'est pas une facture CII.
+    """
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    try:
+        root = ET.fromstring(xml)
+    except ET.ParseError as e:
+        raise FacturXParseError(f"XML Factur-X invalide : {e}")
+
+    if root.tag != f"{{{NAMESPACES['rsm']}}}CrossIndustryInvoice":
+        raise FacturXParseError(f"Racine inattendue : {root.tag}")
+
+    doc = root.find('rsm:ExchangedDocument', NAMESPACES)
+    transaction = root.find('rsm:SupplyChainTradeTransaction', NAMESPACES)
+    if doc is None or transaction is None:
+        raise FacturXParseError("ExchangedDocument ou SupplyChainTradeTransaction absent")
+
+    agreement = transaction.find('ram:ApplicableHeaderTradeAgreement', NAMESPACES)
+    settlement = transaction.find('ram:ApplicableHeaderTradeSettlement', NAMESPACES)
+    summation = None
+    if settlement is not None:
+        summation = settlement.find('ram:SpecifiedTradeSettlementHeaderMonetarySummation', NAMESPACES)
+
+    vat_breakdown = []
+    if settlement is not None:
+        for tax in settlement.findall('ram:ApplicableTradeTax', NAMESPACES):
+            vat_breakdown.append({
+                'vat_category': _text(tax, 'ram:CategoryCode'),
+                'rate': _amount(tax, 'ram:RateApplicablePercent') or Decimal('0'),
+                'base_ht': _amount(tax, 'ram:BasisAmount') or Decimal('0'),
+                'vat_amount': _amount(tax, 'ram:CalculatedAmount') or Decimal('0'),
+                'vat_exemption_code': _text(tax, 'ram:ExemptionReasonCode'),
+                'vat_exemption_reason': _text(tax, 'ram:ExemptionReason'),
+            })
+
+    lines = []
+    for item in transaction.findall('ram:IncludedSupplyChainTradeLineItem', NAMESPACES):
+        lines.append({
+            'description': _text(item, 'ram:SpecifiedTradeProduct/ram:Name'),
+            'net_ht': _amount(
+                item,
+                'ram:SpecifiedLineTradeSettlement/'
+                'ram:SpecifiedTradeSettlementLineMonetarySummation/ram:LineTotalAmount',
+            ),
+        })
+
+    seller = agreement.find('ram:SellerTradeParty', NAMESPACES) if agreement is not None else None
+    buyer = agreement.find('ram:BuyerTradeParty', NAMESPACES) if agreement is not None else None
+
+    return {
+        'invoice_number': _text(doc, 'ram:ID'),
+        'type_code': _text(doc, 'ram:TypeCode'),
+        'issue_date': _date(doc, 'ram:IssueDateTime/udt:DateTimeString'),
+        'due_date': _date(settlement, 'ram:SpecifiedTradePaymentTerms/ram:DueDateDateTime/udt:DateTimeString'),
+        'currency_code': _text(settlement, 'ram:InvoiceCurrencyCode'),
+        'buyer_reference': _text(agreement, 'ram:BuyerReference'),
+        'purchase_order_reference': _text(agreement, 'ram:BuyerOrderReferencedDocument/ram:IssuerAssignedID'),
+        'seller': _party(seller),
+        'buyer': _party(buyer),
+        'total_ht': _amount(summation, 'ram:TaxBasisTotalAmount'),
+        'total_vat': _amount(summation, 'ram:TaxTotalAmount'),
+        'total_ttc': _amount(summation, 'ram:GrandTotalAmount'),
+        'vat_breakdown': vat_breakdown,
+        'lines': lines,
+    }
+
+
+# Noms de la pièce jointe XML selon les versions Factur-X / ZUGFeRD
+FACTURX_FILENAMES = ('factur-x.xml', 'facturx.xml', 'zugferd-invoice.xml', 'xrechnung.xml')
+
+
+def _iter_name_tree(node, depth: int = 0):
+    """Parcourt un arbre de noms PDF (/Names et /Kids) : (nom, valeur)."""
+    if node is None or depth > 32:
+        return
+    node = node.get_object()
+    names = node.get('/Names')
+    if names is not None:
+        names = names.get_object()
+        for i in range(0, len(names) - 1, 2):
+            yield names[i], names[i + 1]
+    for kid in node.get('/Kids') or []:
+        yield from _iter_name_tree(kid, depth + 1)
+
+
+def find_facturx_filespec(catalog):
+    """
+    Cherche la pièce jointe XML Factur-X dans l'arbre /Names/EmbeddedFiles du catalogue.
+
+    Returns:
+        Dictionnaire de la spécification de fichier (/Filespec), ou None.
+    """
+    names = catalog.get('/Names')
+    tree = names.get_object().get('/EmbeddedFiles') if names is not None else None
+    for name, spec in _iter_name_tree(tree):
+        spec = spec.get_object()
+        filename = str(spec.get('/UF') or spec.get('/F') or name)
+        if filename.lower() in FACTURX_FILENAMES and spec.get('/EF') is not None:
+            return spec
+    return None
+
+
+def filespec_data(spec) -> bytes | None:
+    """Contenu du fichier embarqué d'une spécification de fichier, ou None."""
+    embedded = spec['/EF'].get_object()
+    stream = embedded.get('/F') or embedded.get('/UF')
+    return stream.get_object().get_data() if stream is not None else None
+
+
+def extract_facturx_xml(pdf) -> bytes:
+    """
+    Extrait le XML Factur-X embarqué dans un PDF.
+
+    Seuls la table des références, le catalogue et l'arbre /Names/EmbeddedFiles
+    sont lus (résolution paresseuse des objets) : les pages, polices et
+    images du document ne sont jamais décodées.
+
+    Args:
+        pdf: Chemin du fichier ou contenu PDF (bytes).
+
+    Returns:
+        Contenu XML (bytes).
+
+    Raises:
+        FacturXParseError: Si le PDF est illisible ou ne contient pas de XML Factur-X.
+    """
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    source = io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else open(pdf, 'rb')
+    try:
+        try:
+            catalog = PdfReader(source).trailer['/Root'].get_object()
+            spec = find_facturx_filespec(catalog)
+            data = filespec_data(spec) if spec is not None else None
+            if data is not None:
+                return data
+        except (PyPdfError, KeyError, AttributeError, TypeError, ValueError) as e:
+            raise FacturXParseError(f"PDF Factur-X illisible : {e}")
+    finally:
+        source.close()
+    raise FacturXParseError("Aucun XML Factur-X embarqué dans le PDF")
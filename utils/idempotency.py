@@ -0,0 +1,252 @@
+"""
+Émission idempotente des factures (clés de requête et réutilisation du résultat).
+
+Chaque émission est rattachée à une clé : la clé fournie par le client de
+l'API (en-tête `Idempotency-Key`), ou à défaut l'empreinte du contenu
+normalisé de la facture (invoice_content_hash). La clé est réservée avant la
+génération ; une requête rejouée (double clic, nouvel essai après un délai
+dépassé) reçoit le résultat enregistré sans nouveau rendu ni nouveau numéro.
+
+Les résultats sont gardés en mémoire quelques minutes (ResultCache) et, si
+une base est activée, dans la table invoice_requests, partagée par tous les
+processus : c'est elle qui sérialise deux requêtes simultanées. Le résultat
+y est écrit dans la transaction même qui insère la facture (record) : une
+réservation reprise après l'interruption de son processus ne peut donc pas
+émettre une seconde fois une facture déjà enregistrée.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from utils.db import db_cursor
+from utils.invoice_input import INVOICE_DEFAULTS
+from utils.invoice_lines import LINE_FIELDS
+
+# Durée de validité d'une clé fournie par le client, et d'une empreinte de contenu
+KEY_TTL = 24 * 3600
+CONTENT_TTL = 10 * 60
+# Réservation abandonnée (processus interrompu) reprise après ce délai
+PENDING_TIMEOUT = 120
+MAX_KEY_LENGTH = 200
+
+_NUMERIC_FIELDS = ('quantity', 'unit_price_ht', 'vat_rate', 'discount_value')
+
+
+class IdempotencyConflict(Exception):
+    """Clé déjà utilisée pour une facture différente."""
+
+
+class IdempotencyInProgress(Exception):
+    """Émission en cours pour cette clé (requête concurrente)."""
+
+
+def is_valid_key(key) -> bool:
+    """Clé de requête acceptable : texte imprimable non vide, MAX_KEY_LENGTH caractères au plus."""
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+def _number(value: str) -> str:
+    try:
+        number = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return value
+    return f'{number.normalize():f}' if number.is_finite() else value
+
+
+def invoice_content_hash(invoice_data: dict, lines: list[dict], auto_numbering: bool = False) -> str:
+    """
+    Empreinte SHA-256 du contenu normalisé d'une facture (en-tête et lignes).
+
+    Espaces superflus et écritures équivalentes des nombres (10, 10.00) sont
+    ignorés. En numérotation automatique, le numéro (attribué à l'émission)
+    n'entre pas dans l'empreinte.
+    """
+    header = {field: str(invoice_data.get(field) or '').strip() for field in INVOICE_DEFAULTS}
+    if auto_numbering:
+        del header['invoice_number']
+    normalized = []
+    for line in lines:
+        values = {field: str(line.get(field) or '').strip() for field in LINE_FIELDS}
+        for field in _NUMERIC_FIELDS:
+            values[field] = _number(values[field])
+        normalized.append(values)
+    payload = json.dumps({'invoice': header, 'lines': normalized}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Résultats récents en mémoire (LRU borné, expiration par entrée), partagés entre threads."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[str, dict] | None:
+        """(empreinte, résultat) encore valide pour la clé, ou None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, content_hash, result = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return content_hash, result
+
+    def put(self, key: str, content_hash: str, result: dict, ttl: float | None = None) -> None:
+        expires = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._entries[key] = (expires, content_hash, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class IdempotencyStore:
+    """
+    Réservation des clés et résultats d'émission (mémoire + table invoice_requests).
+
+    `use_db` est appelé à chaque opération : la table n'est utilisée que si
+    une base est activée ; sinon les réservations restent propres au processus.
+    """
+
+    def __init__(self, use_db, cache: ResultCache | None = None):
+        self.use_db = use_db
+        self.cache = cache or ResultCache()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, content_hash: str, ttl: float = KEY_TTL) -> dict | None:
+        """
+        Réserve la clé avant une émission.
+
+        Returns:
+            None si la clé est réservée (l'appelant émet puis appelle complete
+            ou release), ou le résultat déjà enregistré pour ce même contenu.
+
+        Raises:
+            IdempotencyConflict: Clé déjà utilisée pour un autre contenu.
+            IdempotencyInProgress: Émission en cours ailleurs pour cette clé.
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._replay(cached[0], cached[1], content_hash)
+
+        if self.use_db():
+            return self._claim_db(key, content_hash, ttl)
+
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None and pending[1] > now - PENDING_TIMEOUT:
+                if pending[0] != content_hash:
+                    raise IdempotencyConflict(key)
+                raise IdempotencyInProgress(key)
+            self._pending[key] = (content_hash, now)
+        return None
+
+    @staticmethod
+    def _replay(stored_hash: str, result: dict, content_hash: str) -> dict:
+        if stored_hash != content_hash:
+            raise IdempotencyConflict()
+        return result
+
+    def _claim_db(self, key: str, content_hash: str, ttl: float) -> dict | None:
+        now = time.time()
+        with db_cursor(commit=True) as (_conn, cursor):
+            cursor.execute(
+                "DELETE FROM invoice_requests WHERE request_key = %s AND expires_at < %s", (key, now),
+            )
+            cursor.execute(
+                """INSERT INTO invoice_requests (request_key, content_hash, claimed_at, expires_at)
+                   VALUES (%s, %s, %s, %s)
+                   ON CONFLICT (request_key) DO NOTHING""",
+                (key, content_hash, now, now + ttl),
+            )
+            if cursor.rowcount == 1:
+                return None
+
+            cursor.execute(
+                "SELECT content_hash, result, claimed_at, expires_at FROM invoice_requests WHERE request_key = %s",
+                (key,),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise IdempotencyInProgress(key)
+            stored_hash, result, claimed_at, expires_at = row
+            if stored_hash != content_hash:
+                raise IdempotencyConflict(key)
+            if result is not None:
+                result = json.loads(result)
+                self.cache.put(key, stored_hash, result, ttl=min(self.cache.ttl, expires_at - now))
+                return result
+
+            # Réservation abandonnée par un processus interrompu : reprise
+            if claimed_at < now - PENDING_TIMEOUT:
+                cursor.execute(
+                    """UPDATE invoice_requests SET claimed_at = %s
+                       WHERE request_key = %s AND result IS NULL AND claimed_at = %s""",
+                    (now, key, claimed_at),
+                )
+                if cursor.rowcount == 1:
+                    return None
+            raise IdempotencyInProgress(key)
+
+    def record(self, conn, key: str, result: dict) -> None:
+        """
+        Enregistre le résultat dans la transaction d'émission (connexion `conn`).
+
+        La facture et le résultat de sa clé sont validés ensemble : si le
+        processus s'arrête avant complete, la reprise de la réservation
+        trouve le résultat au lieu de réémettre.
+        """
+        if not self.use_db():
+            return
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE invoice_requests SET result = %s, invoice_num = %s WHERE request_key = %s",
+            (json.dumps(result, ensure_ascii=False), result.get('invoice_number'), key),
+        )
+        cursor.close()
+
+    def complete(self, key: str, content_hash: str, result: dict, ttl: float = KEY_TTL) -> None:
+        """Enregistre le résultat (JSON) d'une émission réservée par claim."""
+        if self.use_db():
+            with db_cursor(commit=True) as (_conn, cursor):
+                cursor.execute(
+                    "UPDATE invoice_requests SET result = %s, invoice_num = %s WHERE request_key = %s",
+                    (json.dumps(result, ensure_ascii=False), result.get('invoice_number'), key),
+                )
+        with self._lock:
+            self._pending.pop(key, None)
+        # Sans base, la mémoire est le seul stockage : le résultat y reste toute la durée de la clé
+        self.cache.put(key, content_hash, result, ttl=None if self.use_db() else ttl)
+
+    def release(self, key: str) -> None:
+        """Libère une réservation après un échec d'émission (la requête pourra être rejouée)."""
+        with self._lock:
+            self._pending.pop(key, None)
+        if self.use_db():
+            with db_cursor(commit=True) as (_conn, cursor):
+                cursor.execute(
+                    "DELETE FROM invoice_requests WHERE request_key = %s AND result IS NULL", (key,),
+                )
+
+    def purge(self) -> int:
+        """Supprime les clés expirées de la table ; retourne leur nombre."""
+        if not self.use_db():
+            return 0
+        with db_cursor(commit=True) as (_conn, cursor):
+            cursor.execute("DELETE FROM invoice_requests WHERE expires_at < %s", (time.time(),))
+            return cursor.rowcount
@@ -0,0 +1,216 @@
+"""
+Ingestion des factures reçues déposées dans un répertoire (PDF Factur-X).
+
+Les PDF sont empreintés (SHA-256 du contenu) : un fichier déjà ingéré est
+écarté par simple recherche dans l'ensemble des empreintes connues, sans
+être parsé. L'empreinte impose de relire le fichier ; un cache
+chemin -> (mtime_ns, taille, empreinte) l'évite pour les fichiers inchangés
+depuis le passage précédent (mode surveillance). Les autres sont traités dans un pool de processus
+(extraction du XML embarqué par l'arbre EmbeddedFiles, à défaut le fichier
+`facturx-<numéro>.xml` voisin, puis parsing et validation), et insérés
+dans incoming_invoices par lots.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from utils.db import db_cursor, db_server_cursor
+from utils.facturx_parser import FacturXParseError, extract_facturx_xml, parse_facturx_xml
+from utils.invoice_store import incoming_invoice_from_parsed, insert_incoming_invoices
+
+_HASH_BLOCK = 1024 * 1024
+# Un fichier modifié depuis moins de STABLE_AGE s est peut-être encore en cours de copie
+STABLE_AGE = 2.0
+
+
+def file_sha256(path) -> str:
+    """Empreinte SHA-256 (hexadécimale) du contenu d'un fichier, lu par blocs."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_pdf_files(directory, min_age: float = 0.0) -> list[Path]:
+    """Liste les PDF d'un répertoire (non récursif), par nom, en ignorant les fichiers trop récents."""
+    now = time.time()
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith('.pdf'):
+                continue
+            if min_age and now - entry.stat().st_mtime < min_age:
+                continue
+            files.append(Path(entry.path))
+    return sorted(files)
+
+
+def _sidecar_xml(pdf_path: Path) -> Path:
+    """`facture-<numéro>.pdf` -> `facturx-<numéro>.xml` dans le même répertoire."""
+    stem = pdf_path.stem
+    if stem.startswith('facture-'):
+        stem = stem[len('facture-'):]
+    return pdf_path.with_name(f"facturx-{stem}.xml")
+
+
+def parse_invoice_file(pdf_path: str, content_sha256: str) -> dict:
+    """
+    Lit une facture reçue (exécuté dans un processus du pool).
+
+    Returns:
+        Dictionnaire prêt pour insert_incoming_invoices.
+
+    Raises:
+        FacturXParseError: XML absent, invalide ou incomplet.
+    """
+    path = Path(pdf_path)
+    try:
+        xml_content = extract_facturx_xml(path)
+    except FacturXParseError:
+        sidecar = _sidecar_xml(path)
+        if not sidecar.is_file():
+            raise
+        xml_content = sidecar.read_bytes()
+
+    parsed = parse_facturx_xml(xml_content)
+    return incoming_invoice_from_parsed(parsed, xml_content, str(path), content_sha256=content_sha256)
+
+
+def _parse_safe(args: tuple) -> tuple:
+    pdf_path, content_sha256 = args
+    try:
+        return 'ok', parse_invoice_file(pdf_path, content_sha256)
+    except FacturXParseError as e:
+        return 'invalid', str(e)
+    except OSError as e:
+        return 'invalid', f"Lecture impossible : {e}"
+
+
+def load_known_hashes() -> set[str]:
+    """Empreintes des factures reçues déjà en base (curseur côté serveur)."""
+    known = set()
+    with db_server_cursor('ingest_hashes', itersize=10000) as (_conn, cursor):
+        cursor.execute("SELECT content_sha256 FROM incoming_invoices WHERE content_sha256 IS NOT NULL")
+        for (digest,) in cursor:
+            known.add(digest)
+    return known
+
+
+def insert_invoice_batch(invoices: list[dict]) -> int:
+    """Insère un lot de factures reçues dans une transaction."""
+    with db_cursor(commit=True) as (_conn, cursor):
+        return len(insert_incoming_invoices(cursor, invoices))
+
+
+def _cached_sha256(path: Path, seen: dict, current: dict) -> str:
+    """Empreinte d'un fichier, relue seulement si sa date de modification ou sa taille a changé."""
+    st = path.stat()
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = seen.get(str(path))
+    digest = cached[1] if cached and cached[0] == signature else file_sha256(path)
+    current[str(path)] = (signature, digest)
+    return digest
+
+
+def ingest_directory(directory, workers: int = None, batch_size: int = 200, known: set = None,
+                     insert=insert_invoice_batch, min_age: float = 0.0, progress=None,
+                     seen: dict = None) -> dict:
+    """
+    Ingère les PDF Factur-X d'un répertoire dans incoming_invoices.
+
+    Args:
+        directory: Répertoire à parcourir.
+        workers: Nombre de processus de parsing (défaut : nombre de CPU).
+        batch_size: Nombre de factures par insertion.
+        known: Empreintes déjà ingérées (défaut : lues en base) ; complété au fil de l'eau.
+        seen: Cache chemin -> ((mtime_ns, taille), empreinte) du passage précédent ;
+            mis à jour avec les fichiers présents.
+        insert: Fonction (invoices) -> nombre inséré.
+        min_age: Âge minimal (s) d'un fichier pour être traité.
+        progress: Fonction (stats) appelée après chaque lot inséré.
+
+    Returns:
+        Statistiques {scanned, skipped, parsed, inserted, invalid}.
+    """
+    known = load_known_hashes() if known is None else known
+    stats = {'scanned': 0, 'skipped': 0, 'parsed': 0, 'inserted': 0, 'invalid': 0}
+
+    todo = []
+    current = {}
+    for path in scan_pdf_files(directory, min_age):
+        stats['scanned'] += 1
+        try:
+            digest = _cached_sha256(path, seen or {}, current)
+        except FileNotFoundError:
+            # Supprimé ou déplacé depuis le parcours
+            continue
+        if digest in known:
+            stats['skipped'] += 1
+            continue
+        known.add(digest)
+        todo.append((str(path), digest))
+    if seen is not None:
+        # Les fichiers retirés du répertoire sortent du cache
+        seen.clear()
+        seen.update(current)
+
+    if not todo:
+        return stats
+
+    batch = []
+
+    def _flush():
+        stats['inserted'] += insert(batch)
+        batch.clear()
+        if progress:
+            progress(dict(stats))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, min(32, len(todo) // ((workers or os.cpu_count() or 1) * 4)))
+        for (pdf_path, digest), (outcome, value) in zip(todo, pool.map(_parse_safe, todo, chunksize=chunksize)):
+            if outcome == 'ok':
+                stats['parsed'] += 1
+                batch.append(value)
+                if len(batch) >= batch_size:
+                    _flush()
+            else:
+                stats['invalid'] += 1
+                # Fichier corrigé puis redéposé : nouvelle empreinte, il sera retraité
+                print(f"[WARNING] {pdf_path} ignoré : {value}")
+
+    if batch:
+        _flush()
+    return stats
+
+
+def watch_directory(directory, interval: float = 10.0, stop=None, **kwargs) -> None:
+    """
+    Surveille un répertoire et ingère les nouveaux PDF à chaque passage.
+
+    Les empreintes connues sont lues une fois puis tenues à jour en mémoire ;
+    un fichier inchangé (même mtime_ns, même taille) n'est pas relu pour être
+    empreinté à nouveau. Les fichiers en cours de copie (modifiés depuis moins de STABLE_AGE s)
+    sont traités au passage suivant.
+
+    Args:
+        interval: Délai (s) entre deux passages.
+        stop: threading.Event optionnel d'arrêt.
+        **kwargs: Transmis à ingest_directory.
+    """
+    known = kwargs.pop('known', None)
+    known = load_known_hashes() if known is None else known
+    kwargs.setdefault('min_age', STABLE_AGE)
+    seen = kwargs.pop('seen', None)
+    seen = {} if seen is None else seen
+    while stop is None or not stop.is_set():
+        stats = ingest_directory(directory, known=known, seen=seen, **kwargs)
+        if stats['parsed'] or stats['invalid']:
+            print(f"[OK] {stats['inserted']} facture(s) ingérée(s), {stats['invalid']} illisible(s)")
+        if stop is not None:
+            stop.wait(interval)
+        else:
+            time.sleep(interval)
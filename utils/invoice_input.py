@@ -0,0 +1,64 @@
+"""
+Lecture des données d'en-tête d'une facture (formulaire step1 ou API JSON).
+
+Le formulaire de l'étape 1 et l'API REST (`/api/v1/invoices`) produisent le
+même dictionnaire `invoice_data` (INVOICE_DEFAULTS), validé par
+validate_step1 puis émis par issue_invoice avec les lignes de l'étape 2.
+"""
+
+# Champs de l'en-tête et valeur par défaut (formulaire step1)
+INVOICE_DEFAULTS = {
+    'invoice_number': '',
+    'type_code': '380',
+    'currency_code': 'EUR',
+    'issue_date': '',
+    'due_date': '',
+    'buyer_reference': '',
+    'purchase_order_reference': '',
+    'payment_terms': '',
+    'recipient_name': '',
+    'recipient_legal_form': '',
+    'recipient_siret': '',
+    'recipient_vat_number': '',
+    'recipient_address': '',
+    'recipient_postal_code': '',
+    'recipient_city': '',
+    'recipient_country_code': 'FR',
+}
+
+# Nombre maximal de factures par appel à /api/v1/invoices/batch
+API_BATCH_MAX = 500
+
+
+def _text(value, default: str) -> str:
+    if value is None:
+        return default
+    return value if isinstance(value, str) else str(value)
+
+
+def invoice_data_from_form(form_data) -> dict:
+    """En-tête de facture lu dans le formulaire step1."""
+    return {field: form_data.get(field, default) for field, default in INVOICE_DEFAULTS.items()}
+
+
+def invoice_data_from_payload(payload: dict) -> dict:
+    """
+    En-tête de facture d'un corps JSON de l'API.
+
+    Format : {"invoice": {<champs de INVOICE_DEFAULTS>}, "client": {...}, "lines": ...}.
+    Les champs du client s'écrivent sans le préfixe `recipient_` dans
+    "client" (name, siret, vat_number, address, postal_code, city,
+    country_code, legal_form) ; ils peuvent aussi figurer dans "invoice".
+
+    Raises:
+        ValueError: "invoice" ou "client" n'est pas un objet.
+    """
+    header = payload.get('invoice', {})
+    client = payload.get('client', {})
+    if not isinstance(header, dict) or not isinstance(client, dict):
+        raise ValueError("Corps JSON invalide : objets 'invoice' et 'client' attendus")
+
+    values = dict(header)
+    for key, value in client.items():
+        values.setdefault(key if key.startswith('recipient_') else f'recipient_{key}', value)
+    return {field: _text(values.get(field), default).strip() for field, default in INVOICE_DEFAULTS.items()}
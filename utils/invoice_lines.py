@@ -0,0 +1,288 @@
+"""
+Lecture et validation des lignes de facture envoyées par l'étape 2.
+
+Les lignes arrivent soit en formulaire (`lines[<i>][<champ>]`), soit en JSON
+(`POST /invoice`, Content-Type application/json) :
+  - colonnes : {"lines": {"description": [...], "quantity": [...], ...}}
+    (format envoyé par le template step2, noms de champs transmis une fois) ;
+  - lignes : {"lines": [{"description": ..., "quantity": ...}, ...]}.
+Dans les deux cas les lignes sont mises en colonnes et validées champ par
+champ en une passe (validate_line_columns), puis converties en dictionnaires
+pour les calculs (columns_to_lines).
+
+Les lignes importées depuis un CSV ou collées depuis un tableur sont mises
+dans les mêmes colonnes (line_columns_from_csv).
+"""
+
+import csv
+import io
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+# Champs d'une ligne et valeur par défaut (formulaire step2)
+LINE_DEFAULTS = {
+    'description': '',
+    'quantity': '',
+    'unit_price_ht': '',
+    'vat_rate': '20',
+    'discount_value': '',
+    'discount_type': 'percent',
+    'vat_category': '',
+    'vat_exemption_code': '',
+    'vat_exemption_reason': '',
+}
+LINE_FIELDS = tuple(LINE_DEFAULTS)
+
+# Catégories TVA à taux 0 exigeant un code VATEX ou un motif
+EXEMPT_CATEGORIES = ('E', 'AE', 'G', 'K', 'O')
+
+MAX_LINES = 10000
+
+_FORM_KEY = re.compile(r'lines\[(\d+)\]\[(\w+)\]')
+
+# En-têtes CSV reconnus (normalisés : minuscules, sans accents ni ponctuation)
+CSV_HEADERS = {
+    'description': 'description', 'libelle': 'description', 'designation': 'description',
+    'quantity': 'quantity', 'quantite': 'quantity', 'qte': 'quantity',
+    'unit price ht': 'unit_price_ht', 'prix unitaire ht': 'unit_price_ht', 'prix unitaire': 'unit_price_ht',
+    'pu ht': 'unit_price_ht', 'prix ht': 'unit_price_ht',
+    'vat rate': 'vat_rate', 'tva': 'vat_rate', 'taux tva': 'vat_rate', 'taux de tva': 'vat_rate',
+    'discount value': 'discount_value', 'rabais': 'discount_value', 'remise': 'discount_value',
+    'discount type': 'discount_type', 'type rabais': 'discount_type', 'type de rabais': 'discount_type',
+    'vat category': 'vat_category', 'categorie tva': 'vat_category', 'categorie': 'vat_category',
+    'vat exemption code': 'vat_exemption_code', 'code vatex': 'vat_exemption_code', 'vatex': 'vat_exemption_code',
+    'vat exemption reason': 'vat_exemption_reason', 'motif d exoneration': 'vat_exemption_reason',
+    'motif exoneration': 'vat_exemption_reason', 'motif': 'vat_exemption_reason',
+}
+
+_CSV_NUMBERS = ('quantity', 'unit_price_ht', 'vat_rate', 'discount_value')
+
+
+def _text(value, default: str) -> str:
+    if value is None:
+        return default
+    return value if isinstance(value, str) else str(value)
+
+
+def _decimal(value: str) -> Decimal | None:
+    """Décimal fini, ou None si la valeur n'est pas un nombre."""
+    try:
+        number = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return number if number.is_finite() else None
+
+
+def line_columns_from_form(form_data) -> dict[str, list[str]]:
+    """
+    Colonnes des lignes d'un formulaire `lines[<i>][<champ>]` (une seule passe sur les clés).
+
+    Les lignes sont ordonnées par indice ; les champs absents prennent leur valeur par défaut.
+    """
+    rows = {}
+    for key, value in form_data.items():
+        match = _FORM_KEY.fullmatch(key)
+        if match and match.group(2) in LINE_DEFAULTS:
+            rows.setdefault(int(match.group(1)), {})[match.group(2)] = value
+    ordered = [rows[idx] for idx in sorted(rows)]
+    return {field: [row.get(field, default) for row in ordered] for field, default in LINE_DEFAULTS.items()}
+
+
+def line_columns_from_payload(payload) -> dict[str, list[str]]:
+    """
+    Colonnes des lignes d'un corps JSON (format colonnes ou liste de lignes).
+
+    Raises:
+        ValueError: Corps mal formé (colonnes de longueurs différentes, ligne
+            qui n'est pas un objet, plus de MAX_LINES lignes...).
+    """
+    lines = payload.get('lines') if isinstance(payload, dict) else None
+
+    if isinstance(lines, dict):
+        sizes = {len(values) for values in lines.values() if isinstance(values, list)}
+        if len(sizes) != 1 or any(not isinstance(v, list) for k, v in lines.items() if k in LINE_DEFAULTS):
+            raise ValueError("Colonnes de lignes invalides : listes de même longueur attendues")
+        count = sizes.pop()
+        if count > MAX_LINES:
+            raise ValueError(f"Trop de lignes ({count}, maximum {MAX_LINES})")
+        return {
+            field: [_text(v, default) for v in lines[field]] if field in lines else [default] * count
+            for field, default in LINE_DEFAULTS.items()
+        }
+
+    if isinstance(lines, list):
+        if len(lines) > MAX_LINES:
+            raise ValueError(f"Trop de lignes ({len(lines)}, maximum {MAX_LINES})")
+        if any(not isinstance(line, dict) for line in lines):
+            raise ValueError("Lignes invalides : objets attendus")
+        return {
+            field: [_text(line.get(field), default) for line in lines]
+            for field, default in LINE_DEFAULTS.items()
+        }
+
+    raise ValueError("Corps JSON invalide : clé 'lines' (colonnes ou liste de lignes) attendue")
+
+
+def lines_to_columns(lines: list[dict]) -> dict[str, list[str]]:
+    """Met en colonnes une liste de lignes (dictionnaires)."""
+    return {
+        field: [_text(line.get(field), default) for line in lines]
+        for field, default in LINE_DEFAULTS.items()
+    }
+
+
+def columns_to_lines(columns: dict[str, list[str]]) -> list[dict]:
+    """Reconstitue les lignes (dictionnaires de LINE_FIELDS) à partir des colonnes."""
+    return [dict(zip(LINE_FIELDS, values)) for values in zip(*(columns[field] for field in LINE_FIELDS))]
+
+
+def validate_line_columns(columns: dict[str, list[str]]) -> list[dict]:
+    """
+    Valide les lignes mises en colonnes, colonne par colonne.
+
+    Mêmes règles et messages que la validation ligne à ligne de l'étape 2 :
+    description obligatoire, quantité et prix unitaire numériques et > 0,
+    taux de TVA et rabais (facultatifs) numériques et >= 0, rabais en
+    pourcentage au plus de 100 %, catégorie (et code VATEX ou motif)
+    obligatoires pour un taux de 0 %.
+
+    Returns:
+        Erreurs {field, message}, triées par ligne puis par champ.
+    """
+    descriptions = columns['description']
+    if not descriptions:
+        return [{'field': 'lines', 'message': 'La facture doit contenir au moins une ligne'}]
+
+    found = []
+    for i, description in enumerate(descriptions):
+        if not description.strip():
+            found.append((i, 0, 'description', 'la description est obligatoire'))
+
+    for rank, (field, label, invalid) in enumerate((
+        ('quantity', 'la quantité doit être supérieure à 0', 'quantité invalide'),
+        ('unit_price_ht', 'le prix unitaire doit être supérieur à 0', 'prix unitaire invalide'),
+    ), start=1):
+        for i, number in enumerate(map(_decimal, columns[field])):
+            if number is None:
+                found.append((i, rank, field, invalid))
+            elif number <= 0:
+                found.append((i, rank, field, label))
+
+    # Taux et rabais vides : valeurs par défaut (20 %, pas de rabais)
+    rates = [None if value == '' else _decimal(value) for value in columns['vat_rate']]
+    for i, (value, rate) in enumerate(zip(columns['vat_rate'], rates)):
+        if value == '':
+            continue
+        if rate is None:
+            found.append((i, 3, 'vat_rate', 'taux de TVA invalide'))
+        elif rate < 0:
+            found.append((i, 3, 'vat_rate', 'le taux de TVA ne peut pas être négatif'))
+
+    categories = columns['vat_category']
+    for i, rate in enumerate(rates):
+        if rate != 0:  # None (taux vide) : 20 % par défaut
+            continue
+        category = categories[i].strip()
+        if not category:
+            found.append((i, 4, 'vat_category', 'la catégorie TVA est obligatoire quand le taux est à 0%'))
+        elif (category in EXEMPT_CATEGORIES and not columns['vat_exemption_code'][i].strip()
+              and not columns['vat_exemption_reason'][i].strip()):
+            found.append((i, 4, 'vat_exemption_code',
+                          f"un code VATEX ou un motif d'exonération est requis pour la catégorie {category}"))
+
+    discount_types = columns['discount_type']
+    for i, value in enumerate(columns['discount_value']):
+        if value == '':
+            continue
+        discount = _decimal(value)
+        if discount is None:
+            found.append((i, 5, 'discount_value', 'rabais invalide'))
+        elif discount < 0:
+            found.append((i, 5, 'discount_value', 'le rabais ne peut pas être négatif'))
+        elif discount_types[i] == 'percent' and discount > 100:
+            found.append((i, 5, 'discount_value', 'un rabais en pourcentage ne peut pas dépasser 100 %'))
+
+    found.sort(key=lambda item: (item[0], item[1]))
+    return [{'field': f'lines[{i}][{field}]', 'message': f'Ligne {i + 1} : {message}'}
+            for i, _rank, field, message in found]
+
+
+def _header_key(cell: str) -> str:
+    text = unicodedata.normalize('NFKD', cell).encode('ascii', 'ignore').decode().lower()
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def _csv_number(value: str) -> str:
+    """Nombre saisi à la française (1 234,50 ; 5,5 %) remis au format décimal (1234.50 ; 5.5)."""
+    text = re.sub(r'[\s\u00a0\u202f%€]', '', value)
+    if ',' in text and '.' in text:
+        # Le dernier séparateur est le séparateur décimal, l'autre celui des milliers
+        thousands = '.' if text.rfind(',') > text.rfind('.') else ','
+        text = text.replace(thousands, '')
+    return text.replace(',', '.')
+
+
+def line_columns_from_csv(data: str | bytes) -> dict[str, list[str]]:
+    """
+    Colonnes des lignes d'un CSV (fichier importé ou cellules collées depuis un tableur).
+
+    Séparateur détecté sur la première ligne (tabulation, point-virgule ou
+    virgule). Si elle contient au moins deux en-têtes connus (CSV_HEADERS), les colonnes
+    sont associées par nom, sinon dans l'ordre de LINE_FIELDS. Les nombres à la
+    française sont convertis et le taux de TVA normalisé (20,00 -> 20), pour
+    que les lignes soient regroupées comme celles saisies dans le formulaire.
+
+    Raises:
+        ValueError: Contenu vide ou plus de MAX_LINES lignes.
+    """
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            data = data.decode('cp1252', errors='replace')
+    text = data.lstrip('\ufeff')
+
+    first = next((line for line in text.splitlines() if line.strip()), '')
+    if not first:
+        raise ValueError("Aucune ligne à importer")
+    delimiter = '\t' if '\t' in first else ';' if ';' in first else ','
+    rows = [row for row in csv.reader(io.StringIO(text), delimiter=delimiter) if any(c.strip() for c in row)]
+
+    header = [CSV_HEADERS.get(_header_key(cell)) for cell in rows[0]]
+    if sum(1 for field in header if field) >= 2:
+        rows = rows[1:]
+    else:
+        header = list(LINE_FIELDS)
+    if len(rows) > MAX_LINES:
+        raise ValueError(f"Trop de lignes ({len(rows)}, maximum {MAX_LINES})")
+
+    positions = {}
+    for position, field in enumerate(header):
+        if field and field not in positions:
+            positions[field] = position
+
+    columns = {}
+    for field, default in LINE_DEFAULTS.items():
+        position = positions.get(field)
+        values = [row[position].strip() if position is not None and position < len(row) else '' for row in rows]
+        if field in _CSV_NUMBERS:
+            values = [_csv_number(v) for v in values]
+        if field == 'vat_rate':
+            values = [f'{rate.normalize():f}' if (rate := _decimal(v)) is not None else v for v in values]
+        elif field == 'discount_type':
+            values = ['percent' if v in ('', '%') or v.lower() == 'percent' else 'amount' for v in values]
+        elif field == 'vat_category':
+            values = [v.upper() for v in values]
+        columns[field] = [v or default for v in values]
+    return columns
+
+
+def parse_lines_from_form(form_data) -> list[dict]:
+    """Parse les lignes de facture depuis les données du formulaire."""
+    return columns_to_lines(line_columns_from_form(form_data))
+
+
+def validate_step2(lines: list[dict]) -> list[dict]:
+    """Valide les lignes de facture (voir validate_line_columns)."""
+    return validate_line_columns(lines_to_columns(lines))
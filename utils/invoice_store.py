@@ -0,0 +1,355 @@
+"""
+Persistance des données dérivées des factures (ventilation TVA, ...) et
+insertion groupée des factures reçues.
+
+Ces données sont calculées une seule fois, à l'insertion ou par
+`cli.py backfill-fields` pour les factures antérieures, pour que les exports
+et rapports n'aient pas à re-parser `xml_facture` à chaque ligne.
+"""
+
+import re
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from utils.db import db_cursor, db_server_cursor, get_backend
+from utils.facturx_parser import parse_facturx_xml, FacturXParseError
+from utils.search import SEARCH_VECTOR_SQL, search_document
+
+# Direction d'une facture -> table source
+INVOICE_TABLES = {
+    'sent': 'sent_invoices',
+    'received': 'incoming_invoices',
+}
+
+_CENT = Decimal('0.01')
+
+# Champs métier extraits du XML à l'insertion (colonnes typées et indexées,
+# communes à sent_invoices et incoming_invoices)
+EXTRACTED_COLUMNS = (
+    'due_date', 'currency_code', 'seller_vat_number', 'buyer_siret', 'buyer_vat_number',
+    'buyer_reference', 'purchase_order_reference', 'total_ht', 'total_vat', 'type_code',
+)
+
+# Colonnes renseignées à l'insertion d'une facture reçue
+INCOMING_COLUMNS = (
+    'invoice_num', 'company_name', 'company_siret', 'xml_facture', 'pdf_path',
+    'invoice_date', 'total_ttc', 'pdp_invoice_id', 'content_sha256',
+) + EXTRACTED_COLUMNS
+
+
+def _round(value) -> Decimal:
+    return Decimal(str(value)).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def vat_rows_from_totals(vat_breakdown: dict) -> list[tuple]:
+    """
+    Convertit le `vat_breakdown` de calculate_invoice_totals en lignes à stocker.
+
+    Returns:
+        Liste de tuples (vat_category, vat_rate, base_ht, vat_amount), arrondis au centime.
+    """
+    return [
+        (info['vat_category'], _round(info['rate']), _round(info['base_ht']), _round(info['vat_amount']))
+        for info in vat_breakdown.values()
+    ]
+
+
+def vat_rows_from_parsed(parsed: dict) -> list[tuple]:
+    """Convertit la ventilation TVA d'un XML parsé (parse_facturx_xml) en lignes à stocker."""
+    rows = {}
+    for info in parsed['vat_breakdown']:
+        key = (info['vat_category'] or 'S', _round(info['rate']))
+        base, vat = rows.get(key, (Decimal('0'), Decimal('0')))
+        rows[key] = (base + _round(info['base_ht']), vat + _round(info['vat_amount']))
+    return [(cat, rate, base, vat) for (cat, rate), (base, vat) in rows.items()]
+
+
+def _siret(party: dict) -> str | None:
+    digits = re.sub(r'\s', '', party.get('siret', ''))
+    return digits if re.fullmatch(r'\d{14}', digits) else None
+
+
+def extracted_fields(parsed: dict) -> dict:
+    """
+    Champs métier d'un XML parsé (parse_facturx_xml), prêts pour EXTRACTED_COLUMNS.
+
+    Les valeurs absentes du XML valent None (colonnes NULL).
+    """
+    seller, buyer = parsed['seller'], parsed['buyer']
+    return {
+        'due_date': parsed['due_date'] or None,
+        'currency_code': parsed['currency_code'][:3] or None,
+        'seller_vat_number': seller['vat_number'][:20] or None,
+        'buyer_siret': _siret(buyer),
+        'buyer_vat_number': buyer['vat_number'][:20] or None,
+        'buyer_reference': parsed['buyer_reference'][:100] or None,
+        'purchase_order_reference': parsed['purchase_order_reference'][:100] or None,
+        'total_ht': _round(parsed['total_ht']) if parsed['total_ht'] is not None else None,
+        'total_vat': _round(parsed['total_vat']) if parsed['total_vat'] is not None else None,
+        'type_code': parsed['type_code'][:3] or None,
+    }
+
+
+# Ventilation TVA : une ligne par (facture source, catégorie, taux)
+_VAT_INSERT = """INSERT INTO invoice_vat_breakdown
+   (direction, company_siret, invoice_num, vat_category, vat_rate, base_ht, vat_amount)
+   VALUES {values}
+   ON CONFLICT (direction, company_siret, invoice_num, vat_category, vat_rate) DO NOTHING"""
+
+
+def store_vat_breakdown(cursor, direction: str, invoice_num: str, rows: list[tuple],
+                        company_siret: str = '') -> None:
+    """
+    Enregistre la ventilation TVA d'une facture (dans la transaction en cours).
+
+    Args:
+        cursor: Curseur psycopg2 (ou SQLite, voir utils/db_sqlite.py).
+        direction: 'sent' ou 'received'.
+        invoice_num: Numéro de la facture.
+        rows: Tuples (vat_category, vat_rate, base_ht, vat_amount).
+        company_siret: SIRET de la facture source (client ou fournisseur).
+    """
+    if not rows:
+        return
+    values = [(direction, company_siret, invoice_num, *row) for row in rows]
+    if get_backend() == 'sqlite':
+        cursor.executemany(_VAT_INSERT.format(values='(%s, %s, %s, %s, %s, %s, %s)'), values)
+        return
+
+    from psycopg2.extras import execute_values
+
+    execute_values(cursor, _VAT_INSERT.format(values='%s'), values)
+
+
+def fill_missing_vat_breakdown(direction: str, date_from: str = None, date_to: str = None,
+                               batch_size: int = 500) -> int:
+    """
+    Complète la ventilation TVA des factures qui n'en ont pas encore.
+
+    Les XML sont lus via un curseur côté serveur, parsés une seule fois et
+    les lignes insérées par lots. Les exécutions suivantes ne relisent plus
+    ces XML.
+
+    Returns:
+        Nombre de factures complétées.
+    """
+    from psycopg2.extras import execute_values
+
+    table = INVOICE_TABLES[direction]
+    query = (
+        f"SELECT i.invoice_num, i.company_siret, i.xml_facture::text FROM {table} i "
+        "WHERE NOT EXISTS (SELECT 1 FROM invoice_vat_breakdown b "
+        "                  WHERE b.direction = %s AND b.company_siret = i.company_siret "
+        "                    AND b.invoice_num = i.invoice_num)"
+    )
+    params = [direction]
+    if date_from and date_to:
+        query += " AND i.invoice_date >= %s AND i.invoice_date <= %s"
+        params += [date_from, date_to]
+
+    filled = 0
+    batch = []
+
+    def _flush():
+        with db_cursor(commit=True) as (_conn, cursor):
+            execute_values(cursor, _VAT_INSERT.format(values='%s'), batch)
+        batch.clear()
+
+    with db_server_cursor(f'vat_fill_{direction}', itersize=batch_size) as (_conn, cursor):
+        cursor.execute(query, params)
+        for invoice_num, company_siret, xml_content in cursor:
+            try:
+                rows = vat_rows_from_parsed(parse_facturx_xml(xml_content))
+            except FacturXParseError as e:
+                print(f"[WARNING] Ventilation TVA illisible pour {invoice_num}: {e}")
+                continue
+            batch.extend((direction, company_siret, invoice_num, *row) for row in rows)
+            filled += 1
+            if len(batch) >= batch_size:
+                _flush()
+
+    if batch:
+        _flush()
+    return filled
+
+
+def backfill_extracted_fields(direction: str, batch_size: int = 500, progress=None) -> dict:
+    """
+    Renseigne les champs extraits (EXTRACTED_COLUMNS) des factures antérieures.
+
+    Les factures non encore traitées (fields_extracted_at NULL, index
+    partiel) sont lues via un curseur côté serveur, leur XML parsé une seule
+    fois et les colonnes mises à jour par lots d'une instruction
+    `UPDATE ... FROM (VALUES ...)`. Un XML illisible est signalé et marqué
+    traité, pour ne pas être relu à chaque exécution. La ventilation TVA
+    manquante est complétée ensuite.
+
+    Args:
+        direction: 'sent' ou 'received'.
+        batch_size: Nombre de factures par mise à jour.
+        progress: Fonction (stats) appelée après chaque lot.
+
+    Returns:
+        Statistiques {updated, invalid, vat_filled}.
+    """
+    from psycopg2.extras import execute_values
+
+    table = INVOICE_TABLES[direction]
+    stats = {'updated': 0, 'invalid': 0, 'vat_filled': 0}
+    batch = []
+
+    def _flush():
+        with db_cursor(commit=True) as (_conn, cursor):
+            execute_values(
+                cursor,
+                f"""UPDATE {table} t SET
+                       due_date = v.due_date::date,
+                       currency_code = v.currency_code,
+                       seller_vat_number = v.seller_vat_number,
+                       buyer_siret = v.buyer_siret,
+                       buyer_vat_number = v.buyer_vat_number,
+                       buyer_reference = v.buyer_reference,
+                       purchase_order_reference = v.purchase_order_reference,
+                       total_ht = v.total_ht::numeric,
+                       total_vat = v.total_vat::numeric,
+                       type_code = v.type_code,
+                       fields_extracted_at = now()
+                   FROM (VALUES %s) AS v(invoice_num, company_siret, {', '.join(EXTRACTED_COLUMNS)})
+                   WHERE t.invoice_num = v.invoice_num AND t.company_siret = v.company_siret""",
+                batch,
+                page_size=len(batch),
+            )
+        batch.clear()
+        if progress:
+            progress(dict(stats))
+
+    with db_server_cursor(f'fields_fill_{direction}', itersize=batch_size) as (_conn, cursor):
+        cursor.execute(
+            f"SELECT invoice_num, company_siret, xml_facture::text FROM {table} WHERE fields_extracted_at IS NULL"
+        )
+        for invoice_num, company_siret, xml_content in cursor:
+            try:
+                fields = extracted_fields(parse_facturx_xml(xml_content))
+                stats['updated'] += 1
+            except FacturXParseError as e:
+                print(f"[WARNING] Champs illisibles pour {invoice_num}: {e}")
+                fields = {}
+                stats['invalid'] += 1
+            batch.append((invoice_num, company_siret, *(fields.get(col) for col in EXTRACTED_COLUMNS)))
+            if len(batch) >= batch_size:
+                _flush()
+
+    if batch:
+        _flush()
+    stats['vat_filled'] = fill_missing_vat_breakdown(direction, batch_size=batch_size)
+    return stats
+
+
+def _seller_siret(seller: dict) -> str:
+    """SIRET du vendeur (URIID), à défaut son identifiant légal (SIREN)."""
+    for value in (seller.get('siret', ''), seller.get('legal_id', '')):
+        digits = re.sub(r'\s', '', value)
+        if re.fullmatch(r'\d{14}', digits):
+            return digits
+    return re.sub(r'\s', '', seller.get('legal_id', ''))[:14]
+
+
+def incoming_invoice_from_parsed(parsed: dict, xml_content, pdf_path: str, **extra) -> dict:
+    """
+    Prépare une facture reçue pour insert_incoming_invoices.
+
+    Args:
+        parsed: Résultat de parse_facturx_xml.
+        xml_content: XML Factur-X (str ou bytes).
+        pdf_path: Chemin du PDF archivé.
+        **extra: Colonnes complémentaires (ex. pdp_invoice_id, content_sha256).
+
+    Returns:
+        Dictionnaire des colonnes INCOMING_COLUMNS (champs extraits compris), plus
+        `vat_rows` et `search_document` (textes du tsvector de recherche).
+
+    Raises:
+        FacturXParseError: Si un champ obligatoire de incoming_invoices manque.
+    """
+    missing = [label for label, value in (
+        ('numéro', parsed['invoice_number']),
+        ('vendeur', parsed['seller']['name']),
+        ("date d'émission", parsed['issue_date']),
+        ('total TTC', parsed['total_ttc']),
+    ) if not value and value != 0]
+    if missing:
+        raise FacturXParseError(f"Champs obligatoires absents du XML : {', '.join(missing)}")
+
+    if isinstance(xml_content, bytes):
+        xml_content = xml_content.decode('utf-8')
+    invoice = {
+        'invoice_num': parsed['invoice_number'][:50],
+        'company_name': parsed['seller']['name'][:255],
+        'company_siret': _seller_siret(parsed['seller']),
+        'xml_facture': xml_content,
+        'pdf_path': str(pdf_path),
+        'invoice_date': parsed['issue_date'],
+        'total_ttc': _round(parsed['total_ttc']),
+        'vat_rows': vat_rows_from_parsed(parsed),
+        'search_document': search_document(parsed),
+    }
+    invoice.update(extracted_fields(parsed))
+    invoice.update(extra)
+    return invoice
+
+
+def _incoming_key(inv: dict) -> tuple:
+    return inv.get('company_siret') or '', inv['invoice_num']
+
+
+def insert_incoming_invoices(cursor, invoices: list[dict]) -> list[str]:
+    """
+    Insère un lot de factures reçues et leur ventilation TVA (transaction en cours).
+
+    Une facture reçue est identifiée par le SIRET du fournisseur et son numéro :
+    deux fournisseurs peuvent utiliser le même numéro. Les factures déjà
+    présentes (même fournisseur et même numéro, même identifiant PDP ou même
+    empreinte de PDF) sont ignorées et signalées : l'insertion peut être
+    rejouée sans doublon.
+
+    Args:
+        cursor: Curseur psycopg2.
+        invoices: Dictionnaires issus de incoming_invoice_from_parsed.
+
+    Returns:
+        Numéros des factures réellement insérées.
+    """
+    from psycopg2.extras import execute_values
+
+    # Une même facture en double dans le lot : seule la première occurrence est retenue
+    unique = {}
+    for inv in invoices:
+        unique.setdefault(_incoming_key(inv), inv)
+    invoices = list(unique.values())
+    if not invoices:
+        return []
+    inserted = execute_values(
+        cursor,
+        f"INSERT INTO incoming_invoices ({', '.join(INCOMING_COLUMNS)}, fields_extracted_at, search_vector) "
+        "VALUES %s ON CONFLICT DO NOTHING RETURNING company_siret, invoice_num",
+        [(*(inv.get(col) for col in INCOMING_COLUMNS), *(inv.get('search_document') or ('', '', '')))
+         for inv in invoices],
+        template=f"({', '.join(['%s'] * len(INCOMING_COLUMNS))}, now(), {SEARCH_VECTOR_SQL})",
+        page_size=len(invoices),
+        fetch=True,
+    )
+    inserted = {(row[0] or '', row[1]) for row in inserted}
+    for inv in invoices:
+        if _incoming_key(inv) not in inserted:
+            print(f"[WARNING] Facture reçue {inv['invoice_num']} (SIRET {inv.get('company_siret') or '?'}) "
+                  "ignorée : déjà présente (même numéro, identifiant PDP ou empreinte)")
+    invoices = [inv for inv in invoices if _incoming_key(inv) in inserted]
+
+    vat_rows = [
+        ('received', *_incoming_key(inv), *row)
+        for inv in invoices
+        for row in inv.get('vat_rows', [])
+    ]
+    if vat_rows:
+        execute_values(cursor, _VAT_INSERT.format(values='%s'), vat_rows, page_size=len(vat_rows))
+    return [inv['invoice_num'] for inv in invoices]
@@ -0,0 +1,185 @@
+"""
+Réécriture compacte des PDF Factur-X (mode `pdf_compact`).
+
+Le PDF produit par ReportLab puis par la librairie factur-x contient des
+objets réécrits non compressés par pypdf (profil ICC, dictionnaires), un
+objet indirect par dictionnaire et, s'il sort de `generate_from_binary`,
+une copie morte du PDF source devant le PDF final. compact_pdf() relit le
+document, fusionne les objets identiques, compresse les flux qui ne le
+sont pas (Flate niveau 9, ASCII85 retiré) et range les objets hors flux
+dans des flux d'objets (`/ObjStm`) indexés par un flux de références
+croisées (`/XRef`).
+
+Les flux d'objets et de références croisées sont admis en PDF/A-2 et
+PDF/A-3 (PDF 1.7) ; les métadonnées XMP, l'OutputIntent, la pièce jointe
+XML et l'identifiant du document sont conservés tels quels.
+"""
+
+import os
+import zlib
+from base64 import a85decode
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, ByteStringObject, NameObject, NumberObject, StreamObject
+
+PDF_HEADER = b'%PDF-1.7'
+# Objets hors flux par flux d'objets (/ObjStm)
+OBJECTS_PER_STREAM = 200
+_FLATE_LEVEL = 9
+
+
+def _filters(stream: StreamObject) -> list[str]:
+    filters = stream.get('/Filter')
+    if filters is None:
+        return []
+    filters = filters.get_object()
+    if isinstance(filters, ArrayObject):
+        return [str(f) for f in filters]
+    return [str(filters)]
+
+
+def _recompress_stream(stream: StreamObject) -> None:
+    """
+    Retire l'ASCII85 et compresse en Flate les flux non compressés.
+
+    Les flux déjà compressés (Flate, DCT) sont gardés tels quels : les
+    recompresser au niveau 9 ne gagne que quelques dizaines d'octets.
+    """
+    if stream.get('/Type') == '/Metadata' or '/DecodeParms' in stream:
+        return
+    filters, data = _filters(stream), stream._data
+    if filters[:1] == ['/ASCII85Decode']:
+        data = data.strip()
+        data = a85decode(data.removeprefix(b'<~'), adobe=data.endswith(b'~>'))
+        filters = filters[1:]
+    elif filters:
+        return
+    if not filters:
+        packed = zlib.compress(data, _FLATE_LEVEL)
+        if len(packed) < len(data):
+            data, filters = packed, ['/FlateDecode']
+    stream._data = data
+    if not filters:
+        stream.pop(NameObject('/Filter'), None)
+    elif len(filters) == 1:
+        stream[NameObject('/Filter')] = NameObject(filters[0])
+    else:
+        stream[NameObject('/Filter')] = ArrayObject(NameObject(f) for f in filters)
+
+
+def _serialize(obj) -> bytes:
+    buffer = BytesIO()
+    obj.write_to_stream(buffer)
+    return buffer.getvalue()
+
+
+def _write_object(out: BytesIO, idnum: int, obj) -> None:
+    out.write(f"{idnum} 0 obj\n".encode())
+    obj.write_to_stream(out)
+    out.write(b"\nendobj\n")
+
+
+def _object_stream(members: list[tuple[int, bytes]]) -> StreamObject:
+    """Flux d'objets : en-tête `numéro décalage ...` puis les objets sérialisés."""
+    offsets, body, position = [], [], 0
+    for idnum, data in members:
+        offsets.append(f"{idnum} {position}")
+        body.append(data)
+        position += len(data) + 1
+    header = (' '.join(offsets) + '\n').encode()
+    stream = StreamObject()
+    stream[NameObject('/Type')] = NameObject('/ObjStm')
+    stream[NameObject('/N')] = NumberObject(len(members))
+    stream[NameObject('/First')] = NumberObject(len(header))
+    stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    stream._data = zlib.compress(header + b'\n'.join(body) + b'\n', _FLATE_LEVEL)
+    return stream
+
+
+def _document_id(writer: PdfWriter) -> ArrayObject:
+    if writer._ID is not None:
+        return writer._ID
+    identifier = ByteStringObject(os.urandom(16))
+    return ArrayObject([identifier, identifier])
+
+
+def compact_pdf(pdf_bytes: bytes) -> bytes:
+    """
+    Réécrit un PDF sous forme compacte (objets dédupliqués, flux compressés,
+    flux d'objets et de références croisées).
+
+    Un PDF chiffré est renvoyé tel quel (les flux d'objets chiffrés ne sont
+    pas pris en charge, et PDF/A interdit le chiffrement).
+    """
+    output = BytesIO()
+    if not write_compact_pdf(BytesIO(pdf_bytes), output):
+        return pdf_bytes
+    return output.getvalue()
+
+
+def write_compact_pdf(source, out) -> bool:
+    """
+    Écrit dans `out` (fichier binaire ouvert) la forme compacte du PDF `source`
+    (chemin ou fichier binaire), sans charger le PDF source en mémoire d'un bloc.
+
+    Returns:
+        False (rien n'est écrit) si le PDF est chiffré.
+    """
+    reader = PdfReader(source)
+    if reader.is_encrypted:
+        return False
+    writer = PdfWriter(clone_from=reader)
+    writer.compress_identical_objects()
+
+    # Décalages relatifs au début du PDF (out peut être un fichier déjà entamé)
+    base = out.tell()
+    out.write(PDF_HEADER + b'\n%\xe2\xe3\xcf\xd3\n')
+
+    # entries[numéro] = (1, décalage) pour un objet direct, (2, flux d'objets, rang) sinon
+    entries: dict[int, tuple[int, int, int]] = {}
+    members: list[tuple[int, bytes]] = []
+    for idnum, obj in enumerate(writer._objects, start=1):
+        if obj is None:
+            continue
+        if isinstance(obj, StreamObject):
+            _recompress_stream(obj)
+            entries[idnum] = (1, out.tell() - base, 0)
+            _write_object(out, idnum, obj)
+        else:
+            members.append((idnum, _serialize(obj)))
+
+    next_id = len(writer._objects) + 1
+    for start in range(0, len(members), OBJECTS_PER_STREAM):
+        chunk = members[start:start + OBJECTS_PER_STREAM]
+        for index, (idnum, _data) in enumerate(chunk):
+            entries[idnum] = (2, next_id, index)
+        entries[next_id] = (1, out.tell() - base, 0)
+        _write_object(out, next_id, _object_stream(chunk))
+        next_id += 1
+
+    # Flux de références croisées (dernier objet), largeur des décalages selon la taille du fichier
+    xref_id, xref_offset = next_id, out.tell() - base
+    entries[xref_id] = (1, xref_offset, 0)
+    size = xref_id + 1
+    width = max(1, (max(xref_offset, size).bit_length() + 7) // 8)
+    rows = [b'\x00' + (0).to_bytes(width, 'big') + b'\xff\xff']
+    for idnum in range(1, size):
+        kind, field2, field3 = entries.get(idnum, (0, 0, 0))
+        rows.append(bytes([kind]) + field2.to_bytes(width, 'big') + field3.to_bytes(2, 'big'))
+
+    xref = StreamObject()
+    xref.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(size),
+        NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+        NameObject('/Root'): writer.root_object.indirect_reference,
+        NameObject('/ID'): _document_id(writer),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+    })
+    if writer._info is not None:
+        xref[NameObject('/Info')] = writer._info.indirect_reference
+    xref._data = zlib.compress(b''.join(rows), _FLATE_LEVEL)
+    _write_object(out, xref_id, xref)
+    out.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+    return True
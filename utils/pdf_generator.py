@@ -5,8 +5,12 @@ Ce module génère un PDF de facture standard qui sera ensuite converti
 en PDF Factur-X avec le module factur-x.
 """
 
+import shutil
+import tempfile
+import zlib
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 
@@ -30,10 +34,12 @@ pdfmetrics.registerFontFamily(
     boldItalic='LiberationSans-BoldItalic',
 )
 rl_config.canvas_basefontname = 'LiberationSans'
+# Flux binaires (Flate, DCT) sans encodage ASCII85 : +25 % de taille sans utilité dans un PDF binaire
+rl_config.useA85 = 0
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
+from reportlab.lib.units import cm, inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
@@ -41,6 +47,18 @@ from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
 # Chemin du profil ICC sRGB pour conformité PDF/A-3
 _ICC_PROFILE_PATH = Path(__file__).parent.parent / 'resources' / 'profiles' / 'sRGB.icc'
 
+# Cadre du logo dans l'en-tête et résolution du logo en mode compact
+_LOGO_BOX = 3*cm
+COMPACT_LOGO_DPI = 150
+
+# Au-delà de cette taille, un PDF intermédiaire passe de la mémoire à un fichier temporaire
+PDF_SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+
+def spooled_pdf():
+    """Fichier temporaire binaire pour un PDF intermédiaire (en mémoire, puis sur disque au-delà du seuil)."""
+    return tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE, mode='w+b')
+
 
 def _format_amount(value) -> str:
     """Formate un montant avec 2 décimales."""
@@ -63,25 +81,69 @@ _calculate_line_totals = calculate_line_totals
 _calculate_invoice_totals = calculate_invoice_totals
 
 
-def _add_output_intent(pdf_bytes: bytes) -> bytes:
-    """Ajoute un OutputIntent sRGB au PDF pour conformité PDF/A-3."""
+@lru_cache(maxsize=1)
+def _icc_profile() -> tuple[bytes, bytes]:
+    """Profil ICC sRGB (brut, compressé Flate), lu et compressé une fois par processus."""
+    icc_data = _ICC_PROFILE_PATH.read_bytes()
+    return icc_data, zlib.compress(icc_data, 9)
+
+
+@lru_cache(maxsize=8)
+def _compact_logo(logo_path: str, mtime: float) -> bytes:
+    """
+    Logo réduit une fois à sa taille imprimée (cadre de 3 cm à COMPACT_LOGO_DPI).
+
+    Mis en cache par processus (clé : chemin et date de modification). Un logo
+    déjà assez petit est repris tel quel ; un JPEG reste un JPEG (qualité 85),
+    les autres formats sont réécrits en PNG (transparence conservée).
+    """
+    from PIL import Image as PILImage
+
+    max_px = round(_LOGO_BOX / inch * COMPACT_LOGO_DPI)
+    with PILImage.open(logo_path) as source:
+        if max(source.size) <= max_px:
+            return Path(logo_path).read_bytes()
+        is_jpeg = source.format == 'JPEG'
+        image = source.convert('RGB' if is_jpeg else 'RGBA')
+    image.thumbnail((max_px, max_px), PILImage.LANCZOS)
+    output = BytesIO()
+    if is_jpeg:
+        image.save(output, 'JPEG', quality=85, optimize=True)
+    else:
+        image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def _add_output_intent(source, out, compact: bool = False) -> None:
+    """
+    Recopie le PDF de `source` dans `out` en y ajoutant un OutputIntent sRGB
+    (conformité PDF/A-3). Les deux sont des fichiers binaires.
+
+    En mode compact, le profil ICC est intégré déjà compressé (Flate).
+    """
     if not _ICC_PROFILE_PATH.exists():
-        return pdf_bytes
+        shutil.copyfileobj(source, out)
+        return
 
     from pypdf import PdfReader, PdfWriter
     from pypdf.generic import (
-        ArrayObject, DecodedStreamObject, DictionaryObject,
+        ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
         NameObject, NumberObject, TextStringObject,
     )
 
-    reader = PdfReader(BytesIO(pdf_bytes))
+    reader = PdfReader(source)
     writer = PdfWriter(clone_from=reader)
 
-    icc_data = _ICC_PROFILE_PATH.read_bytes()
+    icc_data, icc_compressed = _icc_profile()
 
     # Flux ICC
-    icc_stream = DecodedStreamObject()
-    icc_stream.set_data(icc_data)
+    if compact:
+        icc_stream = EncodedStreamObject()
+        icc_stream._data = icc_compressed
+        icc_stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    else:
+        icc_stream = DecodedStreamObject()
+        icc_stream.set_data(icc_data)
     icc_stream[NameObject('/N')] = NumberObject(3)
     icc_stream[NameObject('/Alternate')] = NameObject('/DeviceRGB')
     icc_ref = writer._add_object(icc_stream)
@@ -98,27 +160,81 @@ def _add_output_intent(pdf_bytes: bytes) -> bytes:
     output_intent_ref = writer._add_object(output_intent)
 
     writer._root_object[NameObject('/OutputIntents')] = ArrayObject([output_intent_ref])
+    writer.write(out)
 
-    output = BytesIO()
-    writer.write(output)
-    return output.getvalue()
 
+def emitter_layout(emitter: dict, logo_path: str = None, compact: bool = False) -> dict:
+    """
+    Gabarit de page de l'émetteur : logo prêt à intégrer et blocs de texte fixes.
+
+    Ne dépend que de l'émetteur : construit une fois par profil émetteur
+    (voir utils/emitters.py) et passé à write_invoice_pdf, qui ne relit
+    alors plus le logo et ne recompose plus ces blocs à chaque facture.
 
-def generate_invoice_pdf(data: dict, logo_path: str = None) -> bytes:
+    Returns:
+        {logo (bytes ou None), emitter_markup, iban_markup, pmt_text, pmd_text}
+    """
+    logo = None
+    if logo_path and Path(logo_path).exists():
+        try:
+            if compact:
+                logo = _compact_logo(logo_path, Path(logo_path).stat().st_mtime)
+            else:
+                logo = Path(logo_path).read_bytes()
+        except Exception:
+            logo = None
+    legal_form = f" - {emitter['legal_form']}" if emitter.get('legal_form') else ''
+    return {
+        'logo': logo,
+        'emitter_markup': (
+            f"<b>Émetteur</b><br/>{emitter['name']}{legal_form}<br/>{emitter['address']}<br/>"
+            f"{emitter['postal_code']} {emitter['city']}<br/>SIRET: {emitter['siret']}<br/>"
+            f"TVA: {emitter.get('vat_number', 'N/A')}"
+        ),
+        'iban_markup': (
+            f"<i>En votre aimable règlement par virement bancaire au {emitter['iban']}.</i>"
+            if emitter.get('iban') else None
+        ),
+        'pmt_text': emitter.get('pmt_text') or None,
+        'pmd_text': emitter.get('pmd_text') or None,
+    }
+
+
+def generate_invoice_pdf(data: dict, logo_path: str = None, compact: bool = False) -> bytes:
     """
     Génère un PDF de facture.
 
     Args:
         data: Dictionnaire contenant 'emitter', 'invoice', et 'lines'
         logo_path: Chemin vers le logo (optionnel)
+        compact: Logo réduit à sa taille imprimée et profil ICC compressé
+            (voir utils/pdf_compact.py pour la réécriture finale)
 
     Returns:
         Contenu PDF en bytes
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm)
+    output = BytesIO()
+    write_invoice_pdf(data, output, logo_path=logo_path, compact=compact)
+    return output.getvalue()
+
+
+def write_invoice_pdf(data: dict, out, logo_path: str = None, compact: bool = False,
+                      layout: dict = None) -> None:
+    """
+    Génère un PDF de facture dans un fichier binaire ouvert (`out`).
+
+    Le rendu ReportLab passe par un fichier temporaire (spooled_pdf) relu
+    par l'ajout de l'OutputIntent : aucune copie complète du PDF n'est
+    conservée en mémoire entre les deux étapes.
+
+    Args: voir generate_invoice_pdf ; `layout` est le gabarit de
+    l'émetteur (emitter_layout), construit ici s'il n'est pas fourni.
+    """
+    if layout is None:
+        layout = emitter_layout(data['emitter'], logo_path, compact)
+    rendered = spooled_pdf()
+    doc = SimpleDocTemplate(rendered, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm)
 
-    emitter = data['emitter']
     invoice = data['invoice']
     lines = data['lines']
     invoice_totals = _calculate_invoice_totals(lines)
@@ -156,9 +272,9 @@ def generate_invoice_pdf(data: dict, logo_path: str = None) -> bytes:
     # En-tête avec logo et titre
     header_data = []
 
-    if logo_path and Path(logo_path).exists():
+    if layout['logo']:
         try:
-            img = Image(logo_path, width=3*cm, height=3*cm, kind='proportional')
+            img = Image(BytesIO(layout['logo']), width=_LOGO_BOX, height=_LOGO_BOX, kind='proportional')
             header_data.append([img, Paragraph('FACTURE', title_style)])
         except Exception:
             header_data.append(['', Paragraph('FACTURE', title_style)])
@@ -186,7 +302,7 @@ def generate_invoice_pdf(data: dict, logo_path: str = None) -> bytes:
 
     info_data = [
         [
-            Paragraph(f"<b>Émetteur</b><br/>{emitter['name']}{' - ' + emitter['legal_form'] if emitter.get('legal_form') else ''}<br/>{emitter['address']}<br/>{emitter['postal_code']} {emitter['city']}<br/>SIRET: {emitter['siret']}<br/>TVA: {emitter.get('vat_number', 'N/A')}", normal_style),
+            Paragraph(layout['emitter_markup'], normal_style),
             Paragraph(f"<b>Destinataire</b><br/>{invoice['recipient_name']}<br/>{recipient_address_text}<br/>SIRET: {invoice['recipient_siret']}<br/>TVA: {invoice.get('recipient_vat_number', 'N/A')}", normal_style),
         ]
     ]
@@ -330,26 +446,21 @@ def generate_invoice_pdf(data: dict, logo_path: str = None) -> bytes:
         story.append(Paragraph(f"<b>Conditions de paiement:</b> {invoice['payment_terms']}", normal_style))
 
     # IBAN
-    if emitter.get('iban'):
+    if layout['iban_markup']:
         story.append(Spacer(1, 0.3*cm))
-        story.append(Paragraph(f"<i>En votre aimable règlement par virement bancaire au {emitter['iban']}.</i>", normal_style))
+        story.append(Paragraph(layout['iban_markup'], normal_style))
 
     # Mentions légales PMT / PMD
     small_style = ParagraphStyle('Small', parent=normal_style, fontSize=7, textColor=colors.grey)
-    if emitter.get('pmt_text'):
+    if layout['pmt_text']:
         story.append(Spacer(1, 0.5*cm))
-        story.append(Paragraph(emitter['pmt_text'], small_style))
-    if emitter.get('pmd_text'):
+        story.append(Paragraph(layout['pmt_text'], small_style))
+    if layout['pmd_text']:
         story.append(Spacer(1, 0.1*cm))
-        story.append(Paragraph(emitter['pmd_text'], small_style))
-
-    # Générer le PDF
-    doc.build(story)
-
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-
-    # Ajouter OutputIntent sRGB pour conformité PDF/A-3
-    pdf_bytes = _add_output_intent(pdf_bytes)
+        story.append(Paragraph(layout['pmd_text'], small_style))
 
-    return pdf_bytes
+    # Générer le PDF puis ajouter l'OutputIntent sRGB pour conformité PDF/A-3
+    with rendered:
+        doc.build(story)
+        rendered.seek(0)
+        _add_output_intent(rendered, out, compact=compact)
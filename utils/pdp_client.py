@@ -0,0 +1,365 @@
+"""
+Client HTTP natif pour l'API SuperPDP : pool de connexions persistantes
+(keep-alive), envoi en flux des PDF depuis le disque, délais configurables
+et erreurs structurées.
+
+Remplace les appels `curl` en sous-processus : plus de fork ni de nouvelle
+poignée de main TLS à chaque requête.
+"""
+
+import http.client
+import json
+import os
+import queue
+import ssl
+import threading
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_BASE_URL = "https://api.superpdp.tech"
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_POOL_SIZE = 8
+_BLOCK_SIZE = 64 * 1024
+
+# Erreurs réseau indiquant une connexion persistante fermée par le serveur
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+# Méthodes rejouables sans risque une fois la requête envoyée
+_IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+class PdpError(RuntimeError):
+    """Erreur d'appel à l'API SuperPDP (statut HTTP et corps de réponse éventuels)."""
+
+    def __init__(self, message: str, status: int = None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class PdpAuthError(PdpError):
+    """Authentification refusée (401 / 403, identifiants ou jeton invalides)."""
+
+
+class PdpClientError(PdpError):
+    """Requête rejetée par l'API (4xx) : ne pas la rejouer à l'identique."""
+
+
+class PdpTransientError(PdpError):
+    """Erreur temporaire (réseau, délai dépassé, 429, 5xx) : peut être rejouée."""
+
+    def __init__(self, message: str, status: int = None, body=None, retry_after: float = None):
+        super().__init__(message, status, body)
+        self.retry_after = retry_after
+
+
+def _error_message(body) -> str:
+    """Extrait le message d'erreur d'un corps de réponse JSON SuperPDP."""
+    if isinstance(body, dict):
+        parts = [str(body.get('error', '')), str(body.get('error_description', body.get('message', '')))]
+        return ' - '.join(p for p in parts if p)
+    return str(body)[:200]
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class PdpClient:
+    """
+    Client HTTP/1.1 avec pool de connexions réutilisables, sûr entre threads.
+
+    Args:
+        base_url: URL de l'API (ex. https://api.superpdp.tech ou un bouchon local).
+        timeout: Délai (s) de connexion et de lecture de chaque socket.
+        pool_size: Nombre maximal de connexions inactives conservées.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"URL d'API invalide : {base_url}")
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip('/')
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._ssl_context = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.connections_opened = 0
+
+    # --- Pool de connexions ---
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        self.connections_opened += 1
+        if self._scheme == 'https':
+            return http.client.HTTPSConnection(
+                self._host, self._port, timeout=self.timeout,
+                context=self._ssl_context, blocksize=_BLOCK_SIZE,
+            )
+        return http.client.HTTPConnection(
+            self._host, self._port, timeout=self.timeout, blocksize=_BLOCK_SIZE,
+        )
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """Retourne (connexion, réutilisée ?)."""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        """Ferme toutes les connexions inactives du pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # --- Requêtes ---
+
+    def request(self, method: str, path: str, *, token: str = None, headers: dict = None,
+                body=None, form: dict = None, json_body=None) -> dict:
+        """
+        Exécute une requête et retourne le corps JSON décodé.
+
+        Args:
+            method: Verbe HTTP.
+            path: Chemin relatif à l'URL de base (ex. /v1.beta/invoices).
+            token: Jeton OAuth2 (en-tête Authorization: Bearer).
+            headers: En-têtes supplémentaires.
+            body: Corps brut (bytes ou fichier ouvert en binaire, envoyé en flux).
+            form: Corps application/x-www-form-urlencoded.
+            json_body: Corps JSON.
+
+        Raises:
+            PdpAuthError: 401 / 403.
+            PdpClientError: Autre statut 4xx (hors 429).
+            PdpTransientError: Erreur réseau, délai dépassé, 429 ou 5xx.
+            PdpError: Réponse non JSON.
+        """
+        all_headers = {'Accept': 'application/json'}
+        if token:
+            all_headers['Authorization'] = f'Bearer {token}'
+        if form is not None:
+            body = urlencode(form).encode('utf-8')
+            all_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            all_headers['Content-Type'] = 'application/json'
+        all_headers.update(headers or {})
+
+        status, raw, retry_after = self._exchange(method, path, all_headers, body)
+        return self._decode(status, raw, retry_after)
+
+    def download(self, path: str, dest, *, token: str = None) -> int:
+        """
+        Télécharge une ressource binaire en flux vers un fichier.
+
+        Le fichier est écrit sous un nom temporaire puis renommé : `dest`
+        n'existe que complet.
+
+        Args:
+            path: Chemin relatif à l'URL de base.
+            dest: Chemin du fichier de destination.
+            token: Jeton OAuth2.
+
+        Returns:
+            Nombre d'octets écrits.
+
+        Raises:
+            Mêmes exceptions que request() pour les statuts d'erreur.
+        """
+        dest = Path(dest)
+        tmp_path = dest.with_name(f"{dest.name}.{os.getpid()}.{threading.get_ident()}.part")
+        headers = {'Accept': '*/*'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        try:
+            with open(tmp_path, 'wb') as sink:
+                status, raw, retry_after = self._exchange('GET', path, headers, None, sink)
+            if status >= 400:
+                self._decode(status, raw, retry_after)
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, dest)
+            return size
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _exchange(self, method: str, path: str, headers: dict, body, sink=None) -> tuple:
+        """
+        Envoie une requête sur une connexion du pool.
+
+        Si `sink` est fourni, un corps de réponse 2xx y est copié par blocs
+        au lieu d'être chargé en mémoire.
+
+        Une connexion persistante fermée par le serveur est remplacée et la
+        requête rejouée une fois, seulement si elle n'a pas pu être envoyée
+        ou si la méthode est idempotente (GET, HEAD) : un POST déjà envoyé
+        (téléversement d'une facture) a pu être accepté par le serveur, le
+        rejouer risquerait un doublon. L'erreur est alors remontée
+        (PdpTransientError) et l'appelant décide.
+
+        Returns:
+            Tuple (status, corps brut, en-tête Retry-After).
+        """
+        if hasattr(body, 'read') and 'Content-Length' not in headers:
+            headers['Content-Length'] = str(os.fstat(body.fileno()).st_size - body.tell())
+        start = body.tell() if hasattr(body, 'seek') else None
+
+        url = self._prefix + path
+        for attempt in (1, 2):
+            # Après une connexion périmée, on repart sur une connexion neuve
+            conn, reused = self._acquire() if attempt == 1 else (self._new_connection(), False)
+            sent = False
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                status = response.status
+                if sink is not None and status < 400:
+                    sink.seek(0)
+                    sink.truncate()
+                    for block in iter(lambda: response.read(_BLOCK_SIZE), b''):
+                        sink.write(block)
+                    raw = b''
+                else:
+                    raw = response.read()
+                retry_after = response.getheader('Retry-After')
+                keep = not response.will_close
+            except _STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                # Connexion persistante fermée côté serveur pendant l'inactivité : on rejoue une fois,
+                # sauf une requête non idempotente déjà partie
+                if reused and attempt == 1 and (not sent or method in _IDEMPOTENT_METHODS):
+                    if start is not None:
+                        body.seek(start)
+                    continue
+                raise PdpTransientError(f"Connexion interrompue avec l'API SuperPDP: {e}")
+            except TimeoutError:
+                conn.close()
+                raise PdpTransientError(f"Timeout lors de l'appel à l'API SuperPDP ({self.timeout:g}s)")
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise PdpTransientError(f"Erreur réseau avec l'API SuperPDP: {e}")
+
+            if keep:
+                self._release(conn)
+            else:
+                conn.close()
+            return status, raw, retry_after
+
+        raise PdpTransientError("Connexion interrompue avec l'API SuperPDP")
+
+    @staticmethod
+    def _decode(status: int, raw: bytes, retry_after: str = None) -> dict:
+        """Décode le corps JSON et convertit les statuts d'erreur en exceptions."""
+        try:
+            payload = json.loads(raw) if raw else {}
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            payload = None
+
+        if status >= 400:
+            body = payload if payload is not None else raw[:200].decode('utf-8', 'replace')
+            message = f"Erreur API SuperPDP (HTTP {status}): {_error_message(body)}"
+            if status in (401, 403):
+                raise PdpAuthError(message, status, body)
+            if status == 429 or status >= 500:
+                raise PdpTransientError(message, status, body, _parse_retry_after(retry_after))
+            raise PdpClientError(message, status, body)
+
+        if payload is None:
+            raise PdpError(
+                f"Réponse invalide de l'API SuperPDP: {raw[:200].decode('utf-8', 'replace')}",
+                status, raw[:200],
+            )
+        return payload
+
+    # --- Points d'accès SuperPDP ---
+
+    def fetch_token(self, client_id: str, client_secret: str) -> dict:
+        """POST /oauth2/token (client_credentials)."""
+        return self.request('POST', '/oauth2/token', form={
+            'grant_type': 'client_credentials',
+            'client_id': client_id,
+            'client_secret': client_secret,
+        })
+
+    def upload_invoice(self, token: str, pdf_path: str) -> dict:
+        """POST /v1.beta/invoices : envoie le PDF Factur-X en flux depuis le disque."""
+        with open(Path(pdf_path), 'rb') as pdf:
+            return self.request(
+                'POST', '/v1.beta/invoices', token=token, body=pdf,
+                headers={'Content-Type': 'application/pdf'},
+            )
+
+    def get_company(self, token: str) -> dict:
+        """GET /v1.beta/companies/me."""
+        return self.request('GET', '/v1.beta/companies/me', token=token)
+
+    def list_invoices(self, token: str, direction: str = 'in', starting_after_id: int = 0,
+                      limit: int = 100) -> dict:
+        """
+        GET /v1.beta/invoices : factures postérieures à un identifiant.
+
+        Args:
+            direction: 'in' (reçues) ou 'out' (émises).
+
+        Returns:
+            {data: [{id, direction, created_at, ...}], has_after}.
+        """
+        query = urlencode({'direction': direction, 'starting_after_id': starting_after_id, 'limit': limit})
+        return self.request('GET', f'/v1.beta/invoices?{query}', token=token)
+
+    def download_invoice(self, token: str, invoice_id: int, dest) -> int:
+        """GET /v1.beta/invoices/{id}/download : PDF Factur-X écrit en flux dans `dest`."""
+        return self.download(f'/v1.beta/invoices/{int(invoice_id)}/download', dest, token=token)
+
+    def list_invoice_events(self, token: str, starting_after_id: int = 0, limit: int = 100) -> dict:
+        """
+        GET /v1.beta/invoice_events : événements de cycle de vie postérieurs à un identifiant.
+
+        Returns:
+            {data: [{id, invoice_id, status_code, status_text, created_at}], has_after}.
+        """
+        query = urlencode({'starting_after_id': starting_after_id, 'limit': limit})
+        return self.request('GET', f'/v1.beta/invoice_events?{query}', token=token)
+
+
+_CLIENT: PdpClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_pdp_client() -> PdpClient:
+    """
+    Retourne le client partagé du processus.
+
+    L'URL et le délai sont lus dans PDP_API_URL et PDP_TIMEOUT ; le client
+    est recréé si ces valeurs changent (ex. bouchon local en test).
+    """
+    global _CLIENT
+    base_url = os.environ.get('PDP_API_URL', DEFAULT_BASE_URL).rstrip('/')
+    timeout = float(os.environ.get('PDP_TIMEOUT', DEFAULT_TIMEOUT))
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT.base_url != base_url or _CLIENT.timeout != timeout:
+            if _CLIENT is not None:
+                _CLIENT.close()
+            _CLIENT = PdpClient(base_url, timeout=timeout)
+        return _CLIENT
@@ -0,0 +1,156 @@
+"""
+Import incrémental des factures reçues depuis la PDP.
+
+Les factures entrantes sont listées par pages à partir du dernier identifiant
+importé (watermark de pdp_sync_state), leurs PDF téléchargés en parallèle
+dans le stockage des factures reçues, le XML Factur-X embarqué extrait et
+parsé, puis chaque page est insérée en une transaction avec l'avancement du
+watermark. Une exécution interrompue reprend à la page en cours ; les PDF
+déjà téléchargés ne sont pas redemandés et les factures déjà insérées sont
+ignorées (ON CONFLICT DO NOTHING).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.db import db_cursor
+from utils.facturx_parser import FacturXParseError, extract_facturx_xml, parse_facturx_xml
+from utils.ingest import file_sha256
+from utils.invoice_store import incoming_invoice_from_parsed, insert_incoming_invoices
+from utils.pdp_client import PdpTransientError
+from utils.pdp_sync import load_watermark, save_watermark
+
+INBOUND_SYNC_NAME = 'incoming_invoices'
+
+
+class PgIncomingStore:
+    """Stockage PostgreSQL des factures reçues et du watermark d'import."""
+
+    def __init__(self, name: str = INBOUND_SYNC_NAME):
+        self.name = name
+
+    def load_watermark(self) -> int:
+        return load_watermark(self.name)
+
+    def save_page(self, invoices: list[dict], watermark: int) -> int:
+        """Insère une page de factures et avance le watermark (une transaction)."""
+        with db_cursor(commit=True) as (_conn, cursor):
+            inserted = insert_incoming_invoices(cursor, invoices)
+            save_watermark(cursor, self.name, watermark)
+        return len(inserted)
+
+
+def _default_list_page(starting_after_id: int, limit: int) -> dict:
+    from utils.pdp_client import get_pdp_client
+    from utils.super_pdp import get_cached_pdp_token
+
+    token = get_cached_pdp_token()['access_token']
+    return get_pdp_client().list_invoices(token, 'in', starting_after_id, limit)
+
+
+def _default_download(invoice_id: int, dest: Path) -> None:
+    from utils.pdp_client import get_pdp_client
+    from utils.super_pdp import get_cached_pdp_token
+
+    token = get_cached_pdp_token()['access_token']
+    get_pdp_client().download_invoice(token, invoice_id, dest)
+
+
+def fetch_incoming_invoice(item: dict, storage_dir: Path, download=_default_download) -> dict:
+    """
+    Télécharge (si besoin) et lit une facture reçue.
+
+    Returns:
+        Dictionnaire prêt pour insert_incoming_invoices.
+
+    Raises:
+        FacturXParseError: PDF ou XML inexploitable (erreur définitive).
+        PdpTransientError, OSError: Téléchargement à réessayer.
+    """
+    pdp_invoice_id = int(item['id'])
+    dest = storage_dir / f"pdp-{pdp_invoice_id}.pdf"
+    # Écriture atomique du téléchargement : un fichier présent est complet
+    if not dest.is_file():
+        download(pdp_invoice_id, dest)
+
+    xml_content = extract_facturx_xml(dest)
+    parsed = parse_facturx_xml(xml_content)
+    return incoming_invoice_from_parsed(parsed, xml_content, str(dest), pdp_invoice_id=pdp_invoice_id,
+                                        content_sha256=file_sha256(dest))
+
+
+def sync_incoming_invoices(storage_dir: str = './data/incoming-invoices', list_page=None,
+                           download=None, store=None, page_size: int = 100,
+                           concurrency: int = 8, max_pages: int = None, progress=None) -> dict:
+    """
+    Importe les nouvelles factures reçues depuis le dernier watermark.
+
+    Une facture dont le téléchargement échoue temporairement arrête l'import
+    après la page en cours : le watermark s'arrête juste avant elle, et la
+    prochaine exécution la reprend. Une facture illisible (XML absent ou
+    invalide) est signalée puis ignorée pour ne pas bloquer le flux.
+
+    Args:
+        storage_dir: Répertoire d'archivage des PDF reçus.
+        list_page: Fonction (starting_after_id, limit) -> {data, has_after}.
+        download: Fonction (pdp_invoice_id, dest) écrivant le PDF.
+        store: Stockage (load_watermark, save_page) ; défaut PgIncomingStore.
+        page_size: Nombre de factures demandées par page.
+        concurrency: Téléchargements simultanés.
+        max_pages: Nombre maximal de pages (None : jusqu'au bout du flux).
+        progress: Fonction (stats) appelée après chaque page.
+
+    Returns:
+        Statistiques {pages, invoices, inserted, invalid, pending, watermark}.
+    """
+    list_page = list_page or _default_list_page
+    download = download or _default_download
+    store = store or PgIncomingStore()
+    storage = Path(storage_dir)
+    storage.mkdir(parents=True, exist_ok=True)
+
+    watermark = store.load_watermark()
+    stats = {'pages': 0, 'invoices': 0, 'inserted': 0, 'invalid': 0, 'pending': 0,
+             'watermark': watermark}
+
+    def _fetch(item):
+        try:
+            return 'ok', fetch_incoming_invoice(item, storage, download)
+        except FacturXParseError as e:
+            return 'invalid', str(e)
+        except (PdpTransientError, OSError) as e:
+            return 'retry', str(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while max_pages is None or stats['pages'] < max_pages:
+            page = list_page(watermark, page_size)
+            items = sorted(page.get('data') or [], key=lambda it: int(it['id']))
+            if not items:
+                break
+
+            invoices, retry_ids = [], []
+            for item, (outcome, value) in zip(items, pool.map(_fetch, items)):
+                if outcome == 'ok':
+                    invoices.append(value)
+                elif outcome == 'invalid':
+                    stats['invalid'] += 1
+                    print(f"[WARNING] Facture reçue PDP {item['id']} ignorée : {value}")
+                else:
+                    retry_ids.append(int(item['id']))
+                    print(f"[WARNING] Facture reçue PDP {item['id']} à reprendre : {value}")
+
+            # Le watermark ne dépasse jamais une facture à reprendre
+            last_id = min(retry_ids) - 1 if retry_ids else int(items[-1]['id'])
+            new_watermark = max(watermark, last_id)
+            stats['inserted'] += store.save_page(invoices, new_watermark)
+            stats['pages'] += 1
+            stats['invoices'] += len(invoices)
+            stats['pending'] = len(retry_ids)
+            stats['watermark'] = watermark = new_watermark
+            if progress:
+                progress(dict(stats))
+
+            if retry_ids or not page.get('has_after'):
+                break
+
+    return stats
@@ -0,0 +1,386 @@
+"""
+Envoi en masse des factures PENDING vers SuperPDP.
+
+Les lignes de sent_invoices sont réservées par lots (FOR UPDATE SKIP LOCKED
+et bail `claimed_at`, ce qui permet plusieurs expéditeurs en parallèle),
+téléversées par un pool de threads avec un plafond de débit côté client,
+et les erreurs temporaires sont rejouées avec un délai exponentiel aléatoire.
+Les résultats sont mis en tampon et écrits par lots (PdpResultSink), en une
+instruction UPDATE par lot au lieu d'une connexion par facture.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from utils.db import db_cursor
+from utils.pdp_client import get_pdp_client, PdpError, PdpTransientError
+
+# Bail (s) d'une facture réservée pour l'envoi : passé ce délai, elle est reprise par un autre expéditeur
+CLAIM_LEASE_SECONDS = 600
+
+
+class RateLimiter:
+    """
+    Seau à jetons partagé entre threads : au plus `rate` acquisitions par seconde,
+    avec une rafale de `burst` jetons.
+    """
+
+    def __init__(self, rate: float, burst: int = None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("Le débit doit être strictement positif")
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Bloque jusqu'à disposer d'un jeton."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Le jeton est réservé immédiatement : un solde négatif est une dette
+            # que l'appelant purge en attendant, sans reprendre le verrou.
+            self._tokens -= 1
+            wait_for = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_for > 0:
+            self._sleep(wait_for)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 60.0) -> float:
+    """Délai avant la tentative suivante : exponentiel plafonné, tiré au hasard (full jitter)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def claim_pending_invoices(limit: int, lease_seconds: int = CLAIM_LEASE_SECONDS) -> list[tuple]:
+    """
+    Réserve jusqu'à `limit` factures PENDING pour l'envoi.
+
+    Une facture réservée n'est plus proposée aux autres expéditeurs tant que
+    son bail (`claimed_at` + `lease_seconds`) n'a pas expiré : une facture
+    dont l'expéditeur s'est arrêté en cours de route est donc reprise.
+
+    Returns:
+        Liste de tuples (invoice_num, pdf_path), par ordre de création.
+    """
+    with db_cursor(commit=True) as (_conn, cursor):
+        cursor.execute(
+            """UPDATE sent_invoices s
+               SET claimed_at = now(), send_attempts = s.send_attempts + 1
+               WHERE s.invoice_num IN (
+                   SELECT invoice_num FROM sent_invoices
+                   WHERE status = 'PENDING'
+                     AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s))
+                   ORDER BY created_at
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               )
+               RETURNING s.invoice_num, s.pdf_path""",
+            (lease_seconds, limit),
+        )
+        return cursor.fetchall()
+
+
+def _default_upload(pdf_path: str) -> dict:
+    from utils.super_pdp import get_cached_pdp_token
+
+    token = get_cached_pdp_token()['access_token']
+    return get_pdp_client().upload_invoice(token, pdf_path)
+
+
+# --- Écriture groupée des résultats d'envoi ---
+
+SEND_STATUSES = ('SENT-OK', 'SENT-ERROR')
+
+
+def check_send_result(status: str, exception: str | None) -> None:
+    """
+    Applique côté client la règle du trigger check_exception_on_status.
+
+    Une ligne invalide est rejetée avant l'écriture : elle ferait sinon
+    échouer toute l'instruction groupée.
+
+    Raises:
+        ValueError: Statut inconnu, ou SENT-ERROR sans exception.
+    """
+    if status not in SEND_STATUSES:
+        raise ValueError(f"Statut d'envoi inconnu : {status}")
+    if status == 'SENT-ERROR' and (exception is None or not exception.strip()):
+        raise ValueError("Le champ exception est obligatoire quand status vaut SENT-ERROR")
+
+
+def write_send_results(cursor, results: list[tuple]) -> None:
+    """
+    Enregistre des résultats d'envoi en une seule instruction UPDATE ... FROM (VALUES ...).
+
+    Le bail d'envoi (claimed_at) est libéré et l'exception d'une tentative
+    précédente effacée pour les factures SENT-OK. L'identifiant PDP, quand
+    il est connu, rattache la facture aux événements de cycle de vie.
+
+    Args:
+        cursor: Curseur psycopg2 ouvert.
+        results: Tuples (invoice_num, status, exception, sent_at, pdp_invoice_id).
+    """
+    from psycopg2.extras import execute_values
+
+    if not results:
+        return
+    execute_values(
+        cursor,
+        """UPDATE sent_invoices s
+           SET status = v.status::invoice_status,
+               exception = v.exception,
+               sent_at = v.sent_at::timestamptz,
+               claimed_at = NULL,
+               pdp_invoice_id = COALESCE(v.pdp_invoice_id::bigint, s.pdp_invoice_id)
+           FROM (VALUES %s) AS v(invoice_num, status, exception, sent_at, pdp_invoice_id)
+           WHERE s.invoice_num = v.invoice_num""",
+        results,
+        page_size=len(results),
+    )
+
+
+def flush_send_results(results: list[tuple]) -> None:
+    """Écrit un lot de résultats dans une transaction dédiée."""
+    with db_cursor(commit=True) as (_conn, cursor):
+        write_send_results(cursor, results)
+
+
+class PdpResultSink:
+    """
+    Tampon des résultats d'envoi, écrits par lots (taille ou délai atteint).
+
+    Sûr entre threads : ses méthodes on_success / on_failure se branchent
+    directement sur les rappels de BulkSender.
+
+    Un résultat retenu est celui d'une facture déjà téléversée mais encore
+    réservée en base : s'il n'était pas écrit avant l'expiration du bail, la
+    facture serait téléversée une seconde fois. Le délai est vérifié à chaque
+    ajout et par flush_due(), que BulkSender appelle au plus tous les
+    `max_delay` même quand aucun envoi ne se termine ; il doit rester très
+    inférieur au bail (CLAIM_LEASE_SECONDS).
+
+    Args:
+        max_batch: Nombre de résultats déclenchant l'écriture.
+        max_delay: Délai (s) maximal de rétention d'un résultat.
+        flush: Fonction (results) d'écriture d'un lot (défaut : flush_send_results).
+
+    Raises:
+        ValueError: Si max_delay dépasse le dixième du bail de réservation.
+    """
+
+    def __init__(self, max_batch: int = 200, max_delay: float = 2.0,
+                 flush=flush_send_results, clock=time.monotonic):
+        if not 0 < max_delay <= CLAIM_LEASE_SECONDS / 10:
+            raise ValueError(f"max_delay doit être compris entre 0 et {CLAIM_LEASE_SECONDS / 10:g} s "
+                             f"(bail de réservation : {CLAIM_LEASE_SECONDS} s)")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._write = flush
+        self._clock = clock
+        # Dernier résultat par facture (une ligne VALUES par facture)
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+
+    def add(self, invoice_num: str, status: str, exception: str = None, sent_at: str = None,
+            pdp_invoice_id: int = None) -> None:
+        """
+        Ajoute un résultat au tampon et écrit le lot si un seuil est atteint.
+
+        Raises:
+            ValueError: Voir check_send_result().
+        """
+        check_send_result(status, exception)
+        with self._lock:
+            self._pending[invoice_num] = (invoice_num, status, exception, sent_at or _now_iso(),
+                                          pdp_invoice_id)
+            if self._oldest is None:
+                self._oldest = self._clock()
+            due = (len(self._pending) >= self.max_batch
+                   or self._clock() - self._oldest >= self.max_delay)
+        if due:
+            self.flush()
+
+    def flush_due(self) -> int:
+        """Écrit les résultats en attente si le plus ancien a atteint max_delay."""
+        with self._lock:
+            due = self._oldest is not None and self._clock() - self._oldest >= self.max_delay
+        return self.flush() if due else 0
+
+    def on_success(self, invoice_num: str, response: dict) -> None:
+        self.add(invoice_num, 'SENT-OK', None, response.get('created_at'), response.get('id'))
+
+    def on_failure(self, invoice_num: str, error: str) -> None:
+        self.add(invoice_num, 'SENT-ERROR', error)
+
+    def flush(self) -> int:
+        """
+        Écrit les résultats en attente.
+
+        Returns:
+            Nombre de factures écrites. En cas d'erreur, le lot est remis en
+            attente (sans écraser un résultat plus récent) et l'erreur propagée.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.values())
+                self._pending = {}
+                self._oldest = None
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                with self._lock:
+                    for row in batch:
+                        self._pending.setdefault(row[0], row)
+                    self._oldest = self._oldest or self._clock()
+                raise
+            self.flushes += 1
+            return len(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class BulkSender:
+    """
+    Moteur d'envoi concurrent des factures en attente.
+
+    Args:
+        concurrency: Nombre de téléversements simultanés.
+        rate: Plafond de requêtes par seconde vers la PDP.
+        batch_size: Taille des lots réservés en base.
+        max_attempts: Nombre maximal de tentatives par facture (erreurs temporaires).
+        claim: Fonction (limit) -> [(invoice_num, pdf_path)].
+        upload: Fonction (pdf_path) -> réponse JSON.
+        on_success: Fonction (invoice_num, réponse) appelée après un envoi réussi.
+        on_failure: Fonction (invoice_num, message) appelée après un échec définitif.
+        sink: Tampon des résultats utilisé pour les rappels non fournis
+            (défaut : PdpResultSink, écriture groupée en base).
+        progress: Fonction (stats) appelée tous les `progress_every` résultats.
+    """
+
+    def __init__(self, concurrency: int = 8, rate: float = 20.0, batch_size: int = 200,
+                 max_attempts: int = 5, backoff_base: float = 0.5, backoff_cap: float = 60.0,
+                 claim=claim_pending_invoices, upload=_default_upload,
+                 on_success=None, on_failure=None, sink: PdpResultSink = None,
+                 progress=None, progress_every: int = 100, sleep=time.sleep):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = RateLimiter(rate, burst=concurrency, sleep=sleep)
+        self.claim = claim
+        self.upload = upload
+        self.sink = None
+        if on_success is None or on_failure is None:
+            self.sink = sink or PdpResultSink(max_batch=batch_size)
+        self.on_success = on_success or self.sink.on_success
+        self.on_failure = on_failure or self.sink.on_failure
+        self.progress = progress
+        self.progress_every = progress_every
+        self._sleep = sleep
+        self._stats_lock = threading.Lock()
+        self.stats = {'sent': 0, 'failed': 0, 'retries': 0}
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def send_one(self, invoice_num: str, pdf_path: str) -> bool:
+        """Téléverse une facture (avec reprises) et enregistre le résultat."""
+        attempt = 1
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self.upload(pdf_path)
+            except PdpTransientError as e:
+                if attempt >= self.max_attempts:
+                    self.on_failure(invoice_num, f"{e} (après {attempt} tentatives)")
+                    self._count('failed')
+                    return False
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                if e.retry_after:
+                    delay = max(delay, e.retry_after)
+                self._count('retries')
+                self._sleep(delay)
+                attempt += 1
+                continue
+            except (PdpError, OSError) as e:
+                self.on_failure(invoice_num, str(e) or e.__class__.__name__)
+                self._count('failed')
+                return False
+
+            self.on_success(invoice_num, response)
+            self._count('sent')
+            return True
+
+    def run(self, limit: int = None) -> dict:
+        """
+        Vide la file des factures PENDING.
+
+        Args:
+            limit: Nombre maximal de factures à traiter (None : toutes).
+
+        Returns:
+            Statistiques {sent, failed, retries}.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                self._drive(pool, limit)
+        finally:
+            # Résultats encore en tampon (y compris après une interruption)
+            if self.sink is not None:
+                self.sink.flush()
+        return dict(self.stats)
+
+    def _drive(self, pool: ThreadPoolExecutor, limit: int | None) -> None:
+        """Fenêtre glissante : réserve un nouveau lot dès que les envois en cours passent sous batch_size."""
+        claimed = 0
+        exhausted = False
+        in_flight = set()
+        done_count = 0
+
+        while True:
+            # Réserver le lot suivant avant que les threads ne se vident
+            if not exhausted and len(in_flight) < self.batch_size:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - claimed)
+                rows = self.claim(size) if size > 0 else []
+                if not rows:
+                    exhausted = True
+                claimed += len(rows)
+                for invoice_num, pdf_path in rows:
+                    in_flight.add(pool.submit(self.send_one, invoice_num, pdf_path))
+
+            if not in_flight:
+                break
+
+            # Réveil au plus tous les max_delay : un envoi lent ou bloqué ne retient pas
+            # dans le tampon les résultats des factures déjà téléversées
+            timeout = self.sink.max_delay if self.sink is not None else None
+            done, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if self.sink is not None:
+                self.sink.flush_due()
+            for future in done:
+                future.result()
+                done_count += 1
+                if self.progress and done_count % self.progress_every == 0:
+                    self.progress(dict(self.stats))
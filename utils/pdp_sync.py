@@ -0,0 +1,245 @@
+"""
+Synchronisation du cycle de vie des factures émises depuis la PDP.
+
+Au lieu d'interroger chaque facture, on parcourt le flux d'événements de la
+PDP (GET /v1.beta/invoice_events) à partir du dernier identifiant traité
+(watermark). Chaque page est enregistrée dans une seule transaction :
+insertion groupée des événements, mise à jour du dernier statut des
+factures concernées et avancement du watermark. Une synchronisation
+interrompue reprend donc exactement là où elle s'était arrêtée.
+"""
+
+from utils.db import db_cursor
+
+SYNC_NAME = 'invoice_events'
+
+# Statuts de cycle de vie de la facturation électronique (codes PDP)
+LIFECYCLE_STATUSES = {
+    'api:uploaded': 'Déposée',
+    'fr:200': 'Déposée',
+    'fr:201': 'Émise',
+    'fr:202': 'Reçue par la PA',
+    'fr:203': 'Mise à disposition',
+    'fr:204': 'Prise en charge',
+    'fr:205': 'Approuvée',
+    'fr:206': 'Approuvée partiellement',
+    'fr:207': 'En litige',
+    'fr:208': 'Suspendue',
+    'fr:209': 'Complétée',
+    'fr:210': 'Refusée',
+    'fr:211': 'Paiement transmis',
+    'fr:212': 'Encaissée',
+    'fr:213': 'Rejetée',
+}
+
+
+def lifecycle_label(status_code: str | None) -> str:
+    """Libellé d'un code de statut (le code lui-même s'il est inconnu)."""
+    if not status_code:
+        return ''
+    return LIFECYCLE_STATUSES.get(status_code, status_code)
+
+
+def normalize_event(item: dict) -> tuple:
+    """
+    Convertit un événement de l'API en ligne invoice_events.
+
+    Returns:
+        Tuple (pdp_event_id, pdp_invoice_id, status_code, event_at, details).
+
+    Raises:
+        ValueError: Si un champ obligatoire manque.
+    """
+    try:
+        return (
+            int(item['id']),
+            int(item['invoice_id']),
+            str(item['status_code'])[:20],
+            item['created_at'],
+            item.get('status_text') or item.get('details') or None,
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Événement PDP invalide ({e}) : {item!r}"[:300])
+
+
+def load_watermark(name: str) -> int:
+    """Dernier identifiant PDP traité par la synchronisation `name` (0 au départ)."""
+    with db_cursor() as (_conn, cursor):
+        cursor.execute("SELECT watermark FROM pdp_sync_state WHERE name = %s", (name,))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def save_watermark(cursor, name: str, watermark: int) -> None:
+    """Avance le watermark (dans la transaction en cours ; jamais de retour en arrière)."""
+    cursor.execute(
+        """INSERT INTO pdp_sync_state (name, watermark, synced_at)
+           VALUES (%s, %s, now())
+           ON CONFLICT (name) DO UPDATE
+           SET watermark = GREATEST(pdp_sync_state.watermark, EXCLUDED.watermark),
+               synced_at = now()""",
+        (name, watermark),
+    )
+
+
+class PgEventStore:
+    """Stockage PostgreSQL des événements et du watermark (tables invoice_events, pdp_sync_state)."""
+
+    def __init__(self, name: str = SYNC_NAME):
+        self.name = name
+
+    def load_watermark(self) -> int:
+        return load_watermark(self.name)
+
+    def save_page(self, events: list[tuple], watermark: int) -> int:
+        """
+        Enregistre une page d'événements et le nouveau watermark (une transaction).
+
+        Returns:
+            Nombre d'événements réellement insérés (les doublons sont ignorés).
+        """
+        from psycopg2.extras import execute_values
+
+        with db_cursor(commit=True) as (_conn, cursor):
+            inserted = 0
+            if events:
+                execute_values(
+                    cursor,
+                    """INSERT INTO invoice_events
+                           (pdp_event_id, pdp_invoice_id, invoice_num, status_code, event_at, details)
+                       SELECT v.pdp_event_id::bigint, v.pdp_invoice_id::bigint, s.invoice_num,
+                              v.status_code, v.event_at::timestamptz, v.details
+                       FROM (VALUES %s) AS v(pdp_event_id, pdp_invoice_id, status_code, event_at, details)
+                       LEFT JOIN sent_invoices s ON s.pdp_invoice_id = v.pdp_invoice_id::bigint
+                       ON CONFLICT (pdp_event_id) DO NOTHING""",
+                    events,
+                    page_size=len(events),
+                )
+                inserted = cursor.rowcount
+
+                # Dernier statut connu de chaque facture touchée par la page
+                cursor.execute(
+                    """UPDATE sent_invoices s
+                       SET lifecycle_status = e.status_code, lifecycle_at = e.event_at
+                       FROM (
+                           SELECT DISTINCT ON (pdp_invoice_id) pdp_invoice_id, status_code, event_at
+                           FROM invoice_events
+                           WHERE pdp_event_id = ANY(%s)
+                           ORDER BY pdp_invoice_id, event_at DESC, pdp_event_id DESC
+                       ) e
+                       WHERE s.pdp_invoice_id = e.pdp_invoice_id
+                         AND (s.lifecycle_at IS NULL OR s.lifecycle_at <= e.event_at)""",
+                    ([e[0] for e in events],),
+                )
+
+            save_watermark(cursor, self.name, watermark)
+        return inserted
+
+    def link_orphans(self) -> int:
+        """
+        Rattache les événements reçus avant l'enregistrement de l'identifiant PDP de leur facture.
+
+        Dans la même instruction, le dernier des événements rattachés devient
+        le statut de cycle de vie de la facture, selon la règle de save_page
+        (jamais un événement plus ancien que le statut affiché).
+
+        Returns:
+            Nombre d'événements rattachés.
+        """
+        with db_cursor(commit=True) as (_conn, cursor):
+            cursor.execute(
+                """WITH linked AS (
+                       UPDATE invoice_events e SET invoice_num = s.invoice_num
+                       FROM sent_invoices s
+                       WHERE e.invoice_num IS NULL AND s.pdp_invoice_id = e.pdp_invoice_id
+                       RETURNING e.pdp_event_id, e.pdp_invoice_id, e.status_code, e.event_at
+                   ), latest AS (
+                       SELECT DISTINCT ON (pdp_invoice_id) pdp_invoice_id, status_code, event_at
+                       FROM linked
+                       ORDER BY pdp_invoice_id, event_at DESC, pdp_event_id DESC
+                   ), applied AS (
+                       UPDATE sent_invoices s
+                       SET lifecycle_status = l.status_code, lifecycle_at = l.event_at
+                       FROM latest l
+                       WHERE s.pdp_invoice_id = l.pdp_invoice_id
+                         AND (s.lifecycle_at IS NULL OR s.lifecycle_at <= l.event_at)
+                       RETURNING s.invoice_num
+                   )
+                   SELECT (SELECT count(*) FROM linked), (SELECT count(*) FROM applied)"""
+            )
+            return cursor.fetchone()[0]
+
+
+def _default_fetch_page(starting_after_id: int, limit: int) -> dict:
+    from utils.pdp_client import get_pdp_client
+    from utils.super_pdp import get_cached_pdp_token
+
+    token = get_cached_pdp_token()['access_token']
+    return get_pdp_client().list_invoice_events(token, starting_after_id, limit)
+
+
+def sync_invoice_events(fetch_page=None, store=None, page_size: int = 100,
+                        max_pages: int = None, progress=None) -> dict:
+    """
+    Récupère les nouveaux événements de cycle de vie depuis le dernier watermark.
+
+    Args:
+        fetch_page: Fonction (starting_after_id, limit) -> {data, has_after}
+            (défaut : API SuperPDP via le client et le jeton partagés).
+        store: Stockage (load_watermark, save_page, link_orphans) ; défaut PgEventStore.
+        page_size: Nombre d'événements demandés par page.
+        max_pages: Nombre maximal de pages traitées (None : jusqu'au bout du flux).
+        progress: Fonction (stats) appelée après chaque page.
+
+    Returns:
+        Statistiques {pages, events, inserted, watermark}.
+    """
+    fetch_page = fetch_page or _default_fetch_page
+    store = store or PgEventStore()
+
+    watermark = store.load_watermark()
+    stats = {'pages': 0, 'events': 0, 'inserted': 0, 'watermark': watermark}
+
+    while max_pages is None or stats['pages'] < max_pages:
+        page = fetch_page(watermark, page_size)
+        items = page.get('data') or []
+        if not items:
+            break
+
+        events = [normalize_event(item) for item in items]
+        new_watermark = max(watermark, max(e[0] for e in events))
+        stats['inserted'] += store.save_page(events, new_watermark)
+        stats['pages'] += 1
+        stats['events'] += len(events)
+        stats['watermark'] = watermark = new_watermark
+        if progress:
+            progress(dict(stats))
+
+        if not page.get('has_after'):
+            break
+
+    # Identifiants PDP enregistrés depuis la synchronisation précédente (écriture
+    # groupée de send-pending) : rattachés même sans nouvel événement
+    store.link_orphans()
+    return stats
+
+
+def get_invoice_events(invoice_num: str) -> list[dict]:
+    """Historique des événements d'une facture émise, du plus ancien au plus récent."""
+    with db_cursor(readonly=True) as (_conn, cursor):
+        cursor.execute(
+            """SELECT status_code, event_at, details FROM invoice_events
+               WHERE invoice_num = %s
+               ORDER BY event_at, pdp_event_id""",
+            (invoice_num,),
+        )
+        rows = cursor.fetchall()
+    return [
+        {
+            'status_code': code,
+            'label': lifecycle_label(code),
+            'event_at': event_at.isoformat() if event_at else None,
+            'details': details,
+        }
+        for code, event_at, details in rows
+    ]
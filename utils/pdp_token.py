@@ -0,0 +1,233 @@
+"""
+Gestion partagée du jeton OAuth2 SuperPDP.
+
+Le jeton est conservé en mémoire et renouvelé en tâche de fond avant son
+expiration. Les renouvellements concurrents (threads d'un même processus)
+sont fusionnés en un seul appel réseau, et le cache disque
+`.pdp_token_cache.json` est partagé entre processus (workers) sous verrou
+de fichier : un seul processus interroge l'API, les autres relisent le cache.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+TOKEN_CACHE_PATH = _PROJECT_ROOT / ".pdp_token_cache.json"
+
+# Marge de sécurité : un jeton expirant dans moins de EXPIRY_MARGIN s est considéré expiré
+EXPIRY_MARGIN = 60
+# Renouvellement anticipé en tâche de fond, REFRESH_AHEAD s avant l'expiration
+REFRESH_AHEAD = 300
+# Délai avant une nouvelle tentative de la tâche de fond après un échec
+RETRY_DELAY = 30
+
+
+def _expires_at(token: dict) -> float:
+    return token.get('fetched_at', 0) + token.get('expires_in', 0)
+
+
+class TokenManager:
+    """
+    Jeton OAuth2 partagé, renouvelé avant expiration.
+
+    Args:
+        fetch: Fonction () -> réponse JSON de /oauth2/token (défaut : get_pdp_token).
+        cache_path: Fichier cache partagé entre processus (None : pas de cache disque).
+        margin: Marge (s) avant expiration en deçà de laquelle le jeton est renouvelé.
+        refresh_ahead: Avance (s) du renouvellement en tâche de fond.
+        clock: Horloge murale (time.time), injectable en test.
+    """
+
+    def __init__(self, fetch=None, cache_path: Path | None = TOKEN_CACHE_PATH,
+                 margin: float = EXPIRY_MARGIN, refresh_ahead: float = REFRESH_AHEAD,
+                 clock=time.time):
+        self._fetch = fetch
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self._clock = clock
+        self._token = None
+        self._error = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.fetch_count = 0
+
+    # --- Lecture ---
+
+    def _is_valid(self, token: dict | None, margin: float = None) -> bool:
+        if not token or 'access_token' not in token:
+            return False
+        return _expires_at(token) - (self.margin if margin is None else margin) > self._clock()
+
+    def get(self) -> dict:
+        """
+        Retourne un jeton valide, en le renouvelant si nécessaire (appel bloquant).
+
+        Returns:
+            Dictionnaire JSON : {access_token, expires_in, token_type, fetched_at}.
+
+        Raises:
+            EnvironmentError, RuntimeError: Voir get_pdp_token().
+        """
+        token = self._token
+        if self._is_valid(token):
+            return token
+        return self.refresh()
+
+    def state(self) -> dict:
+        """
+        État courant du jeton, sans aucun appel réseau.
+
+        Au démarrage, le cache disque (renouvelé par un autre processus ou
+        une exécution précédente) est adopté s'il est encore valide ; son
+        remplacement atomique permet de le lire sans verrou.
+
+        Returns:
+            Dictionnaire {access_token, expires_at (timestamp ou None), error}.
+        """
+        token = self._token
+        if token is None:
+            cached = self._read_cache()
+            if self._is_valid(cached):
+                self._token = token = cached
+        if self._is_valid(token, margin=0):
+            return {'access_token': token['access_token'], 'expires_at': _expires_at(token), 'error': None}
+        return {'access_token': None, 'expires_at': None, 'error': self._error}
+
+    # --- Renouvellement ---
+
+    def refresh(self, min_ttl: float = None) -> dict:
+        """
+        Renouvelle le jeton (un seul appel réseau pour tous les appelants concurrents).
+
+        Le jeton en mémoire, puis celui du cache disque (éventuellement
+        renouvelé par un autre processus), sont retenus s'il leur reste au
+        moins `min_ttl` secondes de validité ; sinon l'API est appelée.
+
+        Args:
+            min_ttl: Validité restante exigée (défaut : la marge de sécurité).
+        """
+        min_ttl = self.margin if min_ttl is None else min_ttl
+        with self._refresh_lock:
+            # Un autre thread a pu renouveler le jeton pendant l'attente du verrou
+            if self._is_valid(self._token, margin=min_ttl):
+                return self._token
+
+            try:
+                with self._cache_lock():
+                    token = self._read_cache()
+                    if not self._is_valid(token, margin=min_ttl):
+                        token = self._fetch_token()
+                        self._write_cache(token)
+            except Exception as e:
+                self._error = str(e)
+                raise
+
+            self._token = token
+            self._error = None
+            return token
+
+    def _fetch_token(self) -> dict:
+        if self._fetch is None:
+            from utils.super_pdp import get_pdp_token
+            fetch = get_pdp_token
+        else:
+            fetch = self._fetch
+        token = dict(fetch())
+        token['fetched_at'] = self._clock()
+        self.fetch_count += 1
+        return token
+
+    # --- Cache disque partagé ---
+
+    @contextmanager
+    def _cache_lock(self):
+        """Verrou exclusif inter-processus sur le cache (fichier .lock voisin)."""
+        if self.cache_path is None or fcntl is None:
+            yield
+            return
+        lock_path = self.cache_path.with_name(self.cache_path.name + '.lock')
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_cache(self) -> dict | None:
+        if self.cache_path is None:
+            return None
+        try:
+            return json.loads(self.cache_path.read_text(encoding='utf-8'))
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    def _write_cache(self, token: dict) -> None:
+        """Écriture atomique (fichier temporaire puis renommage)."""
+        if self.cache_path is None:
+            return
+        tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(token, indent=2), encoding='utf-8')
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"[WARNING] Cache du jeton SuperPDP non écrit : {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    # --- Tâche de fond ---
+
+    def start(self) -> None:
+        """Démarre (une seule fois) le thread de renouvellement anticipé."""
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='pdp-token-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Arrête le thread de renouvellement."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            token = self._token
+            if self._is_valid(token, margin=self.refresh_ahead):
+                delay = _expires_at(token) - self.refresh_ahead - self._clock()
+            else:
+                try:
+                    token = self.refresh(min_ttl=self.refresh_ahead)
+                    remaining = _expires_at(token) - self._clock()
+                    # Jeton de durée inférieure à refresh_ahead : renouveler à mi-vie
+                    delay = max(remaining - self.refresh_ahead, remaining / 2)
+                except Exception as e:
+                    print(f"[WARNING] Renouvellement du jeton SuperPDP impossible : {e}")
+                    delay = RETRY_DELAY
+            self._stop.wait(max(delay, 1))
+
+
+_MANAGER: TokenManager | None = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_token_manager() -> TokenManager:
+    """Retourne le gestionnaire de jeton partagé du processus."""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = TokenManager()
+        return _MANAGER
@@ -0,0 +1,243 @@
+"""
+Recherche plein texte dans les factures émises et reçues.
+
+Un `tsvector` pondéré est calculé à l'insertion à partir du XML parsé :
+  A : numéro de facture et références (acheteur, bon de commande) ;
+  B : parties (raisons sociales, SIRET, n° TVA) ;
+  C : désignations des lignes.
+Le texte est normalisé côté Python (minuscules, sans accents) et indexé avec
+la configuration `simple` : aucune extension PostgreSQL n'est requise, et
+la recherche par préfixe (`acm` trouve « ACME Corporation ») fonctionne
+sur les noms comme sur les désignations. Les colonnes `search_vector` sont
+indexées en GIN ; les résultats sont classés (ts_rank_cd) et paginés par
+curseur (keyset), sans OFFSET.
+
+Avec le backend SQLite, les mêmes textes sont indexés dans la table FTS5
+`invoice_search_fts` (filtre `q` du dashboard) ; /api/search reste
+propre à PostgreSQL.
+"""
+
+import base64
+import json
+import re
+import unicodedata
+
+from utils.db import db_cursor, db_server_cursor
+from utils.facturx_parser import FacturXParseError, parse_facturx_xml
+
+SEARCH_CONFIG = 'simple'
+
+# Expression SQL du tsvector : trois paramètres (textes A, B, C)
+SEARCH_VECTOR_SQL = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'B') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'C')"
+)
+
+SEARCH_TABLES = {
+    'sent': 'sent_invoices',
+    'received': 'incoming_invoices',
+}
+
+MAX_TERMS = 8
+
+
+def normalize_search_text(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation (hors - et /, fréquents dans les numéros)."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[^\w\s/-]|_', ' ', text.lower())
+
+
+def search_document(parsed: dict) -> tuple[str, str, str]:
+    """
+    Textes pondérés (A, B, C) d'une facture parsée (parse_facturx_xml).
+
+    Returns:
+        Tuple de trois chaînes normalisées, paramètres de SEARCH_VECTOR_SQL.
+    """
+    seller, buyer = parsed['seller'], parsed['buyer']
+    weight_a = [parsed['invoice_number'], parsed['buyer_reference'], parsed['purchase_order_reference']]
+    weight_b = [
+        seller['name'], seller['siret'], seller['legal_id'], seller['vat_number'],
+        buyer['name'], buyer['siret'], buyer['legal_id'], buyer['vat_number'],
+    ]
+    weight_c = [line['description'] for line in parsed['lines']]
+    return tuple(normalize_search_text(' '.join(v for v in values if v))
+                 for values in (weight_a, weight_b, weight_c))
+
+
+def _search_terms(query: str) -> list[str]:
+    terms = []
+    for word in normalize_search_text(query).split():
+        # to_tsvector('simple') et FTS5 découpent aussi sur - et / : même découpage ici
+        terms.extend(t for t in re.split(r'[-/]', word) if t)
+    return terms[:MAX_TERMS]
+
+
+def build_tsquery(query: str) -> str | None:
+    """
+    Convertit une saisie libre en requête tsquery : tous les termes, par préfixe.
+
+    Returns:
+        Requête (ex. 'ramette:* & acme:*'), ou None si la saisie ne contient aucun terme.
+    """
+    terms = _search_terms(query)
+    if not terms:
+        return None
+    return ' & '.join(f"{term}:*" for term in terms)
+
+
+def build_fts_query(query: str) -> str | None:
+    """
+    Equivalent FTS5 (SQLite) de build_tsquery : tous les termes, par préfixe.
+
+    Returns:
+        Requête MATCH (ex. '"ramette"* "acme"*'), ou None si la saisie ne contient aucun terme.
+    """
+    terms = _search_terms(query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index_search_document(cursor, direction: str, invoice_num: str, document: tuple) -> None:
+    """Indexe les textes (A, B, C) d'une facture dans invoice_search_fts (SQLite uniquement)."""
+    cursor.execute(
+        "INSERT INTO invoice_search_fts (direction, invoice_num, refs, parties, lines) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (direction, invoice_num, *document),
+    )
+
+
+def encode_cursor(row: dict) -> str:
+    """Curseur opaque de pagination (dernière ligne renvoyée)."""
+    key = [row['rank'], row['invoice_date'], row['direction'], row['invoice_num'], row['company_siret']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Raises:
+        ValueError: Curseur invalide.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        rank, invoice_date, direction, invoice_num, company_siret = key
+        return [float(rank), str(invoice_date), str(direction), str(invoice_num), str(company_siret)]
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Curseur de recherche invalide : {e}")
+
+
+def search_invoices(query: str, tab: str = 'all', limit: int = 20, cursor: str = None) -> dict:
+    """
+    Recherche les factures correspondant à tous les termes saisis.
+
+    Les résultats sont triés par pertinence, puis date, sens, numéro et SIRET
+    (ordre total : deux fournisseurs peuvent employer le même numéro) : la page suivante reprend strictement après la dernière
+    ligne renvoyée (`next_cursor`).
+
+    Args:
+        query: Saisie libre (désignation, référence, nom partiel, numéro...).
+        tab: 'all', 'sent' ou 'received'.
+        limit: Nombre de résultats par page.
+        cursor: Curseur `next_cursor` de la page précédente.
+
+    Returns:
+        Dictionnaire {results, next_cursor}.
+
+    Raises:
+        ValueError: Onglet ou curseur invalide.
+    """
+    if tab != 'all' and tab not in SEARCH_TABLES:
+        raise ValueError(f"Onglet inconnu : {tab}")
+    tsquery = build_tsquery(query)
+    if tsquery is None:
+        return {'results': [], 'next_cursor': None}
+
+    directions = list(SEARCH_TABLES) if tab == 'all' else [tab]
+    parts, params = [], []
+    for direction in directions:
+        parts.append(
+            f"""SELECT '{direction}' AS direction, invoice_num, company_siret, company_name, invoice_date, total_ttc,
+                       ts_rank_cd(search_vector, q)::float8 AS rank
+                FROM {SEARCH_TABLES[direction]}, to_tsquery('{SEARCH_CONFIG}', %s) q
+                WHERE search_vector @@ q"""
+        )
+        params.append(tsquery)
+
+    sql = f"SELECT * FROM ({' UNION ALL '.join(parts)}) r"
+    if cursor:
+        sql += (" WHERE (r.rank, r.invoice_date, r.direction, r.invoice_num, r.company_siret)"
+                " < (%s, %s::date, %s, %s, %s)")
+        params += decode_cursor(cursor)
+    sql += (" ORDER BY r.rank DESC, r.invoice_date DESC, r.direction DESC, r.invoice_num DESC,"
+            " r.company_siret DESC LIMIT %s")
+    params.append(limit + 1)
+
+    with db_cursor(readonly=True) as (_conn, db):
+        db.execute(sql, params)
+        columns = [desc[0] for desc in db.description]
+        rows = [dict(zip(columns, row)) for row in db.fetchall()]
+
+    for row in rows:
+        row['invoice_date'] = str(row['invoice_date'])
+        row['total_ttc'] = float(row['total_ttc']) if row['total_ttc'] is not None else None
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {'results': rows[:limit], 'next_cursor': next_cursor}
+
+
+def backfill_search_vectors(direction: str, batch_size: int = 500, progress=None) -> dict:
+    """
+    Calcule le tsvector des factures qui n'en ont pas encore (index partiel).
+
+    Les XML sont lus via un curseur côté serveur, parsés une seule fois et
+    les vecteurs écrits par lots d'une instruction `UPDATE ... FROM (VALUES ...)`.
+    Un XML illisible n'est indexé que par son numéro, pour ne pas être relu.
+
+    Returns:
+        Statistiques {updated, invalid}.
+    """
+    from psycopg2.extras import execute_values
+
+    table = SEARCH_TABLES[direction]
+    stats = {'updated': 0, 'invalid': 0}
+    batch = []
+
+    def _flush():
+        with db_cursor(commit=True) as (_conn, cursor):
+            execute_values(
+                cursor,
+                f"""UPDATE {table} t SET search_vector =
+                       setweight(to_tsvector('{SEARCH_CONFIG}', v.a), 'A') ||
+                       setweight(to_tsvector('{SEARCH_CONFIG}', v.b), 'B') ||
+                       setweight(to_tsvector('{SEARCH_CONFIG}', v.c), 'C')
+                   FROM (VALUES %s) AS v(invoice_num, company_siret, a, b, c)
+                   WHERE t.invoice_num = v.invoice_num AND t.company_siret = v.company_siret""",
+                batch,
+                page_size=len(batch),
+            )
+        batch.clear()
+        if progress:
+            progress(dict(stats))
+
+    with db_server_cursor(f'search_fill_{direction}', itersize=batch_size) as (_conn, cursor):
+        cursor.execute(
+            f"SELECT invoice_num, company_siret, xml_facture::text FROM {table} WHERE search_vector IS NULL"
+        )
+        for invoice_num, company_siret, xml_content in cursor:
+            try:
+                document = search_document(parse_facturx_xml(xml_content))
+                stats['updated'] += 1
+            except FacturXParseError as e:
+                print(f"[WARNING] Texte de recherche illisible pour {invoice_num}: {e}")
+                document = (normalize_search_text(invoice_num), '', '')
+                stats['invalid'] += 1
+            batch.append((invoice_num, company_siret, *document))
+            if len(batch) >= batch_size:
+                _flush()
+
+    if batch:
+        _flush()
+    return stats
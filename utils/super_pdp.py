@@ -4,14 +4,12 @@ Client pour l'API SuperPDP : authentification OAuth2 et envoi de factures.
 
 import json
 import os
-import subprocess
-import time
 from pathlib import Path
 
 from dotenv import load_dotenv
 
-_PROJECT_ROOT = Path(__file__).resolve().parent.parent
-_TOKEN_CACHE_PATH = _PROJECT_ROOT / ".pdp_token_cache.json"
+from utils.pdp_client import get_pdp_client
+from utils.pdp_token import get_token_manager
 
 
 def _load_env():
@@ -31,14 +29,16 @@ def get_pdp_token() -> dict:
     Récupère un token OAuth2 auprès de l'API SuperPDP.
 
     Lit PDP_SENDER_ID et PDP_SENDER_SECRET depuis .env / .env.local,
-    construit et exécute la commande curl, puis retourne la réponse JSON complète.
+    appelle POST /oauth2/token via le client HTTP partagé, puis retourne
+    la réponse JSON complète.
 
     Returns:
         Dictionnaire JSON : {access_token, expires_in, scope, token_type}.
 
     Raises:
         EnvironmentError: Si PDP_SENDER_ID ou PDP_SENDER_SECRET manquent.
-        RuntimeError: Si la commande curl échoue ou si la réponse est invalide.
+        RuntimeError: Si l'appel échoue ou si la réponse est invalide
+            (PdpError et ses sous-classes).
     """
     _load_env()
 
@@ -51,40 +51,7 @@ def get_pdp_token() -> dict:
             "dans .env ou .env.local"
         )
 
-    curl_cmd = [
-        "curl", "-s", "-X", "POST",
-        "https://api.superpdp.tech/oauth2/token",
-        "-H", "Content-Type: application/x-www-form-urlencoded",
-        "-d", (
-            f"grant_type=client_credentials"
-            f"&client_id={sender_id}"
-            f"&client_secret={sender_secret}"
-        ),
-    ]
-
-    try:
-        result = subprocess.run(
-            curl_cmd,
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-    except subprocess.TimeoutExpired:
-        raise RuntimeError("Timeout lors de l'appel à l'API SuperPDP (30s)")
-    except FileNotFoundError:
-        raise RuntimeError("curl n'est pas installé ou introuvable dans le PATH")
-
-    if result.returncode != 0:
-        raise RuntimeError(
-            f"Erreur curl (code {result.returncode}): {result.stderr.strip()}"
-        )
-
-    try:
-        response = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        raise RuntimeError(
-            f"Réponse invalide de l'API SuperPDP: {result.stdout[:200]}"
-        )
+    response = get_pdp_client().fetch_token(sender_id, sender_secret)
 
     if "error" in response:
         raise RuntimeError(
@@ -94,7 +61,7 @@ def get_pdp_token() -> dict:
 
     if "access_token" not in response:
         raise RuntimeError(
-            f"Pas de access_token dans la réponse: {result.stdout[:200]}"
+            f"Pas de access_token dans la réponse: {json.dumps(response)[:200]}"
         )
 
     return response
@@ -102,38 +69,25 @@ def get_pdp_token() -> dict:
 
 def get_cached_pdp_token() -> dict:
     """
-    Retourne un token OAuth2 SuperPDP depuis le cache local ou via l'API.
+    Retourne un token OAuth2 SuperPDP valide sans appel réseau superflu.
 
-    Lit le fichier cache `.pdp_token_cache.json` à la racine du projet.
-    Si le token est encore valide (avec une marge de 60 s), il est retourné
-    directement sans appel réseau. Sinon, un nouveau token est demandé via
-    `get_pdp_token()` et le cache est mis à jour.
+    Délègue au gestionnaire partagé (utils.pdp_token) : jeton en mémoire,
+    puis cache `.pdp_token_cache.json` commun aux processus, puis appel à
+    `get_pdp_token()` si le jeton expire dans moins de 60 s.
 
     Returns:
         Dictionnaire JSON : {access_token, expires_in, token_type, fetched_at}.
     """
-    if _TOKEN_CACHE_PATH.exists():
-        try:
-            cached = json.loads(_TOKEN_CACHE_PATH.read_text(encoding="utf-8"))
-            fetched_at = cached.get("fetched_at", 0)
-            expires_in = cached.get("expires_in", 0)
-            if fetched_at + expires_in - 60 > time.time():
-                return cached
-        except (json.JSONDecodeError, OSError):
-            pass
-
-    token_data = get_pdp_token()
-    token_data["fetched_at"] = time.time()
-    _TOKEN_CACHE_PATH.write_text(
-        json.dumps(token_data, indent=2), encoding="utf-8"
-    )
-    return token_data
+    return get_token_manager().get()
 
 
 def send_facturx_to_pdp(pdf_path: str) -> dict:
     """
     Envoie un PDF Factur-X à l'API SuperPDP.
 
+    Le fichier est transmis en flux depuis le disque sur une connexion
+    persistante du client partagé.
+
     Args:
         pdf_path: Chemin vers le fichier PDF Factur-X à envoyer.
 
@@ -142,7 +96,8 @@ def send_facturx_to_pdp(pdf_path: str) -> dict:
 
     Raises:
         FileNotFoundError: Si le fichier PDF n'existe pas.
-        RuntimeError: Si la commande curl échoue ou si la réponse est invalide.
+        RuntimeError: Si l'appel échoue ou si la réponse est invalide
+            (PdpError et ses sous-classes).
     """
     pdf = Path(pdf_path)
     if not pdf.exists():
@@ -151,37 +106,7 @@ def send_facturx_to_pdp(pdf_path: str) -> dict:
     token_data = get_cached_pdp_token()
     access_token = token_data["access_token"]
 
-    curl_cmd = [
-        "curl", "-s", "-X", "POST",
-        "https://api.superpdp.tech/v1.beta/invoices",
-        "-H", f"Authorization: Bearer {access_token}",
-        "-H", "Content-Type: application/pdf",
-        "--data-binary", f"@{pdf}",
-    ]
-
-    try:
-        result = subprocess.run(
-            curl_cmd,
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-    except subprocess.TimeoutExpired:
-        raise RuntimeError("Timeout lors de l'envoi de la facture (30s)")
-    except FileNotFoundError:
-        raise RuntimeError("curl n'est pas installé ou introuvable dans le PATH")
-
-    if result.returncode != 0:
-        raise RuntimeError(
-            f"Erreur curl (code {result.returncode}): {result.stderr.strip()}"
-        )
-
-    try:
-        response = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        raise RuntimeError(
-            f"Réponse invalide de l'API SuperPDP: {result.stdout[:200]}"
-        )
+    response = get_pdp_client().upload_invoice(access_token, str(pdf))
 
     if "error" in response:
         raise RuntimeError(
@@ -199,23 +124,22 @@ def send_facturx_to_pdp(pdf_path: str) -> dict:
     return response
 
 
-def update_invoice_sent_ok(invoice_num: str, sent_at: str) -> None:
+def update_invoice_sent_ok(invoice_num: str, sent_at: str, pdp_invoice_id: int = None) -> None:
     """
     Met à jour une facture en statut SENT-OK après téléversement réussi.
 
+    Pour les envois en masse, préférer PdpResultSink (utils.pdp_sender)
+    qui regroupe les mises à jour.
+
     Args:
         invoice_num: Numéro de la facture (clé primaire sent_invoices).
         sent_at: Timestamp ISO 8601 du téléversement (created_at de la réponse API).
+        pdp_invoice_id: Identifiant de la facture côté PDP (id de la réponse API).
     """
-    from utils.db import db_cursor
+    from utils.pdp_sender import flush_send_results
 
     _load_env()
-    with db_cursor(commit=True) as (conn, cur):
-        cur.execute(
-            "UPDATE sent_invoices SET status = 'SENT-OK', sent_at = %s "
-            "WHERE invoice_num = %s",
-            (sent_at, invoice_num),
-        )
+    flush_send_results([(invoice_num, 'SENT-OK', None, sent_at, pdp_invoice_id)])
 
 
 def update_invoice_sent_error(invoice_num: str, exception: str, sent_at: str) -> None:
@@ -226,16 +150,15 @@ def update_invoice_sent_error(invoice_num: str, exception: str, sent_at: str) ->
         invoice_num: Numéro de la facture (clé primaire sent_invoices).
         exception: Motif de l'erreur (obligatoire d'après le trigger PG).
         sent_at: Timestamp ISO 8601 de la tentative d'envoi.
+
+    Raises:
+        ValueError: Si l'exception est vide.
     """
-    from utils.db import db_cursor
+    from utils.pdp_sender import check_send_result, flush_send_results
 
+    check_send_result('SENT-ERROR', exception)
     _load_env()
-    with db_cursor(commit=True) as (conn, cur):
-        cur.execute(
-            "UPDATE sent_invoices SET status = 'SENT-ERROR', exception = %s, "
-            "sent_at = %s WHERE invoice_num = %s",
-            (exception, sent_at, invoice_num),
-        )
+    flush_send_results([(invoice_num, 'SENT-ERROR', exception, sent_at, None)])
 
 
 def check_pdp_token(token: str) -> dict:
@@ -253,40 +176,13 @@ def check_pdp_token(token: str) -> dict:
 
     Raises:
         ValueError: Si le token est vide ou None.
-        RuntimeError: Si la commande curl échoue ou si la réponse est invalide.
+        RuntimeError: Si l'appel échoue ou si la réponse est invalide
+            (PdpError et ses sous-classes).
     """
     if not token:
         raise ValueError("Le token OAuth2 ne peut pas être vide")
 
-    curl_cmd = [
-        "curl", "-s",
-        "https://api.superpdp.tech/v1.beta/companies/me",
-        "-H", f"Authorization: Bearer {token}",
-    ]
-
-    try:
-        result = subprocess.run(
-            curl_cmd,
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-    except subprocess.TimeoutExpired:
-        raise RuntimeError("Timeout lors de la vérification du token (30s)")
-    except FileNotFoundError:
-        raise RuntimeError("curl n'est pas installé ou introuvable dans le PATH")
-
-    if result.returncode != 0:
-        raise RuntimeError(
-            f"Erreur curl (code {result.returncode}): {result.stderr.strip()}"
-        )
-
-    try:
-        response = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        raise RuntimeError(
-            f"Réponse invalide de l'API SuperPDP: {result.stdout[:200]}"
-        )
+    response = get_pdp_client().get_company(token)
 
     if "error" in response:
         raise RuntimeError(